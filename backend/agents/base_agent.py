@@ -2,11 +2,19 @@
 Base Agent Class and Agent Orchestrator
 Core framework for the 5-agent agentic workflow
 """
+import hashlib
+import json
 import logging
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any, Dict, List, Optional
 from datetime import datetime
 from enum import Enum
+from backend.agents.data_context import DEFAULT_LOG_WINDOW_DAYS, WorkflowDataContext
+from backend.config import config
+from backend.firebase_client import learning_job_service
+from backend.image_store import image_store
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +41,25 @@ class WorkflowState(Enum):
     REQUIRES_HUMAN = "requires_human"
 
 
+def plan_fingerprint(interventions: List[Dict[str, Any]]) -> str:
+    """
+    Stable fingerprint of a remediation plan's interventions
+    
+    Two plans with the same fingerprint get the same risk assessment. The
+    population evidence annotation and the order it sorts interventions
+    into are left out - the risk agent uses neither.
+    """
+    canonical = sorted(
+        json.dumps(
+            {key: value for key, value in intervention.items() if key != "population_effectiveness"},
+            sort_keys=True,
+            default=str
+        )
+        for intervention in interventions or []
+    )
+    return hashlib.sha256(json.dumps(canonical).encode("utf-8")).hexdigest()
+
+
 # ============================================================================
 # Base Agent Class
 # ============================================================================
@@ -173,6 +200,11 @@ class AgentOrchestrator:
         self.agents: Dict[AgentType, BaseAgent] = {}
         self.workflow_history: List[Dict[str, Any]] = []
         self.active_workflows: Dict[str, Dict[str, Any]] = {}  # For real-time tracking
+        # Runs risk assessments speculatively while remediation is still planning
+        self.speculation_executor = ThreadPoolExecutor(
+            max_workers=config.SPECULATIVE_RISK_WORKERS,
+            thread_name_prefix="speculative-risk"
+        )
     
     def register_agent(self, agent: BaseAgent):
         """
@@ -215,6 +247,9 @@ class AgentOrchestrator:
         
         logger.info(f"Starting workflow {workflow_id}")
         
+        # Swap inline photos for image IDs so the blob isn't copied into every agent input
+        trigger_data = image_store.externalize_images(trigger_data)
+        
         # Default to full workflow
         if agents_to_run is None:
             agents_to_run = [
@@ -234,8 +269,16 @@ class AgentOrchestrator:
             "state": WorkflowState.IN_PROGRESS.value
         }
         
+        # One data context per workflow: each Firestore source is read once,
+        # for the widest window any of the scheduled agents needs
+        data_context = WorkflowDataContext(
+            trigger_data.get("patient_id"),
+            log_window_days=self._log_window_days(agents_to_run)
+        )
+        
         # Execute agents in sequence
-        previous_output = trigger_data
+        previous_output = {**trigger_data, "data_context": data_context}
+        speculation = None
         
         for agent_type in agents_to_run:
             agent = self.get_agent(agent_type)
@@ -244,8 +287,13 @@ class AgentOrchestrator:
                 logger.warning(f"Agent {agent_type.value} not registered, skipping")
                 continue
             
-            # Execute agent with previous output as input
-            agent_result = agent.execute(previous_output)
+            # Execute agent with previous output as input - or keep the
+            # speculative risk assessment if it was made for this exact plan
+            agent_result = None
+            if agent_type == AgentType.RISK_ASSESSMENT and speculation:
+                agent_result = self._commit_speculative_risk(speculation, previous_output, workflow_result)
+            if agent_result is None:
+                agent_result = agent.execute(previous_output)
             workflow_result["agents_executed"].append(agent_result)
             
             # Collect reasoning steps from agent if available
@@ -265,12 +313,27 @@ class AgentOrchestrator:
                 **previous_output,
                 f"{agent_type.value}_output": agent_result.get("result", {})
             }
+            
+            # Investigation done: the plan is now predictable, so start the
+            # risk checks in parallel with remediation
+            if (
+                agent_type == AgentType.INVESTIGATION
+                and config.SPECULATIVE_RISK_ENABLED
+                and AgentType.REMEDIATION in agents_to_run
+                and AgentType.RISK_ASSESSMENT in agents_to_run
+            ):
+                speculation = self._start_speculative_risk(previous_output, workflow_result)
         
         # Mark workflow as completed if no failures
         if workflow_result["state"] == WorkflowState.IN_PROGRESS.value:
             workflow_result["state"] = WorkflowState.COMPLETED.value
         
         workflow_result["completed_at"] = datetime.utcnow().isoformat()
+        workflow_result["data_reads"] = data_context.read_stats()
+        logger.info(
+            f"Workflow {workflow_id} Firestore reads: {workflow_result['data_reads']['documents']} documents "
+            f"in {workflow_result['data_reads']['queries']} queries"
+        )
         
         # Store workflow in active_workflows for SSE streaming
         self.active_workflows[workflow_id] = workflow_result
@@ -286,6 +349,139 @@ class AgentOrchestrator:
         
         return workflow_result
     
+    def _log_window_days(self, agents_to_run: List[AgentType]) -> int:
+        """Widest adherence-log window (days) needed by the agents in this workflow"""
+        windows = [
+            getattr(self.agents[agent_type], "data_window_days", 0)
+            for agent_type in agents_to_run
+            if agent_type in self.agents
+        ]
+        return max(windows, default=0) or DEFAULT_LOG_WINDOW_DAYS
+    
+    def _start_speculative_risk(
+        self,
+        investigation_input: Dict[str, Any],
+        workflow_result: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Predict the remediation plan and start assessing it in the background
+        
+        The prediction is the remediation agent's pre-plan (built from the
+        investigation alone, no Firestore reads), so remediation itself
+        still runs once. When the real plan matches, the risk agent's
+        MedGemma calls overlap remediation's reads; workflow_result
+        ["speculation"] records the seconds the risk step waited and saved.
+        
+        Args:
+            investigation_input: Trigger data plus investigation_output
+            workflow_result: Workflow record (speculation outcome is noted here)
+            
+        Returns:
+            Speculation handle with the predicted plan fingerprint and future,
+            or None if speculation isn't worthwhile
+        """
+        remediation_agent = self.get_agent(AgentType.REMEDIATION)
+        risk_agent = self.get_agent(AgentType.RISK_ASSESSMENT)
+        
+        if not (hasattr(remediation_agent, "predict_plan") and hasattr(risk_agent, "speculate")):
+            return None
+        
+        try:
+            predicted_plan = remediation_agent.predict_plan(investigation_input)
+            predicted_input = {**investigation_input, "remediation_output": predicted_plan}
+            
+            if not risk_agent.worth_speculating(predicted_input):
+                return None
+            
+            def timed_speculate():
+                started = time.monotonic()
+                result = risk_agent.speculate(predicted_input)
+                return result, time.monotonic() - started
+            
+            future: Future = self.speculation_executor.submit(timed_speculate)
+            
+        except Exception as e:
+            logger.warning(f"Speculative risk assessment not started: {str(e)}")
+            return None
+        
+        logger.info(f"Workflow {workflow_result['workflow_id']}: speculative risk assessment started")
+        workflow_result["speculation"] = {"started": True, "committed": False}
+        
+        return {
+            "fingerprint": plan_fingerprint(predicted_plan.get("interventions", [])),
+            "future": future
+        }
+    
+    def _commit_speculative_risk(
+        self,
+        speculation: Dict[str, Any],
+        risk_input: Dict[str, Any],
+        workflow_result: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Use the speculative risk assessment if the actual plan matches the prediction
+        
+        Args:
+            speculation: Handle from _start_speculative_risk()
+            risk_input: Actual risk agent input (with the real remediation_output)
+            workflow_result: Workflow record (speculation outcome is noted here)
+            
+        Returns:
+            Speculative agent result, or None to run the risk agent normally
+        """
+        actual_interventions = risk_input.get("remediation_output", {}).get("interventions", [])
+        future = speculation["future"]
+        
+        workflow_id = workflow_result["workflow_id"]
+        
+        if plan_fingerprint(actual_interventions) != speculation["fingerprint"]:
+            workflow_result["speculation"]["discarded"] = "plan_mismatch"
+            logger.info(f"Workflow {workflow_id}: plan differs from prediction, discarding speculation")
+            if not future.cancel():
+                # Already calling MedGemma, which cannot be interrupted: let
+                # it finish on its worker and account for it when it does
+                workflow_result["speculation"]["wasted_call"] = True
+                future.add_done_callback(lambda done: self._log_wasted_speculation(workflow_id, done))
+            return None
+        
+        try:
+            waited_from = time.monotonic()
+            agent_result, ran_seconds = future.result(timeout=config.AGENT_TIMEOUT)
+            waited = time.monotonic() - waited_from
+        except Exception as e:
+            workflow_result["speculation"]["discarded"] = f"error: {str(e)}"
+            logger.warning(f"Speculative risk assessment failed: {str(e)}")
+            return None
+        
+        if agent_result.get("status") != "success":
+            workflow_result["speculation"]["discarded"] = "agent_error"
+            return None
+        
+        risk_agent = self.get_agent(AgentType.RISK_ASSESSMENT)
+        risk_agent.execution_history.append(agent_result)
+        risk_agent.reasoning_steps = agent_result.get("result", {}).get("reasoning", [])
+        
+        # The risk step took `waited` instead of the full assessment time
+        workflow_result["speculation"].update({
+            "committed": True,
+            "waited_seconds": round(waited, 3),
+            "saved_seconds": round(max(ran_seconds - waited, 0.0), 3)
+        })
+        logger.info(
+            f"Workflow {workflow_id}: committed speculative risk assessment "
+            f"(saved {workflow_result['speculation']['saved_seconds']}s)"
+        )
+        
+        return agent_result
+    
+    def _log_wasted_speculation(self, workflow_id: str, future: Future):
+        """Record the outcome of a discarded speculative assessment that could not be cancelled"""
+        try:
+            _, ran_seconds = future.result()
+            logger.info(f"Workflow {workflow_id}: discarded speculative risk assessment finished after {ran_seconds:.2f}s")
+        except Exception as e:
+            logger.warning(f"Workflow {workflow_id}: discarded speculative risk assessment failed: {str(e)}")
+    
     def _generate_workflow_summary(self, workflow_result: Dict[str, Any]) -> Dict[str, Any]:
         """
         Generate an intelligent, conversational summary of the workflow
@@ -449,9 +645,22 @@ class AgentOrchestrator:
             if reason == "side_effects":
                 # Full workflow for side effects - medical assessment needed
                 return self.execute_workflow(action_data)
-            else:
-                # Just learning agent for routine successful doses
-                return self.execute_workflow(action_data, agents_to_run=[AgentType.LEARNING])
+            elif config.LEARNING_BATCH_ENABLED:
+                # Routine successful dose - queue the patient for the batch
+                # learning worker instead of running Learning inline
+                try:
+                    learning_job_service.enqueue(action_data)
+                    return {
+                        "status": "queued",
+                        "state": WorkflowState.PENDING.value,
+                        "patient_id": action_data.get("patient_id"),
+                        "message": "Learning deferred to the batch learning worker"
+                    }
+                except Exception as e:
+                    logger.warning(f"Could not queue learning job, running it inline: {str(e)}")
+            
+            # Just learning agent for routine successful doses
+            return self.execute_workflow(action_data, agents_to_run=[AgentType.LEARNING])
         
         elif action == "snoozed":
             # Investigation + Learning
@@ -0,0 +1,224 @@
+"""
+Workflow Data Context - Patient data shared by all agents in one workflow
+Loads each Firestore source once and lets agents slice it in memory
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from backend.analytics import rollups
+from backend.config import config
+from backend.firebase_client import (
+    adherence_service,
+    intervention_service,
+    patient_service,
+    rollup_service
+)
+from backend.models import LogRow
+
+logger = logging.getLogger(__name__)
+
+# Log window used when no agent declares one
+DEFAULT_LOG_WINDOW_DAYS = 30
+
+# Interventions loaded per workflow (LearningAgent reads the latest 5)
+DEFAULT_INTERVENTION_LIMIT = 10
+
+
+class WorkflowDataContext:
+    """
+    Request-scoped cache of a patient's Firestore data
+
+    The orchestrator creates one per workflow, sized to the widest log
+    window any scheduled agent needs, and passes it to every agent as
+    input_data["data_context"]. Each source (profile, logs, interventions,
+    rollup) is read at most once. Logs are read for the first window an
+    agent asks for, so agents answered by the rollup never pull the whole
+    planned window; narrower windows are in-memory slices, and a wider one
+    reloads once. Reads are counted per collection for reporting.
+
+    Loads are serialized with a lock because the speculative risk
+    assessment reads the context from a worker thread.
+    """
+
+    def __init__(
+        self,
+        patient_id: str,
+        log_window_days: int = DEFAULT_LOG_WINDOW_DAYS,
+        intervention_limit: int = DEFAULT_INTERVENTION_LIMIT
+    ):
+        self.patient_id = patient_id
+        self.log_window_days = log_window_days
+        self.intervention_limit = intervention_limit
+
+        self._lock = threading.RLock()
+        self._loaded: Dict[str, Any] = {}
+        self._loaded_log_days = 0
+        self._reads: Dict[str, Dict[str, int]] = {}
+
+    # ------------------------------------------------------------------
+    # Sources
+    # ------------------------------------------------------------------
+
+    def patient(self) -> Optional[Dict[str, Any]]:
+        """Patient profile (None if the patient does not exist)"""
+        return self._load("patient", lambda: patient_service.get_patient(self.patient_id), "patients")
+
+    def timezone(self) -> str:
+        """Patient's timezone, falling back to the PatientProfile default"""
+        try:
+            patient = self.patient() or {}
+        except Exception as e:
+            logger.warning(f"Could not load timezone for patient {self.patient_id}: {str(e)}")
+            patient = {}
+        return patient.get("timezone") or rollups.DEFAULT_TIMEZONE
+
+    def logs(self, days: Optional[int] = None) -> List[LogRow]:
+        """
+        Adherence logs of the last `days` days, newest first
+
+        Args:
+            days: Window to return (defaults to the full context window)
+
+        Returns:
+            List of LogRow entries (a slice of the single load)
+        """
+        days = days or self.log_window_days
+
+        with self._lock:
+            if days > self.log_window_days:
+                # An agent needs more history than planned - widen and reload once
+                logger.warning(
+                    f"Data context for {self.patient_id}: widening log window "
+                    f"{self.log_window_days} -> {days} days"
+                )
+                self.log_window_days = days
+            if days > self._loaded_log_days:
+                self._loaded.pop("logs", None)
+                self._loaded_log_days = days
+
+            logs = self._load(
+                "logs",
+                lambda: list(adherence_service.stream_patient_logs(self.patient_id, days=self._loaded_log_days)),
+                "adherence_logs"
+            )
+
+        if days == self._loaded_log_days:
+            return logs
+
+        # Same cutoff as the Firestore query in stream_patient_logs
+        cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+        return [log for log in logs if (log.timestamp or "") >= cutoff]
+
+    def interventions(self, limit: int = 5) -> List[Dict[str, Any]]:
+        """Most recent interventions, newest first"""
+        with self._lock:
+            if limit > self.intervention_limit:
+                self.intervention_limit = limit
+                self._loaded.pop("interventions", None)
+
+            interventions = self._load(
+                "interventions",
+                lambda: intervention_service.get_patient_interventions(
+                    self.patient_id, limit=self.intervention_limit
+                ),
+                "interventions"
+            )
+
+        return interventions[:limit]
+
+    def preload(self, **sources):
+        """
+        Use data that was already loaded in bulk for many patients
+
+        The bulk queries are not counted in read_stats().
+
+        Args:
+            sources: Any of patient, logs (LogRow list covering log_window_days,
+                newest first), interventions (newest first, up to
+                intervention_limit) and rollup
+        """
+        unknown = set(sources) - {"patient", "logs", "interventions", "rollup"}
+        if unknown:
+            raise ValueError(f"Unknown data context sources: {', '.join(sorted(unknown))}")
+
+        with self._lock:
+            self._loaded.update(sources)
+            if "logs" in sources:
+                self._loaded_log_days = self.log_window_days
+
+    def rollup(self) -> Optional[Dict[str, Any]]:
+        """Adherence rollup document (None if rollups are off, missing or not backfilled)"""
+        if not config.ROLLUPS_ENABLED:
+            return None
+        return self._load("rollup", lambda: rollup_service.get_rollup(self.patient_id), "adherence_rollups")
+
+    def adherence_stats(self, days: int) -> Dict[str, Any]:
+        """
+        Adherence statistics for the last `days` days
+
+        Same result as AdherenceService.calculate_adherence_rate, served from
+        the rollup or the already-loaded logs.
+        """
+        rollup = self.rollup()
+        if rollup:
+            stats = rollups.adherence_stats(self.patient_id, days, rollups.window_summary(rollup, days))
+            stats["source"] = "rollup"
+        else:
+            stats = rollups.adherence_stats(self.patient_id, days, rollups.summarize_logs(self.logs(days)))
+            stats["source"] = "logs"
+        return stats
+
+    # ------------------------------------------------------------------
+    # Read Accounting
+    # ------------------------------------------------------------------
+
+    def read_stats(self) -> Dict[str, Any]:
+        """
+        Firestore reads made through this context
+
+        Returns:
+            {"queries": n, "documents": n, "by_collection": {collection: {...}}}
+        """
+        with self._lock:
+            by_collection = {name: dict(counts) for name, counts in self._reads.items()}
+
+        return {
+            "queries": sum(c["queries"] for c in by_collection.values()),
+            "documents": sum(c["documents"] for c in by_collection.values()),
+            "by_collection": by_collection
+        }
+
+    def _load(self, key: str, loader, collection: str):
+        with self._lock:
+            if key not in self._loaded:
+                value = loader()
+                self._loaded[key] = value
+
+                if isinstance(value, list):
+                    documents = max(len(value), 1)  # an empty query is billed one read
+                else:
+                    documents = 1
+
+                counts = self._reads.setdefault(collection, {"queries": 0, "documents": 0})
+                counts["queries"] += 1
+                counts["documents"] += documents
+
+            return self._loaded[key]
+
+
+def context_for(input_data: Dict[str, Any]) -> WorkflowDataContext:
+    """
+    The workflow's data context, or a fresh one for a standalone agent call
+
+    Args:
+        input_data: Agent input (contains patient_id and, inside a workflow,
+            data_context)
+
+    Returns:
+        WorkflowDataContext for the input's patient
+    """
+    context = input_data.get("data_context")
+    if isinstance(context, WorkflowDataContext):
+        return context
+    return WorkflowDataContext(input_data.get("patient_id"))
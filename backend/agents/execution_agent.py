@@ -2,14 +2,33 @@
 Execution Agent - Implements approved interventions
 """
 import logging
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 from backend.agents.base_agent import BaseAgent, AgentType
-from backend.firebase_client import patient_service, intervention_service
+from backend import scheduler
+from backend.config import config
+from backend.firebase_client import intervention_service, new_document_id, scheduler_service
+from backend.notifications import notification_pipeline
+from backend.write_behind import write_behind
 
 logger = logging.getLogger(__name__)
 
 
+def merge_updates(patch: Dict[str, Any], updates: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merge one intervention's patient updates into the combined patch
+    
+    Nested maps are merged key by key (two schedule adjustments for
+    different days both survive); other values are overwritten.
+    """
+    for field, value in updates.items():
+        if isinstance(value, dict) and isinstance(patch.get(field), dict):
+            merge_updates(patch[field], value)
+        else:
+            patch[field] = value
+    return patch
+
+
 class ExecutionAgent(BaseAgent):
     """
     Executes approved interventions and updates patient data
@@ -71,31 +90,46 @@ class ExecutionAgent(BaseAgent):
         
         execution_results = []
         
+        # Patient changes of all interventions are merged into one patch
+        # and committed together with the intervention record
+        patient_updates = {}
+        
         for idx, intervention in enumerate(interventions, 1):
             self.reasoning_steps.append(f"  {idx}. {intervention.get('action', 'Unknown action')}")
-            result = self._execute_intervention(intervention, patient_id)
+            updates = {}
+            result = self._execute_intervention(intervention, patient_id, updates)
             execution_results.append(result)
+            merge_updates(patient_updates, updates)
         
         # Log intervention in Firebase
         self.reasoning_steps.append("💾 Saving intervention to Firebase Firestore...")
-        self._log_intervention_to_firebase(
+        commit_error = self._log_intervention_to_firebase(
             patient_id,
             remediation,
             risk_assessment,
-            execution_results
+            execution_results,
+            patient_updates
         )
         
+        if commit_error:
+            # The batch carried every intervention - none of them took effect
+            for result in execution_results:
+                result["status"] = "failed"
+                result["error"] = f"Intervention was not committed: {commit_error}"
+        
         # Generate patient notification
         self.reasoning_steps.append("📧 Generating patient notification...")
         notification = self._generate_patient_notification(
             remediation,
             execution_results
         )
+        self._queue_notification(patient_id, notification)
         
-        self.reasoning_steps.append("📅 Scheduling 2-week follow-up check-in...")
-        follow_up = self._schedule_follow_up(patient_id)
+        self.reasoning_steps.append("📅 Scheduling follow-up check-in and 2-week re-investigation...")
+        follow_up = self._schedule_follow_up(patient_id, remediation.get("root_cause"))
         
-        self.reasoning_steps.append(f"✅ Successfully executed all {len(execution_results)} interventions")
+        succeeded = len([r for r in execution_results if r["status"] != "failed"])
+        self.reasoning_steps.append(f"✅ Successfully executed {succeeded} of {len(execution_results)} interventions")
         self.reasoning_steps.append("🎯 Intervention implementation complete")
         
         return {
@@ -110,37 +144,45 @@ class ExecutionAgent(BaseAgent):
     def _execute_intervention(
         self,
         intervention: Dict[str, Any],
-        patient_id: str
+        patient_id: str,
+        updates: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """Execute a single intervention"""
+        """
+        Execute a single intervention
+        
+        Patient fields to change are added to `updates`; they are written
+        by _log_intervention_to_firebase together with the other
+        interventions' changes.
+        """
         
         intervention_type = intervention.get("type")
         self.reasoning_steps.append(f"Executing: {intervention_type}")
         
         # Route to specific execution function
         if intervention_type == "schedule_adjustment":
-            return self._execute_schedule_adjustment(intervention, patient_id)
+            return self._execute_schedule_adjustment(intervention, patient_id, updates)
         
         elif intervention_type == "time_shift":
-            return self._execute_time_shift(intervention, patient_id)
+            return self._execute_time_shift(intervention, patient_id, updates)
         
         elif intervention_type == "reminder_frequency":
-            return self._execute_reminder_frequency(intervention, patient_id)
+            return self._execute_reminder_frequency(intervention, patient_id, updates)
         
         elif intervention_type == "auto_refill":
-            return self._execute_auto_refill(intervention, patient_id)
+            return self._execute_auto_refill(intervention, patient_id, updates)
         
         elif intervention_type == "timing_optimization":
-            return self._execute_timing_optimization(intervention, patient_id)
+            return self._execute_timing_optimization(intervention, patient_id, updates)
         
         else:
             # Generic execution for other types
-            return self._execute_generic(intervention, patient_id)
+            return self._execute_generic(intervention, patient_id, updates)
     
     def _execute_schedule_adjustment(
         self,
         intervention: Dict[str, Any],
-        patient_id: str
+        patient_id: str,
+        updates: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Adjust medication schedule"""
         
@@ -148,189 +190,149 @@ class ExecutionAgent(BaseAgent):
         target_day = details.get("target_day")
         adjustment = details.get("adjustment")
         
-        try:
-            # Update patient schedule in Firebase
-            update_data = {
-                "schedule_adjustments": {
-                    target_day: {
-                        "adjustment": adjustment,
-                        "applied_at": datetime.utcnow().isoformat(),
-                        "reason": details.get("reason")
-                    }
+        # Patient schedule change (committed with the intervention)
+        update_data = {
+            "schedule_adjustments": {
+                target_day: {
+                    "adjustment": adjustment,
+                    "applied_at": datetime.utcnow().isoformat(),
+                    "reason": details.get("reason")
                 }
             }
-            
-            patient_service.update_patient(patient_id, update_data)
-            
-            self.reasoning_steps.append(f"✓ Adjusted schedule for {target_day}")
-            
-            return {
-                "intervention_type": "schedule_adjustment",
-                "status": "success",
-                "details": f"Schedule adjusted for {target_day}: {adjustment}"
-            }
-            
-        except Exception as e:
-            logger.error(f"Schedule adjustment failed: {str(e)}")
-            return {
-                "intervention_type": "schedule_adjustment",
-                "status": "failed",
-                "error": str(e)
-            }
+        }
+        
+        updates.update(update_data)
+        
+        self.reasoning_steps.append(f"✓ Adjusted schedule for {target_day}")
+        
+        return {
+            "intervention_type": "schedule_adjustment",
+            "status": "success",
+            "details": f"Schedule adjusted for {target_day}: {adjustment}"
+        }
     
     def _execute_time_shift(
         self,
         intervention: Dict[str, Any],
-        patient_id: str
+        patient_id: str,
+        updates: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Shift medication time"""
         
         details = intervention.get("details", {})
         
-        try:
-            update_data = {
-                "preferred_time": details.get("proposed_time"),
-                "time_context": details.get("context"),
-                "time_updated_at": datetime.utcnow().isoformat()
-            }
-            
-            patient_service.update_patient(patient_id, update_data)
-            
-            self.reasoning_steps.append(f"✓ Shifted time to {details.get('proposed_time')}")
-            
-            return {
-                "intervention_type": "time_shift",
-                "status": "success",
-                "details": f"Medication time changed to {details.get('proposed_time')}"
-            }
-            
-        except Exception as e:
-            logger.error(f"Time shift failed: {str(e)}")
-            return {
-                "intervention_type": "time_shift",
-                "status": "failed",
-                "error": str(e)
-            }
+        update_data = {
+            "preferred_time": details.get("proposed_time"),
+            "time_context": details.get("context"),
+            "time_updated_at": datetime.utcnow().isoformat()
+        }
+        
+        updates.update(update_data)
+        
+        self.reasoning_steps.append(f"✓ Shifted time to {details.get('proposed_time')}")
+        
+        return {
+            "intervention_type": "time_shift",
+            "status": "success",
+            "details": f"Medication time changed to {details.get('proposed_time')}"
+        }
     
     def _execute_reminder_frequency(
         self,
         intervention: Dict[str, Any],
-        patient_id: str
+        patient_id: str,
+        updates: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Update reminder frequency"""
         
         details = intervention.get("details", {})
         
-        try:
-            update_data = {
-                "reminder_settings": {
-                    "initial_reminder": details.get("initial_reminder"),
-                    "follow_ups": [
-                        details.get("follow_up_1"),
-                        details.get("follow_up_2")
-                    ],
-                    "escalation": details.get("escalation"),
-                    "updated_at": datetime.utcnow().isoformat()
-                }
-            }
-            
-            patient_service.update_patient(patient_id, update_data)
-            
-            self.reasoning_steps.append("✓ Updated reminder frequency")
-            
-            return {
-                "intervention_type": "reminder_frequency",
-                "status": "success",
-                "details": "Enhanced reminder system activated"
-            }
-            
-        except Exception as e:
-            logger.error(f"Reminder frequency update failed: {str(e)}")
-            return {
-                "intervention_type": "reminder_frequency",
-                "status": "failed",
-                "error": str(e)
+        update_data = {
+            "reminder_settings": {
+                "initial_reminder": details.get("initial_reminder"),
+                "follow_ups": [
+                    details.get("follow_up_1"),
+                    details.get("follow_up_2")
+                ],
+                "escalation": details.get("escalation"),
+                "updated_at": datetime.utcnow().isoformat()
             }
+        }
+        
+        updates.update(update_data)
+        
+        self.reasoning_steps.append("✓ Updated reminder frequency")
+        
+        return {
+            "intervention_type": "reminder_frequency",
+            "status": "success",
+            "details": "Enhanced reminder system activated"
+        }
     
     def _execute_auto_refill(
         self,
         intervention: Dict[str, Any],
-        patient_id: str
+        patient_id: str,
+        updates: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Set up automatic refill"""
         
         details = intervention.get("details", {})
         
-        try:
-            update_data = {
-                "auto_refill_enabled": True,
-                "refill_trigger_days": 7,
-                "refill_settings": {
-                    "pharmacy": details.get("pharmacy"),
-                    "notification": details.get("notification"),
-                    "enabled_at": datetime.utcnow().isoformat()
-                }
-            }
-            
-            patient_service.update_patient(patient_id, update_data)
-            
-            self.reasoning_steps.append("✓ Auto-refill enabled")
-            
-            return {
-                "intervention_type": "auto_refill",
-                "status": "success",
-                "details": "Auto-refill activated - will trigger 7 days before running out"
-            }
-            
-        except Exception as e:
-            logger.error(f"Auto-refill setup failed: {str(e)}")
-            return {
-                "intervention_type": "auto_refill",
-                "status": "failed",
-                "error": str(e)
+        update_data = {
+            "auto_refill_enabled": True,
+            "refill_trigger_days": 7,
+            "refill_settings": {
+                "pharmacy": details.get("pharmacy"),
+                "notification": details.get("notification"),
+                "enabled_at": datetime.utcnow().isoformat()
             }
+        }
+        
+        updates.update(update_data)
+        
+        self.reasoning_steps.append("✓ Auto-refill enabled")
+        
+        return {
+            "intervention_type": "auto_refill",
+            "status": "success",
+            "details": "Auto-refill activated - will trigger 7 days before running out"
+        }
     
     def _execute_timing_optimization(
         self,
         intervention: Dict[str, Any],
-        patient_id: str
+        patient_id: str,
+        updates: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Optimize medication timing for tolerability"""
         
         details = intervention.get("details", {})
         
-        try:
-            update_data = {
-                "timing_optimization": {
-                    "suggestion": details.get("suggestion"),
-                    "meal_recommendation": details.get("meal_recommendation"),
-                    "reason": details.get("reason"),
-                    "applied_at": datetime.utcnow().isoformat()
-                }
-            }
-            
-            patient_service.update_patient(patient_id, update_data)
-            
-            self.reasoning_steps.append("✓ Timing optimized for tolerability")
-            
-            return {
-                "intervention_type": "timing_optimization",
-                "status": "success",
-                "details": f"{details.get('suggestion')} - {details.get('meal_recommendation')}"
-            }
-            
-        except Exception as e:
-            logger.error(f"Timing optimization failed: {str(e)}")
-            return {
-                "intervention_type": "timing_optimization",
-                "status": "failed",
-                "error": str(e)
+        update_data = {
+            "timing_optimization": {
+                "suggestion": details.get("suggestion"),
+                "meal_recommendation": details.get("meal_recommendation"),
+                "reason": details.get("reason"),
+                "applied_at": datetime.utcnow().isoformat()
             }
+        }
+        
+        updates.update(update_data)
+        
+        self.reasoning_steps.append("✓ Timing optimized for tolerability")
+        
+        return {
+            "intervention_type": "timing_optimization",
+            "status": "success",
+            "details": f"{details.get('suggestion')} - {details.get('meal_recommendation')}"
+        }
     
     def _execute_generic(
         self,
         intervention: Dict[str, Any],
-        patient_id: str
+        patient_id: str,
+        updates: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Generic execution for other intervention types"""
         
@@ -349,9 +351,20 @@ class ExecutionAgent(BaseAgent):
         patient_id: str,
         remediation: Dict[str, Any],
         risk_assessment: Dict[str, Any],
-        execution_results: List[Dict[str, Any]]
-    ):
-        """Log intervention details to Firebase"""
+        execution_results: List[Dict[str, Any]],
+        patient_updates: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
+        """
+        Log intervention details and patient changes to Firebase in one batch
+        
+        With the write-behind queue enabled the batch is queued locally and
+        committed by the background flusher, so a slow Firestore write does
+        not hold up the workflow.
+        
+        Returns:
+            None once the write was committed (or durably queued),
+            otherwise the commit error
+        """
         
         try:
             intervention_data = {
@@ -367,11 +380,32 @@ class ExecutionAgent(BaseAgent):
                 "expected_outcome": remediation.get("expected_outcome")
             }
             
-            intervention_service.log_intervention(intervention_data)
-            self.reasoning_steps.append("✓ Intervention logged to Firebase")
+            if config.WRITE_BEHIND_ENABLED:
+                try:
+                    # The ID is fixed now so a retried flush cannot duplicate the record
+                    write_behind.enqueue("intervention", {
+                        "intervention_id": new_document_id(),
+                        "intervention": intervention_data,
+                        "patient_updates": patient_updates
+                    })
+                    self.reasoning_steps.append("✓ Intervention queued for Firestore (write-behind)")
+                    return None
+                except Exception as e:
+                    logger.warning(f"Write-behind queue unavailable, writing inline: {str(e)}")
+            
+            intervention_service.log_intervention(intervention_data, patient_updates)
+            if patient_updates:
+                self.reasoning_steps.append(
+                    f"✓ Intervention and {len(patient_updates)} patient field updates committed in one batch"
+                )
+            else:
+                self.reasoning_steps.append("✓ Intervention logged to Firebase")
+            return None
             
         except Exception as e:
             logger.error(f"Failed to log intervention: {str(e)}")
+            self.reasoning_steps.append(f"❌ Intervention not saved: {str(e)}")
+            return str(e)
     
     def _generate_patient_notification(
         self,
@@ -401,22 +435,64 @@ class ExecutionAgent(BaseAgent):
             "action_required": False
         }
     
-    def _schedule_follow_up(self, patient_id: str) -> Dict[str, Any]:
-        """Schedule follow-up check"""
+    def _queue_notification(self, patient_id: str, notification: Dict[str, Any]):
+        """Queue the notification for delivery (digest pipeline, else write-behind)"""
+        
+        if config.NOTIFICATION_DIGEST_ENABLED:
+            try:
+                notification_pipeline.submit(patient_id, notification)
+                return
+            except Exception as e:
+                logger.warning(f"Notification pipeline unavailable, using write-behind: {str(e)}")
         
-        from datetime import timedelta
-        follow_up_date = datetime.utcnow() + timedelta(days=3)
+        if not config.WRITE_BEHIND_ENABLED:
+            return
         
-        self.reasoning_steps.append(f"✓ Follow-up scheduled for {follow_up_date.date()}")
+        try:
+            write_behind.enqueue("notification", {
+                "notification_id": new_document_id(),
+                "patient_id": patient_id,
+                "notification": notification
+            })
+        except Exception as e:
+            logger.warning(f"Could not queue notification for patient {patient_id}: {str(e)}")
+    
+    def _schedule_follow_up(self, patient_id: str, root_cause: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Schedule the follow-up check-in, learning evaluation and re-investigation
+        
+        The jobs are stored for backend.scheduler, which runs them when
+        they fall due.
+        """
+        
+        jobs = scheduler.intervention_jobs(patient_id, root_cause)
+        follow_up = jobs[0]
+        scheduled = False
+        
+        if config.SCHEDULER_ENABLED:
+            try:
+                if config.WRITE_BEHIND_ENABLED:
+                    for job in jobs:
+                        write_behind.enqueue("scheduled_job", {"job": job})
+                else:
+                    scheduler_service.schedule(jobs)
+                scheduled = True
+            except Exception as e:
+                logger.error(f"Failed to schedule follow-up jobs: {str(e)}")
+        
+        if scheduled:
+            self.reasoning_steps.append(f"✓ Follow-up scheduled for {follow_up['due_at'][:10]}")
+        else:
+            self.reasoning_steps.append("⚠️ Follow-up could not be scheduled")
         
         return {
-            "scheduled": True,
-            "follow_up_date": follow_up_date.isoformat(),
+            "scheduled": scheduled,
+            "follow_up_date": follow_up["due_at"],
             "check_type": "automated",
-            "questions": [
-                "Are the new reminders working better for you?",
-                "Have you noticed any improvement?",
-                "Any issues we should address?"
+            "questions": follow_up["payload"]["questions"],
+            "jobs": [
+                {"job_id": job["job_id"], "kind": job["kind"], "due_at": job["due_at"]}
+                for job in jobs
             ]
         }
     
@@ -2,11 +2,12 @@
 Investigation Agent - Analyzes patterns and identifies root causes
 """
 import logging
-from typing import Any, Dict, List
-from datetime import datetime, timedelta
-from collections import Counter
+from typing import Any, Dict, List, Optional
 from backend.agents.base_agent import BaseAgent, AgentType
-from backend.firebase_client import adherence_service, patient_service
+from backend.agents.data_context import WorkflowDataContext, context_for
+from backend.analytics import dose_calendar, multi_window, rollups
+from backend.analytics.pattern_engine import analyze_by_medication
+from backend.config import config
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +23,15 @@ class InvestigationAgent(BaseAgent):
     - Provide detailed analysis for remediation
     """
 
+    # Look-back windows analyzed (days); patterns are reported for the
+    # primary window, slow-building ones (refill gaps) from the longest
+    windows = multi_window.DEFAULT_WINDOWS
+    primary_window_days = 30
+    data_window_days = max(windows)
+
+    # Unlogged scheduled doses (silent misses) that count as a pattern
+    silent_miss_min = 3
+
     def __init__(self):
         super().__init__(AgentType.INVESTIGATION)
         self.reasoning_steps = []
@@ -44,15 +54,29 @@ class InvestigationAgent(BaseAgent):
         """
         self.reasoning_steps = []
         patient_id = input_data["patient_id"]
+        context = context_for(input_data)
 
         logger.info(f"Investigating patterns for patient {patient_id}")
         self.reasoning_steps.append(f"🔍 Investigation Agent started for patient {patient_id}")
-        self.reasoning_steps.append(f"📊 Retrieving last 30 days of adherence data from Firestore...")
-
-        # Get adherence logs (last 30 days)
-        logs = adherence_service.get_patient_logs(patient_id, days=30)
-
-        if not logs:
+        self.reasoning_steps.append(f"📊 Retrieving last {self.data_window_days} days of adherence data from Firestore...")
+
+        # 7/30/90-day windows from one newest-first pass; each window is
+        # reported as soon as the pass moves beyond it
+        rollup = self._window_rollup(context)
+        windows = {}
+        for window in multi_window.scan_windows(
+            self._daily_buckets(context, rollup),
+            self.windows,
+            rollups.local_today(context.timezone())
+        ):
+            windows[window["days"]] = window
+            self._record_window_step(window)
+
+        # Expected doses from the medication schedule - catches doses never logged
+        calendar = self._dose_calendar(context, logs_loaded=rollup is None)
+        silent_misses = calendar["unlogged"] if calendar else 0
+
+        if not windows[self.data_window_days]["total_actions"] and silent_misses < self.silent_miss_min:
             logger.warning(f"No adherence logs found for patient {patient_id}")
             self.reasoning_steps.append("ℹ️ No historical data found - insufficient for pattern analysis")
             return {
@@ -61,42 +85,62 @@ class InvestigationAgent(BaseAgent):
                 "reasoning": self.reasoning_steps
             }
 
-        self.reasoning_steps.append(f"✅ Retrieved {len(logs)} adherence records")
-        
-        # Analyze skipped doses
-        skipped_logs = [log for log in logs if log.get("action") == "skipped"]
-        adherence_rate = round((len(logs) - len(skipped_logs)) / len(logs) * 100, 2) if logs else 0
+        # Patterns come from the primary (30-day) window, refill gaps from the longest
+        primary = windows[self.primary_window_days]
+        refill_gaps = windows[self.data_window_days]["refill_gaps"]
+        total_actions = primary["total_actions"]
+        skipped_count = primary["skipped_count"]
+        adherence_rate = primary["adherence_rate"]
+        window_summaries = {f"{days}d": window for days, window in windows.items()}
         
-        self.reasoning_steps.append(f"📈 Analysis: {len(logs)} total doses, {len(skipped_logs)} skipped ({100-adherence_rate:.1f}% miss rate)")
+        self.reasoning_steps.append(f"📈 Analysis: {total_actions} total doses, {skipped_count} skipped ({100-adherence_rate:.1f}% miss rate)")
         
-        if len(skipped_logs) < 2:
+        if skipped_count < 2 and not refill_gaps["detected"] and silent_misses < self.silent_miss_min:
             self.reasoning_steps.append("✓ Good adherence - not enough misses to identify concerning pattern")
             analysis = {
                 "pattern_detected": False,
-                "total_actions": len(logs),
-                "skipped_count": len(skipped_logs),
+                "total_actions": total_actions,
+                "skipped_count": skipped_count,
                 "adherence_rate": adherence_rate,
+                "dose_calendar": calendar,
+                "windows": window_summaries,
                 "reasoning": self.reasoning_steps
             }
         else:
             self.reasoning_steps.append("🔎 Analyzing temporal patterns...")
             
-            # Analyze patterns
-            day_pattern = self._analyze_day_pattern(skipped_logs)
-            time_pattern = self._analyze_time_pattern(skipped_logs)
-            reason_pattern = self._analyze_reasons(skipped_logs)
+            day_pattern = primary["day_pattern"]
+            time_pattern = primary["time_pattern"]
+            reason_pattern = primary["reason_pattern"]
+            self._record_pattern_steps(day_pattern, time_pattern, reason_pattern)
+            
+            medication_patterns = self._medication_patterns(context, rollup)
             
             self.reasoning_steps.append("🧠 Identifying root cause...")
-            root_cause = self._determine_root_cause(day_pattern, time_pattern, reason_pattern)
+            root_cause = self._determine_root_cause(
+                day_pattern, time_pattern, reason_pattern, refill_gaps, calendar
+            )
+            root_cause_medications = self._attribute_root_cause(
+                root_cause, day_pattern, time_pattern, reason_pattern, medication_patterns, calendar
+            )
+            names = self._medication_names(context, root_cause_medications)
+            if names:
+                self.reasoning_steps.append(f"💊 Root cause attributed to: {', '.join(names)}")
             
             analysis = {
                 "pattern_detected": True,
-                "total_actions": len(logs),
-                "skipped_count": len(skipped_logs),
+                "total_actions": total_actions,
+                "skipped_count": skipped_count,
                 "adherence_rate": adherence_rate,
                 "day_pattern": day_pattern,
                 "time_pattern": time_pattern,
                 "reason_pattern": reason_pattern,
+                "refill_gaps": refill_gaps,
+                "dose_calendar": calendar,
+                "medication_patterns": medication_patterns,
+                "root_cause_medications": root_cause_medications,
+                "root_cause_medication_names": names,
+                "windows": window_summaries,
                 "root_cause": root_cause,
                 "recommendations": self._generate_recommendations(root_cause),
                 "reasoning": self.reasoning_steps
@@ -124,113 +168,209 @@ class InvestigationAgent(BaseAgent):
         
         return analysis
 
-    def _analyze_day_pattern(self, logs: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Analyze which days of week have issues"""
-        days = []
-
-        for log in logs:
-            timestamp_str = log.get("timestamp", "")
-            if timestamp_str:
-                try:
-                    dt = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                    days.append(dt.strftime("%A"))  # Day name
-                except:
-                    pass
-
-        if not days:
-            return {"problem_day": None}
-
-        day_counts = Counter(days)
-        most_common = day_counts.most_common(1)
-
-        if most_common:
-            problem_day = most_common[0][0]
-            count = most_common[0][1]
-
-            self.reasoning_steps.append(f"📅 Day pattern: {count} skips on {problem_day}s (recurring weekly pattern)")
-
-            return {
-                "problem_day": problem_day,
-                "occurrences": count,
-                "pattern_strength": "strong" if count >= 3 else "weak"
-            }
-
-        return {"problem_day": None}
-
-    def _analyze_time_pattern(self, logs: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Analyze which times of day have issues"""
-        times = []
-
-        for log in logs:
-            timestamp_str = log.get("timestamp", "")
-            if timestamp_str:
-                try:
-                    dt = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                    hour = dt.hour
-
-                    if 5 <= hour < 12:
-                        times.append("morning")
-                    elif 12 <= hour < 17:
-                        times.append("afternoon")
-                    elif 17 <= hour < 21:
-                        times.append("evening")
-                    else:
-                        times.append("night")
-                except:
-                    pass
+    def _get_rollup(self, context: WorkflowDataContext) -> Optional[Dict[str, Any]]:
+        """Patient's adherence rollup, or None to fall back to the raw logs"""
+        try:
+            return context.rollup()
+        except Exception as e:
+            logger.warning(f"Could not read adherence rollup for patient {context.patient_id}: {str(e)}")
+            return None
+
+    def _window_rollup(self, context: WorkflowDataContext) -> Optional[Dict[str, Any]]:
+        """The rollup if its daily buckets cover the longest window, else None (read the logs)"""
+        rollup = self._get_rollup(context)
+        if rollup and config.ROLLUP_RETENTION_DAYS >= self.data_window_days:
+            return rollup
+        return None
+
+    def _daily_buckets(self, context: WorkflowDataContext, rollup: Optional[Dict[str, Any]]):
+        """Newest-first daily buckets from the rollup, or from the log cursor"""
+        if rollup:
+            self.reasoning_steps.append("✅ Reading daily buckets from the adherence rollup")
+            return multi_window.daily_from_rollup(
+                rollup, self.data_window_days, rollups.local_today(context.timezone())
+            )
+
+        logs = context.logs(days=self.data_window_days)
+        self.reasoning_steps.append(f"✅ Retrieved {len(logs)} adherence records")
+        return multi_window.daily_from_rows(logs, context.timezone())
+
+    def _record_window_step(self, window: Dict[str, Any]):
+        """Add a completed window's summary to the reasoning steps"""
+        trend = window["trend"]
+        self.reasoning_steps.append(
+            f"🪟 {window['days']}-day window: {window['total_actions']} doses, "
+            f"{window['skipped_count']} skipped, trend {trend['direction'].replace('_', ' ')}"
+        )
+
+        change_point = window["change_point"]
+        if change_point["detected"]:
+            self.reasoning_steps.append(
+                f"📉 Change-point on {change_point['date']}: miss rate "
+                f"{change_point['miss_rate_before']:.0%} → {change_point['miss_rate_after']:.0%}"
+            )
+
+        refill_gaps = window["refill_gaps"]
+        if refill_gaps["detected"] and window["days"] == self.data_window_days:
+            self.reasoning_steps.append(
+                f"📦 Refill gaps: {refill_gaps['episodes']} 'ran out' episodes about every "
+                f"{refill_gaps['interval_days']} days"
+            )
+
+    def _dose_calendar(self, context: WorkflowDataContext, logs_loaded: bool) -> Optional[Dict[str, Any]]:
+        """
+        Expected-dose summary for the primary window (None without a schedule)
 
-        if not times:
-            return {"problem_time": None}
+        Matching doses to the schedule needs the raw logs. When the rollup
+        answered the windows they are only read for this if
+        INVESTIGATION_DOSE_CALENDAR is set.
+        """
+        if not logs_loaded and not config.INVESTIGATION_DOSE_CALENDAR:
+            return None
+
+        try:
+            patient = context.patient()
+        except Exception as e:
+            logger.warning(f"Could not load schedule for patient {context.patient_id}: {str(e)}")
+            return None
+        if not any(dose_calendar.daily_minutes(med) for med in (patient or {}).get("medications") or []):
+            return None
+
+        calendar = dose_calendar.calendar_summary(
+            patient, context.logs(days=self.primary_window_days), context.timezone(), self.primary_window_days
+        )
+        if calendar:
+            self.reasoning_steps.append(
+                f"🗓️ Schedule: {calendar['expected_doses']} expected doses - {calendar['taken']} on time, "
+                f"{calendar['late']} late, {calendar['skipped']} skipped, {calendar['unlogged']} never logged"
+            )
+        return calendar
+
+    def _medication_patterns(
+        self,
+        context: WorkflowDataContext,
+        rollup: Optional[Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Skip patterns per medication over the primary window (one grouped pass)
 
-        time_counts = Counter(times)
-        most_common = time_counts.most_common(1)
+        When the rollup answered the windows, the logs are not read: the
+        per-medication counters of its daily buckets are summed instead.
+        """
+        if rollup:
+            medication_patterns = rollups.medication_summary(
+                rollup, self.primary_window_days, today=rollups.local_today(context.timezone())
+            )
+        else:
+            logs = context.logs(days=self.primary_window_days)
+            medication_patterns = analyze_by_medication(logs, context.timezone())
 
-        if most_common:
-            problem_time = most_common[0][0]
-            count = most_common[0][1]
+        for medication_id, patterns in medication_patterns.items():
+            if patterns["skipped_count"]:
+                self.reasoning_steps.append(
+                    f"💊 {medication_id}: {patterns['skipped_count']}/{patterns['total_actions']} skipped"
+                    + (f", mostly {patterns['day_pattern']['problem_day']}s" if patterns["day_pattern"].get("problem_day") else "")
+                )
 
-            self.reasoning_steps.append(f"⏰ Time pattern: {count} skips in {problem_time} (consistent timing issue)")
+        return medication_patterns
 
-            return {
-                "problem_time": problem_time,
-                "occurrences": count,
-                "pattern_strength": "strong" if count >= 3 else "weak"
-            }
-
-        return {"problem_time": None}
+    def _attribute_root_cause(
+        self,
+        root_cause: str,
+        day_pattern: Dict[str, Any],
+        time_pattern: Dict[str, Any],
+        reason_pattern: Dict[str, Any],
+        medication_patterns: Dict[str, Dict[str, Any]],
+        calendar: Optional[Dict[str, Any]] = None
+    ) -> List[str]:
+        """
+        Medications that show the pattern behind the root cause
 
-    def _analyze_reasons(self, logs: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Analyze stated reasons for skipping"""
-        reasons = [log.get("reason", "unknown") for log in logs]
-        reason_counts = Counter(reasons)
+        Returns:
+            Medication IDs, most skips first (empty if nothing was skipped)
+        """
+        if "Memory/reminder" in root_cause and calendar:
+            by_medication = calendar["by_medication"]
+            return sorted(
+                (m for m, counts in by_medication.items() if counts["unlogged"]),
+                key=lambda m: by_medication[m]["unlogged"],
+                reverse=True
+            )
+
+        skipped = {
+            medication_id: patterns
+            for medication_id, patterns in medication_patterns.items()
+            if patterns["skipped_count"]
+        }
 
-        reason_str = ", ".join([f"{k}: {v}" for k, v in reason_counts.items()])
+        if "Behavioral pattern" in root_cause:
+            matches = [m for m, p in skipped.items() if p["day_pattern"].get("problem_day") == day_pattern.get("problem_day")]
+        elif "Timing issue" in root_cause:
+            matches = [m for m, p in skipped.items() if p["time_pattern"].get("problem_time") == time_pattern.get("problem_time")]
+        elif "Supply chain" in root_cause:
+            matches = [m for m, p in skipped.items() if "ran_out" in p["reason_pattern"].get("all_reasons", {})]
+        else:
+            primary_reason = reason_pattern.get("primary_reason")
+            matches = [m for m, p in skipped.items() if p["reason_pattern"].get("primary_reason") == primary_reason]
+
+        # Nothing shares the pattern exactly - the medication missed most often
+        if not matches and skipped:
+            matches = [max(skipped, key=lambda m: skipped[m]["skipped_count"])]
+
+        return sorted(matches, key=lambda m: skipped[m]["skipped_count"], reverse=True)
+
+    def _medication_names(self, context: WorkflowDataContext, medication_ids: List[str]) -> List[str]:
+        """Display names for medication IDs (the ID if the profile has no match)"""
+        if not medication_ids:
+            return []
+        try:
+            medications = (context.patient() or {}).get("medications", [])
+        except Exception:
+            medications = []
+        names = {med.get("medication_id"): med.get("name") for med in medications}
+        return [names.get(medication_id) or medication_id for medication_id in medication_ids]
+
+    def _record_pattern_steps(
+        self,
+        day_pattern: Dict[str, Any],
+        time_pattern: Dict[str, Any],
+        reason_pattern: Dict[str, Any]
+    ):
+        """Add the pattern findings to the reasoning steps"""
+        if day_pattern.get("problem_day"):
+            self.reasoning_steps.append(
+                f"📅 Day pattern: {day_pattern['occurrences']} skips on {day_pattern['problem_day']}s (recurring weekly pattern)"
+            )
+
+        if time_pattern.get("problem_time"):
+            self.reasoning_steps.append(
+                f"⏰ Time pattern: {time_pattern['occurrences']} skips in {time_pattern['problem_time']} (consistent timing issue)"
+            )
+
+        reason_str = ", ".join([f"{k}: {v}" for k, v in reason_pattern.get("all_reasons", {}).items()])
         self.reasoning_steps.append(f"💬 Stated reasons: {reason_str}")
 
-        most_common = reason_counts.most_common(1)
-
-        if most_common:
-            primary_reason = most_common[0][0]
-            count = most_common[0][1]
-
-            return {
-                "primary_reason": primary_reason,
-                "occurrences": count,
-                "all_reasons": dict(reason_counts)
-            }
-
-        return {"primary_reason": "unknown"}
-
     def _determine_root_cause(
         self,
         day_pattern: Dict[str, Any],
         time_pattern: Dict[str, Any],
-        reason_pattern: Dict[str, Any]
+        reason_pattern: Dict[str, Any],
+        refill_gaps: Optional[Dict[str, Any]] = None,
+        calendar: Optional[Dict[str, Any]] = None
     ) -> str:
         """Determine the primary root cause"""
 
         primary_reason = reason_pattern.get("primary_reason", "unknown")
 
+        # Recurring refill gaps only show up over the long window
+        if refill_gaps and refill_gaps.get("detected"):
+            root_cause = (
+                f"Supply chain: Runs out of medication about every "
+                f"{refill_gaps['interval_days']} days (refill gap)"
+            )
+            self.reasoning_steps.append(f"✓ ROOT CAUSE: {root_cause}")
+            return root_cause
+
         # Check for behavioral patterns
         if day_pattern.get("problem_day") and day_pattern.get("pattern_strength") == "strong":
             root_cause = f"Behavioral pattern: Consistently forgets on {day_pattern['problem_day']}"
@@ -242,6 +382,15 @@ class InvestigationAgent(BaseAgent):
             self.reasoning_steps.append(f"Root cause identified: {root_cause}")
             return root_cause
 
+        # Scheduled doses that were never logged outnumber the logged skips
+        if calendar and calendar["unlogged"] >= self.silent_miss_min and calendar["unlogged"] >= calendar["skipped"]:
+            root_cause = f"Memory/reminder: {calendar['unlogged']} scheduled doses never logged (silent misses"
+            if calendar.get("silent_miss_time"):
+                root_cause += f", mostly {calendar['silent_miss_time']}"
+            root_cause += ")"
+            self.reasoning_steps.append(f"Root cause identified: {root_cause}")
+            return root_cause
+
         # Reason-based root cause
         if primary_reason == "timing_conflict":
             root_cause = "Medication complexity: Patient confused about multiple medication timing requirements"
@@ -249,6 +398,8 @@ class InvestigationAgent(BaseAgent):
             root_cause = "Drug interaction: Supplements or OTC medications interfering with prescribed medication"
         elif primary_reason == "side_effects":
             root_cause = "Tolerability issue: Side effects affecting adherence"
+        elif primary_reason == "ran_out":
+            root_cause = "Supply chain: Patient ran out of medication"
         else:
             root_cause = "Unknown: Pattern unclear, needs more data"
 
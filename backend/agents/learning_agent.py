@@ -4,8 +4,11 @@ Learning Agent - Tracks outcomes and improves over time
 import logging
 from typing import Any, Dict, List
 from datetime import datetime, timedelta
+import numpy as np
 from backend.agents.base_agent import BaseAgent, AgentType
-from backend.firebase_client import adherence_service, intervention_service
+from backend.agents.data_context import WorkflowDataContext, context_for
+from backend.analytics import effectiveness, population
+from backend.firebase_client import population_service
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +25,9 @@ class LearningAgent(BaseAgent):
     - Provide feedback to other agents
     """
     
+    # Days of adherence history compared around an intervention
+    data_window_days = 14
+    
     def __init__(self):
         super().__init__(AgentType.LEARNING)
         self.reasoning_steps = []
@@ -46,17 +52,18 @@ class LearningAgent(BaseAgent):
         
         patient_id = input_data.get("patient_id")
         current_action = input_data.get("current_action", {})
+        context = context_for(input_data)
         
         logger.info(f"Learning from outcomes for patient {patient_id}")
         self.reasoning_steps.append(f"📊 Learning Agent started for patient {patient_id}")
         self.reasoning_steps.append(f"🔍 Retrieving intervention history from Firestore...")
         
         # Get recent interventions
-        interventions = intervention_service.get_patient_interventions(patient_id, limit=5)
+        interventions = context.interventions(limit=5)
         
         if not interventions:
             self.reasoning_steps.append("🆕 First intervention - establishing baseline")
-            result = self._baseline_learning(patient_id, current_action)
+            result = self._baseline_learning(context, current_action)
             result["reasoning"] = self.reasoning_steps
             return result
         
@@ -64,11 +71,12 @@ class LearningAgent(BaseAgent):
         self.reasoning_steps.append(f"📈 Calculating effectiveness metrics...")
         
         # Analyze intervention effectiveness
-        effectiveness = self._analyze_intervention_effectiveness(patient_id, interventions)
+        effectiveness = self._analyze_intervention_effectiveness(context, interventions)
         
         # Update learning model
         self.reasoning_steps.append("🧠 Generating insights from outcome data...")
         insights = self._generate_insights(effectiveness, interventions)
+        insights += self._population_insights(context, effectiveness)
         
         # Provide recommendations for future interventions
         self.reasoning_steps.append("💡 Creating recommendations for future interventions...")
@@ -88,7 +96,7 @@ class LearningAgent(BaseAgent):
     
     def _baseline_learning(
         self,
-        patient_id: str,
+        context: WorkflowDataContext,
         current_action: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Initial learning when no interventions exist yet"""
@@ -100,7 +108,7 @@ class LearningAgent(BaseAgent):
         
         # Get baseline adherence
         try:
-            baseline = adherence_service.calculate_adherence_rate(patient_id, days=7)
+            baseline = context.adherence_stats(days=7)
             
             self.reasoning_steps.append(
                 f"Baseline adherence: {baseline.get('adherence_rate')}%"
@@ -126,35 +134,76 @@ class LearningAgent(BaseAgent):
     
     def _analyze_intervention_effectiveness(
         self,
-        patient_id: str,
+        context: WorkflowDataContext,
         interventions: List[Dict[str, Any]]
     ) -> Dict[str, Any]:
         """Analyze how effective past interventions were"""
         
         self.reasoning_steps.append(f"Analyzing {len(interventions)} interventions")
         
+        # One sorted log array scores every intervention (see analytics.effectiveness);
+        # those with stored counters are scored from them by the same formula
+        now = datetime.utcnow()
+        times = effectiveness.intervention_times(interventions)
+        too_recent = times > np.datetime64(now - timedelta(days=3), "ms")
+        has_counters = np.array([bool(i.get("effectiveness")) for i in interventions], dtype=bool)
+        # Without counters, the before window must lie inside the loaded logs
+        before_logs = times < np.datetime64(
+            now - timedelta(days=self.data_window_days - effectiveness.COUNTER_WINDOW_DAYS), "ms"
+        )
+        scores = self._calculate_effectiveness_scores(
+            context, np.where(too_recent | has_counters | before_logs, np.datetime64("NaT", "ms"), times)
+        )
+        
         effectiveness_scores = []
         
-        for intervention in interventions:
+        for intervention, score, recent, stored, too_old in zip(
+            interventions, scores, too_recent, has_counters, before_logs
+        ):
             intervention_date = intervention.get("created_at")
             root_cause = intervention.get("root_cause", "unknown")
             
+            # Sealed by the effectiveness worker - read the finished numbers
+            counters = intervention.get("effectiveness") or {}
+            if counters.get("sealed"):
+                self.reasoning_steps.append(
+                    f"Sealed effectiveness: {counters['before_rate']:.1f}% → {counters['after_rate']:.1f}%"
+                )
+                effectiveness_scores.append({
+                    "root_cause": root_cause,
+                    "effectiveness_score": counters["score"],
+                    "intervention_date": str(intervention_date),
+                    "source": "sealed"
+                })
+                continue
+            
             # Skip if intervention is too recent (less than 3 days)
-            if intervention_date:
-                try:
-                    intervention_dt = intervention_date
-                    days_since = (datetime.utcnow() - intervention_dt).days
-                    
-                    if days_since < 3:
-                        self.reasoning_steps.append(
-                            "Intervention too recent - skipping effectiveness analysis"
-                        )
-                        continue
-                except:
-                    pass
+            if recent:
+                self.reasoning_steps.append(
+                    "Intervention too recent - skipping effectiveness analysis"
+                )
+                continue
+            
+            # Counted so far by the effectiveness worker, not sealed yet
+            if stored:
+                result = effectiveness.counters_score(counters)
+                self.reasoning_steps.append(
+                    f"Adherence change: {result['before_rate']:.1f}% → {result['after_rate']:.1f}%"
+                )
+                effectiveness_scores.append({
+                    "root_cause": root_cause,
+                    "effectiveness_score": result["score"],
+                    "intervention_date": str(intervention_date),
+                    "source": "counters"
+                })
+                continue
+            
+            if too_old:
+                self.reasoning_steps.append(
+                    "Intervention predates the loaded logs and has no counters - skipping effectiveness analysis"
+                )
+                continue
             
-            # Compare adherence before and after intervention
-            score = self._calculate_effectiveness_score(patient_id, intervention)
             effectiveness_scores.append({
                 "root_cause": root_cause,
                 "effectiveness_score": score,
@@ -178,64 +227,46 @@ class LearningAgent(BaseAgent):
             "individual_scores": effectiveness_scores
         }
     
-    def _calculate_effectiveness_score(
+    def _calculate_effectiveness_scores(
         self,
-        patient_id: str,
-        intervention: Dict[str, Any]
-    ) -> float:
+        context: WorkflowDataContext,
+        times: np.ndarray
+    ) -> List[float]:
         """
-        Calculate effectiveness score for a single intervention
+        Calculate effectiveness scores for a set of interventions
         
         Score = (Adherence After - Adherence Before) / 100
         Range: -1.0 (made it worse) to +1.0 (perfect improvement)
+        
+        Before: logs of the 7 days preceding the intervention;
+        after: logs of the 7 days from the intervention on.
         """
         
+        if np.isnat(times).all():
+            return [0.0] * len(times)  # nothing to recompute - no logs needed
+        
         try:
-            intervention_date = intervention.get("created_at")
-            
-            if not intervention_date:
-                return 0.0
-            
-            intervention_dt = intervention_date
-            
-            # Get adherence 7 days before intervention
-            before_logs = adherence_service.get_patient_logs(patient_id, days=14)
-            before_logs = [
-                log for log in before_logs
-                if datetime.fromisoformat(log.get("timestamp", "").replace('Z', '+00:00'))
-                < intervention_dt
-            ]
-            
-            # Get adherence 7 days after intervention
-            after_logs = adherence_service.get_patient_logs(patient_id, days=7)
-            after_logs = [
-                log for log in after_logs
-                if datetime.fromisoformat(log.get("timestamp", "").replace('Z', '+00:00'))
-                >= intervention_dt
-            ]
-            
-            # Calculate rates
-            before_took = len([l for l in before_logs if l.get("action") == "took"])
-            before_total = len(before_logs)
-            before_rate = (before_took / before_total * 100) if before_total > 0 else 0
-            
-            after_took = len([l for l in after_logs if l.get("action") == "took"])
-            after_total = len(after_logs)
-            after_rate = (after_took / after_total * 100) if after_total > 0 else 0
-            
-            # Calculate improvement
-            improvement = (after_rate - before_rate) / 100
+            results = effectiveness.effectiveness_scores(
+                context.logs(days=self.data_window_days), times
+            )
+        except Exception as e:
+            logger.error(f"Effectiveness calculation failed: {str(e)}")
+            return [0.0] * len(times)
+        
+        scores = []
+        for result in results:
+            if result is None:
+                scores.append(0.0)
+                continue
             
+            improvement = result["score"]
             self.reasoning_steps.append(
-                f"Adherence change: {before_rate:.1f}% → {after_rate:.1f}% "
+                f"Adherence change: {result['before_rate']:.1f}% → {result['after_rate']:.1f}% "
                 f"(+{improvement*100:.1f}%)"
             )
-            
-            return improvement
-            
-        except Exception as e:
-            logger.error(f"Effectiveness calculation failed: {str(e)}")
-            return 0.0
+            scores.append(improvement)
+        
+        return scores
     
     def _generate_insights(
         self,
@@ -290,6 +321,40 @@ class LearningAgent(BaseAgent):
         
         return insights
     
+    def _population_insights(
+        self,
+        context: WorkflowDataContext,
+        effectiveness: Dict[str, Any]
+    ) -> List[str]:
+        """Compare the patient's intervention results with the population table"""
+        
+        table = population_service.table()
+        individual_scores = effectiveness.get("individual_scores", [])
+        if not len(table) or not individual_scores:
+            return []
+        
+        try:
+            patient_cohort = population.cohort(context.patient())
+        except Exception:
+            patient_cohort = (population.ANY, population.ANY)
+        
+        insights = []
+        categories = sorted({population.root_cause_category(s["root_cause"]) for s in individual_scores})
+        for category in categories:
+            stats = table.lookup(category, patient_cohort=patient_cohort)
+            if stats:
+                insights.append(
+                    f"Population benchmark for {category}: {stats['mean']*100:+.0f}% "
+                    f"average improvement across {stats['n']} interventions"
+                )
+            ranked = table.ranked_types(category)
+            if ranked:
+                insights.append(f"Most effective {category} intervention across patients: {ranked[0][0]}")
+        
+        self.reasoning_steps.append(f"📚 Compared with population data ({len(insights)} benchmarks)")
+        
+        return insights
+    
     def _recommend_improvements(
         self,
         effectiveness: Dict[str, Any],
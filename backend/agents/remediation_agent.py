@@ -1,9 +1,13 @@
 """
 Remediation Agent - Creates personalized solutions
 """
+import copy
 import logging
 from typing import Any, Dict, List
 from backend.agents.base_agent import BaseAgent, AgentType
+from backend.agents.data_context import context_for
+from backend.analytics import population
+from backend.firebase_client import population_service
 
 logger = logging.getLogger(__name__)
 
@@ -63,10 +67,34 @@ class RemediationAgent(BaseAgent):
         
         # Create targeted remediation plan
         plan = self._create_targeted_plan(root_cause, investigation)
+        self._apply_population_evidence(plan, input_data)
         plan["reasoning"] = self.reasoning_steps
         
         return plan
     
+    def predict_plan(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Predict the plan for speculative risk assessment
+        
+        Builds the pre-plan from the investigation alone: the population
+        evidence step (the only part of process() that reads Firestore) is
+        skipped, since it only annotates and reorders interventions, which
+        plan_fingerprint() ignores. Runs on a shallow copy so the live
+        agent's reasoning steps are not touched.
+        
+        Args:
+            input_data: Trigger data plus investigation_output
+            
+        Returns:
+            Predicted remediation plan
+        """
+        speculative = copy.copy(self)
+        speculative.reasoning_steps = []
+        investigation = input_data.get("investigation_output", {})
+        if not investigation.get("pattern_detected"):
+            return speculative._general_remediation()
+        return speculative._create_targeted_plan(investigation.get("root_cause", ""), investigation)
+    
     def _general_remediation(self) -> Dict[str, Any]:
         """Create general remediation when no pattern is found"""
         return {
@@ -281,6 +309,34 @@ class RemediationAgent(BaseAgent):
         
         return plan
     
+    def _apply_population_evidence(self, plan: Dict[str, Any], input_data: Dict[str, Any]):
+        """
+        Annotate interventions with population effectiveness, best first
+        
+        Interventions without enough population data keep their order
+        after the ones that have it.
+        """
+        table = population_service.table()
+        if not len(table):
+            return
+        
+        try:
+            patient_cohort = population.cohort(context_for(input_data).patient())
+        except Exception:
+            patient_cohort = (population.ANY, population.ANY)
+        
+        for intervention in plan["interventions"]:
+            stats = table.lookup(plan["root_cause"], intervention["type"], patient_cohort)
+            if stats:
+                intervention["population_effectiveness"] = {"mean": stats["mean"], "n": stats["n"]}
+                self.reasoning_steps.append(
+                    f"📚 Population evidence: {intervention['type']} {stats['mean']*100:+.0f}% (n={stats['n']})"
+                )
+        
+        plan["interventions"].sort(
+            key=lambda i: -i["population_effectiveness"]["mean"] if "population_effectiveness" in i else float("inf")
+        )
+    
     def get_reasoning_steps(self) -> List[str]:
         """Return reasoning steps for transparency"""
         return self.reasoning_steps
@@ -1,14 +1,57 @@
 """
 Risk Assessment Agent - Validates safety with MedGemma
 """
+import copy
+import hashlib
+import json
 import logging
-from typing import Any, Dict, List
-from backend.agents.base_agent import BaseAgent, AgentType
+from typing import Any, Dict, List, Optional, Tuple
+from backend.agents.base_agent import BaseAgent, AgentType, plan_fingerprint
+from backend.agents.data_context import WorkflowDataContext, context_for
 from backend.agents.medgemma_hf import MedGemmaHF, create_medical_prompt
+from backend.agents.risk_rules import RiskRuleEngine, summarize_tiers
 from backend.config import config
+from backend.firebase_client import risk_cache_service
+from backend.image_store import image_store
 
 logger = logging.getLogger(__name__)
 
+# Trigger fields that change what MedGemma is asked
+CACHE_TRIGGER_FIELDS = ["action", "reason", "medication_id", "notes"]
+
+
+def regimen_fingerprint(medications: List[Dict[str, Any]]) -> str:
+    """Fingerprint of a patient's medication list (order-independent)"""
+    regimen = sorted(
+        (
+            {
+                "medication_id": med.get("medication_id"),
+                "name": med.get("name"),
+                "dosage": med.get("dosage"),
+                "frequency": med.get("frequency"),
+                "scheduled_times": med.get("scheduled_times")
+            }
+            for med in medications or []
+        ),
+        key=lambda med: str(med["medication_id"])
+    )
+    canonical = json.dumps(regimen, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def assessment_fingerprint(
+    regimen_hash: str,
+    interventions: List[Dict[str, Any]],
+    current_action: Dict[str, Any]
+) -> str:
+    """Fingerprint of (patient regimen, plan interventions, relevant trigger fields)"""
+    canonical = json.dumps({
+        "regimen": regimen_hash,
+        "plan": plan_fingerprint(interventions),
+        "trigger": {field: current_action.get(field) for field in CACHE_TRIGGER_FIELDS}
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
 
 class RiskAssessmentAgent(BaseAgent):
     """
@@ -24,6 +67,9 @@ class RiskAssessmentAgent(BaseAgent):
     def __init__(self):
         super().__init__(AgentType.RISK_ASSESSMENT)
         self.reasoning_steps = []
+        self.rule_engine = RiskRuleEngine()
+        self.confidence_threshold = config.RISK_RULE_CONFIDENCE_THRESHOLD
+        self.cache_enabled = config.RISK_CACHE_ENABLED
         
         # Initialize MedGemma HF
         try:
@@ -43,6 +89,58 @@ class RiskAssessmentAgent(BaseAgent):
             logger.warning(f"Failed to initialize MedGemma HF: {e}. Will use rule-based fallback.")
             self.llm = None
     
+    def worth_speculating(self, input_data: Dict[str, Any]) -> bool:
+        """
+        Check whether assessing a plan would call MedGemma
+        
+        Only those plans are worth assessing speculatively - rule-tier and
+        fallback assessments are already instant.
+        
+        Args:
+            input_data: Trigger data plus a (predicted) remediation_output
+        """
+        if not self.llm:
+            return False
+        
+        current_action = input_data.get("current_action") or input_data
+        if current_action.get("reason") == "side_effects" and self._has_image(current_action):
+            return True
+        
+        return self._needs_medgemma(input_data.get("remediation_output", {}).get("interventions", []), current_action)
+    
+    def _needs_medgemma(self, interventions: List[Dict[str, Any]], current_action: Dict[str, Any]) -> bool:
+        """Check whether any intervention escalates past the rule tier to MedGemma"""
+        reason = current_action.get("reason") or ""
+        
+        for intervention in interventions:
+            intervention_type = intervention.get("type")
+            if intervention_type == "medgemma_consult" and reason.startswith("side_effect"):
+                return True
+            if intervention_type in ["schedule_adjustment", "time_shift", "timing_optimization"]:
+                verdict = self.rule_engine.evaluate(intervention, current_action)
+                if verdict["confidence"] < self.confidence_threshold:
+                    return True
+        
+        return False
+    
+    def speculate(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Assess a predicted plan ahead of time (called from a worker thread)
+        
+        Runs on a shallow copy with its own reasoning and history so the live
+        agent is untouched; the orchestrator decides whether to keep the result.
+        
+        Args:
+            input_data: Trigger data plus the predicted remediation_output
+            
+        Returns:
+            Formatted agent output, as from execute()
+        """
+        speculative = copy.copy(self)
+        speculative.reasoning_steps = []
+        speculative.execution_history = []
+        return speculative.execute(input_data)
+    
     def validate_input(self, input_data: Dict[str, Any]) -> bool:
         """Validate input contains remediation plan"""
         if "remediation_output" not in input_data:
@@ -61,6 +159,7 @@ class RiskAssessmentAgent(BaseAgent):
         """
         self.reasoning_steps = []
         self.medgemma_actually_consulted = False  # Track actual MedGemma usage
+        self.medgemma_failed = False  # Fallback results are never cached
         
         patient_id = input_data.get("patient_id")
         remediation = input_data.get("remediation_output", {})
@@ -86,7 +185,7 @@ class RiskAssessmentAgent(BaseAgent):
         investigation = input_data.get("investigation_output", {})
         
         # Check if this is a side effect with image - handle vision analysis FIRST
-        if current_action.get("reason") == "side_effects" and current_action.get("image"):
+        if current_action.get("reason") == "side_effects" and self._has_image(current_action):
             self.reasoning_steps.append("📸 Image detected with side effects - activating vision analysis")
             # Create a special intervention for vision analysis
             vision_result = self._assess_with_vision({}, current_action)
@@ -107,6 +206,17 @@ class RiskAssessmentAgent(BaseAgent):
         
         # Assess each intervention
         interventions = remediation.get("interventions", [])
+        
+        # Reuse a recent assessment of the identical plan for this patient;
+        # only MedGemma results are cached, so rule-tier plans skip the lookup
+        cache_key = None
+        if self._needs_medgemma(interventions, current_action):
+            cache_key = self._cache_key(context_for(input_data), interventions, current_action)
+        if cache_key:
+            cached = self._get_cached_assessment(patient_id, cache_key)
+            if cached:
+                return cached
+        
         self.reasoning_steps.append(f"🔍 Reviewing {len(interventions)} proposed interventions for safety...")
         
         assessment_results = []
@@ -125,6 +235,7 @@ class RiskAssessmentAgent(BaseAgent):
             "overall_risk_level": self._determine_overall_risk(assessment_results),
             "intervention_assessments": assessment_results,
             "medgemma_consulted": self.medgemma_actually_consulted,  # Accurate tracking
+            "tier_decisions": summarize_tiers(assessment_results),
             "recommendations": self._generate_safety_recommendations(assessment_results),
             "reasoning": self.reasoning_steps
         }
@@ -136,8 +247,77 @@ class RiskAssessmentAgent(BaseAgent):
             self.reasoning_steps.append("❌ HIGH RISK: Intervention requires physician review")
             self.reasoning_steps.append("⚠️ Human oversight required before proceeding")
         
+        # Only MedGemma-backed results are worth caching; fallbacks must be retried
+        if cache_key and self.medgemma_actually_consulted and not self.medgemma_failed:
+            self._store_cached_assessment(patient_id, cache_key, assessment)
+        
         return assessment
     
+    def _cache_key(
+        self,
+        context: WorkflowDataContext,
+        interventions: List[Dict[str, Any]],
+        current_action: Dict[str, Any]
+    ) -> Optional[Tuple[str, str]]:
+        """Build the (assessment fingerprint, regimen hash) cache key, or None if caching is off"""
+        if not self.cache_enabled or not context.patient_id or not interventions:
+            return None
+        
+        try:
+            patient = context.patient() or {}
+        except Exception as e:
+            logger.warning(f"Risk cache disabled for this run - patient lookup failed: {str(e)}")
+            return None
+        
+        regimen_hash = regimen_fingerprint(patient.get("medications", []))
+        return assessment_fingerprint(regimen_hash, interventions, current_action), regimen_hash
+    
+    def _get_cached_assessment(
+        self,
+        patient_id: str,
+        cache_key: Tuple[str, str]
+    ) -> Optional[Dict[str, Any]]:
+        """Return a still-valid cached assessment for this plan, if any"""
+        fingerprint, regimen_hash = cache_key
+        
+        try:
+            entry = risk_cache_service.get_assessment(
+                patient_id, fingerprint, regimen_hash, config.RISK_CACHE_TTL_HOURS
+            )
+        except Exception as e:
+            logger.warning(f"Risk cache lookup failed: {str(e)}")
+            return None
+        
+        if not entry:
+            return None
+        
+        self.reasoning_steps.append(
+            f"♻️ Identical plan assessed at {entry.get('cached_at')} - reusing cached MedGemma assessment"
+        )
+        
+        return {
+            **entry.get("assessment", {}),
+            "medgemma_consulted": False,
+            "cache_hit": True,
+            "cached_at": entry.get("cached_at"),
+            "reasoning": self.reasoning_steps
+        }
+    
+    def _store_cached_assessment(
+        self,
+        patient_id: str,
+        cache_key: Tuple[str, str],
+        assessment: Dict[str, Any]
+    ):
+        """Persist an assessment under its plan fingerprint (best effort)"""
+        fingerprint, regimen_hash = cache_key
+        cached = {k: v for k, v in assessment.items() if k != "reasoning"}
+        
+        try:
+            risk_cache_service.store_assessment(patient_id, fingerprint, regimen_hash, cached)
+        except Exception as e:
+            logger.warning(f"Failed to cache risk assessment: {str(e)}")
+    
     def _assess_intervention(
         self,
         intervention: Dict[str, Any],
@@ -163,7 +343,8 @@ class RiskAssessmentAgent(BaseAgent):
                 "intervention_type": intervention_type,
                 "risk_level": "low",
                 "approved": True,
-                "reason": "Non-medical intervention - low risk"
+                "reason": "Non-medical intervention - low risk",
+                "tier": "rules"
             }
     
     def _assess_timing_change(
@@ -171,10 +352,40 @@ class RiskAssessmentAgent(BaseAgent):
         intervention: Dict[str, Any],
         current_action: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """Use MedGemma to assess if timing change is safe"""
+        """Assess a timing change - deterministic rules first, MedGemma below the confidence threshold"""
         
         details = intervention.get("details", {})
         
+        # Tier 1: deterministic rules
+        verdict = self.rule_engine.evaluate(intervention, current_action)
+        tier_info = {
+            "rule": verdict["rule"],
+            "rule_confidence": verdict["confidence"],
+            "confidence_threshold": self.confidence_threshold
+        }
+        
+        if verdict["confidence"] >= self.confidence_threshold:
+            self.reasoning_steps.append(
+                f"📏 Rule '{verdict['rule']}' resolved timing change "
+                f"(confidence {verdict['confidence']:.2f}) - MedGemma not needed"
+            )
+            logger.info(f"Risk tier decision: rules ({verdict['rule']}, confidence={verdict['confidence']})")
+            
+            return {
+                "intervention_type": intervention.get("type"),
+                "risk_level": verdict["risk_level"],
+                "approved": verdict["approved"],
+                "reason": verdict["reason"],
+                "tier": "rules",
+                **tier_info
+            }
+        
+        # Tier 2: MedGemma for cases the rules can't settle
+        self.reasoning_steps.append(
+            f"📏 Rule confidence {verdict['confidence']:.2f} below {self.confidence_threshold:.2f} - escalating to MedGemma"
+        )
+        logger.info(f"Risk tier decision: medgemma ({verdict['rule']}, confidence={verdict['confidence']})")
+        
         # Create prompt for MedGemma
         prompt = create_medical_prompt(
             question=(
@@ -209,19 +420,24 @@ class RiskAssessmentAgent(BaseAgent):
                 "risk_level": "low" if safe else "medium",
                 "approved": safe,
                 "medgemma_response": response[:500],  # Truncate for storage
-                "reason": "MedGemma validation completed"
+                "reason": "MedGemma validation completed",
+                "tier": "medgemma",
+                **tier_info
             }
             
         except Exception as e:
             logger.error(f"MedGemma timing assessment failed: {str(e)}")
             self.reasoning_steps.append(f"⚠️ MedGemma error: {str(e)}")
+            self.medgemma_failed = True
             
-            # Fallback: timing changes are generally safe
+            # Fallback: use the low-confidence rule verdict
             return {
                 "intervention_type": intervention.get("type"),
-                "risk_level": "low",
-                "approved": True,
-                "reason": "MedGemma unavailable - using rule-based fallback for timing change"
+                "risk_level": verdict["risk_level"],
+                "approved": verdict["approved"],
+                "reason": f"MedGemma unavailable - using rule-based fallback for timing change ({verdict['reason']})",
+                "tier": "rules_fallback",
+                **tier_info
             }
     
     def _assess_side_effects(
@@ -242,7 +458,7 @@ class RiskAssessmentAgent(BaseAgent):
             }
         
         # Check if image is present - use vision analysis for side effects with photos
-        if current_action.get("image"):
+        if self._has_image(current_action):
             return self._assess_with_vision(intervention, current_action)
         
         # Text-only side effect assessment
@@ -282,11 +498,13 @@ class RiskAssessmentAgent(BaseAgent):
                 "approved": not requires_doctor,
                 "requires_doctor": requires_doctor,
                 "medgemma_response": response[:500],
-                "reason": "MedGemma side effect assessment completed"
+                "reason": "MedGemma side effect assessment completed",
+                "tier": "medgemma"
             }
             
         except Exception as e:
             logger.error(f"MedGemma side effect assessment failed: {str(e)}")
+            self.medgemma_failed = True
             
             # Fallback: recommend caution
             return {
@@ -303,10 +521,10 @@ class RiskAssessmentAgent(BaseAgent):
     ) -> Dict[str, Any]:
         """Use MedGemma Vision API to analyze medical images (e.g., side effect photos)"""
         
-        image_data = current_action.get("image", "")
         notes = current_action.get("notes", "")
         image_day = current_action.get("image_day", 1)
-        previous_images = current_action.get("previous_images", [])
+        previous_image_ids = current_action.get("previous_image_ids") or []
+        previous_images = current_action.get("previous_images") or previous_image_ids
         
         self.reasoning_steps.append(f"📸 Image detected (Day {image_day}) - activating MedGemma Vision analysis...")
         
@@ -357,6 +575,11 @@ class RiskAssessmentAgent(BaseAgent):
             self.reasoning_steps.append("📋 Performing baseline assessment (initial photo)...")
         
         try:
+            # Load image bytes only now - workflows carry image IDs, not blobs
+            image_data = current_action.get("image") or image_store.get_base64(current_action["image_id"])
+            if previous_image_ids and not current_action.get("previous_images"):
+                previous_images = [image_store.get_base64(image_id) for image_id in previous_image_ids]
+            
             # Call MedGemma Vision API with actual image data
             # The endpoint is configured as image-text-to-text (multimodal)
             response = self.llm.invoke(
@@ -398,6 +621,7 @@ class RiskAssessmentAgent(BaseAgent):
                 "temporal_comparison": len(previous_images) > 0,
                 "healing_trend": healing_trend,
                 "image_day": image_day,
+                "image_id": current_action.get("image_id"),
                 "medgemma_response": response[:500],
                 "reason": f"MedGemma Vision assessment completed (Day {image_day})"
             }
@@ -405,6 +629,7 @@ class RiskAssessmentAgent(BaseAgent):
         except Exception as e:
             logger.error(f"MedGemma Vision analysis failed: {str(e)}")
             self.reasoning_steps.append(f"⚠️ Vision API error: {str(e)}")
+            self.medgemma_failed = True
             
             # Fallback: recommend caution for images
             return {
@@ -415,6 +640,10 @@ class RiskAssessmentAgent(BaseAgent):
                 "reason": "Vision API unavailable - recommend manual image review by healthcare provider"
             }
     
+    def _has_image(self, current_action: Dict[str, Any]) -> bool:
+        """Check if the action carries a photo, either inline or as a stored image ID"""
+        return bool(current_action.get("image") or current_action.get("image_id"))
+    
     def _determine_overall_risk(self, assessment_results: List[Dict[str, Any]]) -> str:
         """Determine overall risk level from individual assessments"""
         
@@ -0,0 +1,200 @@
+"""
+Deterministic Risk Rules - First tier of the risk assessment
+Resolves routine medication timing changes without calling MedGemma
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+
+# ============================================================================
+# Medication Timing Knowledge
+# ============================================================================
+
+# Once-daily drugs with long half-lives: morning vs evening dosing is equivalent
+TIMING_FLEXIBLE = {
+    "atorvastatin", "rosuvastatin", "pitavastatin",
+    "amlodipine", "lisinopril", "losartan", "valsartan", "olmesartan",
+    "allopurinol", "sertraline", "escitalopram", "citalopram",
+    "omeprazole", "pantoprazole", "montelukast", "cetirizine",
+}
+
+# Short half-life statins: evening dosing is preferred
+EVENING_PREFERRED = {"simvastatin", "pravastatin", "lovastatin", "fluvastatin"}
+
+# Must be taken on an empty stomach - "take with food" reduces absorption
+EMPTY_STOMACH = {"levothyroxine", "alendronate", "risedronate", "ibandronate"}
+
+# Drugs where food is recommended or harmless
+FOOD_OK = {
+    "metformin", "allopurinol", "ibuprofen", "naproxen", "prednisone",
+    "atorvastatin", "rosuvastatin", "amlodipine", "lisinopril", "losartan",
+    "sertraline", "escitalopram", "citalopram",
+}
+
+# Narrow therapeutic index or timing-critical drugs - always defer to MedGemma
+TIMING_SENSITIVE = {
+    "levothyroxine", "warfarin", "insulin", "tacrolimus", "cyclosporine",
+    "levodopa", "carbidopa", "phenytoin", "lithium", "digoxin",
+}
+
+EVENING_TIMES = {"evening", "night", "bedtime"}
+
+
+class RiskRuleEngine:
+    """
+    Deterministic rules for timing-related interventions
+
+    Each verdict carries a confidence score. The Risk Assessment Agent only
+    consults MedGemma when the confidence is below the configured threshold.
+    """
+
+    def evaluate(
+        self,
+        intervention: Dict[str, Any],
+        current_action: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Evaluate a timing-related intervention
+
+        Args:
+            intervention: Intervention from the remediation plan
+            current_action: Triggering patient action (used to identify the drug)
+
+        Returns:
+            Verdict with risk_level, approved, confidence, rule and reason
+        """
+        intervention_type = intervention.get("type")
+        details = intervention.get("details", {})
+        drug = self.identify_drug(current_action)
+
+        if intervention_type == "schedule_adjustment":
+            return self._schedule_adjustment(details, drug)
+        elif intervention_type == "time_shift":
+            return self._time_shift(details, drug)
+        elif intervention_type == "timing_optimization":
+            return self._timing_optimization(details, drug)
+
+        return self._verdict("no_rule", "medium", True, 0.0, "No deterministic rule for this intervention")
+
+    def identify_drug(self, current_action: Dict[str, Any]) -> Optional[str]:
+        """Find a known drug name in the action's medication name or ID"""
+        text = " ".join(
+            str(current_action.get(key) or "")
+            for key in ("medication_name", "medication_id")
+        ).lower()
+
+        known = TIMING_FLEXIBLE | EVENING_PREFERRED | EMPTY_STOMACH | FOOD_OK | TIMING_SENSITIVE
+        for drug in sorted(known):
+            if drug in text:
+                return drug
+        return None
+
+    def _schedule_adjustment(self, details: Dict[str, Any], drug: Optional[str]) -> Dict[str, Any]:
+        """Reminder moved by a few minutes on a specific day"""
+        minutes = self._parse_minutes(details.get("adjustment", ""))
+
+        if drug in TIMING_SENSITIVE:
+            return self._verdict(
+                "sensitive_drug_reschedule", "low", True, 0.5,
+                f"{drug} is timing-critical - medical review of any schedule change"
+            )
+
+        if minutes is not None and minutes <= 60:
+            return self._verdict(
+                "small_reminder_shift", "low", True, 0.95,
+                f"Reminder moved by {minutes} minutes - well within the dosing window"
+            )
+
+        return self._verdict(
+            "large_reminder_shift", "low", True, 0.6,
+            "Schedule change larger than one hour or unspecified"
+        )
+
+    def _time_shift(self, details: Dict[str, Any], drug: Optional[str]) -> Dict[str, Any]:
+        """Dose moved between parts of the day (e.g. morning -> evening)"""
+        current = str(details.get("current_time") or "").lower()
+        proposed = str(details.get("proposed_time") or "").lower()
+
+        if drug is None:
+            return self._verdict("unknown_drug_shift", "low", True, 0.5, "Medication not recognised")
+
+        if drug in TIMING_SENSITIVE:
+            return self._verdict(
+                "sensitive_drug_shift", "medium", True, 0.3,
+                f"{drug} is timing-critical - needs medical validation"
+            )
+
+        if drug in EVENING_PREFERRED:
+            if proposed in EVENING_TIMES:
+                return self._verdict(
+                    "statin_to_evening", "low", True, 0.9,
+                    f"{drug} is preferably taken in the evening"
+                )
+            return self._verdict(
+                "statin_from_evening", "medium", True, 0.7,
+                f"{drug} has a short half-life - moving away from evening may reduce efficacy"
+            )
+
+        if drug in TIMING_FLEXIBLE:
+            return self._verdict(
+                "once_daily_flexible", "low", True, 0.9,
+                f"{drug} is long-acting once-daily - {current or 'current'} vs {proposed or 'proposed'} dosing is equivalent"
+            )
+
+        return self._verdict("known_drug_shift", "low", True, 0.6, f"No timing rule for {drug}")
+
+    def _timing_optimization(self, details: Dict[str, Any], drug: Optional[str]) -> Dict[str, Any]:
+        """Dose anchored to food for tolerability"""
+        suggestion = str(details.get("suggestion") or "").lower()
+        with_food = "food" in suggestion or "meal" in suggestion
+
+        if not with_food:
+            return self._verdict("non_food_optimization", "low", True, 0.5, "Unrecognised timing optimisation")
+
+        if drug in EMPTY_STOMACH:
+            return self._verdict(
+                "empty_stomach_with_food", "medium", False, 0.9,
+                f"{drug} must be taken on an empty stomach - food reduces absorption"
+            )
+
+        if drug in FOOD_OK:
+            return self._verdict(
+                "food_ok", "low", True, 0.9,
+                f"{drug} can be taken with food - may reduce GI side effects"
+            )
+
+        return self._verdict("unknown_drug_food", "low", True, 0.5, "Food interaction not known for this medication")
+
+    def _parse_minutes(self, text: str) -> Optional[int]:
+        """Parse '30 minutes earlier' / '1 hour later' into minutes"""
+        match = re.search(r"(\d+)\s*(minute|min|hour|hr)", str(text).lower())
+        if not match:
+            return None
+        value = int(match.group(1))
+        return value * 60 if match.group(2) in ("hour", "hr") else value
+
+    def _verdict(
+        self,
+        rule: str,
+        risk_level: str,
+        approved: bool,
+        confidence: float,
+        reason: str
+    ) -> Dict[str, Any]:
+        return {
+            "rule": rule,
+            "risk_level": risk_level,
+            "approved": approved,
+            "confidence": confidence,
+            "reason": reason
+        }
+
+
+def summarize_tiers(assessment_results: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Count how many intervention assessments each tier resolved"""
+    counts: Dict[str, int] = {}
+    for result in assessment_results:
+        tier = result.get("tier")
+        if tier:
+            counts[tier] = counts.get(tier, 0) + 1
+    return counts
@@ -0,0 +1,6 @@
+"""
+MedAdhere Pro - Analytics Package
+Vectorized engines for adherence pattern analysis
+"""
+
+__version__ = "0.1.0"
@@ -0,0 +1,176 @@
+"""
+Streaming Adherence Anomaly Detection
+Per patient/medication EWMA and CUSUM statistics updated with every logged action
+
+Each action updates a small state dictionary in constant time: a fast
+EWMA of the miss indicator (the recent miss rate), a slow EWMA (the
+patient's own baseline), a one-sided CUSUM of misses above that baseline,
+and a two-sided CUSUM of how far doses drift from their usual time of
+day. triage() turns the updated statistics into a routing decision, so
+an isolated miss is acknowledged while a sustained deterioration still
+gets the full agent workflow.
+"""
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+from backend.analytics.pattern_engine import parse_timestamps, to_local_time
+
+WORKFLOW = "workflow"        # run the full agent workflow now
+ACKNOWLEDGE = "acknowledge"  # log only - nothing unusual
+DEFER = "defer"              # queue for the batch review
+
+# Miss indicator per action (a snooze is half a miss); other actions are ignored
+MISS_WEIGHTS = {"took": 0.0, "snoozed": 0.5, "skipped": 1.0}
+
+# EWMA smoothing: recent miss rate, long-run baseline, usual dose time
+FAST_ALPHA = 0.3
+SLOW_ALPHA = 0.05
+TIME_ALPHA = 0.1
+
+# Miss CUSUM: allowance above the baseline per action and alarm threshold
+MISS_SLACK = 0.1
+MISS_THRESHOLD = 1.5
+
+# Recent miss rate that triggers the workflow (when above the baseline) or a review
+MISS_RATE_ALERT = 0.5
+MISS_RATE_REVIEW = 0.35
+
+# Timing CUSUM (minutes): tolerated deviation per dose and alarm threshold
+TIMING_SLACK_MINUTES = 45
+TIMING_THRESHOLD_MINUTES = 180
+
+# Actions observed before the baseline is trusted (misses go to the workflow until then)
+WARMUP_ACTIONS = 5
+
+# Reasons that always need the workflow, whatever the statistics say
+URGENT_REASONS = {"side_effects", "ran_out"}
+
+
+def new_state() -> Dict[str, Any]:
+    """Detector state for a patient/medication with no history"""
+    return {
+        "observations": 0,
+        "miss_fast": 0.0,
+        "miss_slow": 0.0,
+        "miss_cusum": 0.0,
+        "time_mean": None,
+        "time_cusum_late": 0.0,
+        "time_cusum_early": 0.0
+    }
+
+
+def local_minute(timestamp: Any, timezone: Optional[str]) -> Optional[int]:
+    """Minute of the local day of a log timestamp (None if unparseable)"""
+    local = to_local_time(parse_timestamps([timestamp or ""]), timezone)[0]
+    if np.isnat(local):
+        return None
+    return int((local - local.astype("datetime64[D]")).astype("timedelta64[m]").astype(int))
+
+
+def update(
+    state: Dict[str, Any],
+    action: Optional[str],
+    minute: Optional[int] = None
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Fold one logged action into the detector state
+
+    Args:
+        state: Current state (see new_state); not modified
+        action: Logged action (took/skipped/snoozed)
+        minute: Local minute of day of the action, if known
+
+    Returns:
+        (updated state, signals for triage())
+    """
+    state = {**new_state(), **state}
+    x = MISS_WEIGHTS.get(action)
+
+    if x is not None:
+        baseline = state["miss_slow"]
+        state["miss_cusum"] = max(0.0, state["miss_cusum"] + x - baseline - MISS_SLACK)
+        state["miss_fast"] += FAST_ALPHA * (x - state["miss_fast"])
+        state["miss_slow"] += SLOW_ALPHA * (x - state["miss_slow"])
+        state["observations"] += 1
+
+    miss_alarm = state["miss_cusum"] >= MISS_THRESHOLD
+    if miss_alarm:
+        state["miss_cusum"] = 0.0  # the next alarm needs fresh evidence
+
+    drift = None
+    timing_alarm = False
+    if action == "took" and minute is not None:
+        if state["time_mean"] is None:
+            state["time_mean"] = float(minute)
+        else:
+            # Circular difference, so 23:50 vs 00:10 is 20 minutes late
+            drift = (minute - state["time_mean"] + 720) % 1440 - 720
+            state["time_cusum_late"] = max(0.0, state["time_cusum_late"] + drift - TIMING_SLACK_MINUTES)
+            state["time_cusum_early"] = max(0.0, state["time_cusum_early"] - drift - TIMING_SLACK_MINUTES)
+            state["time_mean"] = (state["time_mean"] + TIME_ALPHA * drift) % 1440
+
+            timing_alarm = max(state["time_cusum_late"], state["time_cusum_early"]) >= TIMING_THRESHOLD_MINUTES
+            if timing_alarm:
+                state["time_cusum_late"] = state["time_cusum_early"] = 0.0
+
+    signals = {
+        "observations": state["observations"],
+        "miss_rate": round(state["miss_fast"], 3),
+        "baseline_miss_rate": round(state["miss_slow"], 3),
+        "miss_alarm": miss_alarm,
+        "timing_drift_minutes": None if drift is None else round(drift),
+        "timing_alarm": timing_alarm
+    }
+    return state, signals
+
+
+def triage(action: Optional[str], reason: Optional[str], signals: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Decide how a logged action is handled
+
+    Args:
+        action: Logged action
+        reason: Stated reason
+        signals: Signals returned by update()
+
+    Returns:
+        (WORKFLOW | ACKNOWLEDGE | DEFER, human-readable explanation)
+    """
+    if reason in URGENT_REASONS:
+        return WORKFLOW, f"'{reason}' needs follow-up"
+
+    if action in ("skipped", "snoozed"):
+        if signals["observations"] <= WARMUP_ACTIONS:
+            return WORKFLOW, "Not enough history for a baseline yet"
+        if signals["miss_alarm"]:
+            return WORKFLOW, "Sustained rise in missed doses (CUSUM alarm)"
+        miss_rate = signals["miss_rate"]
+        if miss_rate >= MISS_RATE_ALERT and miss_rate > signals["baseline_miss_rate"] + MISS_SLACK:
+            return WORKFLOW, f"Recent miss rate {miss_rate:.0%} above the patient's baseline"
+        if miss_rate >= MISS_RATE_REVIEW:
+            return DEFER, f"Recent miss rate {miss_rate:.0%}"
+        return ACKNOWLEDGE, "Isolated miss"
+
+    if signals["timing_alarm"]:
+        return DEFER, "Dose times drifting from the usual schedule"
+
+    return ACKNOWLEDGE, "Routine dose"
+
+
+def needs_workflow(data: Dict[str, Any], triage_result: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Whether a logged action should trigger the agent workflow
+
+    The detector's decision (made when logging) gates the workflow;
+    without one, every miss or side-effect report triggers it.
+
+    Args:
+        data: Logged patient action
+        triage_result: Detector decision for the action ({"decision", ...}), if triage ran
+
+    Returns:
+        True if the workflow should run for this action
+    """
+    if triage_result:
+        return triage_result["decision"] == WORKFLOW
+    action = data.get("action")
+    return action in ("skipped", "snoozed") or (action == "took" and data.get("reason") == "side_effects")
@@ -0,0 +1,347 @@
+"""
+Expected-Dose Calendar
+Scheduled doses from each medication's scheduled_times/frequency, matched
+against the adherence logs
+
+Adherence counts built from logs alone never see a dose the patient did
+not log. The calendar expands every medication's daily times over the
+date range into one datetime64 array (local wall-clock times converted to
+UTC per distinct day, DST included), then assigns logs to slots with a
+single searchsorted over sorted (medication, time) keys. Every slot ends
+up taken, late, skipped, unlogged (a silent miss) or pending (its window
+is still open) - without a per-dose Python loop.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from backend.analytics.pattern_engine import (
+    DAY_NAMES,
+    HOUR_TO_BUCKET,
+    TIME_BUCKETS,
+    LogArrays,
+    from_local_time,
+    most_common,
+    parse_timestamps,
+    to_local_time,
+    weekday_and_hour
+)
+
+STATUSES = ["taken", "late", "skipped", "unlogged", "pending"]
+TAKEN, LATE, SKIPPED, UNLOGGED, PENDING = range(len(STATUSES))
+
+# Daily times used when a medication has no scheduled_times
+DEFAULT_TIMES = {
+    "QD": ["08:00"],
+    "QAM": ["08:00"],
+    "QHS": ["21:00"],
+    "BID": ["08:00", "20:00"],
+    "TID": ["08:00", "14:00", "20:00"],
+    "QID": ["08:00", "12:00", "16:00", "20:00"]
+}
+
+# As-needed medications have no expected doses
+AS_NEEDED_FREQUENCIES = {"PRN"}
+
+# A log belongs to a slot from EARLY_MINUTES before it until the next
+# slot of the same medication, and at most MATCH_WINDOW_HOURS after it
+EARLY_MINUTES = 60
+MATCH_WINDOW_HOURS = 12
+
+# A dose taken more than this long after its slot is late
+LATE_AFTER_MINUTES = 60
+
+# Key layout for the sorted merge: medication code in the high bits,
+# epoch seconds (valid well past year 2200) in the low 33 bits
+_SECONDS_BITS = 33
+
+
+# ============================================================================
+# Schedule Expansion
+# ============================================================================
+
+def daily_minutes(medication: Dict[str, Any]) -> List[int]:
+    """
+    Scheduled minutes after local midnight for one medication
+
+    Args:
+        medication: Medication dictionary (scheduled_times, frequency)
+
+    Returns:
+        Sorted, de-duplicated minutes of day (empty for PRN or unknown schedules)
+    """
+    frequency = (medication.get("frequency") or "").upper()
+    if frequency in AS_NEEDED_FREQUENCIES:
+        return []
+
+    times = medication.get("scheduled_times") or DEFAULT_TIMES.get(frequency, [])
+    minutes = set()
+    for value in times:
+        try:
+            hours, mins = str(value).split(":")[:2]
+            minute = int(hours) * 60 + int(mins)
+        except ValueError:
+            continue
+        if 0 <= minute < 24 * 60:
+            minutes.add(minute)
+    return sorted(minutes)
+
+
+class DoseCalendar:
+    """
+    Expected doses of a patient's medications over a period, with their status
+
+    Attributes:
+        medication_ids: Medication IDs; medication_codes index into this list
+        medication_codes: int code per slot
+        scheduled: datetime64[ms] UTC time per slot
+        local: datetime64[ms] local wall-clock time per slot
+        status: int8 index into STATUSES per slot
+        delay_minutes: float delay of the matched "took" (NaN if none)
+        unscheduled_logs: took/skipped logs that matched no slot
+    """
+
+    def __init__(
+        self,
+        medications: Sequence[Dict[str, Any]],
+        logs: Sequence[Dict[str, Any]],
+        timezone: Optional[str],
+        days: int,
+        now: Optional[datetime] = None,
+        since: Optional[Any] = None
+    ):
+        """
+        Expand the schedule over the last `days` days and classify every slot
+
+        Args:
+            medications: Patient's medication dictionaries
+            logs: Adherence logs covering the period (any order)
+            timezone: Patient's IANA timezone
+            days: Period length; slots from now - days up to now are reported
+            now: Current UTC time (naive); defaults to datetime.utcnow()
+            since: Optional enrollment time - earlier slots are not expected
+        """
+        now = np.datetime64(now or datetime.utcnow(), "ms")
+        cutoff = now - np.timedelta64(days, "D")
+        if since:
+            enrolled = parse_timestamps([since])[0]
+            if not np.isnat(enrolled) and enrolled > cutoff:
+                cutoff = enrolled
+
+        self.medication_ids: List[str] = []
+        schedules = []
+        for medication in medications:
+            minutes = daily_minutes(medication)
+            if minutes and medication.get("medication_id"):
+                self.medication_ids.append(medication["medication_id"])
+                schedules.append(minutes)
+
+        # Local dates covering the period, plus a day either side so slots
+        # just outside it can still bound the match windows
+        local_range = to_local_time(np.array([cutoff, now]), timezone).astype("datetime64[D]")
+        dates = np.arange(local_range[0] - 1, local_range[1] + 2)
+
+        local, codes = _expand(dates, schedules)
+        scheduled = from_local_time(local, timezone)
+        order = np.lexsort((scheduled, codes))
+        local, codes, scheduled = local[order], codes[order], scheduled[order]
+
+        status, delay, self.unscheduled_logs = _classify(
+            codes, scheduled, logs, timezone, self.medication_ids, cutoff, now
+        )
+
+        keep = (scheduled >= cutoff) & (scheduled <= now)
+        self.medication_codes = codes[keep]
+        self.scheduled = scheduled[keep]
+        self.local = local[keep]
+        self.status = status[keep]
+        self.delay_minutes = delay[keep]
+
+    def __len__(self) -> int:
+        return len(self.status)
+
+    def status_counts(self, mask: Optional[np.ndarray] = None) -> Dict[str, int]:
+        """Slots per status (optionally for a subset of slots)"""
+        status = self.status if mask is None else self.status[mask]
+        counts = np.bincount(status, minlength=len(STATUSES))
+        return {name: int(n) for name, n in zip(STATUSES, counts)}
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Expected-dose totals for the period
+
+        Returns:
+            Status counts, expected_doses, dose_adherence_rate (taken or late
+            as a share of slots whose window has closed), silent-miss
+            day/time pattern and per-medication counts
+        """
+        result = self._totals(self.status_counts())
+
+        silent = self.status == UNLOGGED
+        weekday, hour = weekday_and_hour(self.local[silent])
+        top_day = most_common(weekday, 7)
+        top_time = most_common(HOUR_TO_BUCKET[hour], len(TIME_BUCKETS))
+        result["silent_miss_day"] = DAY_NAMES[top_day[0]] if top_day else None
+        result["silent_miss_time"] = TIME_BUCKETS[top_time[0]] if top_time else None
+
+        result["unscheduled_logs"] = self.unscheduled_logs
+        result["by_medication"] = {
+            medication_id: self._totals(self.status_counts(self.medication_codes == m))
+            for m, medication_id in enumerate(self.medication_ids)
+        }
+        return result
+
+    def slots(self, statuses: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Individual slots, oldest first (for display - loops over the result)
+
+        Args:
+            statuses: Only return slots with these statuses
+
+        Returns:
+            [{"medication_id", "scheduled", "local", "status", "delay_minutes"}]
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if statuses is not None:
+            mask = np.isin(self.status, [STATUSES.index(s) for s in statuses])
+
+        indices = np.flatnonzero(mask)
+        indices = indices[np.argsort(self.scheduled[indices], kind="stable")]
+        return [
+            {
+                "medication_id": self.medication_ids[self.medication_codes[i]],
+                "scheduled": str(self.scheduled[i].astype("datetime64[s]")),
+                "local": str(self.local[i].astype("datetime64[m]")),
+                "status": STATUSES[self.status[i]],
+                "delay_minutes": None if np.isnan(self.delay_minutes[i]) else round(float(self.delay_minutes[i]))
+            }
+            for i in indices
+        ]
+
+    @staticmethod
+    def _totals(counts: Dict[str, int]) -> Dict[str, Any]:
+        expected = sum(counts.values())
+        resolved = expected - counts["pending"]
+        rate = (counts["taken"] + counts["late"]) / resolved * 100 if resolved else 0
+        return {
+            "expected_doses": expected,
+            **counts,
+            "dose_adherence_rate": round(rate, 2)
+        }
+
+
+# ============================================================================
+# Helpers
+# ============================================================================
+
+def _expand(dates: np.ndarray, schedules: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Local slot times and medication codes: every date x every daily time"""
+    if not schedules:
+        return np.array([], dtype="datetime64[ms]"), np.array([], dtype=np.int64)
+
+    minutes = np.concatenate([np.asarray(m, dtype=np.int64) for m in schedules])
+    med_of_minute = np.repeat(np.arange(len(schedules)), [len(m) for m in schedules])
+
+    local = dates.astype("datetime64[m]")[:, None] + minutes.astype("timedelta64[m]")[None, :]
+    codes = np.broadcast_to(med_of_minute, local.shape)
+    return local.ravel().astype("datetime64[ms]"), codes.ravel().astype(np.int64)
+
+
+def _classify(
+    codes: np.ndarray,
+    scheduled: np.ndarray,
+    logs: Sequence[Dict[str, Any]],
+    timezone: Optional[str],
+    medication_ids: List[str],
+    cutoff: np.datetime64,
+    now: np.datetime64
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Sorted-merge of logs into slots (slots sorted by medication, then time)
+
+    Returns:
+        (status per slot, took delay in minutes per slot, logs within
+        cutoff..now that matched no slot)
+    """
+    n = len(codes)
+    seconds = scheduled.astype("datetime64[s]").astype(np.int64)
+    slot_keys = (codes << _SECONDS_BITS) | seconds
+
+    # Window end: next slot of the same medication (minus the early allowance),
+    # at most MATCH_WINDOW_HOURS after the slot
+    ends = seconds + MATCH_WINDOW_HOURS * 3600
+    if n > 1:
+        same_next = codes[1:] == codes[:-1]
+        ends[:-1] = np.where(same_next, np.minimum(ends[:-1], seconds[1:] - EARLY_MINUTES * 60), ends[:-1])
+
+    arrays = LogArrays(logs, timezone)
+    med_index = {medication_id: m for m, medication_id in enumerate(medication_ids)}
+    label_to_med = np.array([med_index.get(label, -1) for label in arrays.medication_labels] or [-1])
+    log_meds = label_to_med[arrays.medication_codes] if arrays.size else np.array([], dtype=np.int64)
+
+    took = arrays.action_mask("took")
+    skipped = arrays.action_mask("skipped")
+    usable = (took | skipped) & ~np.isnat(arrays.utc)
+    matchable = usable & (log_meds >= 0)
+
+    log_seconds = arrays.utc[matchable].astype("datetime64[s]").astype(np.int64)
+    log_keys = (log_meds[matchable] << _SECONDS_BITS) | (log_seconds + EARLY_MINUTES * 60)
+    slot = np.searchsorted(slot_keys, log_keys, side="right") - 1
+
+    safe = np.clip(slot, 0, max(n - 1, 0))
+    matched = (slot >= 0) & (n > 0)
+    if n:
+        matched &= (codes[safe] == log_meds[matchable]) & (log_seconds < ends[safe])
+
+    delay = np.full(n, np.inf)
+    was_took = took[matchable] & matched
+    np.minimum.at(delay, slot[was_took], (log_seconds[was_took] - seconds[slot[was_took]]) / 60)
+
+    was_skipped = np.zeros(n, dtype=bool)
+    was_skipped[slot[skipped[matchable] & matched]] = True
+
+    now_seconds = now.astype("datetime64[s]").astype(np.int64)
+    status = np.where(
+        delay <= LATE_AFTER_MINUTES, TAKEN,
+        np.where(
+            np.isfinite(delay), LATE,
+            np.where(was_skipped, SKIPPED, np.where(now_seconds < ends, PENDING, UNLOGGED))
+        )
+    ).astype(np.int8)
+
+    delay[~np.isfinite(delay)] = np.nan
+    in_period = usable & (arrays.utc >= cutoff) & (arrays.utc <= now)
+    matched_in_period = np.zeros(arrays.size, dtype=bool)
+    matched_in_period[np.flatnonzero(matchable)[matched]] = True
+    unscheduled = int((in_period & ~matched_in_period).sum())
+    return status, delay, unscheduled
+
+
+def calendar_summary(
+    patient: Optional[Dict[str, Any]],
+    logs: Sequence[Dict[str, Any]],
+    timezone: Optional[str],
+    days: int,
+    now: Optional[datetime] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Expected-dose summary for a patient profile
+
+    Args:
+        patient: Patient dictionary (medications, created_at)
+        logs: Adherence logs of the last `days` days
+        timezone: Patient's IANA timezone
+        days: Period length
+        now: Current UTC time (naive)
+
+    Returns:
+        DoseCalendar.summary() plus "period_days", or None if the patient
+        has no scheduled medications
+    """
+    medications = (patient or {}).get("medications") or []
+    if not any(daily_minutes(med) for med in medications):
+        return None
+
+    calendar = DoseCalendar(
+        medications, logs, timezone, days, now=now, since=(patient or {}).get("created_at")
+    )
+    return {**calendar.summary(), "period_days": days}
@@ -0,0 +1,199 @@
+"""
+Intervention Effectiveness
+Before/after adherence around interventions from one sorted timestamp array
+
+Logs are parsed and sorted once; the before and after windows of every
+intervention are then located with searchsorted on that array and the
+"took" counts read from a cumulative sum, so scoring N interventions costs
+one sort plus O(N log n) instead of re-filtering the logs per intervention.
+
+Every score compares the COUNTER_WINDOW_DAYS before an intervention with
+the COUNTER_WINDOW_DAYS from it on, whether it comes from the logs
+(effectiveness_scores) or from the materialized counters (counters_score).
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from backend.analytics.pattern_engine import parse_timestamps
+
+# Days compared on each side of an intervention
+COUNTER_WINDOW_DAYS = 7
+
+
+class SortedLogs:
+    """
+    Log timestamps sorted ascending, with a running count of "took" actions
+
+    Naive timestamps are UTC (what log_action writes); logs without a
+    parseable timestamp are left out.
+    """
+
+    def __init__(self, logs: Sequence[Dict[str, Any]]):
+        utc = parse_timestamps([log.get("timestamp") or "" for log in logs])
+        took = np.array([log.get("action") == "took" for log in logs], dtype=bool)
+
+        valid = ~np.isnat(utc)
+        order = np.argsort(utc[valid], kind="stable")
+        self.timestamps = utc[valid][order]
+        self.took_before = np.concatenate([[0], np.cumsum(took[valid][order])])
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def counts(self, start: np.ndarray, end: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Took and total counts in [start, end) for arrays of window bounds
+
+        Args:
+            start: datetime64 window starts (inclusive)
+            end: datetime64 window ends (exclusive); None for "up to now"
+
+        Returns:
+            (took counts, total counts)
+        """
+        lo = np.searchsorted(self.timestamps, start, side="left")
+        if end is None:
+            hi = np.full(len(lo), len(self.timestamps))
+        else:
+            hi = np.maximum(np.searchsorted(self.timestamps, end, side="left"), lo)
+        return self.took_before[hi] - self.took_before[lo], hi - lo
+
+
+def intervention_times(interventions: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """created_at of each intervention as UTC datetime64[ms] (NaT if missing)"""
+    return parse_timestamps([intervention.get("created_at") or "" for intervention in interventions])
+
+
+def effectiveness_scores(logs: Any, times: np.ndarray) -> List[Optional[Dict[str, float]]]:
+    """
+    Before/after adherence and score for every intervention at once
+
+    Score = (after rate - before rate) / 100, from -1.0 (made it worse) to
+    +1.0 (perfect improvement); a window without logs has a rate of 0.
+
+    Args:
+        logs: Adherence logs covering the windows of every intervention, or SortedLogs
+        times: Intervention times (see intervention_times)
+
+    Returns:
+        Per intervention {"before_rate", "after_rate", "score"}, or None
+        if it has no time
+    """
+    has_time = ~np.isnat(times)
+    counts = window_counts(logs, times[has_time])
+
+    before_rate = _rates(counts["before_took"], counts["before_total"])
+    after_rate = _rates(counts["after_took"], counts["after_total"])
+
+    results: List[Optional[Dict[str, float]]] = [None] * len(times)
+    for i, index in enumerate(np.flatnonzero(has_time)):
+        results[index] = {
+            "before_rate": float(before_rate[i]),
+            "after_rate": float(after_rate[i]),
+            "score": float((after_rate[i] - before_rate[i]) / 100)
+        }
+    return results
+
+
+def _rates(took: np.ndarray, total: np.ndarray) -> np.ndarray:
+    rates = np.zeros(len(total))
+    has_logs = total > 0
+    rates[has_logs] = took[has_logs] / total[has_logs] * 100
+    return rates
+
+
+# ============================================================================
+# Materialized Counters
+# ============================================================================
+#
+# Stored on each intervention as "effectiveness" and kept current by the
+# effectiveness worker. The windows are fixed around the intervention
+# (COUNTER_WINDOW_DAYS before and after it), so the score stops changing
+# - and is sealed - once the after window has closed. Logs written up to
+# "counted_until" were backfilled; the worker counts the later ones.
+
+COUNTER_FIELDS = ("before_took", "before_total", "after_took", "after_total")
+
+
+def new_counters(anchor: datetime, counted_until: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Empty counters for an intervention created at `anchor`
+
+    Args:
+        anchor: Intervention time (naive UTC)
+        counted_until: When the backfilled logs were read (default: anchor)
+
+    Returns:
+        {"anchor", "window_end", "counted_until", counters..., "sealed": False, "score": None}
+    """
+    return {
+        "anchor": anchor.isoformat(),
+        "window_end": (anchor + timedelta(days=COUNTER_WINDOW_DAYS)).isoformat(),
+        "counted_until": (counted_until or anchor).isoformat(),
+        **{field: 0 for field in COUNTER_FIELDS},
+        "sealed": False,
+        "score": None
+    }
+
+
+def window_counts(logs: Any, anchors: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Counter values contributed by a set of logs to interventions at `anchors`
+
+    Args:
+        logs: Adherence logs or SortedLogs
+        anchors: datetime64 intervention times
+
+    Returns:
+        {field: array aligned with anchors} for COUNTER_FIELDS
+    """
+    sorted_logs = logs if isinstance(logs, SortedLogs) else SortedLogs(logs)
+    window = np.timedelta64(COUNTER_WINDOW_DAYS, "D")
+
+    before_took, before_total = sorted_logs.counts(anchors - window, anchors)
+    after_took, after_total = sorted_logs.counts(anchors, anchors + window)
+    return {
+        "before_took": before_took,
+        "before_total": before_total,
+        "after_took": after_took,
+        "after_total": after_total
+    }
+
+
+def initial_counters(logs: Any, anchor: datetime, counted_until: Optional[datetime] = None) -> Dict[str, Any]:
+    """Counters for an intervention at `anchor`, counting the given logs (read at `counted_until`)"""
+    counts = window_counts(logs, np.array([anchor], dtype="datetime64[ms]"))
+    return add_counts(new_counters(anchor, counted_until), {field: values[0] for field, values in counts.items()})
+
+
+def add_counts(counters: Dict[str, Any], counts: Dict[str, Any]) -> Dict[str, Any]:
+    """Counters with counts added (not modified in place)"""
+    return {**counters, **{field: counters.get(field, 0) + int(counts.get(field, 0)) for field in COUNTER_FIELDS}}
+
+
+def counters_score(counters: Dict[str, Any]) -> Dict[str, float]:
+    """Before/after rates and score from counters (same formula as effectiveness_scores)"""
+    before_rate, after_rate = _rates(
+        np.array([counters["before_took"], counters["after_took"]]),
+        np.array([counters["before_total"], counters["after_total"]])
+    )
+    return {
+        "before_rate": float(before_rate),
+        "after_rate": float(after_rate),
+        "score": float((after_rate - before_rate) / 100)
+    }
+
+
+def is_due(counters: Dict[str, Any], now: Optional[datetime] = None) -> bool:
+    """Whether the after window has closed and the counters can be sealed"""
+    return not counters.get("sealed") and counters["window_end"] <= (now or datetime.utcnow()).isoformat()
+
+
+def seal(counters: Dict[str, Any], now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Final counters with the score fixed"""
+    return {
+        **counters,
+        **counters_score(counters),
+        "sealed": True,
+        "sealed_at": (now or datetime.utcnow()).isoformat()
+    }
@@ -0,0 +1,286 @@
+"""
+Multi-Window Adherence Analysis
+7/30/90-day histograms, trends, change-points and refill gaps in one pass
+
+The scanner consumes daily buckets newest first - either straight from a
+date-descending log cursor or from a rollup document - and emits each
+window's result as soon as the cursor moves past the window's start, so
+the 7-day result is ready after a week of history has been read and the
+cursor is abandoned once the widest window completes.
+"""
+from datetime import date, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from backend.analytics.pattern_engine import HOUR_TO_BUCKET, TIME_BUCKETS, LogArrays
+from backend.analytics.rollups import PatternCounts, local_today, merge_counts, window_days
+
+DEFAULT_WINDOWS = (7, 30, 90)
+
+# Trend: change in adherence (percentage points per period) that counts as a trend
+TREND_THRESHOLD = 2.0
+
+# Change-point: minimum days on each side and minimum miss-rate shift
+CHANGE_POINT_MIN_SEGMENT = 3
+CHANGE_POINT_MIN_SHIFT = 0.25
+
+# Refill gaps: "ran out" episodes recurring at roughly monthly intervals
+REFILL_GAP_MERGE_DAYS = 2
+REFILL_INTERVAL_RANGE = (20, 40)
+
+DailyBucket = Tuple[str, Dict[str, Any]]
+
+
+# ============================================================================
+# Daily Bucket Sources
+# ============================================================================
+
+def daily_from_rows(
+    rows: Iterable[Any],
+    timezone: Optional[str],
+    chunk_size: int = 500
+) -> Iterator[DailyBucket]:
+    """
+    Group a date-descending log cursor into daily buckets
+
+    Timestamps are converted a chunk at a time (vectorized), and a day is
+    yielded as soon as the cursor moves to an earlier date.
+
+    Args:
+        rows: LogRow (or log dict) iterator, newest first
+        timezone: Patient's IANA timezone
+        chunk_size: Rows converted per vectorized batch
+
+    Yields:
+        (YYYY-MM-DD, bucket) in the rollup "daily" format
+    """
+    rows = iter(rows)
+    current_day = None
+    current: Dict[str, Any] = {}
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        arrays = LogArrays(chunk, timezone)
+        days = arrays.local.astype("datetime64[D]").astype(str)
+
+        for i, row in enumerate(chunk):
+            if arrays.hour[i] < 0:
+                continue  # no usable timestamp
+
+            if days[i] != current_day:
+                if current_day is not None:
+                    yield current_day, current
+                current_day, current = str(days[i]), {}
+
+            action = row.get("action") or "unknown"
+            counts = {
+                "actions": {action: 1},
+                "buckets": {action: {TIME_BUCKETS[HOUR_TO_BUCKET[arrays.hour[i]]]: 1}}
+            }
+            reason = row.get("reason")
+            if reason:
+                counts["reasons"] = {action: {reason: 1}}
+            merge_counts(current, counts)
+
+    if current_day is not None:
+        yield current_day, current
+
+
+def daily_from_rollup(rollup: Dict[str, Any], days: int, today: Optional[date] = None) -> Iterator[DailyBucket]:
+    """Daily buckets of a rollup document, newest first"""
+    return iter(window_days(rollup, days, today))
+
+
+# ============================================================================
+# Scanner
+# ============================================================================
+
+def scan_windows(
+    daily: Iterable[DailyBucket],
+    windows: Iterable[int] = DEFAULT_WINDOWS,
+    today: Optional[date] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Analyze several look-back windows in one pass over newest-first days
+
+    A window of N days covers N dates: today and the N - 1 days before it
+    (the same dates as rollups.window_days()).
+
+    Args:
+        daily: (YYYY-MM-DD, bucket) pairs, newest first
+        windows: Window lengths in days
+        today: Patient's local date
+
+    Yields:
+        One result per window, shortest first, as each window completes
+    """
+    pending = sorted(set(windows))
+    today = today or local_today(None)
+
+    counts = PatternCounts("skipped")
+    series: List[Dict[str, Any]] = []  # newest first
+
+    for day, bucket in daily:
+        age = (today - date.fromisoformat(day)).days
+
+        while pending and age >= pending[0]:
+            yield window_result(pending.pop(0), counts, series, today)
+        if not pending:
+            return  # widest window done - stop reading the cursor
+
+        counts.add_day(day, bucket)
+        actions = bucket.get("actions", {})
+        entry = {
+            "date": day,
+            "took": actions.get("took", 0),
+            "skipped": actions.get("skipped", 0),
+            "total": sum(actions.values()),
+            "ran_out": bucket.get("reasons", {}).get("skipped", {}).get("ran_out", 0)
+        }
+        if series and series[-1]["date"] == day:
+            merge_counts(series[-1], {k: v for k, v in entry.items() if k != "date"})
+        else:
+            series.append(entry)
+
+    for days in pending:
+        yield window_result(days, counts, series, today)
+
+
+def window_result(
+    days: int,
+    counts: PatternCounts,
+    series: List[Dict[str, Any]],
+    today: date
+) -> Dict[str, Any]:
+    """
+    Summarize a completed window
+
+    Returns:
+        Totals, adherence rate, skip patterns, trend, change-point and refill gaps
+    """
+    total = sum(entry["total"] for entry in series)
+    skipped = sum(entry["skipped"] for entry in series)
+    adherence_rate = round((total - skipped) / total * 100, 2) if total else 0
+
+    return {
+        "days": days,
+        "total_actions": total,
+        "skipped_count": skipped,
+        "adherence_rate": adherence_rate,
+        **counts.patterns(),
+        "trend": adherence_trend(series, days, today),
+        "change_point": miss_rate_change_point(series),
+        "refill_gaps": refill_gaps(series)
+    }
+
+
+# ============================================================================
+# Trend, Change-Point and Refill Gap Detection
+# ============================================================================
+
+def adherence_trend(series: List[Dict[str, Any]], days: int, today: date) -> Dict[str, Any]:
+    """
+    Direction of adherence over the window (daily periods up to a week, weekly beyond)
+
+    Returns:
+        {"direction": improving|declining|stable|insufficient_data, "slope": pp/period, "period_days": n}
+    """
+    period_days = 1 if days <= 7 else 7
+    periods = days // period_days + 1
+
+    took = np.zeros(periods)
+    total = np.zeros(periods)
+    for entry in series:
+        period = min((today - date.fromisoformat(entry["date"])).days // period_days, periods - 1)
+        if period >= 0:
+            took[period] += entry["took"]
+            total[period] += entry["total"]
+
+    has_data = total > 0
+    if has_data.sum() < 2:
+        return {"direction": "insufficient_data", "period_days": period_days}
+
+    # x grows towards the present
+    x = -np.flatnonzero(has_data).astype(float)
+    rates = took[has_data] / total[has_data] * 100
+    slope = float(np.polyfit(x, rates, 1)[0])
+
+    if slope >= TREND_THRESHOLD:
+        direction = "improving"
+    elif slope <= -TREND_THRESHOLD:
+        direction = "declining"
+    else:
+        direction = "stable"
+
+    return {"direction": direction, "slope": round(slope, 2), "period_days": period_days}
+
+
+def miss_rate_change_point(series: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Single most significant shift in the daily miss rate
+
+    Splits the series (oldest first) where the difference in mean miss rate,
+    weighted by segment sizes, is largest.
+
+    Returns:
+        {"detected": False} or {"detected": True, "date", "miss_rate_before", "miss_rate_after"}
+    """
+    days = [entry for entry in reversed(series) if entry["total"]]
+    n = len(days)
+    if n < 2 * CHANGE_POINT_MIN_SEGMENT:
+        return {"detected": False}
+
+    miss = np.array([entry["skipped"] / entry["total"] for entry in days])
+    cumulative = np.cumsum(miss)
+
+    splits = np.arange(CHANGE_POINT_MIN_SEGMENT, n - CHANGE_POINT_MIN_SEGMENT + 1)
+    before = cumulative[splits - 1] / splits
+    after = (cumulative[-1] - cumulative[splits - 1]) / (n - splits)
+    shift = after - before
+    score = np.abs(shift) * np.sqrt(splits * (n - splits) / n)
+
+    best = int(np.argmax(score))
+    if abs(shift[best]) < CHANGE_POINT_MIN_SHIFT:
+        return {"detected": False}
+
+    split = int(splits[best])
+    return {
+        "detected": True,
+        "date": days[split]["date"],
+        "miss_rate_before": round(float(before[best]), 2),
+        "miss_rate_after": round(float(after[best]), 2)
+    }
+
+
+def refill_gaps(series: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Recurring "ran out" episodes (e.g. a refill that is always a few days late)
+
+    Returns:
+        {"detected": bool, "episodes": n, "interval_days": median days between episodes}
+    """
+    ran_out_days = sorted(
+        date.fromisoformat(entry["date"]) for entry in series if entry["ran_out"]
+    )
+
+    episodes: List[date] = []
+    last = None
+    for day in ran_out_days:
+        if last is None or (day - last) > timedelta(days=REFILL_GAP_MERGE_DAYS):
+            episodes.append(day)
+        last = day
+
+    if len(episodes) < 2:
+        return {"detected": False, "episodes": len(episodes)}
+
+    interval = float(np.median(np.diff([day.toordinal() for day in episodes])))
+    low, high = REFILL_INTERVAL_RANGE
+
+    return {
+        "detected": low <= interval <= high,
+        "episodes": len(episodes),
+        "interval_days": round(interval)
+    }
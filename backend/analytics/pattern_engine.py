@@ -0,0 +1,465 @@
+"""
+Vectorized Adherence Pattern Engine
+Single-pass NumPy analysis of adherence logs (day-of-week, time-of-day, reasons)
+
+Timestamps are parsed once into datetime64, converted to the patient's local
+time, and every histogram is a bincount over integer codes - no per-log
+datetime parsing or Counter building in Python loops.
+"""
+import logging
+from datetime import datetime, timezone as dt_timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import numpy as np
+from backend.models import PatientProfile
+
+logger = logging.getLogger(__name__)
+
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+TIME_BUCKETS = ["morning", "afternoon", "evening", "night"]
+
+# Hour of day -> time bucket code (5-12 morning, 12-17 afternoon, 17-21 evening, else night)
+HOUR_TO_BUCKET = np.array([3] * 5 + [0] * 7 + [1] * 5 + [2] * 4 + [3] * 3, dtype=np.int8)
+
+DEFAULT_TIMEZONE = PatientProfile.model_fields["timezone"].default
+
+# Occurrences needed for a "strong" pattern
+STRONG_PATTERN_MIN = 3
+
+
+# ============================================================================
+# Timestamp Conversion
+# ============================================================================
+
+def parse_timestamps(values: Sequence[Any]) -> np.ndarray:
+    """
+    Parse ISO-8601 timestamps into UTC datetime64[ms]
+
+    Handles "Z", "+HH:MM"/"-HH:MM" offsets and naive timestamps (treated as
+    UTC, which is what log_action writes). Unparseable values become NaT.
+
+    Args:
+        values: ISO strings (datetime objects are also accepted)
+
+    Returns:
+        datetime64[ms] array in UTC
+    """
+    if len(values) == 0:
+        return np.array([], dtype="datetime64[ms]")
+
+    # datetime objects stringify as "YYYY-MM-DD HH:MM:SS[+HH:MM]", which parses the same way
+    arr = np.asarray(values, dtype=str)
+    arr[arr == "None"] = ""
+    length = np.strings.str_len(arr)
+
+    # Offset suffix starts at the first "Z", "+" or "-" after "YYYY-MM-DDTHH:MM"
+    suffix_at = length.copy()
+    for marker in ("Z", "+", "-"):
+        found = np.strings.find(arr, marker, 16)
+        suffix_at = np.where((found >= 0) & (found < suffix_at), found, suffix_at)
+
+    core = np.strings.slice(arr, 0, suffix_at)
+    try:
+        parsed = core.astype("datetime64[ms]")
+    except ValueError:
+        parsed = np.array([_parse_one(v) for v in core], dtype="datetime64[ms]")
+
+    # Apply explicit UTC offsets ("+05:30" -> subtract 330 minutes)
+    has_offset = (suffix_at < length) & (np.strings.slice(arr, suffix_at, suffix_at + 1) != "Z")
+    if has_offset.any():
+        offsets = arr[has_offset]
+        starts = suffix_at[has_offset]
+        sign = np.where(np.strings.slice(offsets, starts, starts + 1) == "-", -1, 1)
+        hours = _to_int(np.strings.slice(offsets, starts + 1, starts + 3))
+        minutes = _to_int(np.strings.slice(offsets, starts + 4, starts + 6))
+        parsed[has_offset] -= (sign * (hours * 60 + minutes)).astype("timedelta64[m]")
+
+    return parsed
+
+
+def to_local_time(utc: np.ndarray, timezone: Optional[str]) -> np.ndarray:
+    """
+    Convert UTC datetime64 values to the patient's local wall-clock time
+
+    UTC offsets only change at DST transitions, so the offset is looked up
+    once per distinct UTC day and only resolved hour by hour on the few days
+    where it changes.
+
+    Args:
+        utc: datetime64 array in UTC
+        timezone: IANA timezone name (e.g. "America/New_York")
+
+    Returns:
+        datetime64[ms] array of local times
+    """
+    local = utc.astype("datetime64[ms]").copy()
+    valid = ~np.isnat(local)
+
+    if valid.any():
+        local[valid] += _offsets_at(local[valid], _zone(timezone)).astype("timedelta64[s]")
+    return local
+
+
+def from_local_time(local: np.ndarray, timezone: Optional[str]) -> np.ndarray:
+    """
+    Convert local wall-clock datetime64 values to UTC (inverse of to_local_time)
+
+    Wall times skipped or repeated by a DST change resolve to one of the
+    two candidate offsets rather than failing.
+
+    Args:
+        local: datetime64 array of local times
+        timezone: IANA timezone name
+
+    Returns:
+        datetime64[ms] array in UTC
+    """
+    tz = _zone(timezone)
+    utc = local.astype("datetime64[ms]").copy()
+    valid = ~np.isnat(utc)
+
+    if valid.any():
+        wall = utc[valid]
+        # First guess uses the offset at the wall time read as UTC; the
+        # second pass corrects it near transitions
+        guess = wall - _offsets_at(wall, tz).astype("timedelta64[s]")
+        utc[valid] = wall - _offsets_at(guess, tz).astype("timedelta64[s]")
+    return utc
+
+
+def weekday_and_hour(local: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Day of week (Monday=0) and hour of day for local datetime64 values
+
+    Returns:
+        (weekday, hour) int8 arrays; -1 where the timestamp is NaT
+    """
+    valid = ~np.isnat(local)
+    days = local.astype("datetime64[D]")
+
+    # 1970-01-01 was a Thursday (weekday 3)
+    weekday = ((days.astype(np.int64) + 3) % 7).astype(np.int8)
+    hour = ((local - days).astype("timedelta64[h]").astype(np.int64)).astype(np.int8)
+
+    weekday[~valid] = -1
+    hour[~valid] = -1
+    return weekday, hour
+
+
+# ============================================================================
+# Log Arrays
+# ============================================================================
+
+class LogArrays:
+    """
+    Columnar view of a list of adherence logs
+
+    Attributes:
+        utc: datetime64[ms] UTC timestamps (NaT if missing/unparseable)
+        local: datetime64[ms] local timestamps
+        weekday: int8 day of week, Monday=0 (-1 if no timestamp)
+        hour: int8 local hour (-1 if no timestamp)
+        reason_codes: int codes into reason_labels
+        reason_labels: reason strings, in order of first appearance
+        action_codes / action_labels: same encoding for the action
+        medication_codes / medication_labels: same encoding for medication_id
+    """
+
+    def __init__(self, logs: Sequence[Dict[str, Any]], timezone: Optional[str] = None):
+        timestamps = [log.get("timestamp") or "" for log in logs]
+        reasons = [log.get("reason") or "unknown" for log in logs]
+        actions = [log.get("action") or "unknown" for log in logs]
+        medications = [log.get("medication_id") or "unknown" for log in logs]
+
+        self.size = len(timestamps)
+        self.utc = parse_timestamps(timestamps)
+        self.local = to_local_time(self.utc, timezone)
+        self.weekday, self.hour = weekday_and_hour(self.local)
+        self.reason_labels, self.reason_codes = encode_labels(reasons)
+        self.action_labels, self.action_codes = encode_labels(actions)
+        self.medication_labels, self.medication_codes = encode_labels(medications)
+
+    def action_mask(self, action: str) -> np.ndarray:
+        """Boolean mask of the logs with the given action"""
+        if action not in self.action_labels:
+            return np.zeros(self.size, dtype=bool)
+        return self.action_codes == self.action_labels.index(action)
+
+
+def encode_labels(values: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+    """
+    Encode strings as integer codes, labels ordered by first appearance
+
+    Returns:
+        (labels, codes)
+    """
+    index: Dict[str, int] = {}
+    codes = np.fromiter(
+        (index.setdefault(value, len(index)) for value in values),
+        dtype=np.int64,
+        count=len(values)
+    )
+    return list(index), codes
+
+
+# ============================================================================
+# Histograms
+# ============================================================================
+
+def most_common(codes: np.ndarray, size: int) -> Optional[tuple]:
+    """
+    Most frequent code and its count
+
+    Ties go to the code seen first, matching Counter.most_common().
+
+    Args:
+        codes: Non-negative integer codes
+        size: Number of possible codes
+
+    Returns:
+        (code, count) or None if there are no codes
+    """
+    if len(codes) == 0:
+        return None
+
+    counts = np.bincount(codes, minlength=size)
+    top = counts.max()
+    tied = np.flatnonzero(counts == top)
+
+    if len(tied) > 1:
+        first_seen = np.array([np.argmax(codes == code) for code in tied])
+        code = tied[np.argmin(first_seen)]
+    else:
+        code = tied[0]
+
+    return int(code), int(top)
+
+
+def grouped_most_common(
+    groups: np.ndarray,
+    codes: np.ndarray,
+    n_groups: int,
+    size: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Most frequent code within every group, in one pass
+
+    Each (group, code) pair becomes a single composite key, so all groups
+    are histogrammed by one bincount - linear in the number of rows. Ties
+    go to the code seen first within the group, like most_common().
+
+    Args:
+        groups: Group code per row
+        codes: Value code per row
+        n_groups: Number of groups
+        size: Number of possible value codes
+
+    Returns:
+        (top code per group, top count per group, full n_groups x size count matrix);
+        groups without rows have a top count of 0
+    """
+    keys = groups.astype(np.int64) * size + codes
+    counts = np.bincount(keys, minlength=n_groups * size).reshape(n_groups, size)
+
+    first_seen = np.full(n_groups * size, len(keys), dtype=np.int64)
+    np.minimum.at(first_seen, keys, np.arange(len(keys)))
+    first_seen = first_seen.reshape(n_groups, size)
+
+    top_count = counts.max(axis=1) if size else np.zeros(n_groups, dtype=np.int64)
+    tied_first = np.where(counts == top_count[:, None], first_seen, np.iinfo(np.int64).max)
+    top_code = tied_first.argmin(axis=1) if size else np.zeros(n_groups, dtype=np.int64)
+
+    return top_code, top_count, counts
+
+
+def day_pattern(arrays: LogArrays) -> Dict[str, Any]:
+    """Which day of the week has the most entries"""
+    weekdays = arrays.weekday[arrays.weekday >= 0]
+    top = most_common(weekdays, 7)
+
+    if top is None:
+        return {"problem_day": None}
+
+    code, count = top
+    return {
+        "problem_day": DAY_NAMES[code],
+        "occurrences": count,
+        "pattern_strength": "strong" if count >= STRONG_PATTERN_MIN else "weak"
+    }
+
+
+def time_pattern(arrays: LogArrays) -> Dict[str, Any]:
+    """Which part of the day has the most entries"""
+    hours = arrays.hour[arrays.hour >= 0]
+    top = most_common(HOUR_TO_BUCKET[hours], len(TIME_BUCKETS))
+
+    if top is None:
+        return {"problem_time": None}
+
+    code, count = top
+    return {
+        "problem_time": TIME_BUCKETS[code],
+        "occurrences": count,
+        "pattern_strength": "strong" if count >= STRONG_PATTERN_MIN else "weak"
+    }
+
+
+def reason_pattern(arrays: LogArrays) -> Dict[str, Any]:
+    """Stated reasons and the most common one"""
+    top = most_common(arrays.reason_codes, len(arrays.reason_labels))
+
+    if top is None:
+        return {"primary_reason": "unknown"}
+
+    counts = np.bincount(arrays.reason_codes, minlength=len(arrays.reason_labels))
+    code, count = top
+    return {
+        "primary_reason": arrays.reason_labels[code],
+        "occurrences": count,
+        "all_reasons": {label: int(n) for label, n in zip(arrays.reason_labels, counts)}
+    }
+
+
+def analyze_patterns(
+    logs: Sequence[Dict[str, Any]],
+    timezone: Optional[str] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Compute day, time and reason patterns for a set of logs in one pass
+
+    Args:
+        logs: Adherence log documents (typically the skipped doses)
+        timezone: Patient's IANA timezone
+
+    Returns:
+        {"day_pattern": ..., "time_pattern": ..., "reason_pattern": ...}
+    """
+    arrays = LogArrays(logs, timezone)
+    return {
+        "day_pattern": day_pattern(arrays),
+        "time_pattern": time_pattern(arrays),
+        "reason_pattern": reason_pattern(arrays)
+    }
+
+
+def analyze_by_medication(
+    logs: Sequence[Dict[str, Any]],
+    timezone: Optional[str] = None,
+    action: str = "skipped"
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Day, time and reason patterns of one action for every medication at once
+
+    Args:
+        logs: All adherence logs in the window (any action)
+        timezone: Patient's IANA timezone
+        action: Action whose patterns are computed (default "skipped")
+
+    Returns:
+        {medication_id: {"total_actions", "skipped_count", "miss_rate",
+        "day_pattern", "time_pattern", "reason_pattern"}}, medications in
+        order of first appearance
+    """
+    arrays = LogArrays(logs, timezone)
+    n_meds = len(arrays.medication_labels)
+    if not n_meds:
+        return {}
+
+    totals = np.bincount(arrays.medication_codes, minlength=n_meds)
+    mask = arrays.action_mask(action)
+    meds = arrays.medication_codes[mask]
+    action_counts = np.bincount(meds, minlength=n_meds)
+
+    timed = mask & (arrays.weekday >= 0)
+    timed_meds = arrays.medication_codes[timed]
+    day_code, day_count, _ = grouped_most_common(timed_meds, arrays.weekday[timed], n_meds, 7)
+    time_code, time_count, _ = grouped_most_common(
+        timed_meds, HOUR_TO_BUCKET[arrays.hour[timed]], n_meds, len(TIME_BUCKETS)
+    )
+
+    n_reasons = len(arrays.reason_labels)
+    reason_code, reason_count, reason_matrix = grouped_most_common(
+        meds, arrays.reason_codes[mask], n_meds, n_reasons
+    )
+
+    results = {}
+    for m, medication_id in enumerate(arrays.medication_labels):
+        results[medication_id] = {
+            "total_actions": int(totals[m]),
+            "skipped_count": int(action_counts[m]),
+            "miss_rate": round(float(action_counts[m] / totals[m]), 3) if totals[m] else 0.0,
+            "day_pattern": _pattern("problem_day", DAY_NAMES, day_code[m], day_count[m]),
+            "time_pattern": _pattern("problem_time", TIME_BUCKETS, time_code[m], time_count[m]),
+            "reason_pattern": {
+                "primary_reason": arrays.reason_labels[reason_code[m]],
+                "occurrences": int(reason_count[m]),
+                "all_reasons": {
+                    label: int(n) for label, n in zip(arrays.reason_labels, reason_matrix[m]) if n
+                }
+            } if reason_count[m] else {"primary_reason": "unknown"}
+        }
+
+    return results
+
+
+# ============================================================================
+# Helpers
+# ============================================================================
+
+def _pattern(key: str, labels: List[str], code: int, count: int) -> Dict[str, Any]:
+    if not count:
+        return {key: None}
+    return {
+        key: labels[code],
+        "occurrences": int(count),
+        "pattern_strength": "strong" if count >= STRONG_PATTERN_MIN else "weak"
+    }
+
+
+def _zone(timezone: Optional[str]):
+    try:
+        return ZoneInfo(timezone or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning(f"Unknown timezone {timezone!r} - using UTC")
+        return dt_timezone.utc
+
+
+def _offsets_at(moments: np.ndarray, tz) -> np.ndarray:
+    """UTC offset in seconds at each (non-NaT) UTC moment, looked up per distinct day"""
+    days = moments.astype("datetime64[D]")
+    unique_days, inverse = np.unique(days, return_inverse=True)
+    day_start = _utc_offsets(unique_days, tz)
+    day_end = _utc_offsets(unique_days + np.timedelta64(1, "D"), tz)
+    offsets = day_start[inverse]
+
+    # Days containing a DST transition: resolve per hour
+    changing = np.flatnonzero(day_start != day_end)
+    if len(changing):
+        on_change_day = np.isin(inverse, changing)
+        hours = moments[on_change_day].astype("datetime64[h]")
+        offsets[on_change_day] = _utc_offsets(hours, tz)
+
+    return offsets
+
+
+def _utc_offsets(moments: np.ndarray, tz) -> np.ndarray:
+    """UTC offset in seconds of the timezone at each UTC moment"""
+    epoch_seconds = moments.astype("datetime64[s]").astype(np.int64)
+    return np.array(
+        [datetime.fromtimestamp(int(s), tz).utcoffset().total_seconds() for s in epoch_seconds],
+        dtype=np.int64
+    )
+
+
+def _parse_one(value: str):
+    try:
+        return np.datetime64(value, "ms") if value else np.datetime64("NaT", "ms")
+    except ValueError:
+        return np.datetime64("NaT", "ms")
+
+
+def _to_int(digits: np.ndarray) -> np.ndarray:
+    digits = np.where(np.strings.isdigit(digits), digits, "0")
+    return digits.astype(np.int64)
+
@@ -0,0 +1,239 @@
+"""
+Population Effectiveness Table
+Intervention effectiveness across all patients by root cause, intervention
+type and cohort
+
+Built periodically from every sealed intervention score (see
+backend.population_admin): the collection is split into chunks that are
+aggregated in parallel worker processes into (count, sum, sum of squares)
+per key, and the partial results are merged. The finished table is a
+plain dictionary keyed by tuples, with the wildcard marginals precomputed,
+so a lookup with back-off to broader cohorts is a few dict gets.
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+ANY = "*"
+
+# Cohort features: age band and number of medications
+AGE_BANDS = [(75, "75+"), (65, "65-74"), (50, "50-64"), (0, "<50")]
+MEDICATION_BANDS = [(4, "4+"), (2, "2-3"), (1, "1"), (0, "0")]
+
+# Samples needed before a table cell is trusted (otherwise back off)
+MIN_SAMPLES = 20
+
+# Rows per parallel aggregation task
+CHUNK_SIZE = 20000
+
+Key = Tuple[str, str, str, str]
+Row = Tuple[str, Tuple[str, ...], str, str, float]
+
+
+def root_cause_category(root_cause: Optional[str]) -> str:
+    """Category of a root cause ("Timing issue: ... (Metformin)" -> "Timing issue")"""
+    return (root_cause or "Unknown").split(":")[0].strip() or "Unknown"
+
+
+def cohort(patient: Optional[Dict[str, Any]]) -> Tuple[str, str]:
+    """
+    Cohort features of a patient profile
+
+    Returns:
+        (age band, medication count band); ANY for unknown values
+    """
+    patient = patient or {}
+    age = patient.get("age")
+    medications = patient.get("medications")
+
+    age_band = ANY if not isinstance(age, (int, float)) else next(b for low, b in AGE_BANDS if age >= low)
+    medication_band = ANY if medications is None else next(
+        b for low, b in MEDICATION_BANDS if len(medications) >= low
+    )
+    return age_band, medication_band
+
+
+def intervention_row(
+    intervention: Dict[str, Any],
+    cohorts: Dict[str, Tuple[str, str]]
+) -> Optional[Row]:
+    """
+    Aggregation row for a sealed intervention (None if it has no final score)
+
+    Args:
+        intervention: Intervention document
+        cohorts: {patient_id: cohort} from cohort()
+
+    Returns:
+        (root cause category, intervention types, age band, medication band, score)
+    """
+    counters = intervention.get("effectiveness") or {}
+    if not counters.get("sealed") or counters.get("score") is None:
+        return None
+
+    types = tuple(sorted({
+        item.get("type") for item in intervention.get("interventions") or [] if item.get("type")
+    })) or ("unspecified",)
+    age_band, medication_band = cohorts.get(intervention.get("patient_id"), (ANY, ANY))
+
+    return root_cause_category(intervention.get("root_cause")), types, age_band, medication_band, float(counters["score"])
+
+
+# ============================================================================
+# Aggregation
+# ============================================================================
+
+def aggregate_rows(rows: Sequence[Row]) -> Dict[Key, List[float]]:
+    """
+    Sufficient statistics [n, sum, sum of squares] per key, marginals included
+
+    Each row counts once for every intervention type it used, at every
+    back-off level (exact cohort, one feature, no cohort, any type).
+    """
+    sums: Dict[Key, List[float]] = {}
+    for cause, types, age_band, medication_band, score in rows:
+        keys = {(cause, ANY, ANY, ANY)}
+        for intervention_type in types:
+            keys.update([
+                (cause, intervention_type, age_band, medication_band),
+                (cause, intervention_type, age_band, ANY),
+                (cause, intervention_type, ANY, medication_band),
+                (cause, intervention_type, ANY, ANY)
+            ])
+        for key in keys:
+            stats = sums.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += score
+            stats[2] += score * score
+    return sums
+
+
+def merge_sums(partials: Iterable[Dict[Key, List[float]]]) -> Dict[Key, List[float]]:
+    """Add up partial aggregates"""
+    merged: Dict[Key, List[float]] = {}
+    for partial in partials:
+        for key, (n, total, squares) in partial.items():
+            stats = merged.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += n
+            stats[1] += total
+            stats[2] += squares
+    return merged
+
+
+def build_table(rows: Sequence[Row], workers: int = 1, chunk_size: int = CHUNK_SIZE) -> "EffectivenessTable":
+    """
+    Aggregate rows into an EffectivenessTable, in parallel processes
+
+    Args:
+        rows: Rows from intervention_row()
+        workers: Worker processes (1 aggregates in this process)
+        chunk_size: Rows per task
+
+    Returns:
+        EffectivenessTable
+    """
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(aggregate_rows, chunks))
+    else:
+        partials = [aggregate_rows(chunk) for chunk in chunks]
+
+    return EffectivenessTable.from_sums(merge_sums(partials))
+
+
+# ============================================================================
+# Lookup
+# ============================================================================
+
+class EffectivenessTable:
+    """
+    In-memory population effectiveness lookup
+
+    Entries are {"n", "mean", "std"} keyed by (root cause category,
+    intervention type, age band, medication band), with ANY for
+    marginalized features.
+    """
+
+    def __init__(self, entries: Optional[Dict[Key, Dict[str, float]]] = None, built_at: Optional[str] = None):
+        self.entries = entries or {}
+        self.built_at = built_at
+
+        # Intervention types per cause, best first (for recommendations)
+        self._ranked: Dict[str, List[Tuple[str, Dict[str, float]]]] = {}
+        for (cause, intervention_type, age_band, medication_band), stats in self.entries.items():
+            if intervention_type != ANY and age_band == ANY and medication_band == ANY and stats["n"] >= MIN_SAMPLES:
+                self._ranked.setdefault(cause, []).append((intervention_type, stats))
+        for ranked in self._ranked.values():
+            ranked.sort(key=lambda item: item[1]["mean"], reverse=True)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @classmethod
+    def from_sums(cls, sums: Dict[Key, List[float]], built_at: Optional[str] = None) -> "EffectivenessTable":
+        entries = {}
+        for key, (n, total, squares) in sums.items():
+            mean = total / n
+            variance = max(squares / n - mean * mean, 0.0)
+            entries[key] = {"n": int(n), "mean": round(mean, 4), "std": round(math.sqrt(variance), 4)}
+        return cls(entries, built_at)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]], built_at: Optional[str] = None) -> "EffectivenessTable":
+        """Table from stored records (see to_records)"""
+        return cls({
+            (r["root_cause"], r["intervention_type"], r["age_band"], r["medication_band"]): {
+                "n": r["n"], "mean": r["mean"], "std": r["std"]
+            }
+            for r in records
+        }, built_at)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Flat records for storage"""
+        return [
+            {
+                "root_cause": cause,
+                "intervention_type": intervention_type,
+                "age_band": age_band,
+                "medication_band": medication_band,
+                **stats
+            }
+            for (cause, intervention_type, age_band, medication_band), stats in self.entries.items()
+        ]
+
+    def lookup(
+        self,
+        root_cause: str,
+        intervention_type: str = ANY,
+        patient_cohort: Tuple[str, str] = (ANY, ANY)
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Population effectiveness, backing off to broader cohorts when sparse
+
+        Args:
+            root_cause: Root cause (full text or category)
+            intervention_type: Intervention type, or ANY for the whole cause
+            patient_cohort: (age band, medication band) from cohort()
+
+        Returns:
+            {"n", "mean", "std", "cohort"} or None without enough samples
+        """
+        cause = root_cause_category(root_cause)
+        age_band, medication_band = patient_cohort
+
+        for key in (
+            (cause, intervention_type, age_band, medication_band),
+            (cause, intervention_type, age_band, ANY),
+            (cause, intervention_type, ANY, medication_band),
+            (cause, intervention_type, ANY, ANY)
+        ):
+            stats = self.entries.get(key)
+            if stats and stats["n"] >= MIN_SAMPLES:
+                return {**stats, "cohort": key[2:]}
+        return None
+
+    def ranked_types(self, root_cause: str) -> List[Tuple[str, Dict[str, float]]]:
+        """Intervention types for a root cause, most effective first"""
+        return self._ranked.get(root_cause_category(root_cause), [])
@@ -0,0 +1,191 @@
+"""
+Refill Forecast
+Remaining supply and run-out dates for every medication of the fleet at once
+
+Each medication's supply is a ledger entry: doses remaining as of a point
+in time, started from the profile's refill_days_remaining (times the daily
+doses) and reset whenever that field or the medication's last_refill_at
+changes, i.e. when a fill is recorded. A nightly pass subtracts the "took"
+logs written since the previous pass - matched to (patient, medication)
+rows with one searchsorted over sorted keys - and divides the rest by the
+daily doses to project run-out dates, so the whole fleet is a handful of
+array operations instead of a loop over patients.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from backend.analytics.dose_calendar import daily_minutes
+
+# Default days of supply left at which a refill is triggered
+DEFAULT_TRIGGER_DAYS = 7
+
+# Key separator for (patient, medication) keys (never in Firestore IDs)
+_SEPARATOR = "/"
+
+
+def _key(patient_id: Any, medication_id: Any) -> str:
+    return f"{patient_id}{_SEPARATOR}{medication_id}"
+
+
+class SupplyForecast:
+    """
+    Supply ledger rows of many patients, advanced by new logs
+
+    Attributes:
+        patient_ids, medication_ids, names: Per-row identifiers
+        doses_remaining: float doses left after the new logs
+        days_remaining: float days of supply left (inf for as-needed medications)
+        run_out: datetime64[D] projected run-out date (NaT if it never runs out)
+        due: bool, supply at or under the patient's trigger days
+        alert: bool, due and not yet alerted for the current fill
+        reset: bool, ledger (re)started from the profile in this pass
+    """
+
+    def __init__(
+        self,
+        patients: Sequence[Dict[str, Any]],
+        ledgers: Dict[str, Dict[str, Dict[str, Any]]],
+        logs: Sequence[Dict[str, Any]],
+        now: Optional[datetime] = None,
+        trigger_days: int = DEFAULT_TRIGGER_DAYS
+    ):
+        """
+        Args:
+            patients: Projected profiles (medications, refill_trigger_days,
+                auto_refill_enabled)
+            ledgers: {patient_id: {medication_id: ledger entry}} from the
+                previous pass
+            logs: Logs written since the previous pass (patient_id,
+                medication_id, action, reason)
+            now: Current UTC time (naive)
+            trigger_days: Trigger for patients without refill_trigger_days
+        """
+        self.now = now or datetime.utcnow()
+        self.patient_ids: List[str] = []
+        self.medication_ids: List[str] = []
+        self.names: List[Optional[str]] = []
+        self.auto_refill: List[bool] = []
+        self._entries: List[Dict[str, Any]] = []
+
+        start, per_day, trigger, alerted, reset = [], [], [], [], []
+        for patient in patients:
+            patient_ledger = ledgers.get(patient["patient_id"]) or {}
+            for medication in patient.get("medications") or []:
+                medication_id = medication.get("medication_id")
+                baseline_days = medication.get("refill_days_remaining")
+                entry = patient_ledger.get(medication_id)
+                if not medication_id or (baseline_days is None and entry is None):
+                    continue
+
+                doses_per_day = len(daily_minutes(medication))
+                filled_at = medication.get("last_refill_at")
+                is_new_fill = entry is None or baseline_days is not None and (
+                    entry.get("baseline_days") != baseline_days or entry.get("filled_at") != filled_at
+                )
+                if is_new_fill:
+                    entry = {
+                        "baseline_days": baseline_days,
+                        "filled_at": filled_at,
+                        "doses_remaining": float(baseline_days * doses_per_day),
+                        "as_of": self.now.isoformat(),
+                        "alerted": False
+                    }
+
+                self.patient_ids.append(patient["patient_id"])
+                self.medication_ids.append(medication_id)
+                self.names.append(medication.get("name"))
+                self.auto_refill.append(bool(patient.get("auto_refill_enabled")))
+                self._entries.append(entry)
+                start.append(entry["doses_remaining"])
+                per_day.append(doses_per_day)
+                trigger.append(patient.get("refill_trigger_days") or trigger_days)
+                alerted.append(bool(entry.get("alerted")))
+                reset.append(is_new_fill)
+
+        self.reset = np.array(reset, dtype=bool)
+        taken, ran_out = self._match_logs(logs)
+        # A new fill starts now, so earlier logs do not draw on it
+        taken[self.reset] = 0
+        ran_out &= ~self.reset
+
+        per_day = np.array(per_day, dtype=np.float64)
+        remaining = np.maximum(np.array(start, dtype=np.float64) - taken, 0)
+        remaining[ran_out] = 0
+        self.doses_remaining = remaining
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            days = np.where(per_day > 0, remaining / per_day, np.where(remaining > 0, np.inf, 0.0))
+        self.days_remaining = days
+
+        finite = np.isfinite(days)
+        self.run_out = np.full(len(days), np.datetime64("NaT"), dtype="datetime64[D]")
+        self.run_out[finite] = np.datetime64(self.now.date(), "D") + np.floor(days[finite]).astype("timedelta64[D]")
+
+        self.due = days <= np.array(trigger, dtype=np.float64)
+        self.alert = self.due & ~np.array(alerted, dtype=bool)
+        self._changed = self.reset | (taken > 0) | ran_out | self.alert
+
+    def __len__(self) -> int:
+        return len(self.patient_ids)
+
+    def _match_logs(self, logs: Sequence[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Took counts and ran-out flags per row for the new logs"""
+        taken = np.zeros(len(self), dtype=np.float64)
+        ran_out = np.zeros(len(self), dtype=bool)
+        if not len(self) or not logs:
+            return taken, ran_out
+
+        keys = np.array([_key(p, m) for p, m in zip(self.patient_ids, self.medication_ids)])
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+
+        log_keys = np.array([_key(log.get("patient_id"), log.get("medication_id")) for log in logs])
+        position = np.minimum(np.searchsorted(sorted_keys, log_keys), len(sorted_keys) - 1)
+        matched = sorted_keys[position] == log_keys
+        row = order[position]
+
+        actions = np.array([log.get("action") for log in logs], dtype=object)
+        reasons = np.array([log.get("reason") for log in logs], dtype=object)
+        took = matched & (actions == "took")
+        taken += np.bincount(row[took], minlength=len(self))
+        ran_out[row[matched & (actions == "skipped") & (reasons == "ran_out")]] = True
+        return taken, ran_out
+
+    def ledgers(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Ledger entries that changed in this pass
+
+        Returns:
+            {patient_id: {medication_id: entry}}
+        """
+        changed: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for i in np.flatnonzero(self._changed):
+            entry = {
+                **self._entries[i],
+                "doses_remaining": float(self.doses_remaining[i]),
+                "as_of": self.now.isoformat(),
+                "alerted": bool(self._entries[i].get("alerted") or self.alert[i])
+            }
+            changed.setdefault(self.patient_ids[i], {})[self.medication_ids[i]] = entry
+        return changed
+
+    def alerts(self) -> List[Dict[str, Any]]:
+        """
+        Medications that reached their trigger and were not alerted yet
+
+        Returns:
+            [{"patient_id", "medication_id", "name", "doses_remaining",
+              "days_remaining", "run_out_date", "auto_refill"}]
+        """
+        return [
+            {
+                "patient_id": self.patient_ids[i],
+                "medication_id": self.medication_ids[i],
+                "name": self.names[i],
+                "doses_remaining": float(self.doses_remaining[i]),
+                "days_remaining": round(float(self.days_remaining[i]), 1),
+                "run_out_date": str(self.run_out[i]),
+                "auto_refill": self.auto_refill[i]
+            }
+            for i in np.flatnonzero(self.alert)
+        ]
@@ -0,0 +1,297 @@
+"""
+Reminder Index
+Inverted index from UTC minute of the day to the medication reminders due in it
+
+A patient's reminders follow from each medication's scheduled_times (see
+dose_calendar.daily_minutes), shifted by the per-weekday
+schedule_adjustments and followed by the reminder_settings follow-ups;
+doses that fall inside the patient's quiet hours are held until the quiet
+hours end. The index is built for one UTC day at a time: every patient's
+local schedule for the three local dates overlapping that day is expanded
+into arrays and converted to UTC per timezone in one vectorized pass, so a
+dispatcher reads a minute's reminders with one dict lookup instead of
+scanning profiles.
+"""
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import numpy as np
+from backend.analytics.dose_calendar import daily_minutes
+from backend.analytics.pattern_engine import DAY_NAMES, DEFAULT_TIMEZONE, from_local_time
+
+MINUTES_PER_DAY = 24 * 60
+
+# Reminder kinds
+DOSE = "dose"
+FOLLOW_UP = "follow_up"
+
+# "30 minutes", "1 hour", "+30m", "-15m"
+_DURATION = re.compile(r"([+-]?)\s*(\d+)\s*(hours?|hrs?|h|minutes?|mins?|m)\b")
+
+
+class Reminder(NamedTuple):
+    """One reminder to dispatch"""
+    patient_id: str
+    medication_id: str
+    medication_name: Optional[str]
+    kind: str  # DOSE or FOLLOW_UP
+    scheduled_local: str  # the dose's local wall-clock time ("YYYY-MM-DDTHH:MM")
+    dose_at: str  # UTC time of the dose (ISO, minute precision)
+    due_at: str  # UTC time the reminder fires
+
+
+@lru_cache(maxsize=1024)
+def _signed_duration(text: str) -> Optional[int]:
+    lowered = text.lower()
+    match = _DURATION.search(lowered)
+    if not match:
+        return None
+    value = int(match.group(2))
+    if match.group(3).startswith("h"):
+        value *= 60
+    if match.group(1) == "-" or "earlier" in lowered or "before" in lowered:
+        value = -value
+    return value
+
+
+def duration_minutes(text: Any) -> Optional[int]:
+    """Minutes in a phrase like "5 minutes after" or "1 hour" (unsigned)"""
+    minutes = _signed_duration(str(text)) if text else None
+    return abs(minutes) if minutes is not None else None
+
+
+def adjustment_minutes(text: Any) -> int:
+    """Signed shift of a schedule adjustment ("30 minutes earlier" -> -30, "+15m" -> 15)"""
+    return (_signed_duration(str(text)) if text else None) or 0
+
+
+def _clock_minute(value: Any) -> Optional[int]:
+    try:
+        hours, minutes = str(value).split(":")[:2]
+        minute = int(hours) * 60 + int(minutes)
+    except ValueError:
+        return None
+    return minute if 0 <= minute < MINUTES_PER_DAY else None
+
+
+def quiet_hours(patient: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    """Patient's quiet hours as (start, end) minutes of day, or None"""
+    quiet = ((patient.get("preferences") or {}).get("quiet_hours")) or {}
+    start, end = _clock_minute(quiet.get("start")), _clock_minute(quiet.get("end"))
+    if start is None or end is None or start == end:
+        return None
+    return start, end
+
+
+def follow_up_offsets(patient: Dict[str, Any]) -> List[int]:
+    """Minutes after a dose at which follow-up reminders fire (reminder_settings)"""
+    settings = patient.get("reminder_settings") or {}
+    offsets = {duration_minutes(value) for value in settings.get("follow_ups") or []}
+    return sorted(offset for offset in offsets if offset)
+
+
+def weekday_adjustments(patient: Dict[str, Any]) -> List[int]:
+    """Signed minute shift for each weekday (Monday first) from schedule_adjustments"""
+    shifts = [0] * 7
+    for day, adjustment in (patient.get("schedule_adjustments") or {}).items():
+        if day in DAY_NAMES and isinstance(adjustment, dict):
+            shifts[DAY_NAMES.index(day)] = adjustment_minutes(adjustment.get("adjustment"))
+    return shifts
+
+
+# ============================================================================
+# Expansion
+# ============================================================================
+
+class _Templates:
+    """Per-patient reminder templates flattened into arrays"""
+
+    def __init__(self, patients: Iterable[Dict[str, Any]]):
+        self.patient_ids: List[str] = []
+        self.timezones: List[str] = []
+        self.medications: List[Tuple[str, Optional[str]]] = []
+
+        patient_codes, medication_codes, base, offset = [], [], [], []
+        adjustments, quiet = [], []
+
+        for patient in patients:
+            p = len(self.patient_ids)
+            offsets = [0] + follow_up_offsets(patient)
+            added = False
+            for medication in patient.get("medications") or []:
+                if not medication.get("medication_id"):
+                    continue
+                minutes = daily_minutes(medication)
+                if not minutes:
+                    continue
+                rows = len(minutes) * len(offsets)
+                patient_codes.extend([p] * rows)
+                medication_codes.extend([len(self.medications)] * rows)
+                base.extend(minute for minute in minutes for _ in offsets)
+                offset.extend(offsets * len(minutes))
+                self.medications.append((medication["medication_id"], medication.get("name")))
+                added = True
+
+            if added:
+                self.patient_ids.append(patient["patient_id"])
+                self.timezones.append(patient.get("timezone") or DEFAULT_TIMEZONE)
+                adjustments.append(weekday_adjustments(patient))
+                quiet.append(quiet_hours(patient) or (-1, -1))
+
+        self.patient = np.array(patient_codes, dtype=np.int64)
+        self.medication = np.array(medication_codes, dtype=np.int64)
+        self.base = np.array(base, dtype=np.int64)
+        self.offset = np.array(offset, dtype=np.int64)
+        self.adjustments = np.array(adjustments, dtype=np.int64).reshape(-1, 7)
+        self.quiet = np.array(quiet, dtype=np.int64).reshape(-1, 2)
+
+
+def _hold_for_quiet_hours(minute: np.ndarray, start: np.ndarray, end: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Minutes moved to the end of the quiet hours they fall in
+
+    Returns:
+        (adjusted minutes relative to the same local midnight, in-quiet mask)
+    """
+    of_day = minute % MINUTES_PER_DAY
+    day_start = minute - of_day
+    has_quiet = start >= 0
+    wraps = start > end  # e.g. 22:00-07:00
+
+    in_quiet = has_quiet & np.where(
+        wraps, (of_day >= start) | (of_day < end), (of_day >= start) & (of_day < end)
+    )
+    # Late-evening part of a wrapping window ends on the next day
+    next_day = wraps & (of_day >= start)
+    held = day_start + end + np.where(next_day, MINUTES_PER_DAY, 0)
+    return np.where(in_quiet, held, minute), in_quiet
+
+
+def expand_reminders(patients: Iterable[Dict[str, Any]], day: date) -> Dict[str, Any]:
+    """
+    All reminders of the patients that fire during a UTC day
+
+    Args:
+        patients: Patient profiles (medications, timezone, preferences,
+            schedule_adjustments, reminder_settings)
+        day: UTC date
+
+    Returns:
+        {"reminders": [Reminder], "minutes": int array of UTC minute of day}
+        sorted by minute
+    """
+    templates = _Templates(patients)
+    day_start = np.datetime64(day, "m")
+    timezone_of = np.array(templates.timezones, dtype=object)[templates.patient]
+    rows = {"template": [], "utc": [], "local": []}
+
+    for local_date in (day - timedelta(days=1), day, day + timedelta(days=1)):
+        weekday = local_date.weekday()
+        dose = templates.base + templates.adjustments[templates.patient, weekday]
+        start = templates.quiet[templates.patient, 0]
+        end = templates.quiet[templates.patient, 1]
+
+        dose, _ = _hold_for_quiet_hours(dose, start, end)
+        fire = dose + templates.offset
+
+        # A follow-up that would land in quiet hours is dropped
+        _, follow_up_quiet = _hold_for_quiet_hours(fire, start, end)
+        keep = (templates.offset == 0) | ~follow_up_quiet
+
+        midnight = np.datetime64(local_date, "m")
+        local_dose = midnight + dose.astype("timedelta64[m]")
+        local_fire = midnight + fire.astype("timedelta64[m]")
+
+        utc = np.empty(len(fire), dtype="datetime64[m]")
+        for timezone in set(templates.timezones):
+            in_zone = timezone_of == timezone
+            utc[in_zone] = from_local_time(local_fire[in_zone], timezone).astype("datetime64[m]")
+
+        keep &= (utc >= day_start) & (utc < day_start + np.timedelta64(1, "D"))
+        index = np.flatnonzero(keep)
+        rows["template"].append(index)
+        rows["utc"].append(utc[index])
+        rows["local"].append(local_dose[index])
+
+    template = np.concatenate(rows["template"])
+    utc = np.concatenate(rows["utc"])
+    local = np.concatenate(rows["local"])
+
+    order = np.argsort(utc, kind="stable")
+    template, utc, local = template[order], utc[order], local[order]
+    minutes = (utc - day_start).astype(np.int64)
+
+    offset = templates.offset[template]
+    dose_utc = utc - offset.astype("timedelta64[m]")
+
+    reminders = []
+    rows = zip(
+        templates.patient[template].tolist(), templates.medication[template].tolist(), offset.tolist(),
+        local.astype(str).tolist(), dose_utc.astype(str).tolist(), utc.astype(str).tolist()
+    )
+    for p, m, extra, local_at, dose_at, fire_at in rows:
+        medication_id, name = templates.medications[m]
+        reminders.append(Reminder(
+            templates.patient_ids[p], medication_id, name,
+            FOLLOW_UP if extra else DOSE, local_at, dose_at, fire_at
+        ))
+
+    return {"reminders": reminders, "minutes": minutes}
+
+
+# ============================================================================
+# Index
+# ============================================================================
+
+class ReminderIndex:
+    """
+    Reminders of one UTC day keyed by minute of the day
+
+    Patients can be replaced individually (e.g. after a profile change)
+    without rebuilding the whole index.
+    """
+
+    def __init__(self, day: date):
+        self.day = day
+        # {minute: {patient_id: [Reminder]}} so a patient is dropped without
+        # scanning the (large) peak-minute buckets
+        self._by_minute: Dict[int, Dict[str, List[Reminder]]] = {}
+        self._by_patient: Dict[str, set] = {}
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, patients: Iterable[Dict[str, Any]]):
+        """Add the reminders of patients (who must not be in the index yet)"""
+        expanded = expand_reminders(patients, self.day)
+        for minute, reminder in zip(expanded["minutes"].tolist(), expanded["reminders"]):
+            self._by_minute.setdefault(minute, {}).setdefault(reminder.patient_id, []).append(reminder)
+            self._by_patient.setdefault(reminder.patient_id, set()).add(minute)
+        self._count += len(expanded["reminders"])
+
+    def remove(self, patient_id: str):
+        """Drop all reminders of a patient"""
+        for minute in self._by_patient.pop(patient_id, ()):
+            self._count -= len(self._by_minute[minute].pop(patient_id, []))
+
+    def replace(self, patients: List[Dict[str, Any]]):
+        """Re-index patients whose profiles changed"""
+        for patient in patients:
+            self.remove(patient["patient_id"])
+        self.add(patients)
+
+    def due(self, minute: int) -> List[Reminder]:
+        """Reminders firing at a UTC minute of the day (0-1439)"""
+        return [
+            reminder
+            for reminders in self._by_minute.get(minute, {}).values()
+            for reminder in reminders
+        ]
+
+    def minute_of(self, moment: datetime) -> Optional[int]:
+        """Minute of the index day for a naive UTC time (None on another day)"""
+        if moment.date() != self.day:
+            return None
+        return moment.hour * 60 + moment.minute
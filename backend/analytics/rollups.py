@@ -0,0 +1,463 @@
+"""
+Per-Patient Adherence Rollups
+Counter documents maintained incrementally on every logged action
+
+A rollup holds lifetime counters (by action, reason, day-of-week x time
+bucket and medication) and rolling daily buckets keyed by the patient's
+local date. Readers answer "last N days" questions from the daily buckets
+instead of re-reading raw adherence logs.
+
+Only a rollup marked "complete" is read: the counters start counting at
+the first logged action, so a rollup is complete once it was backfilled
+from the raw logs (build_rollup) or created with the patient, before any
+log existed.
+
+Rollup document shape:
+    {
+        "patient_id": "p001",
+        "timezone": "America/New_York",
+        "complete": True,
+        "total": 42,
+        "actions": {"took": 38, "skipped": 4},
+        "reasons": {"skipped": {"forgot": 3, "ran_out": 1}},
+        "slots": {"skipped": {"Monday_morning": 2, ...}},
+        "medications": {"med_metformin_500mg": {"took": 20, "skipped": 2}},
+        "daily": {
+            "2026-03-02": {
+                "actions": {"took": 1, "skipped": 1},
+                "buckets": {"skipped": {"morning": 1}},
+                "reasons": {"skipped": {"forgot": 1}},
+                "medications": {
+                    "med_metformin_500mg": {
+                        "actions": {"took": 1, "skipped": 1},
+                        "buckets": {"skipped": {"morning": 1}},
+                        "reasons": {"skipped": {"forgot": 1}}
+                    }
+                }
+            }
+        }
+    }
+"""
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from backend.analytics.pattern_engine import (
+    DAY_NAMES,
+    DEFAULT_TIMEZONE,
+    HOUR_TO_BUCKET,
+    STRONG_PATTERN_MIN,
+    TIME_BUCKETS,
+    from_local_time,
+    parse_timestamps,
+    to_local_time,
+    weekday_and_hour
+)
+
+# Counter sections of the rollup document (everything else is metadata)
+COUNTER_FIELDS = ("total", "actions", "reasons", "slots", "medications", "daily")
+
+
+# ============================================================================
+# Building Rollups
+# ============================================================================
+
+def local_slot(timestamp: Any, timezone: Optional[str]) -> Optional[Tuple[str, str, str]]:
+    """
+    Local date, day name and time bucket for a log timestamp
+
+    Returns:
+        (YYYY-MM-DD, day name, time bucket) or None if the timestamp is unusable
+    """
+    local = to_local_time(parse_timestamps([timestamp or ""]), timezone)
+    if np.isnat(local[0]):
+        return None
+
+    weekday, hour = weekday_and_hour(local)
+    return (
+        str(local[0].astype("datetime64[D]")),
+        DAY_NAMES[weekday[0]],
+        TIME_BUCKETS[HOUR_TO_BUCKET[hour[0]]]
+    )
+
+
+def log_counts(log: Dict[str, Any], timezone: Optional[str]) -> Dict[str, Any]:
+    """
+    Counter increments contributed by one adherence log
+
+    Args:
+        log: Adherence log document
+        timezone: Patient's IANA timezone
+
+    Returns:
+        Nested dict of +1 counts in the rollup document shape
+    """
+    action = log.get("action") or "unknown"
+    reason = log.get("reason")
+    medication_id = log.get("medication_id")
+
+    counts: Dict[str, Any] = {"total": 1, "actions": {action: 1}}
+
+    if reason:
+        counts["reasons"] = {action: {reason: 1}}
+
+    if medication_id:
+        counts["medications"] = {medication_id: {action: 1}}
+
+    slot = local_slot(log.get("timestamp"), timezone)
+    if slot:
+        day, day_name, bucket = slot
+        counts["slots"] = {action: {f"{day_name}_{bucket}": 1}}
+        daily = {"actions": {action: 1}, "buckets": {action: {bucket: 1}}}
+        if reason:
+            daily["reasons"] = {action: {reason: 1}}
+        if medication_id:
+            # Same counters per medication, for per-medication window patterns
+            daily["medications"] = {medication_id: dict(daily)}
+        counts["daily"] = {day: daily}
+
+    return counts
+
+
+def merge_counts(target: Dict[str, Any], counts: Dict[str, Any]) -> Dict[str, Any]:
+    """Add nested counts into target in place"""
+    for key, value in counts.items():
+        if isinstance(value, dict):
+            merge_counts(target.setdefault(key, {}), value)
+        else:
+            target[key] = target.get(key, 0) + value
+    return target
+
+
+def build_rollup(
+    patient_id: str,
+    logs: Iterable[Dict[str, Any]],
+    timezone: Optional[str],
+    retention_days: int,
+    today: Optional[date] = None
+) -> Dict[str, Any]:
+    """
+    Build a rollup from scratch (backfill / rebuild)
+
+    Args:
+        patient_id: Patient identifier
+        logs: All adherence logs of the patient
+        timezone: Patient's IANA timezone
+        retention_days: Daily buckets older than this are dropped
+        today: Patient's local date (defaults to today in their timezone)
+
+    Returns:
+        Rollup document (counter sections plus patient_id/timezone/complete)
+    """
+    rollup: Dict[str, Any] = {"total": 0, "actions": {}}
+    for log in logs:
+        merge_counts(rollup, log_counts(log, timezone))
+
+    today = today or local_today(timezone)
+    cutoff = (today - timedelta(days=retention_days)).isoformat()
+    rollup["daily"] = {
+        day: bucket for day, bucket in rollup.get("daily", {}).items() if day >= cutoff
+    }
+
+    rollup["patient_id"] = patient_id
+    rollup["timezone"] = timezone
+    rollup["complete"] = True
+    return rollup
+
+
+def local_today(timezone: Optional[str]) -> date:
+    """Today's date in the patient's timezone"""
+    now = np.array([np.datetime64(datetime.utcnow(), "ms")])
+    return to_local_time(now, timezone)[0].astype("datetime64[D]").astype(date)
+
+
+def local_day_bounds(start: date, end: date, timezone: Optional[str]) -> Tuple[datetime, datetime]:
+    """
+    UTC instants where the local days start..end (inclusive) begin and end
+
+    Returns:
+        (start, end) as naive UTC datetimes; end is exclusive
+    """
+    midnights = np.array([start, end + timedelta(days=1)], dtype="datetime64[D]")
+    utc = from_local_time(midnights, timezone).astype(datetime)
+    return utc[0], utc[1]
+
+
+# ============================================================================
+# Consistency Checks
+# ============================================================================
+
+def diff_rollups(
+    stored: Dict[str, Any],
+    expected: Dict[str, Any],
+    retention_days: int,
+    today: Optional[date] = None
+) -> List[str]:
+    """
+    Compare a stored rollup against one rebuilt from the raw logs
+
+    Daily buckets are only compared inside the retention window, since the
+    stored document prunes them lazily.
+
+    Returns:
+        Human-readable mismatches ("actions.skipped: stored 3, expected 4")
+    """
+    today = today or local_today(expected.get("timezone"))
+    cutoff = (today - timedelta(days=retention_days)).isoformat()
+
+    def in_window(section: Dict[str, Any]) -> Dict[str, Any]:
+        return {day: bucket for day, bucket in section.items() if day >= cutoff}
+
+    mismatches: List[str] = []
+    for field in COUNTER_FIELDS:
+        stored_value = stored.get(field, {} if field != "total" else 0)
+        expected_value = expected.get(field, {} if field != "total" else 0)
+        if field == "daily":
+            stored_value, expected_value = in_window(stored_value), in_window(expected_value)
+        _diff(field, stored_value, expected_value, mismatches)
+
+    return mismatches
+
+
+def _diff(path: str, stored: Any, expected: Any, mismatches: List[str]):
+    if isinstance(stored, dict) or isinstance(expected, dict):
+        stored = stored if isinstance(stored, dict) else {}
+        expected = expected if isinstance(expected, dict) else {}
+        for key in sorted(set(stored) | set(expected)):
+            _diff(f"{path}.{key}", stored.get(key, 0), expected.get(key, 0), mismatches)
+    elif (stored or 0) != (expected or 0):
+        mismatches.append(f"{path}: stored {stored or 0}, expected {expected or 0}")
+
+
+# ============================================================================
+# Reading Rollups
+# ============================================================================
+
+def window_days(rollup: Dict[str, Any], days: int, today: Optional[date] = None) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Daily buckets of the last `days` days (today and the days - 1 before it), most recent first
+
+    Returns:
+        [(YYYY-MM-DD, bucket), ...]
+    """
+    today = today or local_today(rollup.get("timezone"))
+    cutoff = (today - timedelta(days=days - 1)).isoformat()
+    return sorted(
+        ((day, bucket) for day, bucket in rollup.get("daily", {}).items() if day >= cutoff),
+        key=lambda item: item[0],
+        reverse=True
+    )
+
+
+def window_summary(rollup: Dict[str, Any], days: int, today: Optional[date] = None) -> Dict[str, int]:
+    """
+    Dose counts over the last `days` days
+
+    Returns:
+        Dictionary with total_doses, took_doses, skipped_doses, snoozed_doses
+    """
+    actions: Dict[str, int] = {}
+    for _, bucket in window_days(rollup, days, today):
+        merge_counts(actions, bucket.get("actions", {}))
+    return dose_counts(actions)
+
+
+def range_summary(rollup: Dict[str, Any], start: date, end: date) -> Dict[str, int]:
+    """
+    Dose counts of the local days start..end (inclusive), same shape as window_summary()
+    """
+    first, last = start.isoformat(), end.isoformat()
+    actions: Dict[str, int] = {}
+    for day, bucket in rollup.get("daily", {}).items():
+        if first <= day <= last:
+            merge_counts(actions, bucket.get("actions", {}))
+    return dose_counts(actions)
+
+
+def medication_summary(
+    rollup: Dict[str, Any],
+    days: int,
+    action: str = "skipped",
+    today: Optional[date] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Per-medication counts and patterns over the last `days` days
+
+    Same shape as pattern_engine.analyze_by_medication(), summed from the
+    per-medication counters of the daily buckets.
+
+    Returns:
+        {medication_id: {"total_actions", "skipped_count", "miss_rate",
+        "day_pattern", "time_pattern", "reason_pattern"}}, medications in
+        order of their most recent day
+    """
+    totals: Dict[str, int] = {}
+    patterns: Dict[str, PatternCounts] = {}
+    for day, bucket in window_days(rollup, days, today):
+        for medication_id, medication_bucket in bucket.get("medications", {}).items():
+            totals[medication_id] = totals.get(medication_id, 0) + sum(medication_bucket.get("actions", {}).values())
+            patterns.setdefault(medication_id, PatternCounts(action)).add_day(day, medication_bucket)
+
+    results = {}
+    for medication_id, counts in patterns.items():
+        total = totals[medication_id]
+        count = sum(counts.day_counts.values())
+        results[medication_id] = {
+            "total_actions": total,
+            "skipped_count": count,
+            "miss_rate": round(count / total, 3) if total else 0.0,
+            **counts.patterns()
+        }
+    return results
+
+
+def summarize_logs(logs: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Dose counts of raw logs, in the same shape as window_summary()
+    """
+    actions: Dict[str, int] = {}
+    for log in logs:
+        action = log.get("action")
+        actions[action] = actions.get(action, 0) + 1
+    return dose_counts(actions)
+
+
+def dose_counts(actions: Dict[str, int]) -> Dict[str, int]:
+    """
+    Dose counts from per-action counts
+
+    Returns:
+        Dictionary with total_doses, took_doses, skipped_doses, snoozed_doses
+    """
+    return {
+        "total_doses": sum(actions.values()),
+        "took_doses": actions.get("took", 0),
+        "skipped_doses": actions.get("skipped", 0),
+        "snoozed_doses": actions.get("snoozed", 0)
+    }
+
+
+def adherence_stats(patient_id: str, days: int, counts: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Adherence statistics from dose counts (window_summary / summarize_logs)
+
+    Returns:
+        Dictionary with adherence statistics
+    """
+    total_doses = counts["total_doses"]
+    took_doses = counts["took_doses"]
+    adherence_rate = (took_doses / total_doses * 100) if total_doses > 0 else 0.0
+
+    return {
+        "patient_id": patient_id,
+        "period_days": days,
+        "total_doses": total_doses,
+        "took_doses": took_doses,
+        "skipped_doses": counts["skipped_doses"],
+        "adherence_rate": round(adherence_rate, 2),
+        "calculated_at": datetime.utcnow().isoformat()
+    }
+
+
+def streak_days(rollup: Dict[str, Any], today: Optional[date] = None) -> int:
+    """
+    Consecutive days (ending today or yesterday) with doses taken and none skipped
+    """
+    today = today or local_today(rollup.get("timezone"))
+    daily = rollup.get("daily", {})
+
+    day = today
+    if not _clean_day(daily.get(day.isoformat())):
+        day = today - timedelta(days=1)
+
+    streak = 0
+    while _clean_day(daily.get(day.isoformat())):
+        streak += 1
+        day -= timedelta(days=1)
+    return streak
+
+
+def _clean_day(bucket: Optional[Dict[str, Any]]) -> bool:
+    actions = (bucket or {}).get("actions", {})
+    return actions.get("took", 0) > 0 and actions.get("skipped", 0) == 0
+
+
+class PatternCounts:
+    """
+    Running day/time/reason counters for one action, fed one daily bucket at a time
+
+    Feed days most recent first: ties then go to the value seen on the most
+    recent day, mirroring the newest-first log order.
+    """
+
+    def __init__(self, action: str = "skipped"):
+        self.action = action
+        self.day_counts: Dict[str, int] = {}
+        self.time_counts: Dict[str, int] = {}
+        self.reason_counts: Dict[str, int] = {}
+
+    def add_day(self, day: str, bucket: Dict[str, Any]):
+        """Add one daily bucket (rollup "daily" format)"""
+        count = bucket.get("actions", {}).get(self.action, 0)
+        if count:
+            day_name = DAY_NAMES[date.fromisoformat(day).weekday()]
+            self.day_counts[day_name] = self.day_counts.get(day_name, 0) + count
+        merge_counts(self.time_counts, bucket.get("buckets", {}).get(self.action, {}))
+
+        reasons = bucket.get("reasons", {}).get(self.action, {})
+        merge_counts(self.reason_counts, reasons)
+        unknown = count - sum(reasons.values())
+        if unknown > 0:
+            self.reason_counts["unknown"] = self.reason_counts.get("unknown", 0) + unknown
+
+    def patterns(self) -> Dict[str, Dict[str, Any]]:
+        """Patterns in the pattern_engine.analyze_patterns shape"""
+        return {
+            "day_pattern": _top_pattern("problem_day", self.day_counts),
+            "time_pattern": _top_pattern("problem_time", self.time_counts),
+            "reason_pattern": _reason_pattern(self.reason_counts)
+        }
+
+
+def window_patterns(
+    rollup: Dict[str, Any],
+    days: int,
+    action: str = "skipped",
+    today: Optional[date] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Day, time and reason patterns for one action over the last `days` days
+
+    Same shape as pattern_engine.analyze_patterns. Ties go to the value seen
+    on the most recent day, mirroring the newest-first log order.
+
+    Returns:
+        {"day_pattern": ..., "time_pattern": ..., "reason_pattern": ...}
+    """
+    counts = PatternCounts(action)
+    for day, bucket in window_days(rollup, days, today):
+        counts.add_day(day, bucket)
+    return counts.patterns()
+
+
+def _top_pattern(key: str, counts: Dict[str, int]) -> Dict[str, Any]:
+    if not counts:
+        return {key: None}
+
+    value, count = max(counts.items(), key=lambda item: item[1])
+    return {
+        key: value,
+        "occurrences": count,
+        "pattern_strength": "strong" if count >= STRONG_PATTERN_MIN else "weak"
+    }
+
+
+def _reason_pattern(counts: Dict[str, int]) -> Dict[str, Any]:
+    if not counts:
+        return {"primary_reason": "unknown"}
+
+    reason, count = max(counts.items(), key=lambda item: item[1])
+    return {
+        "primary_reason": reason,
+        "occurrences": count,
+        "all_reasons": dict(counts)
+    }
@@ -1,15 +1,23 @@
 """
 MedAdhere Pro - Flask Application Entry Point
 """
+import atexit
 import logging
+import signal
+import sys
 import threading
 import json
-from datetime import datetime
+from datetime import date, datetime
+from typing import Any, Dict
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 from flask_socketio import SocketIO
+from backend.analytics.anomaly import needs_workflow
 from backend.config import config
-from backend.firebase_client import adherence_service, patient_service
+from backend.firebase_client import adherence_service, learning_job_service
+from backend.image_store import image_store
+from backend.notifications import notification_pipeline
+from backend.write_behind import write_behind
 
 # Configure logging
 logging.basicConfig(
@@ -26,6 +34,38 @@ except Exception as e:
     logger.error(f"Failed to load agent system: {str(e)}")
     orchestrator = None
 
+
+def start_background_services():
+    """
+    Start the background flushers of the serving process
+    
+    Called by the entry point rather than on import, so importing the app
+    (tests, scripts, a WSGI server's loader) starts no threads and
+    installs no signal handler. A WSGI server should call it once per
+    worker process.
+    """
+    # Flush execution writes queued by a previous run
+    if config.WRITE_BEHIND_ENABLED:
+        write_behind.start()
+    
+    # Send notification digests, including those buffered by a previous run
+    if config.NOTIFICATION_DIGEST_ENABLED:
+        notification_pipeline.start()
+    
+    atexit.register(shutdown)
+    
+    # SIGTERM (e.g. a container stop) exits through atexit instead of killing the process
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+
+def shutdown():
+    """Send the buffered notification digests and stop the background flushers"""
+    if config.NOTIFICATION_DIGEST_ENABLED:
+        notification_pipeline.stop(flush=True)
+    if config.WRITE_BEHIND_ENABLED:
+        write_behind.stop()
+
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(config)
@@ -80,6 +120,9 @@ def index():
             "health": "/health",
             "api_docs": "/api/docs",
             "patient_action": "/api/patient-action",
+            "patient_actions_bulk": "/api/patient-actions/bulk",
+            "image_upload": "/api/images",
+            "image_upload_session": "/api/images/uploads",
             "workflow_status": "/api/workflow-status/<workflow_id>",
             "workflows_list": "/api/workflows",
             "agent_query": "/api/agent-query",
@@ -94,6 +137,13 @@ def health_check():
     """Health check endpoint"""
     agent_status = "initialized" if orchestrator and len(orchestrator.agents) == 5 else "not initialized"
     
+    try:
+        persistence = write_behind.stats() if config.WRITE_BEHIND_ENABLED else {"enabled": False}
+    except Exception as e:
+        persistence = {"error": str(e)}
+    
+    notifications = notification_pipeline.stats() if config.NOTIFICATION_DIGEST_ENABLED else {"enabled": False}
+    
     return jsonify({
         "status": "healthy",
         "medgemma_endpoint": config.MEDGEMMA_ENDPOINT,
@@ -102,7 +152,9 @@ def health_check():
         "agents": {
             "status": agent_status,
             "count": len(orchestrator.agents) if orchestrator else 0
-        }
+        },
+        "write_behind": persistence,
+        "notifications": notifications
     })
 
 
@@ -110,6 +162,53 @@ def health_check():
 # API Endpoints (to be implemented)
 # ============================================================================
 
+def start_workflow(data: Dict[str, Any]) -> str:
+    """
+    Run the agent workflow for a logged action in a background thread
+    
+    Args:
+        data: Logged patient action
+        
+    Returns:
+        Workflow ID to poll with /api/workflow-status/<workflow_id>
+    """
+    patient_id = data.get("patient_id")
+    action = data.get("action")
+    workflow_id = f"wf_{patient_id}_{action}_{data.get('timestamp', '').replace(':', '').replace('-', '').replace('Z', '')[:14]}"
+    
+    def run_workflow():
+        try:
+            logger.info(f"Starting async workflow: {workflow_id}")
+            workflow_result = orchestrator.route_patient_action(data)
+            logger.info(f"Workflow {workflow_id} completed: {workflow_result.get('state')}")
+            
+            # Store result for retrieval (serialize for JSON compatibility)
+            workflow_results[workflow_id] = {
+                "status": "completed",
+                "result": serialize_workflow_result(workflow_result),
+                "timestamp": data.get('timestamp'),
+                "completed_at": datetime.now().isoformat()
+            }
+        except Exception as e:
+            logger.error(f"Workflow {workflow_id} error: {str(e)}")
+            workflow_results[workflow_id] = {
+                "status": "error",
+                "error": str(e),
+                "timestamp": data.get('timestamp'),
+                "failed_at": datetime.now().isoformat()
+            }
+    
+    # Mark workflow as started
+    workflow_results[workflow_id] = {
+        "status": "running",
+        "started_at": data.get('timestamp') or datetime.now().isoformat()
+    }
+    
+    thread = threading.Thread(target=run_workflow, daemon=True)
+    thread.start()
+    return workflow_id
+
+
 @app.route("/api/patient-action", methods=["POST"])
 def patient_action():
     """
@@ -122,75 +221,299 @@ def patient_action():
         "medication_id": "med_001",
         "reason": "timing_conflict|supplement_interference|side_effects|other",
         "timestamp": "2026-02-17T08:00:00Z",
-        "notes": "optional user notes"
+        "notes": "optional user notes",
+        "image_id": "optional ID returned by /api/images",
+        "image": "optional base64 photo (legacy - stored and replaced by image_id)"
     }
     """
     try:
-        data = request.json
+        # Store photos once and pass image IDs from here on
+        try:
+            data = image_store.externalize_images(request.json)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
         patient_id = data.get("patient_id")
         action = data.get("action")
         
         logger.info(f"Patient action received: {patient_id} - {action}")
         
+        # Uploaded photos are referenced by ID - make sure they exist before logging
+        try:
+            referenced_ids = image_store.referenced_ids(data)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        missing = [image_id for image_id in referenced_ids if not image_store.exists(image_id)]
+        if missing:
+            return jsonify({
+                "status": "error",
+                "message": f"Unknown image_id(s): {', '.join(missing)}"
+            }), 400
+        
         # Log action to Firebase
         log_id = adherence_service.log_action(data)
         logger.info(f"Action logged to Firebase: {log_id}")
         
+        triage = data.get("triage")
+        
         # Trigger agent workflow if appropriate
-        if orchestrator and (action in ["skipped", "snoozed"] or (action == "took" and data.get("reason") == "side_effects")):
+        if orchestrator and needs_workflow(data, triage):
             logger.info(f"Triggering agent workflow for {action} action")
             
             # Run workflow asynchronously to avoid timeout
-            workflow_id = f"wf_{patient_id}_{action}_{data.get('timestamp', '').replace(':', '').replace('-', '').replace('Z', '')[:14]}"
-            
-            def run_workflow():
-                try:
-                    logger.info(f"Starting async workflow: {workflow_id}")
-                    workflow_result = orchestrator.route_patient_action(data)
-                    logger.info(f"Workflow {workflow_id} completed: {workflow_result.get('state')}")
-                    
-                    # Store result for retrieval (serialize for JSON compatibility)
-                    workflow_results[workflow_id] = {
-                        "status": "completed",
-                        "result": serialize_workflow_result(workflow_result),
-                        "timestamp": data.get('timestamp'),
-                        "completed_at": datetime.now().isoformat()
-                    }
-                except Exception as e:
-                    logger.error(f"Workflow {workflow_id} error: {str(e)}")
-                    workflow_results[workflow_id] = {
-                        "status": "error",
-                        "error": str(e),
-                        "timestamp": data.get('timestamp'),
-                        "failed_at": datetime.now().isoformat()
-                    }
-            
-            # Mark workflow as started
-            workflow_results[workflow_id] = {
-                "status": "running",
-                "started_at": data.get('timestamp') or datetime.now().isoformat()
-            }
-            
-            thread = threading.Thread(target=run_workflow, daemon=True)
-            thread.start()
+            workflow_id = start_workflow(data)
             
             return jsonify({
                 "status": "success",
                 "message": "Action logged and workflow triggered (running asynchronously)",
                 "workflow_id": workflow_id,
+                "triage": triage,
                 "note": "Workflow is running in the background. Use SSE /api/stream-reasoning to monitor progress."
             })
+        elif triage and triage["decision"] == "defer":
+            return jsonify({
+                "status": "success",
+                "message": "Action logged and queued for batch review",
+                "agent_triggered": False,
+                "triage": triage
+            })
         else:
             return jsonify({
                 "status": "success",
                 "message": "Action logged successfully",
-                "agent_triggered": False
+                "agent_triggered": False,
+                "triage": triage
             })
         
     except Exception as e:
         logger.error(f"Error processing patient action: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+
+@app.route("/api/patient-actions/bulk", methods=["POST"])
+def patient_actions_bulk():
+    """
+    Log many patient actions at once (e.g. an offline client syncing a day of doses)
+    
+    Expected payload:
+    {
+        "actions": [
+            {
+                "idempotency_key": "p001-med_001-20260217T0800",
+                "patient_id": "p001",
+                "action": "took",
+                "medication_id": "med_001",
+                "timestamp": "2026-02-17T08:00:00Z"
+            },
+            ...
+        ]
+    }
+    
+    Each action is validated and logged on its own; re-sending an action
+    with the same idempotency_key reports it as a duplicate. At most one
+    workflow is started per patient, for the latest action that needs one.
+    
+    Returns:
+    {
+        "status": "success",
+        "results": [{"index", "status", "log_id", "triage" | "error"}],
+        "counts": {"created": n, "duplicate": n, "invalid": n, "failed": n},
+        "workflows": {"<patient_id>": "<workflow_id>"}
+    }
+    """
+    try:
+        actions = (request.json or {}).get("actions")
+        if not isinstance(actions, list) or not actions:
+            return jsonify({"status": "error", "message": "'actions' must be a non-empty list"}), 400
+        if len(actions) > config.BULK_ACTIONS_MAX_ITEMS:
+            return jsonify({
+                "status": "error",
+                "message": f"At most {config.BULK_ACTIONS_MAX_ITEMS} actions per request"
+            }), 413
+        
+        # Store photos once and pass image IDs from here on; actions with
+        # undecodable photos or that reference unknown ones are rejected
+        # without being logged
+        results = [None] * len(actions)
+        accepted = []
+        for index, action in enumerate(actions):
+            referenced_ids = []
+            if isinstance(action, dict):
+                try:
+                    action = actions[index] = image_store.externalize_images(action)
+                    referenced_ids = image_store.referenced_ids(action)
+                except ValueError as e:
+                    results[index] = {"index": index, "status": "invalid", "error": str(e)}
+                    continue
+            missing = [image_id for image_id in referenced_ids if not image_store.exists(image_id)]
+            if missing:
+                results[index] = {"index": index, "status": "invalid",
+                                  "error": f"Unknown image_id(s): {', '.join(missing)}"}
+            else:
+                accepted.append(index)
+        
+        for result in adherence_service.log_actions([actions[index] for index in accepted]):
+            result["index"] = accepted[result["index"]]
+            results[result["index"]] = result
+        
+        counts = {status: 0 for status in ("created", "duplicate", "invalid", "failed")}
+        latest: Dict[str, Dict[str, Any]] = {}
+        for result in results:
+            counts[result["status"]] += 1
+            triage = result.get("triage")
+            action = actions[result["index"]]
+            if result["status"] == "created" and needs_workflow(action, triage):
+                previous = latest.get(action["patient_id"])
+                if previous is None or str(action.get("timestamp")) >= str(previous.get("timestamp")):
+                    latest[action["patient_id"]] = {**action, "triage": triage}
+        
+        workflows = {}
+        if orchestrator:
+            for patient_id, action in latest.items():
+                workflows[patient_id] = start_workflow(action)
+        
+        logger.info(f"Bulk actions: {counts}, {len(workflows)} workflows triggered")
+        
+        return jsonify({
+            "status": "success",
+            "results": results,
+            "counts": counts,
+            "workflows": workflows
+        }), 207 if counts["invalid"] or counts["failed"] else 200
+        
+    except Exception as e:
+        logger.error(f"Error processing bulk patient actions: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# ============================================================================
+# Image Upload Endpoints
+# ============================================================================
+
+@app.route("/api/images", methods=["POST"])
+def upload_image():
+    """
+    Upload a side-effect photo in one request, streamed to the image store
+    
+    Accepts either multipart/form-data with an "image" file field, or the raw
+    image bytes as the request body (Content-Type: image/jpeg, image/png, ...).
+    The body is hashed while it is written, so memory stays bounded.
+    
+    Returns:
+    {
+        "status": "success",
+        "image_id": "<sha256>"
+    }
+    """
+    try:
+        if request.content_length and request.content_length > config.IMAGE_UPLOAD_MAX_BYTES:
+            return jsonify({"status": "error", "message": "Image too large"}), 413
+        
+        if request.mimetype == "multipart/form-data":
+            upload = request.files.get("image")
+            if upload is None:
+                return jsonify({"status": "error", "message": "Missing 'image' file field"}), 400
+            image_id = image_store.put_stream(upload.stream)
+        else:
+            image_id = image_store.put_stream(request.stream)
+        
+        logger.info(f"Image uploaded: {image_id[:12]}")
+        
+        return jsonify({"status": "success", "image_id": image_id}), 201
+        
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error uploading image: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route("/api/images/uploads", methods=["POST"])
+def begin_image_upload():
+    """
+    Start a resumable chunked upload for large photos or slow connections
+    
+    Flow:
+    1. POST /api/images/uploads                         -> {"upload_id": ...}
+    2. PUT  /api/images/uploads/<upload_id>?offset=N    (raw chunk body, repeat)
+    3. POST /api/images/uploads/<upload_id>/complete    -> {"image_id": ...}
+    
+    Each chunk is a short request, so a slow upload never pins a worker thread.
+    """
+    try:
+        upload_id = image_store.begin_upload()
+        return jsonify({
+            "status": "success",
+            "upload_id": upload_id,
+            "chunk_bytes": config.IMAGE_UPLOAD_CHUNK_BYTES,
+            "max_bytes": config.IMAGE_UPLOAD_MAX_BYTES
+        }), 201
+        
+    except Exception as e:
+        logger.error(f"Error starting image upload: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route("/api/images/uploads/<upload_id>", methods=["PUT", "GET"])
+def image_upload_chunk(upload_id):
+    """
+    Append a chunk to an upload session (PUT) or get bytes received so far (GET)
+    
+    Query params:
+    - offset: Byte offset of this chunk; must equal the bytes received so far
+    """
+    try:
+        if request.method == "GET":
+            return jsonify({"status": "success", **image_store.upload_status(upload_id)})
+        
+        if request.content_length and request.content_length > config.IMAGE_UPLOAD_CHUNK_BYTES:
+            return jsonify({"status": "error", "message": "Chunk too large"}), 413
+        
+        offset = request.args.get("offset", type=int)
+        if offset is None:
+            return jsonify({"status": "error", "message": "offset is required"}), 400
+        
+        received = image_store.append_chunk(upload_id, request.stream, offset)
+        
+        return jsonify({
+            "status": "success",
+            "upload_id": upload_id,
+            "received_bytes": received
+        })
+        
+    except KeyError:
+        return jsonify({"status": "not_found", "message": f"Upload {upload_id} not found"}), 404
+    except ValueError as e:
+        # The session may have expired since the chunk was refused
+        try:
+            status = image_store.upload_status(upload_id)
+        except KeyError:
+            return jsonify({"status": "not_found", "message": f"Upload {upload_id} not found"}), 404
+        return jsonify({"status": "error", "message": str(e), **status}), 409
+    except Exception as e:
+        logger.error(f"Error receiving image chunk: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route("/api/images/uploads/<upload_id>/complete", methods=["POST"])
+def complete_image_upload(upload_id):
+    """
+    Finish an upload session and return the image ID for patient actions
+    """
+    try:
+        image_id = image_store.complete_upload(upload_id)
+        logger.info(f"Image upload {upload_id} completed: {image_id[:12]}")
+        
+        return jsonify({"status": "success", "image_id": image_id}), 201
+        
+    except KeyError:
+        return jsonify({"status": "not_found", "message": f"Upload {upload_id} not found"}), 404
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error completing image upload: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
 @app.route("/api/workflow-status/<workflow_id>", methods=["GET"])
 def get_workflow_status(workflow_id):
     """
@@ -254,7 +577,10 @@ def agent_query():
     }
     """
     try:
-        data = request.json
+        try:
+            data = image_store.externalize_images(request.json)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
         patient_id = data.get("patient_id")
         query_type = data.get("query_type")
         
@@ -320,21 +646,64 @@ def stream_reasoning():
 def adherence_summary(patient_id):
     """
     Get adherence summary and statistics for a patient
+    
+    Query params:
+        days: Period to summarize (default 7)
+        start_date, end_date: Ad-hoc range of local dates (YYYY-MM-DD)
+            instead of the last `days` days; end_date defaults to today
+        calendar: "true" to add expected-dose counts from the medication
+            schedule (reads the window's logs; trailing windows only)
     """
     try:
         logger.info(f"Adherence summary requested for: {patient_id}")
         
-        # TODO: Implement Firebase query
+        days = request.args.get("days", default=7, type=int)
+        include_calendar = request.args.get("calendar", "false").lower() == "true"
+        try:
+            start_date, end_date = (
+                date.fromisoformat(request.args[name]) if request.args.get(name) else None
+                for name in ("start_date", "end_date")
+            )
+        except ValueError:
+            return jsonify({"status": "error", "message": "Dates must be YYYY-MM-DD"}), 400
+        if end_date and not start_date:
+            return jsonify({"status": "error", "message": "end_date requires start_date"}), 400
+        if start_date and end_date and end_date < start_date:
+            return jsonify({"status": "error", "message": "end_date is before start_date"}), 400
+        
+        stats = adherence_service.calculate_adherence_rate(
+            patient_id, days=days, start_date=start_date, end_date=end_date
+        )
+        
+        summary = {
+            "adherence_rate": stats["adherence_rate"],
+            "streak_days": stats.get("streak_days", 0),
+            "total_doses": stats["total_doses"],
+            "missed_doses": stats["skipped_doses"],
+            "period_days": stats["period_days"],
+            "source": stats["source"]
+        }
+        if start_date:
+            summary["start_date"] = stats["start_date"]
+            summary["end_date"] = stats["end_date"]
+        
+        # Against the schedule: doses that were never logged count as missed
+        # (trailing windows only - the calendar is anchored on today)
+        calendar = None
+        if include_calendar and not start_date:
+            calendar = adherence_service.expected_dose_summary(patient_id, days=days)
+        if calendar:
+            summary.update({
+                "expected_doses": calendar["expected_doses"],
+                "late_doses": calendar["late"],
+                "unlogged_doses": calendar["unlogged"],
+                "dose_adherence_rate": calendar["dose_adherence_rate"]
+            })
         
         return jsonify({
             "status": "success",
             "patient_id": patient_id,
-            "summary": {
-                "adherence_rate": 0.0,
-                "streak_days": 0,
-                "total_doses": 0,
-                "missed_doses": 0
-            }
+            "summary": summary
         })
         
     except Exception as e:
@@ -342,6 +711,34 @@ def adherence_summary(patient_id):
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route("/api/learning-insights/<patient_id>", methods=["GET"])
+def learning_insights(patient_id):
+    """
+    Get the latest batch learning output for a patient
+    
+    Routine doses queue a learning job instead of running the Learning
+    agent inline; backend.learning_worker stores the result read here.
+    """
+    try:
+        insights = learning_job_service.get_insights(patient_id)
+        if not insights:
+            return jsonify({
+                "status": "error",
+                "message": f"No learning insights for patient {patient_id} yet"
+            }), 404
+        
+        return jsonify({
+            "status": "success",
+            "patient_id": patient_id,
+            "learning": serialize_workflow_result(insights["learning"]),
+            "updated_at": insights.get("updated_at")
+        })
+        
+    except Exception as e:
+        logger.error(f"Error fetching learning insights: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
 # ============================================================================
 # WebSocket Events
 # ============================================================================
@@ -390,6 +787,8 @@ if __name__ == "__main__":
         logger.info(f"MedGemma Endpoint: {config.MEDGEMMA_ENDPOINT}")
         logger.info(f"MedGemma API Key Set: {bool(config.MEDGEMMA_API_KEY)}")
         
+        start_background_services()
+        
         # Use Flask's built-in server with threading enabled
         app.run(
             host=config.HOST,
@@ -34,10 +34,110 @@ class Config:
     MEDGEMMA_TEMPERATURE = float(os.getenv("MEDGEMMA_TEMPERATURE", "0.7"))
     MEDGEMMA_MAX_TOKENS = int(os.getenv("MEDGEMMA_MAX_TOKENS", "512"))
     
+    # Risk assessment tiering - deterministic rules settle timing changes at or
+    # above this confidence; anything below is escalated to MedGemma
+    RISK_RULE_CONFIDENCE_THRESHOLD = float(os.getenv("RISK_RULE_CONFIDENCE_THRESHOLD", "0.85"))
+    
+    # Speculative risk assessment - start MedGemma checks for the predicted plan
+    # while remediation is still running
+    SPECULATIVE_RISK_ENABLED = os.getenv("SPECULATIVE_RISK_ENABLED", "True").lower() == "true"
+    SPECULATIVE_RISK_WORKERS = int(os.getenv("SPECULATIVE_RISK_WORKERS", "4"))
+    
+    # Risk assessment cache - reuse the assessment of an identical plan for the
+    # same patient within this clinically configurable window
+    RISK_CACHE_ENABLED = os.getenv("RISK_CACHE_ENABLED", "True").lower() == "true"
+    RISK_CACHE_TTL_HOURS = float(os.getenv("RISK_CACHE_TTL_HOURS", "72"))
+    
+    # Adherence rollups - per-patient counters updated with every logged action
+    ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "True").lower() == "true"
+    ROLLUP_RETENTION_DAYS = int(os.getenv("ROLLUP_RETENTION_DAYS", "120"))
+    
+    # Expected-dose calendar in investigations answered by the rollup - needs
+    # the primary window's raw logs (always built when the logs are read anyway)
+    INVESTIGATION_DOSE_CALENDAR = os.getenv("INVESTIGATION_DOSE_CALENDAR", "False").lower() == "true"
+    
+    # Adherence statistics the rollups cannot answer are counted with parallel
+    # server-side count() aggregations (one per action plus the total)
+    ADHERENCE_COUNT_WORKERS = int(os.getenv("ADHERENCE_COUNT_WORKERS", "8"))
+    
+    # Adherence log streaming - documents fetched per page
+    LOG_PAGE_SIZE = int(os.getenv("LOG_PAGE_SIZE", "500"))
+    
+    # Bulk action ingestion - actions accepted per /api/patient-actions/bulk request
+    BULK_ACTIONS_MAX_ITEMS = int(os.getenv("BULK_ACTIONS_MAX_ITEMS", "1000"))
+    
+    # Action triage - online anomaly detection decides which logged actions
+    # run the agent workflow; the rest are acknowledged or batch-reviewed
+    TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "True").lower() == "true"
+    DEFERRED_REVIEW_BATCH_SIZE = int(os.getenv("DEFERRED_REVIEW_BATCH_SIZE", "200"))
+    
+    # Intervention effectiveness store - before/after counters on each
+    # intervention, kept current by backend.effectiveness_worker
+    EFFECTIVENESS_STORE_ENABLED = os.getenv("EFFECTIVENESS_STORE_ENABLED", "True").lower() == "true"
+    EFFECTIVENESS_WORKER_INTERVAL = float(os.getenv("EFFECTIVENESS_WORKER_INTERVAL", "60"))
+    
+    # Population effectiveness table - rebuilt by backend.population_admin,
+    # cached in memory by every process
+    POPULATION_WORKERS = int(os.getenv("POPULATION_WORKERS", "4"))
+    POPULATION_TABLE_TTL_SECONDS = int(os.getenv("POPULATION_TABLE_TTL_SECONDS", "3600"))
+    
+    # Deferred learning - routine "took" actions queue a per-patient learning
+    # job that backend.learning_worker processes in bulk
+    LEARNING_BATCH_ENABLED = os.getenv("LEARNING_BATCH_ENABLED", "True").lower() == "true"
+    LEARNING_BATCH_SIZE = int(os.getenv("LEARNING_BATCH_SIZE", "200"))
+    LEARNING_WORKER_INTERVAL = float(os.getenv("LEARNING_WORKER_INTERVAL", "300"))
+    
+    # Write-behind queue - execution results are queued in a local SQLite
+    # (WAL) database and committed to Firestore by a background flusher
+    WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "True").lower() == "true"
+    WRITE_BEHIND_PATH = os.getenv("WRITE_BEHIND_PATH", str(project_root / "data" / "write_behind.db"))
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+    WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "10"))
+    
+    # Follow-up scheduler - jobs stored in Firestore, run by backend.scheduler
+    SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "True").lower() == "true"
+    SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "500"))
+    SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "300"))
+    SCHEDULER_POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS", "30"))
+    SCHEDULER_LOOKAHEAD_SECONDS = float(os.getenv("SCHEDULER_LOOKAHEAD_SECONDS", "60"))
+    SCHEDULER_MAX_ATTEMPTS = int(os.getenv("SCHEDULER_MAX_ATTEMPTS", "5"))
+    
+    # Reminder engine - per-minute dose reminders sent by backend.reminders
+    REMINDER_NOTIFIER = os.getenv("REMINDER_NOTIFIER", "firestore")  # "firestore" or "local"
+    REMINDER_DISPATCH_BATCH_SIZE = int(os.getenv("REMINDER_DISPATCH_BATCH_SIZE", "1000"))
+    REMINDER_REFRESH_SECONDS = float(os.getenv("REMINDER_REFRESH_SECONDS", "60"))
+    REMINDER_CATCH_UP_MINUTES = int(os.getenv("REMINDER_CATCH_UP_MINUTES", "15"))
+    REMINDER_ANSWERED_WINDOW_MINUTES = int(os.getenv("REMINDER_ANSWERED_WINDOW_MINUTES", "60"))
+    
+    # Refill forecast - supply ledgers advanced nightly by backend.refill_worker
+    REFILL_ALERT_DAYS = int(os.getenv("REFILL_ALERT_DAYS", "7"))
+    REFILL_WORKER_INTERVAL = float(os.getenv("REFILL_WORKER_INTERVAL", "86400"))
+    
+    # Notification pipeline - per-patient digests sent in batches by
+    # backend.notifications
+    NOTIFICATION_DIGEST_ENABLED = os.getenv("NOTIFICATION_DIGEST_ENABLED", "True").lower() == "true"
+    NOTIFICATION_TRANSPORT = os.getenv("NOTIFICATION_TRANSPORT", "firestore")  # "firestore" or "local"
+    NOTIFICATION_BUFFER_PATH = os.getenv("NOTIFICATION_BUFFER_PATH", str(project_root / "data" / "notification_buffer.db"))
+    NOTIFICATION_DIGEST_WINDOW_SECONDS = float(os.getenv("NOTIFICATION_DIGEST_WINDOW_SECONDS", "900"))
+    NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "500"))
+    NOTIFICATION_MAX_PENDING = int(os.getenv("NOTIFICATION_MAX_PENDING", "100000"))
+    NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "3"))
+    NOTIFICATION_FLUSH_INTERVAL = float(os.getenv("NOTIFICATION_FLUSH_INTERVAL", "5.0"))
+    
     # Firebase settings
     FIREBASE_CREDENTIALS_PATH = os.getenv("FIREBASE_CREDENTIALS_PATH", "")
     FIREBASE_DATABASE_URL = os.getenv("FIREBASE_DATABASE_URL", "")
     
+    # Image store settings (content-addressed medical photos)
+    IMAGE_STORE_BACKEND = os.getenv("IMAGE_STORE_BACKEND", "local")  # "local" or "gcs"
+    IMAGE_STORE_PATH = os.getenv("IMAGE_STORE_PATH", str(project_root / "data" / "images"))
+    IMAGE_STORE_BUCKET = os.getenv("IMAGE_STORE_BUCKET", "")
+    IMAGE_STORE_PREFIX = os.getenv("IMAGE_STORE_PREFIX", "medical-images/")
+    IMAGE_UPLOAD_MAX_BYTES = int(os.getenv("IMAGE_UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+    IMAGE_UPLOAD_CHUNK_BYTES = int(os.getenv("IMAGE_UPLOAD_CHUNK_BYTES", str(256 * 1024)))
+    IMAGE_UPLOAD_SESSION_TTL = int(os.getenv("IMAGE_UPLOAD_SESSION_TTL", "3600"))
+    
     # Agent settings
     AGENT_MAX_ITERATIONS = int(os.getenv("AGENT_MAX_ITERATIONS", "5"))
     AGENT_TIMEOUT = int(os.getenv("AGENT_TIMEOUT", "300"))
@@ -0,0 +1,173 @@
+"""
+Intervention Effectiveness Worker
+Keeps the before/after adherence counters on intervention documents current
+
+Usage:
+    python -m backend.effectiveness_worker            # run continuously
+    python -m backend.effectiveness_worker --once     # one pass (e.g. from cron)
+
+Each pass reads the adherence logs written since the previous pass (in
+created_at order), adds them to the counters of their patient's open
+interventions and seals the interventions whose after window has closed.
+LearningAgent then reads the sealed scores instead of recomputing them.
+"""
+import argparse
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from backend.analytics import effectiveness
+from backend.analytics.pattern_engine import parse_timestamps
+from backend.config import config
+from backend.firebase_client import adherence_service, intervention_service
+
+logger = logging.getLogger(__name__)
+
+
+def count_logs(
+    logs: List[Dict[str, Any]],
+    interventions: List[Dict[str, Any]]
+) -> Dict[str, Dict[str, int]]:
+    """
+    Counter increments for a page of newly written logs
+
+    Only logs written after an intervention's counters were backfilled
+    (counted_until) are counted for it, and not those its last_log_cursor
+    covers (counted by an earlier pass whose cursor was not stored).
+
+    Args:
+        logs: New logs (with patient_id and created_at)
+        interventions: Open interventions (with intervention_id and effectiveness)
+
+    Returns:
+        {intervention_id: {counter field: amount}} for interventions with changes
+    """
+    by_patient: Dict[str, List[Dict[str, Any]]] = {}
+    for log in logs:
+        by_patient.setdefault(log.get("patient_id"), []).append(log)
+
+    written = {
+        patient_id: parse_timestamps([log.get("created_at") or "" for log in patient_logs])
+        for patient_id, patient_logs in by_patient.items()
+    }
+
+    increments = {}
+    for intervention in interventions:
+        patient_id = intervention.get("patient_id")
+        if patient_id not in by_patient:
+            continue
+
+        counters = intervention["effectiveness"]
+        anchor = parse_timestamps([counters["anchor"]])
+        counted_until = parse_timestamps([counters.get("counted_until") or counters["anchor"]])
+        after_backfill = written[patient_id] > counted_until[0]
+        counted = counters.get("last_log_cursor")
+        new_logs = [
+            log for log, is_new in zip(by_patient[patient_id], after_backfill)
+            if is_new and not covers(counted, log)
+        ]
+        if not new_logs:
+            continue
+
+        counts = effectiveness.window_counts(new_logs, anchor)
+        if any(values[0] for values in counts.values()):
+            increments[intervention["intervention_id"]] = {
+                field: int(values[0]) for field, values in counts.items()
+            }
+
+    return increments
+
+
+def next_cursor(cursor: Dict[str, Any], logs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Worker position after a page of logs
+
+    Logs written in one batch share a created_at, so the IDs already seen
+    at the last created_at are kept and skipped on the next pass.
+    """
+    last = logs[-1]["created_at"]
+    log_ids = [log["log_id"] for log in logs if log["created_at"] == last]
+    if cursor.get("created_at") == last:
+        log_ids = sorted(set(log_ids) | set(cursor.get("log_ids", [])))
+    return {"created_at": last, "log_ids": log_ids, "updated_at": datetime.utcnow().isoformat()}
+
+
+def covers(cursor: Optional[Dict[str, Any]], log: Dict[str, Any]) -> bool:
+    """Whether a log is at or before a cursor, i.e. was already counted"""
+    if not cursor or log.get("created_at") is None:
+        return False
+    if log["created_at"] == cursor["created_at"]:
+        return log.get("log_id") in cursor.get("log_ids", [])
+    return log["created_at"] < cursor["created_at"]
+
+
+def run_once(page_size: Optional[int] = None, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Process one page of new logs and seal finished interventions
+
+    Args:
+        page_size: Logs per pass (default LOG_PAGE_SIZE)
+        now: Current UTC time (naive)
+
+    Returns:
+        {"logs": counted, "updated": interventions, "sealed": interventions, "more": bool}
+    """
+    page_size = page_size or config.LOG_PAGE_SIZE
+
+    cursor = intervention_service.get_worker_cursor()
+    interventions = intervention_service.open_interventions()
+
+    logs = adherence_service.logs_created_since(cursor.get("created_at"), limit=page_size)
+    seen = set(cursor.get("log_ids", []))
+    new_logs = [log for log in logs if log["log_id"] not in seen]
+
+    increments = count_logs(new_logs, interventions)
+    more = len(logs) == page_size
+
+    if more and not new_logs:
+        logger.warning(f"More than {page_size} logs share one created_at - increase the page size")
+        more = False
+
+    # Seal only once caught up, so no log of a closing window is still unread
+    sealed = {}
+    if not more:
+        for intervention in interventions:
+            counters = effectiveness.add_counts(
+                intervention["effectiveness"], increments.get(intervention["intervention_id"], {})
+            )
+            if effectiveness.is_due(counters, now):
+                sealed[intervention["intervention_id"]] = effectiveness.seal(counters, now)
+
+    if increments or sealed or new_logs:
+        intervention_service.apply_effectiveness_updates(
+            increments, sealed, next_cursor(cursor, logs) if logs else None
+        )
+
+    logger.info(
+        f"Effectiveness pass: {len(new_logs)} logs, {len(increments)} interventions updated, "
+        f"{len(sealed)} sealed"
+    )
+    return {"logs": len(new_logs), "updated": len(increments), "sealed": len(sealed), "more": more}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain intervention effectiveness counters")
+    parser.add_argument("--once", action="store_true", help="Catch up once and exit")
+    parser.add_argument("--interval", type=float, default=config.EFFECTIVENESS_WORKER_INTERVAL,
+                        help="Seconds between passes when running continuously")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    while True:
+        result = run_once()
+        while result["more"]:
+            result = run_once()
+        if args.once:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,14 +3,47 @@ Firebase Integration Module
 Handles all Firebase Firestore operations for patient data management
 """
 import logging
-from typing import Any, Dict, List, Optional
-from datetime import datetime, timedelta
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from datetime import date, datetime, timedelta
 import firebase_admin
 from firebase_admin import credentials, firestore
+from backend.analytics import anomaly, dose_calendar, effectiveness, population, rollups
 from backend.config import config
+from backend.models import LOG_ROW_FIELDS, LogRow
 
 logger = logging.getLogger(__name__)
 
+# Firestore allows at most this many writes per batch
+FIRESTORE_BATCH_LIMIT = 500
+
+# Firestore allows at most this many values in an "in" filter
+FIRESTORE_IN_LIMIT = 30
+
+# Patient fields the reminder engine and refill forecast need
+REMINDER_FIELDS = ["medications", "timezone", "preferences", "schedule_adjustments", "reminder_settings"]
+REFILL_FIELDS = ["medications", "auto_refill_enabled", "refill_trigger_days", "refill_settings"]
+
+# Actions a patient can log
+VALID_ACTIONS = ("took", "skipped", "snoozed")
+
+# Client idempotency keys become log document IDs
+IDEMPOTENCY_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+# Background worker positions
+WORKER_STATE_COLLECTION = "worker_state"
+EFFECTIVENESS_CURSOR = "effectiveness"
+REFILL_CURSOR = "refill"
+
+
+def last_log_cursor(cursor: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a worker cursor stored on the documents a pass updated"""
+    return {"created_at": cursor.get("created_at"), "log_ids": cursor.get("log_ids", [])}
+
 
 class FirebaseClient:
     """
@@ -22,8 +55,9 @@ class FirebaseClient:
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(FirebaseClient, cls).__new__(cls)
-            cls._instance._initialize()
+            instance = super(FirebaseClient, cls).__new__(cls)
+            instance._initialize()
+            cls._instance = instance
         return cls._instance
     
     def _initialize(self):
@@ -50,17 +84,87 @@ class FirebaseClient:
         return self._db
 
 
+class FirestoreService:
+    """
+    Base class for Firestore-backed services
+    
+    The Firestore connection is made on first use rather than at import, so
+    modules can import the global service instances without credentials.
+    """
+    
+    collection: str = ""
+    
+    @property
+    def db(self):
+        """Get Firestore database instance"""
+        return FirebaseClient().db
+    
+    def run_transaction(self, write: Callable[[Any], Any]) -> Any:
+        """
+        Run write(transaction) in a Firestore transaction, retried on contention
+        
+        The transaction takes the same set()/create() calls as a WriteBatch;
+        its reads must come before its writes, and write() must be safe to
+        run again when the transaction is retried.
+        
+        Args:
+            write: Function reading and writing through the transaction
+            
+        Returns:
+            What write() returned on the attempt that committed
+        """
+        return firestore.transactional(write)(self.db.transaction())
+
+
 # ============================================================================
 # Patient Operations
 # ============================================================================
 
-class PatientService:
+class PatientService(FirestoreService):
     """Service for patient data operations"""
     
     def __init__(self):
-        self.db = FirebaseClient().db
         self.collection = "patients"
     
+    def list_patient_ids(self) -> List[str]:
+        """
+        Get the IDs of all patients
+        
+        Returns:
+            List of patient identifiers
+        """
+        try:
+            return [doc.id for doc in self.db.collection(self.collection).select([]).stream()]
+            
+        except Exception as e:
+            logger.error(f"Error listing patients: {str(e)}")
+            raise
+    
+    def profiles(self, fields: List[str], updated_since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        Some fields of every patient (e.g. REMINDER_FIELDS, REFILL_FIELDS)
+        
+        Args:
+            fields: Fields to fetch
+            updated_since: Only patients updated at or after this time
+            
+        Returns:
+            Projected patient dictionaries with patient_id
+        """
+        try:
+            query = self.db.collection(self.collection)
+            if updated_since is not None:
+                query = query.where(filter=firestore.FieldFilter("updated_at", ">=", updated_since))
+            
+            return [
+                {**(doc.to_dict() or {}), "patient_id": doc.id}
+                for doc in query.select(fields).stream()
+            ]
+            
+        except Exception as e:
+            logger.error(f"Error retrieving patient profiles: {str(e)}")
+            raise
+    
     def get_patient(self, patient_id: str) -> Optional[Dict[str, Any]]:
         """
         Get patient profile by ID
@@ -87,6 +191,28 @@ class PatientService:
             logger.error(f"Error retrieving patient {patient_id}: {str(e)}")
             raise
     
+    def get_patients(self, patient_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Get several patient profiles in one round-trip
+        
+        Args:
+            patient_ids: Patient identifiers
+            
+        Returns:
+            {patient_id: patient data} for the patients that exist
+        """
+        try:
+            refs = [self.db.collection(self.collection).document(patient_id) for patient_id in patient_ids]
+            patients = {}
+            for doc in self.db.get_all(refs):
+                if doc.exists:
+                    patients[doc.id] = {**doc.to_dict(), "patient_id": doc.id}
+            return patients
+            
+        except Exception as e:
+            logger.error(f"Error retrieving {len(patient_ids)} patients: {str(e)}")
+            raise
+    
     def create_patient(self, patient_data: Dict[str, Any]) -> str:
         """
         Create a new patient record
@@ -106,7 +232,17 @@ class PatientService:
             patient_data["created_at"] = firestore.SERVER_TIMESTAMP
             patient_data["updated_at"] = firestore.SERVER_TIMESTAMP
             
-            self.db.collection(self.collection).document(patient_id).set(patient_data)
+            patient_ref = self.db.collection(self.collection).document(patient_id)
+            
+            def write(transaction):
+                is_new = not patient_ref.get(transaction=transaction).exists
+                transaction.set(patient_ref, patient_data)
+                # A brand-new patient has no logs yet, so an empty rollup is
+                # complete; existing patients need a backfill (rollup_admin)
+                if is_new and config.ROLLUPS_ENABLED:
+                    rollup_service.add_empty_to_batch(transaction, patient_id, patient_data.get("timezone"))
+            
+            self.run_transaction(write)
             logger.info(f"Created patient: {patient_id}")
             
             return patient_id
@@ -132,23 +268,99 @@ class PatientService:
             self.db.collection(self.collection).document(patient_id).update(updates)
             logger.info(f"Updated patient: {patient_id}")
             
+            self.after_update(patient_id, updates)
+            
             return True
             
         except Exception as e:
             logger.error(f"Error updating patient {patient_id}: {str(e)}")
             raise
+    
+    def add_update_to_batch(self, batch, patient_id: str, updates: Dict[str, Any]):
+        """
+        Add a patient update to a write batch
+        
+        Call after_update() once the batch is committed.
+        
+        Args:
+            batch: Firestore WriteBatch
+            patient_id: Patient identifier
+            updates: Dictionary of fields to update
+        """
+        batch.update(
+            self.db.collection(self.collection).document(patient_id),
+            {**updates, "updated_at": firestore.SERVER_TIMESTAMP}
+        )
+    
+    def after_update(self, patient_id: str, updates: Dict[str, Any]):
+        """Drop cached data that depended on the updated fields"""
+        # Cached risk assessments were made against the old regimen
+        if "medications" in updates:
+            risk_cache_service.invalidate_patient(patient_id)
+        
+        # New logs must be bucketed in the new timezone
+        if "timezone" in updates:
+            rollup_service.forget_timezone(patient_id)
 
 
 # ============================================================================
 # Adherence Log Operations
 # ============================================================================
 
-class AdherenceService:
+def new_document_id() -> str:
+    """
+    Random document ID chosen before a write is queued
+    
+    Queued writes carry their document ID, so a retried commit overwrites
+    the same document instead of creating a duplicate.
+    """
+    return uuid.uuid4().hex
+
+
+def action_error(action: Any) -> Optional[str]:
+    """
+    Why an action cannot be logged (None if it is valid)
+    
+    Args:
+        action: Action dictionary (patient_id, action, medication_id,
+            optional timestamp and idempotency_key)
+        
+    Returns:
+        Error message or None
+    """
+    if not isinstance(action, dict):
+        return "Action must be an object"
+    for field in ("patient_id", "medication_id"):
+        if not action.get(field) or not isinstance(action[field], str):
+            return f"{field} is required"
+    if action.get("action") not in VALID_ACTIONS:
+        return f"action must be one of {', '.join(VALID_ACTIONS)}"
+    
+    timestamp = action.get("timestamp")
+    if timestamp is not None:
+        try:
+            datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+        except ValueError:
+            return f"Invalid timestamp: {timestamp}"
+    
+    key = action.get("idempotency_key")
+    if key is not None:
+        if not isinstance(key, str) or not IDEMPOTENCY_KEY_PATTERN.match(key) \
+                or key in (".", "..") or (key.startswith("__") and key.endswith("__")):
+            return "idempotency_key must be 1-128 letters, digits or _ . : -"
+    return None
+
+
+class AdherenceService(FirestoreService):
     """Service for medication adherence logging"""
     
     def __init__(self):
-        self.db = FirebaseClient().db
         self.collection = "adherence_logs"
+        # Runs the count() aggregations of one statistics request in parallel
+        self._count_executor = ThreadPoolExecutor(
+            max_workers=config.ADHERENCE_COUNT_WORKERS,
+            thread_name_prefix="adherence-count"
+        )
     
     def log_action(self, action_data: Dict[str, Any]) -> str:
         """
@@ -166,9 +378,39 @@ class AdherenceService:
                 action_data["timestamp"] = datetime.utcnow().isoformat()
             
             action_data["created_at"] = firestore.SERVER_TIMESTAMP
+            patient_id = action_data.get("patient_id")
+            medication_id = action_data.get("medication_id") or "unknown"
+            doc_ref = self.db.collection(self.collection).document()
+            
+            def write(transaction):
+                # Online anomaly detection decides how the action is handled;
+                # the decision is stored on the log as action_data["triage"].
+                # The detector state is read in the transaction, so concurrent
+                # logs for the same patient are applied one after the other.
+                detector_state = None
+                if config.TRIAGE_ENABLED:
+                    stored = triage_service.get_states([patient_id], transaction)[patient_id]
+                    detector_state, action_data["triage"] = triage_service.evaluate(
+                        action_data, stored.get(medication_id)
+                    )
+                stored_days = rollup_service.get_stored_days([patient_id], transaction) \
+                    if config.ROLLUPS_ENABLED else {}
+                routine = config.LEARNING_BATCH_ENABLED and action_data.get("action") == "took" \
+                    and action_data.get("reason") != "side_effects"
+                learning_pending = learning_job_service.get_pending([patient_id], transaction) if routine else set()
+                
+                # Log entry, rollup counters and detector state are committed together
+                transaction.set(doc_ref, action_data)
+                if config.ROLLUPS_ENABLED:
+                    rollup_service.add_logs_to_batch(transaction, patient_id, [action_data], stored_days[patient_id])
+                if detector_state is not None:
+                    triage_service.add_to_batch(transaction, action_data, detector_state, doc_ref.id)
+                if routine:
+                    # Routine dose - learning runs later in the batch worker
+                    learning_job_service.add_to_batch(transaction, action_data, patient_id in learning_pending)
             
-            doc_ref = self.db.collection(self.collection).add(action_data)
-            log_id = doc_ref[1].id
+            self.run_transaction(write)
+            log_id = doc_ref.id
             
             logger.info(f"Logged action for patient {action_data.get('patient_id')}: {action_data.get('action')}")
             
@@ -178,6 +420,178 @@ class AdherenceService:
             logger.error(f"Error logging action: {str(e)}")
             raise
     
+    def log_actions(self, actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Log many medication actions (e.g. an offline client's sync) in batched writes
+        
+        Each action is validated on its own. An action's idempotency_key,
+        when given, becomes its log document ID, so a sync that is retried
+        reports the already stored actions as duplicates instead of logging
+        them twice. Actions are written in patient and time order, in
+        batches of at most FIRESTORE_BATCH_LIMIT writes that also carry the
+        rollup, detector and learning updates (one write per patient per
+        batch); each batch is all-or-nothing.
+        
+        Args:
+            actions: Action dictionaries as accepted by log_action, each
+                with an optional idempotency_key
+            
+        Returns:
+            One result per action, in request order: {"index", "status"
+            ("created", "duplicate", "invalid" or "failed"), "log_id",
+            "triage" or "error"}
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(actions)
+        pending = []  # (index, log_id, action_data)
+        keys = set()
+        
+        for index, action in enumerate(actions):
+            error = action_error(action)
+            if error:
+                results[index] = {"index": index, "status": "invalid", "error": error}
+                continue
+            
+            action_data = {key: value for key, value in action.items() if key != "idempotency_key"}
+            key = action.get("idempotency_key")
+            if key in keys:
+                results[index] = {"index": index, "status": "duplicate", "log_id": key}
+                continue
+            if key:
+                keys.add(key)
+            
+            action_data.setdefault("timestamp", datetime.utcnow().isoformat())
+            action_data["created_at"] = firestore.SERVER_TIMESTAMP
+            log_id = key or self.db.collection(self.collection).document().id
+            pending.append((index, log_id, action_data))
+        
+        try:
+            # Only client-keyed logs can already exist
+            keyed = [item for item in pending if actions[item[0]].get("idempotency_key")]
+            pending = self._skip_stored(keyed, results) + [
+                item for item in pending if not actions[item[0]].get("idempotency_key")
+            ]
+            # Detector updates must see each patient's actions in time order
+            pending.sort(key=lambda item: (item[2]["patient_id"], str(item[2]["timestamp"])))
+            
+            for chunk in self._action_batches(pending):
+                self._commit_actions(chunk, results)
+            
+        except Exception as e:
+            logger.error(f"Error logging {len(actions)} actions: {str(e)}")
+            raise
+        
+        created = sum(1 for result in results if result["status"] == "created")
+        logger.info(f"Logged {created} of {len(actions)} actions in bulk")
+        return results
+    
+    def _skip_stored(self, pending: List[tuple], results: List[Optional[Dict[str, Any]]]) -> List[tuple]:
+        """Mark actions whose log document already exists as duplicates"""
+        stored = set()
+        for i in range(0, len(pending), FIRESTORE_BATCH_LIMIT):
+            refs = [
+                self.db.collection(self.collection).document(log_id)
+                for _, log_id, _ in pending[i:i + FIRESTORE_BATCH_LIMIT]
+            ]
+            stored.update(doc.id for doc in self.db.get_all(refs) if doc.exists)
+        
+        remaining = []
+        for index, log_id, action_data in pending:
+            if log_id in stored:
+                results[index] = {"index": index, "status": "duplicate", "log_id": log_id}
+            else:
+                remaining.append((index, log_id, action_data))
+        return remaining
+    
+    def _action_batches(self, pending: List[tuple]) -> List[List[tuple]]:
+        """
+        Split actions so no batch exceeds the Firestore write limit
+        
+        An action takes up to two writes (log and deferred review) and each
+        patient in a batch up to three more (rollup, detector, learning job).
+        """
+        batches, current, patients, writes = [], [], set(), 0
+        for item in pending:
+            patient_id = item[2]["patient_id"]
+            item_writes = 2 + (0 if patient_id in patients else 3)
+            if current and writes + item_writes > FIRESTORE_BATCH_LIMIT:
+                batches.append(current)
+                current, patients, writes = [], set(), 0
+                item_writes = 5
+            current.append(item)
+            patients.add(patient_id)
+            writes += item_writes
+        if current:
+            batches.append(current)
+        return batches
+    
+    def _commit_actions(self, chunk: List[tuple], results: List[Optional[Dict[str, Any]]], retry: bool = True):
+        """Write one batch of actions with their side updates and record the results"""
+        
+        def write(transaction):
+            patient_ids = list(dict.fromkeys(action_data["patient_id"] for _, _, action_data in chunk))
+            stored = triage_service.get_states(patient_ids, transaction) if config.TRIAGE_ENABLED else {}
+            stored_days = rollup_service.get_stored_days(patient_ids, transaction) if config.ROLLUPS_ENABLED else {}
+            routine_patients = list(dict.fromkeys(
+                action_data["patient_id"] for _, _, action_data in chunk
+                if action_data.get("action") == "took" and action_data.get("reason") != "side_effects"
+            ))
+            learning_pending = learning_job_service.get_pending(routine_patients, transaction) \
+                if config.LEARNING_BATCH_ENABLED and routine_patients else set()
+            states: Dict[Tuple[str, str], Dict[str, Any]] = {}
+            by_patient: Dict[str, List[Dict[str, Any]]] = {}
+            
+            for _, log_id, action_data in chunk:
+                patient_id = action_data["patient_id"]
+                medication_id = action_data.get("medication_id") or "unknown"
+                if config.TRIAGE_ENABLED:
+                    current = states.get((patient_id, medication_id)) or stored[patient_id].get(medication_id)
+                    state, action_data["triage"] = triage_service.evaluate(action_data, current)
+                    if state is not None:
+                        states[(patient_id, medication_id)] = state
+                        triage_service.add_review_to_batch(transaction, action_data, log_id)
+                
+                # create() rather than set(): a log stored meanwhile fails the batch
+                transaction.create(self.db.collection(self.collection).document(log_id), action_data)
+                by_patient.setdefault(patient_id, []).append(action_data)
+            
+            for patient_id, logs in by_patient.items():
+                if config.ROLLUPS_ENABLED:
+                    rollup_service.add_logs_to_batch(transaction, patient_id, logs, stored_days[patient_id])
+                patient_states = {key[1]: state for key, state in states.items() if key[0] == patient_id}
+                if patient_states:
+                    triage_service.add_states_to_batch(transaction, patient_id, patient_states)
+                routine = [
+                    log for log in logs
+                    if log.get("action") == "took" and log.get("reason") != "side_effects"
+                ]
+                if config.LEARNING_BATCH_ENABLED and routine:
+                    learning_job_service.add_to_batch(transaction, routine[-1], patient_id in learning_pending)
+        
+        try:
+            self.run_transaction(write)
+            
+        except Exception as e:
+            if retry:
+                # Another sync may have stored some of these logs - drop them and try once more
+                logger.warning(f"Bulk log batch of {len(chunk)} failed, retrying: {str(e)}")
+                remaining = self._skip_stored(chunk, results)
+                if remaining:
+                    self._commit_actions(remaining, results, retry=False)
+                return
+            
+            logger.error(f"Bulk log batch of {len(chunk)} failed: {str(e)}")
+            for index, log_id, _ in chunk:
+                results[index] = {"index": index, "status": "failed", "log_id": log_id, "error": str(e)}
+            return
+        
+        for index, log_id, action_data in chunk:
+            results[index] = {
+                "index": index,
+                "status": "created",
+                "log_id": log_id,
+                "triage": action_data.get("triage")
+            }
+    
     def get_patient_logs(
         self,
         patient_id: str,
@@ -224,71 +638,326 @@ class AdherenceService:
             logger.error(f"Error retrieving logs for patient {patient_id}: {str(e)}")
             raise
     
+    def stream_patient_logs(
+        self,
+        patient_id: str,
+        days: Optional[int] = None,
+        action_type: Optional[str] = None,
+        page_size: Optional[int] = None
+    ) -> Iterator[LogRow]:
+        """
+        Stream a patient's adherence logs as compact rows, newest first
+        
+        Only LOG_ROW_FIELDS are fetched (notes and inline images are never
+        transferred) and results are read one page at a time, so memory use
+        is bounded by the page size rather than the length of the history.
+        
+        Args:
+            patient_id: Patient identifier
+            days: Number of days to retrieve (None for the full history)
+            action_type: Filter by action type (took/skipped/snoozed)
+            page_size: Documents per round-trip (default LOG_PAGE_SIZE)
+            
+        Yields:
+            LogRow for each log entry
+        """
+        page_size = page_size or config.LOG_PAGE_SIZE
+        
+        query = self.db.collection(self.collection) \
+            .where(filter=firestore.FieldFilter("patient_id", "==", patient_id))
+        
+        if days is not None:
+            start_date = datetime.utcnow() - timedelta(days=days)
+            query = query.where(filter=firestore.FieldFilter("timestamp", ">=", start_date.isoformat()))
+        
+        if action_type:
+            query = query.where(filter=firestore.FieldFilter("action", "==", action_type))
+        
+        query = query.select(LOG_ROW_FIELDS) \
+            .order_by("timestamp", direction=firestore.Query.DESCENDING) \
+            .limit(page_size)
+        
+        count = 0
+        last_doc = None
+        
+        try:
+            while True:
+                page = query.start_after(last_doc) if last_doc else query
+                docs = list(page.stream())
+                
+                for doc in docs:
+                    data = doc.to_dict() or {}
+                    yield LogRow(doc.id, *(data.get(field) for field in LOG_ROW_FIELDS))
+                
+                count += len(docs)
+                if len(docs) < page_size:
+                    break
+                last_doc = docs[-1]
+            
+            logger.info(f"Streamed {count} logs for patient {patient_id}")
+            
+        except Exception as e:
+            logger.error(f"Error streaming logs for patient {patient_id}: {str(e)}")
+            raise
+    
+    def logs_for_patients(self, patient_ids: List[str], days: int) -> Dict[str, List[LogRow]]:
+        """
+        Recent logs of many patients, with one query per FIRESTORE_IN_LIMIT patients
+        
+        Args:
+            patient_ids: Patient identifiers
+            days: Number of days to retrieve
+            
+        Returns:
+            {patient_id: LogRow list, newest first} (every requested patient)
+        """
+        start_date = (datetime.utcnow() - timedelta(days=days)).isoformat()
+        logs: Dict[str, List[LogRow]] = {patient_id: [] for patient_id in patient_ids}
+        
+        try:
+            for i in range(0, len(patient_ids), FIRESTORE_IN_LIMIT):
+                docs = self.db.collection(self.collection) \
+                    .where(filter=firestore.FieldFilter("patient_id", "in", patient_ids[i:i + FIRESTORE_IN_LIMIT])) \
+                    .where(filter=firestore.FieldFilter("timestamp", ">=", start_date)) \
+                    .select(LOG_ROW_FIELDS + ["patient_id"]) \
+                    .order_by("timestamp", direction=firestore.Query.DESCENDING) \
+                    .stream()
+                
+                for doc in docs:
+                    data = doc.to_dict() or {}
+                    logs[data.get("patient_id")].append(
+                        LogRow(doc.id, *(data.get(field) for field in LOG_ROW_FIELDS))
+                    )
+            
+            logger.info(f"Retrieved {sum(len(rows) for rows in logs.values())} logs for {len(patient_ids)} patients")
+            return logs
+            
+        except Exception as e:
+            logger.error(f"Error retrieving logs for {len(patient_ids)} patients: {str(e)}")
+            raise
+    
+    def logs_created_since(
+        self,
+        created_at: Optional[datetime] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Logs in write order, starting at a created_at position
+        
+        Args:
+            created_at: Return logs created at or after this time (None: from the start)
+            limit: Maximum number of logs (default LOG_PAGE_SIZE)
+            
+        Returns:
+            Projected log dictionaries with log_id, patient_id and created_at
+        """
+        try:
+            query = self.db.collection(self.collection)
+            if created_at is not None:
+                query = query.where(filter=firestore.FieldFilter("created_at", ">=", created_at))
+            docs = query.select(LOG_ROW_FIELDS + ["patient_id", "created_at"]) \
+                .order_by("created_at") \
+                .limit(limit or config.LOG_PAGE_SIZE) \
+                .stream()
+            
+            logs = []
+            for doc in docs:
+                log_data = doc.to_dict()
+                log_data["log_id"] = doc.id
+                logs.append(log_data)
+            return logs
+            
+        except Exception as e:
+            logger.error(f"Error retrieving logs created since {created_at}: {str(e)}")
+            raise
+    
     def calculate_adherence_rate(
         self,
         patient_id: str,
-        days: int = 7
+        days: int = 7,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None
     ) -> Dict[str, Any]:
         """
         Calculate adherence statistics for a patient
         
+        The last `days` days are read from the patient's rollup document.
+        An explicit start_date..end_date range (the patient's local dates)
+        is summed from the rollup's daily buckets while it lies within
+        ROLLUP_RETENTION_DAYS. Anything the rollup cannot answer is counted
+        with server-side aggregation queries, so log documents are never
+        transferred.
+        
         Args:
             patient_id: Patient identifier
-            days: Number of days to analyze
+            days: Number of days to analyze (ignored when start_date is given)
+            start_date: First local date of an ad-hoc range
+            end_date: Last local date of the range (default today)
             
         Returns:
             Dictionary with adherence statistics
         """
         try:
-            logs = self.get_patient_logs(patient_id, days=days)
+            rollup = rollup_service.get_rollup(patient_id) if config.ROLLUPS_ENABLED else None
             
-            total_doses = len(logs)
-            took_doses = len([log for log in logs if log.get("action") == "took"])
-            skipped_doses = len([log for log in logs if log.get("action") == "skipped"])
+            if start_date is not None:
+                timezone = (rollup or {}).get("timezone") or rollup_service.timezone_for(patient_id)
+                today = rollups.local_today(timezone)
+                end_date = min(end_date or today, today)
+                if end_date < start_date:
+                    raise ValueError(f"end_date {end_date} is before start_date {start_date}")
+                days = (end_date - start_date).days + 1
+                
+                if rollup and start_date >= today - timedelta(days=config.ROLLUP_RETENTION_DAYS):
+                    counts = rollups.range_summary(rollup, start_date, end_date)
+                    source = "rollup"
+                else:
+                    counts = self.count_actions(
+                        patient_id, *rollups.local_day_bounds(start_date, end_date, timezone)
+                    )
+                    source = "aggregation"
+                
+                stats = rollups.adherence_stats(patient_id, days, counts)
+                stats["start_date"] = start_date.isoformat()
+                stats["end_date"] = end_date.isoformat()
             
-            adherence_rate = (took_doses / total_doses * 100) if total_doses > 0 else 0.0
+            elif rollup:
+                stats = rollups.adherence_stats(patient_id, days, rollups.window_summary(rollup, days))
+                source = "rollup"
+                stats["streak_days"] = rollups.streak_days(rollup)
+            else:
+                counts = self.count_actions(patient_id, datetime.utcnow() - timedelta(days=days))
+                stats = rollups.adherence_stats(patient_id, days, counts)
+                source = "aggregation"
             
-            return {
-                "patient_id": patient_id,
-                "period_days": days,
-                "total_doses": total_doses,
-                "took_doses": took_doses,
-                "skipped_doses": skipped_doses,
-                "adherence_rate": round(adherence_rate, 2),
-                "calculated_at": datetime.utcnow().isoformat()
-            }
+            stats["source"] = source
+            return stats
             
         except Exception as e:
             logger.error(f"Error calculating adherence for patient {patient_id}: {str(e)}")
             raise
+    
+    def count_actions(
+        self,
+        patient_id: str,
+        start: datetime,
+        end: Optional[datetime] = None
+    ) -> Dict[str, int]:
+        """
+        Count a patient's logs by action with server-side count() aggregations
+        
+        One aggregation per action plus the total run in parallel; Firestore
+        returns only the counts (billed one read per 1000 index entries
+        counted) instead of every log document.
+        
+        Args:
+            patient_id: Patient identifier
+            start: First UTC instant of the window
+            end: UTC instant the window ends before (default: open-ended)
+            
+        Returns:
+            Dictionary with total_doses, took_doses, skipped_doses, snoozed_doses
+        """
+        query = self.db.collection(self.collection) \
+            .where(filter=firestore.FieldFilter("patient_id", "==", patient_id)) \
+            .where(filter=firestore.FieldFilter("timestamp", ">=", start.isoformat()))
+        if end is not None:
+            query = query.where(filter=firestore.FieldFilter("timestamp", "<", end.isoformat()))
+        
+        queries = {None: query}
+        for action in VALID_ACTIONS:
+            queries[action] = query.where(filter=firestore.FieldFilter("action", "==", action))
+        
+        try:
+            futures = {
+                action: self._count_executor.submit(self._count, action_query)
+                for action, action_query in queries.items()
+            }
+            counts = {action: future.result() for action, future in futures.items()}
+            
+        except Exception as e:
+            logger.error(f"Error counting logs for patient {patient_id}: {str(e)}")
+            raise
+        
+        # Logs with any other action only count towards the total
+        actions = {action: counts[action] for action in VALID_ACTIONS}
+        actions["other"] = counts[None] - sum(actions.values())
+        return rollups.dose_counts(actions)
+    
+    @staticmethod
+    def _count(query) -> int:
+        """Run a count() aggregation"""
+        result = query.count(alias="count").get()
+        return int(result[0][0].value)
+    
+    def expected_dose_summary(
+        self,
+        patient_id: str,
+        days: int = 7
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Adherence against the medication schedule, including doses never logged
+        
+        Args:
+            patient_id: Patient identifier
+            days: Number of days to analyze
+            
+        Returns:
+            Expected-dose summary (see dose_calendar.DoseCalendar.summary),
+            or None if the patient has no scheduled medications
+        """
+        try:
+            patient = patient_service.get_patient(patient_id)
+            if not patient or not any(dose_calendar.daily_minutes(med) for med in patient.get("medications") or []):
+                return None
+            
+            # One extra day so doses logged early for the first slot are matched
+            rows = list(self.stream_patient_logs(patient_id, days=days + 1))
+            timezone = patient.get("timezone") or rollups.DEFAULT_TIMEZONE
+            
+            return dose_calendar.calendar_summary(patient, rows, timezone, days)
+            
+        except Exception as e:
+            logger.error(f"Error building dose calendar for patient {patient_id}: {str(e)}")
+            raise
 
 
 # ============================================================================
 # Intervention History Operations
 # ============================================================================
 
-class InterventionService:
+class InterventionService(FirestoreService):
     """Service for tracking agent interventions"""
     
     def __init__(self):
-        self.db = FirebaseClient().db
         self.collection = "interventions"
     
-    def log_intervention(self, intervention_data: Dict[str, Any]) -> str:
+    def log_intervention(
+        self,
+        intervention_data: Dict[str, Any],
+        patient_updates: Optional[Dict[str, Any]] = None
+    ) -> str:
         """
         Log an agent intervention
         
         Args:
             intervention_data: Intervention details
+            patient_updates: Patient fields changed by the intervention,
+                committed atomically with the intervention record
             
         Returns:
             Intervention ID
         """
         try:
-            intervention_data["created_at"] = firestore.SERVER_TIMESTAMP
+            self.backfill_counters([intervention_data])
             
-            doc_ref = self.db.collection(self.collection).add(intervention_data)
-            intervention_id = doc_ref[1].id
+            # Intervention record and patient changes succeed or fail together
+            batch = self.db.batch()
+            intervention_id = self.add_to_batch(batch, intervention_data, patient_updates)
+            batch.commit()
+            
+            if patient_updates:
+                patient_service.after_update(intervention_data.get("patient_id"), patient_updates)
             
             logger.info(f"Logged intervention for patient {intervention_data.get('patient_id')}")
             
@@ -298,23 +967,181 @@ class InterventionService:
             logger.error(f"Error logging intervention: {str(e)}")
             raise
     
-    def get_patient_interventions(
+    def add_to_batch(
         self,
-        patient_id: str,
-        limit: int = 10
-    ) -> List[Dict[str, Any]]:
+        batch,
+        intervention_data: Dict[str, Any],
+        patient_updates: Optional[Dict[str, Any]] = None,
+        intervention_id: Optional[str] = None
+    ) -> str:
         """
-        Get recent interventions for a patient
+        Add an intervention record (and its patient changes) to a write batch
+        
+        Call backfill_counters() on the records first and
+        patient_service.after_update() once the batch is committed.
         
         Args:
-            patient_id: Patient identifier
-            limit: Maximum number of interventions to return
+            batch: Firestore WriteBatch
+            intervention_data: Intervention details
+            patient_updates: Patient fields changed by the intervention
+            intervention_id: Document ID (see new_document_id(); default: a new one)
             
         Returns:
-            List of intervention records
+            ID of the intervention document
+        """
+        intervention_data["created_at"] = firestore.SERVER_TIMESTAMP
+        patient_id = intervention_data.get("patient_id")
+        
+        doc_ref = self.db.collection(self.collection).document(intervention_id)
+        batch.set(doc_ref, intervention_data)
+        if patient_updates:
+            patient_service.add_update_to_batch(batch, patient_id, patient_updates)
+        return doc_ref.id
+    
+    def backfill_counters(self, records: List[Dict[str, Any]]):
         """
+        Set the effectiveness counters of new intervention records in place
+        
+        The counters are anchored at each record's timestamp (when the
+        intervention was created, not when it is written) and backfilled
+        from the logs that already exist; the effectiveness worker adds
+        later ones. Each patient's logs are streamed once for all of its
+        records. Records that already have counters are left alone.
+        
+        Args:
+            records: Intervention records (with patient_id and timestamp)
+        """
+        if not config.EFFECTIVENESS_STORE_ENABLED:
+            return
+        
+        now = datetime.utcnow()
+        by_patient: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            if record.get("patient_id") and "effectiveness" not in record:
+                by_patient.setdefault(record["patient_id"], []).append(record)
+        
+        for patient_id, patient_records in by_patient.items():
+            try:
+                anchors = [self._created_at(record, now) for record in patient_records]
+                days = effectiveness.COUNTER_WINDOW_DAYS + (now - min(anchors)).days + 1
+                logs = effectiveness.SortedLogs(list(adherence_service.stream_patient_logs(patient_id, days=days)))
+                for record, anchor in zip(patient_records, anchors):
+                    record["effectiveness"] = effectiveness.initial_counters(logs, anchor, now)
+            except Exception as e:
+                # The interventions are still logged; LearningAgent scores them from the raw logs
+                logger.warning(f"Could not backfill effectiveness counters for patient {patient_id}: {str(e)}")
+    
+    @staticmethod
+    def _created_at(record: Dict[str, Any], default: datetime) -> datetime:
+        """Naive UTC creation time of an intervention record"""
         try:
-            docs = self.db.collection(self.collection) \
+            created_at = datetime.fromisoformat(record["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            return default
+        if created_at.tzinfo is not None:
+            created_at = created_at.replace(tzinfo=None) - created_at.utcoffset()
+        return min(created_at, default)
+    
+    def open_interventions(self) -> List[Dict[str, Any]]:
+        """
+        Interventions whose effectiveness counters are not sealed yet
+        
+        Returns:
+            Intervention records (with intervention_id)
+        """
+        try:
+            docs = self.db.collection(self.collection) \
+                .where(filter=firestore.FieldFilter("effectiveness.sealed", "==", False)) \
+                .stream()
+            
+            interventions = []
+            for doc in docs:
+                intervention_data = doc.to_dict()
+                intervention_data["intervention_id"] = doc.id
+                interventions.append(intervention_data)
+            return interventions
+            
+        except Exception as e:
+            logger.error(f"Error retrieving open interventions: {str(e)}")
+            raise
+    
+    def apply_effectiveness_updates(
+        self,
+        increments: Dict[str, Dict[str, int]],
+        sealed: Dict[str, Dict[str, Any]],
+        cursor: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Write counter increments, sealed counters and the worker cursor
+        
+        Everything goes into one batch when it fits; larger updates are
+        split across batches. Each increment also records the cursor as
+        effectiveness.last_log_cursor, so if a later batch fails and the
+        page is read again, the worker skips the logs an intervention has
+        already counted.
+        
+        Args:
+            increments: {intervention_id: {counter field: amount}}
+            sealed: {intervention_id: final counters} (replace the counters)
+            cursor: Worker position to store with the last batch
+        """
+        try:
+            writes = []
+            for intervention_id, counts in increments.items():
+                if intervention_id in sealed:
+                    continue  # the sealed counters already include the increments
+                update = {
+                    f"effectiveness.{field}": firestore.Increment(int(amount))
+                    for field, amount in counts.items() if amount
+                }
+                if update:
+                    if cursor is not None:
+                        update["effectiveness.last_log_cursor"] = last_log_cursor(cursor)
+                    writes.append((intervention_id, update))
+            for intervention_id, counters in sealed.items():
+                writes.append((intervention_id, {"effectiveness": counters}))
+            
+            if len(writes) >= FIRESTORE_BATCH_LIMIT:
+                logger.warning(f"Effectiveness update of {len(writes)} writes split across batches")
+            
+            for start in range(0, max(len(writes), 1), FIRESTORE_BATCH_LIMIT - 1):
+                batch = self.db.batch()
+                chunk = writes[start:start + FIRESTORE_BATCH_LIMIT - 1]
+                for intervention_id, update in chunk:
+                    batch.update(self.db.collection(self.collection).document(intervention_id), update)
+                if cursor is not None and start + FIRESTORE_BATCH_LIMIT - 1 >= len(writes):
+                    batch.set(
+                        self.db.collection(WORKER_STATE_COLLECTION).document(EFFECTIVENESS_CURSOR),
+                        cursor
+                    )
+                batch.commit()
+            
+        except Exception as e:
+            logger.error(f"Error applying effectiveness updates: {str(e)}")
+            raise
+    
+    def get_worker_cursor(self) -> Dict[str, Any]:
+        """Effectiveness worker position ({} before the first run)"""
+        doc = self.db.collection(WORKER_STATE_COLLECTION).document(EFFECTIVENESS_CURSOR).get()
+        return (doc.to_dict() if doc.exists else None) or {}
+    
+    def get_patient_interventions(
+        self,
+        patient_id: str,
+        limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """
+        Get recent interventions for a patient
+        
+        Args:
+            patient_id: Patient identifier
+            limit: Maximum number of interventions to return
+            
+        Returns:
+            List of intervention records
+        """
+        try:
+            docs = self.db.collection(self.collection) \
                 .where(filter=firestore.FieldFilter("patient_id", "==", patient_id)) \
                 .order_by("created_at", direction=firestore.Query.DESCENDING) \
                 .limit(limit) \
@@ -332,6 +1159,1191 @@ class InterventionService:
         except Exception as e:
             logger.error(f"Error retrieving interventions for patient {patient_id}: {str(e)}")
             raise
+    
+    def interventions_for_patients(
+        self,
+        patient_ids: List[str],
+        limit: int = 10
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Recent interventions of many patients, with one limited query per patient
+        
+        Each query stops at `limit` documents, so the reads do not grow with
+        the patients' intervention history.
+        
+        Args:
+            patient_ids: Patient identifiers
+            limit: Maximum number of interventions per patient
+            
+        Returns:
+            {patient_id: intervention records, newest first} (every requested patient)
+        """
+        interventions: Dict[str, List[Dict[str, Any]]] = {}
+        
+        try:
+            for patient_id in patient_ids:
+                docs = self.db.collection(self.collection) \
+                    .where(filter=firestore.FieldFilter("patient_id", "==", patient_id)) \
+                    .order_by("created_at", direction=firestore.Query.DESCENDING) \
+                    .limit(limit) \
+                    .stream()
+                
+                interventions[patient_id] = []
+                for doc in docs:
+                    intervention_data = doc.to_dict()
+                    intervention_data['intervention_id'] = doc.id
+                    interventions[patient_id].append(intervention_data)
+            
+            return interventions
+            
+        except Exception as e:
+            logger.error(f"Error retrieving interventions for {len(patient_ids)} patients: {str(e)}")
+            raise
+
+
+# ============================================================================
+# Patient Notifications
+# ============================================================================
+
+class NotificationService(FirestoreService):
+    """Patient notifications generated by the Execution agent"""
+    
+    def __init__(self):
+        self.collection = "patient_notifications"
+    
+    def add_to_batch(
+        self,
+        batch,
+        patient_id: str,
+        notification: Dict[str, Any],
+        notification_id: Optional[str] = None
+    ) -> str:
+        """
+        Add a notification for a patient to a write batch
+        
+        Args:
+            batch: Firestore WriteBatch
+            patient_id: Patient identifier
+            notification: Notification content (title, message, details, ...)
+            notification_id: Document ID (see new_document_id(); default: a new one)
+            
+        Returns:
+            ID of the notification document
+        """
+        doc_ref = self.db.collection(self.collection).document(notification_id)
+        batch.set(doc_ref, {
+            **notification,
+            "patient_id": patient_id,
+            "status": "pending",
+            "created_at": firestore.SERVER_TIMESTAMP
+        })
+        return doc_ref.id
+    
+    def create(self, patient_id: str, notification: Dict[str, Any]) -> str:
+        """
+        Store a notification for a patient
+        
+        Args:
+            patient_id: Patient identifier
+            notification: Notification content
+            
+        Returns:
+            Notification ID
+        """
+        try:
+            batch = self.db.batch()
+            notification_id = self.add_to_batch(batch, patient_id, notification)
+            batch.commit()
+            return notification_id
+            
+        except Exception as e:
+            logger.error(f"Error storing notification for patient {patient_id}: {str(e)}")
+            raise
+
+
+# ============================================================================
+# Risk Assessment Cache Operations
+# ============================================================================
+
+class RiskAssessmentCacheService(FirestoreService):
+    """
+    Persisted risk assessments keyed by plan fingerprint
+    
+    The fingerprint covers the patient's regimen, the plan interventions and
+    the relevant trigger fields, so identical plans on consecutive days reuse
+    one MedGemma-backed assessment within the validity window.
+    """
+    
+    def __init__(self):
+        self.collection = "risk_assessments"
+    
+    def _doc_id(self, patient_id: str, fingerprint: str) -> str:
+        return f"{patient_id}_{fingerprint}"
+    
+    def get_assessment(
+        self,
+        patient_id: str,
+        fingerprint: str,
+        regimen_hash: str,
+        max_age_hours: float
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get a cached assessment if it is still valid
+        
+        Args:
+            patient_id: Patient identifier
+            fingerprint: Assessment fingerprint
+            regimen_hash: Fingerprint of the patient's current medication list
+            max_age_hours: Validity window
+            
+        Returns:
+            Cached entry (with "assessment" and "cached_at") or None
+        """
+        try:
+            doc = self.db.collection(self.collection).document(self._doc_id(patient_id, fingerprint)).get()
+            
+            if not doc.exists:
+                return None
+            
+            entry = doc.to_dict()
+            cutoff = (datetime.utcnow() - timedelta(hours=max_age_hours)).isoformat()
+            
+            if entry.get("regimen_hash") != regimen_hash or entry.get("cached_at", "") < cutoff:
+                logger.info(f"Cached risk assessment expired for patient {patient_id}")
+                return None
+            
+            logger.info(f"Risk assessment cache hit for patient {patient_id}")
+            return entry
+            
+        except Exception as e:
+            logger.error(f"Error reading cached risk assessment for {patient_id}: {str(e)}")
+            raise
+    
+    def store_assessment(
+        self,
+        patient_id: str,
+        fingerprint: str,
+        regimen_hash: str,
+        assessment: Dict[str, Any]
+    ) -> str:
+        """
+        Cache a completed risk assessment
+        
+        Returns:
+            Cache document ID
+        """
+        try:
+            doc_id = self._doc_id(patient_id, fingerprint)
+            self.db.collection(self.collection).document(doc_id).set({
+                "patient_id": patient_id,
+                "fingerprint": fingerprint,
+                "regimen_hash": regimen_hash,
+                "assessment": assessment,
+                "cached_at": datetime.utcnow().isoformat(),
+                "created_at": firestore.SERVER_TIMESTAMP
+            })
+            
+            logger.info(f"Cached risk assessment for patient {patient_id}")
+            return doc_id
+            
+        except Exception as e:
+            logger.error(f"Error caching risk assessment for {patient_id}: {str(e)}")
+            raise
+    
+    def invalidate_patient(self, patient_id: str) -> int:
+        """
+        Drop all cached assessments for a patient (e.g. after a regimen change)
+        
+        Returns:
+            Number of cache entries removed
+        """
+        try:
+            docs = self.db.collection(self.collection) \
+                .where(filter=firestore.FieldFilter("patient_id", "==", patient_id)) \
+                .stream()
+            
+            batch = self.db.batch()
+            count = 0
+            for doc in docs:
+                batch.delete(doc.reference)
+                count += 1
+                if count % 500 == 0:  # Firestore batch limit
+                    batch.commit()
+                    batch = self.db.batch()
+            
+            if count % 500:
+                batch.commit()
+            
+            logger.info(f"Invalidated {count} cached risk assessments for patient {patient_id}")
+            return count
+            
+        except Exception as e:
+            logger.error(f"Error invalidating risk cache for {patient_id}: {str(e)}")
+            raise
+
+
+# ============================================================================
+# Adherence Rollup Operations
+# ============================================================================
+
+class AdherenceRollupService(FirestoreService):
+    """
+    Per-patient adherence rollup documents
+    
+    AdherenceService.log_action adds each log's counter increments to the
+    same write batch as the log itself, so a rollup never sees a log that
+    was not stored (or misses one that was). The same transaction reads
+    the dates of the stored daily buckets, so every bucket outside the
+    retention window is deleted. rebuild() backfills a rollup from the raw
+    logs and check() reports drift between the two.
+    
+    Readers only get rollups marked complete - backfilled by rebuild() or
+    created empty with a new patient. Increments for a patient who was
+    never backfilled create an incomplete document that is ignored (the
+    count()/log paths are used) until rebuild() replaces it.
+    """
+    
+    def __init__(self):
+        self.collection = "adherence_rollups"
+        self._timezones: Dict[str, str] = {}
+    
+    def timezone_for(self, patient_id: str) -> str:
+        """
+        Patient's timezone, cached per process
+        
+        Args:
+            patient_id: Patient identifier
+            
+        Returns:
+            IANA timezone name (PatientProfile default if unknown)
+        """
+        if patient_id not in self._timezones:
+            try:
+                patient = patient_service.get_patient(patient_id) or {}
+            except Exception as e:
+                logger.warning(f"Could not load timezone for patient {patient_id}: {str(e)}")
+                patient = {}
+            self._timezones[patient_id] = patient.get("timezone") or rollups.DEFAULT_TIMEZONE
+        return self._timezones[patient_id]
+    
+    def forget_timezone(self, patient_id: str):
+        """Drop the cached timezone (rebuild the rollup to re-bucket old logs)"""
+        self._timezones.pop(patient_id, None)
+    
+    def get_stored_days(self, patient_ids: List[str], transaction=None) -> Dict[str, List[str]]:
+        """
+        Dates of the daily buckets stored in several patients' rollups
+        
+        Args:
+            patient_ids: Patient identifiers
+            transaction: Transaction to read in (the one writing the logs)
+            
+        Returns:
+            {patient_id: [YYYY-MM-DD, ...]} ([] for patients without a rollup)
+        """
+        refs = [self.db.collection(self.collection).document(patient_id) for patient_id in patient_ids]
+        days: Dict[str, List[str]] = {patient_id: [] for patient_id in patient_ids}
+        for doc in self.db.get_all(refs, field_paths=["daily"], transaction=transaction):
+            if doc.exists:
+                days[doc.id] = list((doc.to_dict() or {}).get("daily", {}))
+        return days
+    
+    def add_logs_to_batch(
+        self,
+        batch,
+        patient_id: str,
+        logs: List[Dict[str, Any]],
+        stored_days: Iterable[str] = ()
+    ):
+        """
+        Add the combined rollup increments of several logs of one patient
+        
+        Args:
+            batch: Firestore WriteBatch that also writes the logs
+            patient_id: Patient identifier
+            logs: Adherence logs being written
+            stored_days: Dates of the rollup's daily buckets (get_stored_days());
+                those older than the retention window are deleted
+        """
+        timezone = self.timezone_for(patient_id)
+        
+        counts: Dict[str, Any] = {}
+        for log in logs:
+            rollups.merge_counts(counts, rollups.log_counts(log, timezone))
+        update = self._increments(counts)
+        update["patient_id"] = patient_id
+        update["timezone"] = timezone
+        update["updated_at"] = firestore.SERVER_TIMESTAMP
+        
+        # Prune every daily bucket outside the retention window, including
+        # days nobody logged on and late logs for days already pruned
+        cutoff = (rollups.local_today(timezone) - timedelta(days=config.ROLLUP_RETENTION_DAYS)).isoformat()
+        for day in set(stored_days) | set(update.get("daily", {})):
+            if day < cutoff:
+                update.setdefault("daily", {})[day] = firestore.DELETE_FIELD
+        
+        batch.set(self.db.collection(self.collection).document(patient_id), update, merge=True)
+    
+    def add_empty_to_batch(self, batch, patient_id: str, timezone: Optional[str] = None):
+        """
+        Add a complete, empty rollup for a patient who has no logs yet
+        
+        Args:
+            batch: Firestore WriteBatch or transaction creating the patient
+            patient_id: Patient identifier
+            timezone: Patient's IANA timezone (PatientProfile default if None)
+        """
+        rollup = rollups.build_rollup(
+            patient_id, [], timezone or rollups.DEFAULT_TIMEZONE, config.ROLLUP_RETENTION_DAYS
+        )
+        rollup["updated_at"] = firestore.SERVER_TIMESTAMP
+        batch.set(self.db.collection(self.collection).document(patient_id), rollup)
+    
+    def _increments(self, counts: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn nested counts into Firestore Increment transforms"""
+        return {
+            key: self._increments(value) if isinstance(value, dict) else firestore.Increment(value)
+            for key, value in counts.items()
+        }
+    
+    def get_rollup(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a patient's rollup document
+        
+        Args:
+            patient_id: Patient identifier
+            
+        Returns:
+            Rollup dictionary or None if the patient has no complete rollup
+            (none yet, or only the increments of logs since it was created)
+        """
+        try:
+            rollup = self._get_stored(patient_id)
+            return rollup if rollup and rollup.get("complete") else None
+            
+        except Exception as e:
+            logger.error(f"Error retrieving rollup for patient {patient_id}: {str(e)}")
+            raise
+    
+    def get_rollups(self, patient_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Complete rollup documents of several patients in one round-trip ({patient_id: rollup})"""
+        try:
+            refs = [self.db.collection(self.collection).document(patient_id) for patient_id in patient_ids]
+            return {
+                doc.id: doc.to_dict() for doc in self.db.get_all(refs)
+                if doc.exists and (doc.to_dict() or {}).get("complete")
+            }
+            
+        except Exception as e:
+            logger.error(f"Error retrieving rollups for {len(patient_ids)} patients: {str(e)}")
+            raise
+    
+    def _get_stored(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        """The stored rollup document, complete or not"""
+        doc = self.db.collection(self.collection).document(patient_id).get()
+        return doc.to_dict() if doc.exists else None
+    
+    def _build_from_logs(self, patient_id: str) -> Dict[str, Any]:
+        """Rebuild a rollup in memory from all of the patient's logs"""
+        return rollups.build_rollup(
+            patient_id,
+            adherence_service.stream_patient_logs(patient_id),
+            self.timezone_for(patient_id),
+            config.ROLLUP_RETENTION_DAYS
+        )
+    
+    def rebuild(self, patient_id: str) -> Dict[str, Any]:
+        """
+        Backfill or rebuild a patient's rollup from the raw logs
+        
+        Logs written while the rebuild runs may be counted twice or not at
+        all - run it when the patient is not actively logging.
+        
+        Args:
+            patient_id: Patient identifier
+            
+        Returns:
+            The rebuilt rollup
+        """
+        try:
+            rollup = self._build_from_logs(patient_id)
+            rollup["updated_at"] = firestore.SERVER_TIMESTAMP
+            rollup["rebuilt_at"] = datetime.utcnow().isoformat()
+            
+            self.db.collection(self.collection).document(patient_id).set(rollup)
+            
+            logger.info(f"Rebuilt adherence rollup for patient {patient_id} ({rollup['total']} logs)")
+            return rollup
+            
+        except Exception as e:
+            logger.error(f"Error rebuilding rollup for patient {patient_id}: {str(e)}")
+            raise
+    
+    def check(self, patient_id: str) -> List[str]:
+        """
+        Compare a patient's stored rollup against the raw logs
+        
+        Args:
+            patient_id: Patient identifier
+            
+        Returns:
+            List of mismatches (empty if consistent)
+        """
+        try:
+            stored = self._get_stored(patient_id) or {}
+            expected = self._build_from_logs(patient_id)
+            mismatches = rollups.diff_rollups(stored, expected, config.ROLLUP_RETENTION_DAYS)
+            
+            if mismatches:
+                logger.warning(f"Rollup for patient {patient_id} has {len(mismatches)} mismatches")
+            return mismatches
+            
+        except Exception as e:
+            logger.error(f"Error checking rollup for patient {patient_id}: {str(e)}")
+            raise
+
+
+# ============================================================================
+# Action Triage (Online Anomaly Detection)
+# ============================================================================
+
+class AdherenceTriageService(FirestoreService):
+    """
+    Per patient/medication anomaly detectors and the deferred review queue
+    
+    AdherenceService.log_action reads the patient's detector document and
+    calls evaluate() inside the transaction that writes the log: the
+    EWMA/CUSUM state for that medication is updated and triage() decides
+    whether the action runs the full workflow, is simply acknowledged, or
+    is queued for the batch review. The new state (and the review entry,
+    if deferred) is committed with the log, and a concurrent log for the
+    same patient from another process retries the transaction on top of
+    it, so every detector sees every action.
+    """
+    
+    def __init__(self):
+        self.collection = "adherence_detectors"
+        self.review_collection = "deferred_reviews"
+    
+    def get_states(self, patient_ids: List[str], transaction=None) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Stored detector states of several patients in one round-trip
+        
+        Args:
+            patient_ids: Patient identifiers
+            transaction: Transaction to read in (the one writing the logs)
+            
+        Returns:
+            {patient_id: {medication_id: state}} ({} for patients without one)
+        """
+        refs = [self.db.collection(self.collection).document(patient_id) for patient_id in patient_ids]
+        states: Dict[str, Dict[str, Dict[str, Any]]] = {patient_id: {} for patient_id in patient_ids}
+        for doc in self.db.get_all(refs, transaction=transaction):
+            if doc.exists:
+                states[doc.id] = (doc.to_dict() or {}).get("medications", {})
+        return states
+    
+    def evaluate(
+        self,
+        action_data: Dict[str, Any],
+        current: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Update the detector with a new action and triage it
+        
+        Args:
+            action_data: Adherence log about to be written
+            current: Detector state to start from (read with get_states();
+                None for a new detector)
+            
+        Returns:
+            (new detector state or None if the detector is unavailable,
+            {"decision", "reason", "signals"})
+        """
+        patient_id = action_data.get("patient_id")
+        medication_id = action_data.get("medication_id") or "unknown"
+        action = action_data.get("action")
+        
+        try:
+            current = dict(current or anomaly.new_state())
+            
+            minute = anomaly.local_minute(action_data.get("timestamp"), rollup_service.timezone_for(patient_id))
+            state, signals = anomaly.update(current, action, minute)
+            decision, reason = anomaly.triage(action, action_data.get("reason"), signals)
+            
+        except Exception as e:
+            # Fail open: without a detector every action keeps the old routing
+            logger.warning(f"Triage unavailable for patient {patient_id}: {str(e)}")
+            return None, {"decision": anomaly.WORKFLOW, "reason": "Detector unavailable", "signals": {}}
+        
+        logger.info(f"Triage for {patient_id}/{medication_id} {action}: {decision} ({reason})")
+        return state, {"decision": decision, "reason": reason, "signals": signals}
+    
+    def add_to_batch(self, batch, action_data: Dict[str, Any], state: Dict[str, Any], log_id: str):
+        """
+        Add the detector update (and a deferred review entry) to a write batch
+        
+        Args:
+            batch: Firestore WriteBatch that also writes the log
+            action_data: Adherence log being written (with "triage")
+            state: Detector state returned by evaluate()
+            log_id: ID of the log document
+        """
+        medication_id = action_data.get("medication_id") or "unknown"
+        self.add_states_to_batch(batch, action_data["patient_id"], {medication_id: state})
+        self.add_review_to_batch(batch, action_data, log_id)
+    
+    def add_states_to_batch(self, batch, patient_id: str, states: Dict[str, Dict[str, Any]]):
+        """Add detector states ({medication_id: state}) of one patient to a write batch"""
+        batch.set(
+            self.db.collection(self.collection).document(patient_id),
+            {
+                "patient_id": patient_id,
+                "medications": states,
+                "updated_at": firestore.SERVER_TIMESTAMP
+            },
+            merge=True
+        )
+    
+    def add_review_to_batch(self, batch, action_data: Dict[str, Any], log_id: str):
+        """Add a deferred review entry to a write batch if the action was deferred"""
+        patient_id = action_data["patient_id"]
+        medication_id = action_data.get("medication_id") or "unknown"
+        triage = action_data.get("triage", {})
+        
+        if triage.get("decision") == anomaly.DEFER:
+            batch.set(self.db.collection(self.review_collection).document(), {
+                "patient_id": patient_id,
+                "medication_id": medication_id,
+                "log_id": log_id,
+                "action": action_data.get("action"),
+                "reason": action_data.get("reason"),
+                "timestamp": action_data.get("timestamp"),
+                "triage_reason": triage.get("reason"),
+                "signals": triage.get("signals", {}),
+                "status": "pending",
+                "created_at": datetime.utcnow().isoformat()
+            })
+    
+    def pending_reviews(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Oldest pending deferred reviews
+        
+        Args:
+            limit: Maximum number of reviews (default DEFERRED_REVIEW_BATCH_SIZE)
+            
+        Returns:
+            Review entries with review_id
+        """
+        try:
+            docs = self.db.collection(self.review_collection) \
+                .where(filter=firestore.FieldFilter("status", "==", "pending")) \
+                .order_by("created_at") \
+                .limit(limit or config.DEFERRED_REVIEW_BATCH_SIZE) \
+                .stream()
+            
+            reviews = []
+            for doc in docs:
+                review = doc.to_dict()
+                review["review_id"] = doc.id
+                reviews.append(review)
+            return reviews
+            
+        except Exception as e:
+            logger.error(f"Error retrieving deferred reviews: {str(e)}")
+            raise
+    
+    def mark_reviewed(self, review_ids: List[str], workflow_id: Optional[str] = None):
+        """
+        Close deferred reviews after their batch workflow ran
+        
+        Args:
+            review_ids: Reviews covered by the workflow
+            workflow_id: Workflow that reviewed them
+        """
+        try:
+            batch = self.db.batch()
+            for review_id in review_ids:
+                batch.update(self.db.collection(self.review_collection).document(review_id), {
+                    "status": "reviewed",
+                    "workflow_id": workflow_id,
+                    "reviewed_at": datetime.utcnow().isoformat()
+                })
+            batch.commit()
+            
+        except Exception as e:
+            logger.error(f"Error closing deferred reviews: {str(e)}")
+            raise
+
+
+# ============================================================================
+# Population Statistics
+# ============================================================================
+
+class PopulationStatsService(FirestoreService):
+    """
+    Population-wide intervention effectiveness table
+    
+    rebuild() aggregates every sealed intervention score (in parallel
+    processes) and stores the table as one document; table() serves it from
+    memory, reloading it at most every POPULATION_TABLE_TTL_SECONDS.
+    """
+    
+    def __init__(self):
+        self.collection = "population_stats"
+        self.document = "intervention_effectiveness"
+        self._table = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+    
+    def _cohorts(self) -> Dict[str, Any]:
+        """Cohort features of every patient"""
+        docs = self.db.collection(patient_service.collection).select(["age", "medications"]).stream()
+        return {doc.id: population.cohort(doc.to_dict()) for doc in docs}
+    
+    def rebuild(self, workers: Optional[int] = None) -> "population.EffectivenessTable":
+        """
+        Rebuild and store the table from all sealed interventions
+        
+        Args:
+            workers: Aggregation processes (default POPULATION_WORKERS)
+            
+        Returns:
+            The new EffectivenessTable
+        """
+        try:
+            cohorts = self._cohorts()
+            docs = self.db.collection(intervention_service.collection) \
+                .where(filter=firestore.FieldFilter("effectiveness.sealed", "==", True)) \
+                .select(["patient_id", "root_cause", "interventions", "effectiveness"]) \
+                .stream()
+            
+            rows = [row for row in (population.intervention_row(doc.to_dict(), cohorts) for doc in docs) if row]
+            table = population.build_table(rows, workers or config.POPULATION_WORKERS)
+            table.built_at = datetime.utcnow().isoformat()
+            
+            self.db.collection(self.collection).document(self.document).set({
+                "entries": table.to_records(),
+                "interventions": len(rows),
+                "built_at": table.built_at
+            })
+            
+            with self._lock:
+                self._table, self._loaded_at = table, time.monotonic()
+            
+            logger.info(f"Rebuilt population effectiveness table from {len(rows)} interventions ({len(table)} cells)")
+            return table
+            
+        except Exception as e:
+            logger.error(f"Error rebuilding population effectiveness table: {str(e)}")
+            raise
+    
+    def table(self) -> "population.EffectivenessTable":
+        """
+        Current table from memory (empty if it was never built or cannot be read)
+        
+        Returns:
+            EffectivenessTable
+        """
+        with self._lock:
+            if self._table is not None and time.monotonic() - self._loaded_at < config.POPULATION_TABLE_TTL_SECONDS:
+                return self._table
+            
+            try:
+                doc = self.db.collection(self.collection).document(self.document).get()
+                data = doc.to_dict() if doc.exists else None
+                self._table = population.EffectivenessTable.from_records(
+                    (data or {}).get("entries", []), (data or {}).get("built_at")
+                )
+            except Exception as e:
+                logger.warning(f"Population effectiveness table unavailable: {str(e)}")
+                self._table = self._table or population.EffectivenessTable()
+            
+            self._loaded_at = time.monotonic()
+            return self._table
+
+
+# ============================================================================
+# Deferred Learning
+# ============================================================================
+
+class LearningJobService(FirestoreService):
+    """
+    Per-patient learning job queue and the learning output it produces
+    
+    Routine "took" actions do not run LearningAgent inline; they mark the
+    patient's job document (ID = patient_id) as pending, so any number of
+    events between two passes collapse into one job. backend.learning_worker
+    processes the pending jobs in bulk and stores each patient's latest
+    learning output in the insights collection.
+    
+    requested_at is set when a job becomes pending and kept by later
+    events (they only update last_action and the event count), so a
+    patient who keeps logging does not move to the back of the queue.
+    """
+    
+    def __init__(self):
+        self.collection = "learning_jobs"
+        self.insights_collection = "learning_insights"
+    
+    def _job(self, action_data: Dict[str, Any], pending: bool) -> Dict[str, Any]:
+        job = {
+            "patient_id": action_data["patient_id"],
+            "status": "pending",
+            "last_action": {
+                "action": action_data.get("action"),
+                "reason": action_data.get("reason"),
+                "medication_id": action_data.get("medication_id"),
+                "timestamp": action_data.get("timestamp")
+            },
+            "events": firestore.Increment(1)
+        }
+        if not pending:
+            job["requested_at"] = datetime.utcnow().isoformat()
+        return job
+    
+    def get_pending(self, patient_ids: List[str], transaction=None) -> Set[str]:
+        """
+        Patients whose learning job is already pending
+        
+        Args:
+            patient_ids: Patient identifiers
+            transaction: Transaction to read in (the one adding the requests)
+            
+        Returns:
+            Set of patient IDs with a pending job
+        """
+        refs = [self.db.collection(self.collection).document(patient_id) for patient_id in patient_ids]
+        return {
+            doc.id for doc in self.db.get_all(refs, field_paths=["status"], transaction=transaction)
+            if doc.exists and (doc.to_dict() or {}).get("status") == "pending"
+        }
+    
+    def enqueue(self, action_data: Dict[str, Any]):
+        """
+        Request a learning pass for the action's patient
+        
+        Args:
+            action_data: Patient action (with patient_id)
+        """
+        patient_id = action_data["patient_id"]
+        
+        def write(transaction):
+            pending = patient_id in self.get_pending([patient_id], transaction)
+            self.add_to_batch(transaction, action_data, pending)
+        
+        try:
+            self.run_transaction(write)
+            
+        except Exception as e:
+            logger.error(f"Error enqueuing learning job for patient {patient_id}: {str(e)}")
+            raise
+    
+    def add_to_batch(self, batch, action_data: Dict[str, Any], pending: bool = False):
+        """
+        Add the learning request to a write batch (e.g. the one writing the log)
+        
+        Args:
+            batch: Firestore WriteBatch or transaction
+            action_data: Patient action (with patient_id)
+            pending: Whether the patient's job is already pending (get_pending())
+        """
+        batch.set(
+            self.db.collection(self.collection).document(action_data["patient_id"]),
+            self._job(action_data, pending),
+            merge=True
+        )
+    
+    def pending_jobs(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Oldest pending learning jobs
+        
+        Args:
+            limit: Maximum number of jobs (default LEARNING_BATCH_SIZE)
+            
+        Returns:
+            Job documents with update_time (used to close them safely)
+        """
+        try:
+            docs = self.db.collection(self.collection) \
+                .where(filter=firestore.FieldFilter("status", "==", "pending")) \
+                .order_by("requested_at") \
+                .limit(limit or config.LEARNING_BATCH_SIZE) \
+                .stream()
+            
+            jobs = []
+            for doc in docs:
+                job = doc.to_dict()
+                job["update_time"] = doc.update_time
+                jobs.append(job)
+            return jobs
+            
+        except Exception as e:
+            logger.error(f"Error retrieving learning jobs: {str(e)}")
+            raise
+    
+    def complete(self, jobs: List[Dict[str, Any]], results: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Store learning output and close the jobs it answers
+        
+        A job that received another event while it was being processed
+        (its document changed since pending_jobs read it) stays pending
+        and is picked up again by the next pass.
+        
+        Args:
+            jobs: Jobs from pending_jobs()
+            results: {patient_id: LearningAgent output}
+            
+        Returns:
+            Number of jobs closed
+        """
+        now = datetime.utcnow().isoformat()
+        
+        try:
+            items = list(results.items())
+            for i in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+                batch = self.db.batch()
+                for patient_id, result in items[i:i + FIRESTORE_BATCH_LIMIT]:
+                    batch.set(self.db.collection(self.insights_collection).document(patient_id), {
+                        "patient_id": patient_id,
+                        "learning": result,
+                        "updated_at": now
+                    })
+                batch.commit()
+            
+        except Exception as e:
+            logger.error(f"Error storing learning output: {str(e)}")
+            raise
+        
+        closed = 0
+        for job in jobs:
+            if job["patient_id"] not in results:
+                continue
+            try:
+                self.db.collection(self.collection).document(job["patient_id"]).update(
+                    {"status": "done", "processed_at": now, "events": 0},
+                    option=self.db.write_option(last_update_time=job["update_time"])
+                )
+                closed += 1
+            except Exception as e:
+                logger.info(f"Learning job for patient {job['patient_id']} stays pending: {str(e)}")
+        return closed
+    
+    def get_insights(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Latest batch learning output for a patient
+        
+        Args:
+            patient_id: Patient identifier
+            
+        Returns:
+            {"patient_id", "learning", "updated_at"} or None before the first pass
+        """
+        try:
+            doc = self.db.collection(self.insights_collection).document(patient_id).get()
+            return doc.to_dict() if doc.exists else None
+            
+        except Exception as e:
+            logger.error(f"Error retrieving learning insights for patient {patient_id}: {str(e)}")
+            raise
+
+
+# ============================================================================
+# Scheduled Jobs
+# ============================================================================
+
+class SchedulerService(FirestoreService):
+    """
+    Durable store of scheduled jobs (follow-ups, re-investigations, ...)
+    
+    Pending jobs are read in due_at order through the (status, due_at)
+    index, so fetching the next due jobs costs O(log n) per job however
+    many are pending. A worker claims a job by moving its due_at forward
+    by the lease, guarded by an update-time precondition: only one worker
+    can win, and if it dies the job simply becomes due again when the
+    lease runs out.
+    """
+    
+    def __init__(self):
+        self.collection = "scheduled_jobs"
+    
+    def new_job(
+        self,
+        kind: str,
+        patient_id: str,
+        due_at: datetime,
+        payload: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Job document (one per kind, patient and due day, so re-scheduling is idempotent)
+        
+        Args:
+            kind: Job kind (see backend.scheduler)
+            patient_id: Patient identifier
+            due_at: When the job should run (naive UTC)
+            payload: Kind-specific data
+            
+        Returns:
+            Job dictionary including job_id
+        """
+        return {
+            "job_id": f"{kind}_{patient_id}_{due_at.strftime('%Y%m%d')}",
+            "kind": kind,
+            "patient_id": patient_id,
+            "payload": payload or {},
+            "status": "pending",
+            "due_at": due_at.isoformat(),
+            "attempts": 0,
+            "created_at": datetime.utcnow().isoformat()
+        }
+    
+    def add_to_batch(self, batch, job: Dict[str, Any]):
+        """Add a job from new_job() to a write batch"""
+        batch.set(self.db.collection(self.collection).document(job["job_id"]), job)
+    
+    def schedule(self, jobs: List[Dict[str, Any]]):
+        """
+        Store jobs from new_job()
+        
+        Args:
+            jobs: Jobs to store (an existing job with the same ID is replaced)
+        """
+        try:
+            for i in range(0, len(jobs), FIRESTORE_BATCH_LIMIT):
+                batch = self.db.batch()
+                for job in jobs[i:i + FIRESTORE_BATCH_LIMIT]:
+                    self.add_to_batch(batch, job)
+                batch.commit()
+            
+        except Exception as e:
+            logger.error(f"Error scheduling {len(jobs)} jobs: {str(e)}")
+            raise
+    
+    def due_jobs(self, until: datetime, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Pending jobs due by `until`, earliest first
+        
+        Args:
+            until: Latest due time to return (naive UTC)
+            limit: Maximum number of jobs (default SCHEDULER_BATCH_SIZE)
+            
+        Returns:
+            Job dictionaries with update_time (needed to claim them)
+        """
+        try:
+            docs = self.db.collection(self.collection) \
+                .where(filter=firestore.FieldFilter("status", "==", "pending")) \
+                .where(filter=firestore.FieldFilter("due_at", "<=", until.isoformat())) \
+                .order_by("due_at") \
+                .limit(limit or config.SCHEDULER_BATCH_SIZE) \
+                .stream()
+            
+            jobs = []
+            for doc in docs:
+                job = doc.to_dict()
+                job["update_time"] = doc.update_time
+                jobs.append(job)
+            return jobs
+            
+        except Exception as e:
+            logger.error(f"Error retrieving due jobs: {str(e)}")
+            raise
+    
+    def claim(self, job: Dict[str, Any], worker_id: str, now: Optional[datetime] = None) -> bool:
+        """
+        Lease a job to this worker
+        
+        Args:
+            job: Job from due_jobs()
+            worker_id: Claiming worker
+            now: Current UTC time (naive)
+            
+        Returns:
+            True if this worker owns the job for SCHEDULER_LEASE_SECONDS
+        """
+        now = now or datetime.utcnow()
+        try:
+            self.db.collection(self.collection).document(job["job_id"]).update(
+                {
+                    "due_at": (now + timedelta(seconds=config.SCHEDULER_LEASE_SECONDS)).isoformat(),
+                    "lease_owner": worker_id,
+                    "attempts": job.get("attempts", 0) + 1
+                },
+                option=self.db.write_option(last_update_time=job["update_time"])
+            )
+            return True
+        except Exception as e:
+            logger.info(f"Job {job['job_id']} not claimed: {str(e)}")
+            return False
+    
+    def complete(self, job_id: str, result: Optional[Dict[str, Any]] = None):
+        """Mark a claimed job as done"""
+        try:
+            self.db.collection(self.collection).document(job_id).update({
+                "status": "done",
+                "result": result or {},
+                "completed_at": datetime.utcnow().isoformat()
+            })
+            
+        except Exception as e:
+            logger.error(f"Error completing job {job_id}: {str(e)}")
+            raise
+    
+    def retry(self, job_id: str, error: str, retry_at: Optional[datetime]):
+        """
+        Release a failed job
+        
+        Args:
+            job_id: Job identifier
+            error: Failure description
+            retry_at: When to try again (None to give up - status "dead")
+        """
+        updates = {"last_error": error[:500], "lease_owner": None}
+        if retry_at is None:
+            updates["status"] = "dead"
+        else:
+            updates["due_at"] = retry_at.isoformat()
+        
+        try:
+            self.db.collection(self.collection).document(job_id).update(updates)
+            
+        except Exception as e:
+            logger.error(f"Error releasing job {job_id}: {str(e)}")
+            raise
+
+
+# ============================================================================
+# Refill Forecast Operations
+# ============================================================================
+
+class RefillService(FirestoreService):
+    """
+    Medication supply ledgers and refill orders
+    
+    One ledger document per patient holds {medication_id: entry} (see
+    analytics.refill_forecast); the nightly refill worker advances the
+    ledgers from the logs written since its cursor.
+    """
+    
+    def __init__(self):
+        self.collection = "refill_supply"
+        self.orders_collection = "refill_orders"
+    
+    def get_ledgers(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Every patient's supply ledger
+        
+        Returns:
+            {patient_id: {medication_id: entry}}
+        """
+        try:
+            return {
+                doc.id: (doc.to_dict() or {}).get("medications", {})
+                for doc in self.db.collection(self.collection).stream()
+            }
+            
+        except Exception as e:
+            logger.error(f"Error retrieving supply ledgers: {str(e)}")
+            raise
+    
+    def get_ledger(self, patient_id: str) -> Dict[str, Dict[str, Any]]:
+        """Supply ledger of one patient ({} if none yet)"""
+        doc = self.db.collection(self.collection).document(patient_id).get()
+        return (doc.to_dict() or {}).get("medications", {}) if doc.exists else {}
+    
+    def get_worker_cursor(self) -> Dict[str, Any]:
+        """Refill worker position ({} before the first run)"""
+        doc = self.db.collection(WORKER_STATE_COLLECTION).document(REFILL_CURSOR).get()
+        return (doc.to_dict() if doc.exists else None) or {}
+    
+    def _add_alert_to_batch(self, batch, alert: Dict[str, Any], now: datetime) -> int:
+        """Add a refill order (auto-refill) and the patient notification; returns writes"""
+        writes = 0
+        if alert["auto_refill"]:
+            order_id = f"{alert['patient_id']}_{alert['medication_id']}_{now.strftime('%Y%m%d')}"
+            batch.set(self.db.collection(self.orders_collection).document(order_id), {
+                **alert,
+                "status": "requested",
+                "created_at": firestore.SERVER_TIMESTAMP
+            })
+            writes += 1
+            title = f"Refill requested for {alert['name'] or 'your medication'}"
+        else:
+            title = f"Time to refill {alert['name'] or 'your medication'}"
+        
+        notification_service.add_to_batch(batch, alert["patient_id"], {
+            "type": "refill_alert",
+            "title": title,
+            "message": f"About {alert['days_remaining']:g} days of supply left (runs out {alert['run_out_date']}).",
+            "medication_id": alert["medication_id"],
+            "action_required": not alert["auto_refill"]
+        })
+        return writes + 1
+    
+    def apply(
+        self,
+        ledgers: Dict[str, Dict[str, Dict[str, Any]]],
+        alerts: List[Dict[str, Any]],
+        cursor: Optional[Dict[str, Any]] = None,
+        now: Optional[datetime] = None
+    ) -> int:
+        """
+        Write ledger changes, refill orders/alerts and the worker cursor
+        
+        A patient's ledger and alerts always share a batch (so an alert is
+        never recorded without its ledger being marked alerted); batches
+        are filled up to FIRESTORE_BATCH_LIMIT writes and the cursor goes
+        into the last one. Every written entry also records the cursor as
+        last_log_cursor, so if a later batch fails and the logs are read
+        again, the worker skips the ones that entry has already counted.
+        
+        Args:
+            ledgers: {patient_id: {medication_id: entry}} to merge
+            alerts: Alerts from SupplyForecast.alerts()
+            cursor: Worker position to store with the last batch
+            now: Current UTC time (naive)
+            
+        Returns:
+            Number of batches committed
+        """
+        now = now or datetime.utcnow()
+        alerts_by_patient: Dict[str, List[Dict[str, Any]]] = {}
+        for alert in alerts:
+            alerts_by_patient.setdefault(alert["patient_id"], []).append(alert)
+        
+        try:
+            batch, writes, commits = self.db.batch(), 0, 0
+            for patient_id, entries in ledgers.items():
+                patient_alerts = alerts_by_patient.get(patient_id, [])
+                if writes and writes + 1 + 2 * len(patient_alerts) >= FIRESTORE_BATCH_LIMIT:
+                    batch.commit()
+                    batch, writes, commits = self.db.batch(), 0, commits + 1
+                
+                if cursor is not None:
+                    entries = {
+                        medication_id: {**entry, "last_log_cursor": last_log_cursor(cursor)}
+                        for medication_id, entry in entries.items()
+                    }
+                batch.set(
+                    self.db.collection(self.collection).document(patient_id),
+                    {"medications": entries, "updated_at": firestore.SERVER_TIMESTAMP},
+                    merge=True
+                )
+                writes += 1
+                for alert in patient_alerts:
+                    writes += self._add_alert_to_batch(batch, alert, now)
+            
+            if cursor is not None:
+                batch.set(self.db.collection(WORKER_STATE_COLLECTION).document(REFILL_CURSOR), cursor)
+                writes += 1
+            if writes:
+                batch.commit()
+                commits += 1
+            return commits
+            
+        except Exception as e:
+            logger.error(f"Error applying refill forecast: {str(e)}")
+            raise
 
 
 # ============================================================================
@@ -342,6 +2354,14 @@ class InterventionService:
 patient_service = PatientService()
 adherence_service = AdherenceService()
 intervention_service = InterventionService()
+notification_service = NotificationService()
+risk_cache_service = RiskAssessmentCacheService()
+rollup_service = AdherenceRollupService()
+triage_service = AdherenceTriageService()
+population_service = PopulationStatsService()
+learning_job_service = LearningJobService()
+scheduler_service = SchedulerService()
+refill_service = RefillService()
 
 
 def get_patient(patient_id: str) -> Optional[Dict[str, Any]]:
@@ -0,0 +1,534 @@
+"""
+Content-Addressed Medical Image Store
+Keeps side-effect photos out of workflow payloads and Firestore documents.
+
+Images are stored once, keyed by the SHA-256 of their bytes, and workflows
+pass the resulting image ID around instead of the base64 blob. The bytes are
+only loaded again when the vision assessment actually needs them.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, BinaryIO, Dict, List, Optional
+from backend.config import config
+
+logger = logging.getLogger(__name__)
+
+
+# Magic numbers used to recover the MIME type of a stored image
+_IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"RIFF", "image/webp"),
+]
+
+
+def sniff_content_type(data: bytes) -> str:
+    """Guess the MIME type of image bytes from their leading signature"""
+    for signature, content_type in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    return "application/octet-stream"
+
+
+def is_image_id(value: Any) -> bool:
+    """Check whether a value looks like an image ID (hex SHA-256 digest)"""
+    if not isinstance(value, str) or len(value) != 64:
+        return False
+    try:
+        int(value, 16)
+        return True
+    except ValueError:
+        return False
+
+
+# ============================================================================
+# Storage Backends
+# ============================================================================
+
+class ImageBackend(ABC):
+    """Blob storage used by the image store"""
+
+    # Where streamed uploads are spooled before being committed
+    staging_dir: str = tempfile.gettempdir()
+
+    @abstractmethod
+    def exists(self, image_id: str) -> bool:
+        """Check if an image is already stored"""
+        pass
+
+    @abstractmethod
+    def read(self, image_id: str) -> bytes:
+        """Read the bytes of a stored image"""
+        pass
+
+    @abstractmethod
+    def write(self, image_id: str, data: bytes):
+        """Store image bytes under the given ID"""
+        pass
+
+    def write_file(self, image_id: str, path: str):
+        """
+        Store a complete local file under the given ID
+
+        Backends that can move or upload files directly should override this
+        to avoid reading the whole file into memory.
+        """
+        with open(path, "rb") as f:
+            self.write(image_id, f.read())
+        os.remove(path)
+
+
+class LocalImageBackend(ImageBackend):
+    """Stores images on the local filesystem, sharded by digest prefix"""
+
+    def __init__(self, root: str):
+        self.root = root
+        # Staging lives under the root so commits are a same-filesystem rename
+        self.staging_dir = os.path.join(self.root, ".staging")
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def _path(self, image_id: str) -> str:
+        return os.path.join(self.root, image_id[:2], image_id[2:4], image_id)
+
+    def exists(self, image_id: str) -> bool:
+        return os.path.exists(self._path(image_id))
+
+    def read(self, image_id: str) -> bytes:
+        with open(self._path(image_id), "rb") as f:
+            return f.read()
+
+    def write(self, image_id: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.staging_dir, prefix="upload-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        self.write_file(image_id, tmp_path)
+
+    def write_file(self, image_id: str, path: str):
+        target = self._path(image_id)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Atomic rename - concurrent writers of the same content are harmless
+        os.replace(path, target)
+
+
+class GCSImageBackend(ImageBackend):
+    """Stores images in a Google Cloud Storage (or GCS-compatible) bucket"""
+
+    def __init__(self, bucket_name: str, prefix: str = ""):
+        from google.cloud import storage
+
+        self.client = storage.Client(project=config.GCP_PROJECT_ID or None)
+        self.bucket = self.client.bucket(bucket_name)
+        self.prefix = prefix
+
+    def _blob(self, image_id: str):
+        return self.bucket.blob(f"{self.prefix}{image_id}")
+
+    def exists(self, image_id: str) -> bool:
+        return self._blob(image_id).exists()
+
+    def read(self, image_id: str) -> bytes:
+        return self._blob(image_id).download_as_bytes()
+
+    def write(self, image_id: str, data: bytes):
+        self._blob(image_id).upload_from_string(data, content_type=sniff_content_type(data))
+
+    def write_file(self, image_id: str, path: str):
+        with open(path, "rb") as f:
+            content_type = sniff_content_type(f.read(16))
+        try:
+            self._blob(image_id).upload_from_filename(path, content_type=content_type)
+        finally:
+            os.remove(path)
+
+
+# ============================================================================
+# Image Store
+# ============================================================================
+
+class ImageStore:
+    """
+    Content-addressed image store
+
+    Image IDs are the hex SHA-256 digest of the image bytes, so storing the
+    same photo twice is a no-op and IDs can be verified by re-hashing.
+    """
+
+    def __init__(self, backend: ImageBackend):
+        self.backend = backend
+        # Resumable upload sessions open in this process: upload_id -> {path, hasher, size, lock}
+        self._uploads: Dict[str, Dict[str, Any]] = {}
+        self._uploads_lock = threading.Lock()
+
+    def put_bytes(self, data: bytes) -> str:
+        """
+        Store raw image bytes
+
+        Args:
+            data: Image bytes
+
+        Returns:
+            Image ID
+        """
+        image_id = hashlib.sha256(data).hexdigest()
+
+        if not self.backend.exists(image_id):
+            self.backend.write(image_id, data)
+            logger.info(f"Stored image {image_id[:12]} ({len(data)} bytes)")
+
+        return image_id
+
+    def put_base64(self, encoded: str) -> str:
+        """
+        Store a base64 image, with or without a data URI prefix
+
+        Args:
+            encoded: Base64 string, e.g. "data:image/jpeg;base64,/9j/..."
+
+        Returns:
+            Image ID
+        """
+        if encoded.startswith("data:") and "," in encoded:
+            encoded = encoded.split(",", 1)[1]
+
+        try:
+            data = base64.b64decode(encoded, validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise ValueError(f"Invalid base64 image data: {str(e)}")
+
+        return self.put_bytes(data)
+
+    def put_stream(
+        self,
+        stream: BinaryIO,
+        max_bytes: Optional[int] = None,
+        chunk_size: Optional[int] = None
+    ) -> str:
+        """
+        Store an image read from a stream with bounded memory
+
+        Bytes are spooled to a staging file and hashed as they arrive, so
+        memory use is one chunk regardless of the image size.
+
+        Args:
+            stream: File-like object (e.g. the request body or a multipart part)
+            max_bytes: Reject streams larger than this
+            chunk_size: Read size in bytes
+
+        Returns:
+            Image ID
+        """
+        max_bytes = max_bytes or config.IMAGE_UPLOAD_MAX_BYTES
+        chunk_size = chunk_size or config.IMAGE_UPLOAD_CHUNK_BYTES
+        hasher = hashlib.sha256()
+        size = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.backend.staging_dir, prefix="upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ValueError(f"Image exceeds maximum size of {max_bytes} bytes")
+                    hasher.update(chunk)
+                    f.write(chunk)
+
+            if size == 0:
+                raise ValueError("Empty image upload")
+
+            return self._commit_staged(hasher.hexdigest(), tmp_path, size)
+
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _commit_staged(self, image_id: str, tmp_path: str, size: int) -> str:
+        """Move a fully hashed staging file into the backend"""
+        if self.backend.exists(image_id):
+            os.remove(tmp_path)
+        else:
+            self.backend.write_file(image_id, tmp_path)
+            logger.info(f"Stored streamed image {image_id[:12]} ({size} bytes)")
+        return image_id
+
+    # ------------------------------------------------------------------------
+    # Resumable chunked uploads
+    # ------------------------------------------------------------------------
+
+    def begin_upload(self) -> str:
+        """
+        Start a resumable upload session
+
+        Each chunk is sent as its own short request, so a slow mobile
+        connection never holds a worker thread for the whole upload.
+
+        Returns:
+            Upload session ID
+        """
+        self.expire_uploads()
+
+        upload_id = uuid.uuid4().hex
+        path = self._session_path(upload_id)
+        open(path, "wb").close()
+        self._save_session(upload_id, 0)
+
+        with self._uploads_lock:
+            self._uploads[upload_id] = {
+                "path": path,
+                "hasher": hashlib.sha256(),
+                "size": 0,
+                "lock": threading.Lock()
+            }
+
+        logger.info(f"Started image upload session {upload_id}")
+        return upload_id
+
+    def append_chunk(self, upload_id: str, stream: BinaryIO, offset: int) -> int:
+        """
+        Append one chunk to an upload session
+
+        Args:
+            upload_id: Session ID from begin_upload()
+            stream: Chunk body
+            offset: Byte offset the client believes the chunk starts at
+
+        Returns:
+            Total bytes received so far
+
+        Raises:
+            KeyError: Unknown or expired session
+            ValueError: Offset mismatch or size limit exceeded
+        """
+        session = self._get_upload(upload_id)
+
+        with session["lock"]:
+            session = self._sync_upload(upload_id, session)
+            if offset != session["size"]:
+                raise ValueError(f"Offset mismatch: expected {session['size']}, got {offset}")
+
+            # Hash into a copy so a failed or interrupted chunk can be rolled back
+            hasher = session["hasher"].copy()
+            size = session["size"]
+
+            with open(session["path"], "ab") as f:
+                # Drop bytes a crashed append wrote after the last recorded size
+                f.truncate(session["size"])
+                try:
+                    while True:
+                        chunk = stream.read(config.IMAGE_UPLOAD_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        if size > config.IMAGE_UPLOAD_MAX_BYTES:
+                            raise ValueError(
+                                f"Image exceeds maximum size of {config.IMAGE_UPLOAD_MAX_BYTES} bytes"
+                            )
+                        hasher.update(chunk)
+                        f.write(chunk)
+                except Exception:
+                    f.truncate(session["size"])
+                    raise
+
+            self._save_session(upload_id, size)
+            session["hasher"] = hasher
+            session["size"] = size
+            return size
+
+    def complete_upload(self, upload_id: str) -> str:
+        """
+        Finish an upload session and commit the image
+
+        Returns:
+            Image ID
+        """
+        session = self._get_upload(upload_id)
+
+        with session["lock"]:
+            session = self._sync_upload(upload_id, session)
+            with self._uploads_lock:
+                self._uploads.pop(upload_id, None)
+            os.remove(self._session_path(upload_id) + ".json")
+
+            with open(session["path"], "ab") as f:
+                f.truncate(session["size"])
+            if session["size"] == 0:
+                os.remove(session["path"])
+                raise ValueError("Empty image upload")
+
+            return self._commit_staged(session["hasher"].hexdigest(), session["path"], session["size"])
+
+    def upload_status(self, upload_id: str) -> Dict[str, Any]:
+        """Get the number of bytes received for an upload session (for resuming)"""
+        return {"upload_id": upload_id, "received_bytes": self._load_session(upload_id)["size"]}
+
+    def expire_uploads(self, max_age_seconds: Optional[int] = None):
+        """Drop upload sessions, from any process, that have been idle longer than the session TTL"""
+        max_age_seconds = max_age_seconds or config.IMAGE_UPLOAD_SESSION_TTL
+        cutoff = time.time() - max_age_seconds
+
+        expired = []
+        for name in os.listdir(self.backend.staging_dir):
+            if not (name.startswith("session-") and name.endswith(".json")):
+                continue
+            upload_id = name[len("session-"):-len(".json")]
+            try:
+                if self._load_session(upload_id)["updated_at"] >= cutoff:
+                    continue
+            except KeyError:
+                continue
+            expired.append(upload_id)
+            for path in (self._session_path(upload_id), self._session_path(upload_id) + ".json"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        with self._uploads_lock:
+            for upload_id in expired:
+                self._uploads.pop(upload_id, None)
+
+        if expired:
+            logger.info(f"Expired {len(expired)} idle image upload sessions")
+
+    # Session metadata lives next to the chunk file, so any process (or the
+    # same one after a restart) can resume an upload
+
+    def _session_path(self, upload_id: str) -> str:
+        if len(upload_id) != 32 or any(c not in "0123456789abcdef" for c in upload_id):
+            raise KeyError(f"Upload session not found: {upload_id}")
+        return os.path.join(self.backend.staging_dir, f"session-{upload_id}")
+
+    def _save_session(self, upload_id: str, size: int):
+        """Record the received size (written atomically, after the chunk)"""
+        path = self._session_path(upload_id) + ".json"
+        with open(path + ".tmp", "w") as f:
+            json.dump({"size": size, "updated_at": time.time()}, f)
+        os.replace(path + ".tmp", path)
+
+    def _load_session(self, upload_id: str) -> Dict[str, Any]:
+        try:
+            with open(self._session_path(upload_id) + ".json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise KeyError(f"Upload session not found: {upload_id}")
+
+    def _get_upload(self, upload_id: str) -> Dict[str, Any]:
+        """The session's in-process state, created on first use in this process"""
+        self._load_session(upload_id)
+        with self._uploads_lock:
+            return self._uploads.setdefault(upload_id, {
+                "path": self._session_path(upload_id),
+                "hasher": None,
+                "size": None,
+                "lock": threading.Lock()
+            })
+
+    def _sync_upload(self, upload_id: str, session: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Bring the session up to date with its metadata (called with its lock held)
+
+        If another process appended chunks, or this one restarted, the
+        hash is rebuilt by re-reading the received bytes.
+        """
+        size = self._load_session(upload_id)["size"]
+        if session["size"] != size:
+            hasher = hashlib.sha256()
+            with open(session["path"], "rb") as f:
+                remaining = size
+                while remaining:
+                    chunk = f.read(min(config.IMAGE_UPLOAD_CHUNK_BYTES, remaining))
+                    if not chunk:
+                        raise KeyError(f"Upload session data missing: {upload_id}")
+                    hasher.update(chunk)
+                    remaining -= len(chunk)
+            session["hasher"] = hasher
+            session["size"] = size
+        return session
+
+    def get_bytes(self, image_id: str) -> bytes:
+        """Load the bytes of a stored image"""
+        if not is_image_id(image_id):
+            raise ValueError(f"Invalid image ID: {image_id}")
+        return self.backend.read(image_id)
+
+    def get_base64(self, image_id: str) -> str:
+        """Load a stored image as a base64 data URI (the format MedGemma Vision accepts)"""
+        data = self.get_bytes(image_id)
+        encoded = base64.b64encode(data).decode("ascii")
+        return f"data:{sniff_content_type(data)};base64,{encoded}"
+
+    def exists(self, image_id: str) -> bool:
+        """Check if an image ID refers to a stored image"""
+        return is_image_id(image_id) and self.backend.exists(image_id)
+
+    def externalize_images(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Replace inline base64 images in a patient action with image IDs
+
+        "image" becomes "image_id" and "previous_images" becomes
+        "previous_image_ids". Payloads without inline images are returned
+        unchanged.
+
+        Args:
+            payload: Patient action / workflow trigger data
+
+        Returns:
+            Payload safe to copy into workflows and Firestore
+        """
+        if not payload or ("image" not in payload and "previous_images" not in payload):
+            return payload
+
+        payload = dict(payload)
+
+        image = payload.pop("image", None)
+        if image:
+            payload["image_id"] = self.put_base64(image)
+
+        previous_images: List[str] = payload.pop("previous_images", None) or []
+        if not isinstance(previous_images, list):
+            raise ValueError("previous_images must be a list of base64 images")
+        if previous_images:
+            payload["previous_image_ids"] = [self.put_base64(img) for img in previous_images]
+
+        return payload
+
+    def referenced_ids(self, payload: Dict[str, Any]) -> List[str]:
+        """
+        Image IDs a patient action refers to ("image_id" and "previous_image_ids")
+
+        Raises:
+            ValueError: If image_id is not a string or previous_image_ids
+                is not a list of strings
+        """
+        image_id = payload.get("image_id")
+        previous_ids = payload.get("previous_image_ids") or []
+        if image_id is not None and not isinstance(image_id, str):
+            raise ValueError("image_id must be a string")
+        if not isinstance(previous_ids, list) or not all(isinstance(i, str) for i in previous_ids):
+            raise ValueError("previous_image_ids must be a list of image IDs")
+        return ([image_id] if image_id else []) + previous_ids
+
+
+def create_image_store() -> ImageStore:
+    """Create the image store configured by IMAGE_STORE_BACKEND"""
+    if config.IMAGE_STORE_BACKEND == "gcs":
+        backend = GCSImageBackend(config.IMAGE_STORE_BUCKET, config.IMAGE_STORE_PREFIX)
+    else:
+        backend = LocalImageBackend(config.IMAGE_STORE_PATH)
+    return ImageStore(backend)
+
+
+# Global image store instance
+image_store = create_image_store()
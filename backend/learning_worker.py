@@ -0,0 +1,153 @@
+"""
+Batch Learning Worker
+Runs LearningAgent for the patients whose routine "took" actions queued a learning job
+
+Usage:
+    python -m backend.learning_worker            # run continuously
+    python -m backend.learning_worker --once     # one pass (e.g. from cron)
+
+Routine doses only mark the patient's learning job as pending (see
+LearningJobService), so however many doses a patient logs between two
+passes, they are learned from once. Each pass takes a page of pending jobs
+and loads profiles, logs and rollups for all of their patients with bulk
+queries (interventions with one limited query per patient) before running
+the agent on each patient's preloaded data context. The output is stored
+per patient in the learning insights collection
+(GET /api/learning-insights/<patient_id>).
+"""
+import argparse
+import logging
+import sys
+import time
+from typing import Any, Dict, List, Optional
+from backend.agents.data_context import WorkflowDataContext
+from backend.agents.learning_agent import LearningAgent
+from backend.config import config
+from backend.firebase_client import (
+    adherence_service,
+    intervention_service,
+    learning_job_service,
+    patient_service,
+    rollup_service
+)
+
+logger = logging.getLogger(__name__)
+
+# Interventions loaded per patient (LearningAgent reads the latest 5)
+INTERVENTIONS_PER_PATIENT = 5
+
+
+def load_sources(patient_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Learning inputs of many patients, from one set of bulk queries
+
+    Args:
+        patient_ids: Patients to load
+
+    Returns:
+        {patient_id: {"patient", "logs", "interventions", "rollup"}} for
+        WorkflowDataContext.preload
+    """
+    patients = patient_service.get_patients(patient_ids)
+    logs = adherence_service.logs_for_patients(patient_ids, days=LearningAgent.data_window_days)
+    interventions = intervention_service.interventions_for_patients(patient_ids, limit=INTERVENTIONS_PER_PATIENT)
+    rollups = rollup_service.get_rollups(patient_ids) if config.ROLLUPS_ENABLED else {}
+
+    return {
+        patient_id: {
+            "patient": patients.get(patient_id),
+            "logs": logs[patient_id],
+            "interventions": interventions[patient_id],
+            "rollup": rollups.get(patient_id)
+        }
+        for patient_id in patient_ids
+    }
+
+
+def learn(
+    jobs: List[Dict[str, Any]],
+    sources: Dict[str, Dict[str, Any]],
+    agent: Optional[LearningAgent] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Run LearningAgent for each job on its patient's preloaded data
+
+    Args:
+        jobs: Learning jobs (patient_id, last_action)
+        sources: Output of load_sources() for the jobs' patients
+        agent: Agent to run (a new LearningAgent by default)
+
+    Returns:
+        {patient_id: learning output} for the patients that succeeded
+    """
+    agent = agent or LearningAgent()
+
+    results = {}
+    for job in jobs:
+        patient_id = job["patient_id"]
+        context = WorkflowDataContext(
+            patient_id,
+            log_window_days=LearningAgent.data_window_days,
+            intervention_limit=INTERVENTIONS_PER_PATIENT
+        )
+        context.preload(**sources[patient_id])
+
+        try:
+            results[patient_id] = agent.process({
+                "patient_id": patient_id,
+                "current_action": job.get("last_action") or {},
+                "data_context": context
+            })
+        except Exception as e:
+            logger.error(f"Batch learning failed for patient {patient_id}: {str(e)}")
+
+    return results
+
+
+def run_once(limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Process one page of pending learning jobs
+
+    Args:
+        limit: Jobs per pass (default LEARNING_BATCH_SIZE)
+
+    Returns:
+        {"jobs": taken, "learned": patients, "closed": jobs, "more": bool}
+    """
+    limit = limit or config.LEARNING_BATCH_SIZE
+
+    jobs = learning_job_service.pending_jobs(limit)
+    if not jobs:
+        return {"jobs": 0, "learned": 0, "closed": 0, "more": False}
+
+    sources = load_sources([job["patient_id"] for job in jobs])
+    results = learn(jobs, sources)
+    closed = learning_job_service.complete(jobs, results)
+
+    logger.info(f"Learning pass: {len(jobs)} jobs, {len(results)} patients learned, {closed} closed")
+
+    # Jobs that failed or were re-requested stay pending - only keep going
+    # while the pass made progress
+    return {"jobs": len(jobs), "learned": len(results), "closed": closed, "more": len(jobs) == limit and closed > 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process queued learning jobs")
+    parser.add_argument("--once", action="store_true", help="Drain the queue once and exit")
+    parser.add_argument("--interval", type=float, default=config.LEARNING_WORKER_INTERVAL,
+                        help="Seconds between passes when running continuously")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    while True:
+        result = run_once()
+        while result["more"]:
+            result = run_once()
+        if args.once:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,7 @@
 Data Models for Firestore Collections
 Defines the structure of data stored in Firebase
 """
-from typing import List, Optional, Dict, Any
+from typing import List, NamedTuple, Optional, Dict, Any
 from datetime import datetime
 from pydantic import BaseModel, Field
 
@@ -18,7 +18,8 @@ class Medication(BaseModel):
     dosage: str
     frequency: str  # e.g., "BID", "TID", "QD"
     scheduled_times: List[str]  # e.g., ["08:00", "20:00"]
-    refill_days_remaining: Optional[int] = None
+    refill_days_remaining: Optional[int] = None  # days of supply at the last fill
+    last_refill_at: Optional[str] = None
     instructions: Optional[str] = None
 
 
@@ -53,6 +54,28 @@ class AdherenceLog(BaseModel):
     created_at: Optional[str] = None
 
 
+class LogRow(NamedTuple):
+    """
+    Compact, read-only adherence log row for analytics
+    
+    Holds only the projected fields (see LOG_ROW_FIELDS). get() mirrors
+    dict.get so code written against log dictionaries accepts rows too.
+    """
+    log_id: str
+    action: Optional[str] = None
+    reason: Optional[str] = None
+    timestamp: Optional[str] = None
+    medication_id: Optional[str] = None
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None) if key in self._fields else None
+        return default if value is None else value
+
+
+# Fields fetched for LogRow (Firestore select() projection)
+LOG_ROW_FIELDS = ["action", "reason", "timestamp", "medication_id"]
+
+
 # ============================================================================
 # Intervention Models
 # ============================================================================
@@ -82,6 +105,18 @@ class Collections:
     INTERVENTIONS = "interventions"
     WORKFLOWS = "workflows"
     AGENT_LOGS = "agent_logs"
+    RISK_ASSESSMENTS = "risk_assessments"
+    ADHERENCE_ROLLUPS = "adherence_rollups"
+    ADHERENCE_DETECTORS = "adherence_detectors"
+    DEFERRED_REVIEWS = "deferred_reviews"
+    WORKER_STATE = "worker_state"
+    POPULATION_STATS = "population_stats"
+    LEARNING_JOBS = "learning_jobs"
+    LEARNING_INSIGHTS = "learning_insights"
+    PATIENT_NOTIFICATIONS = "patient_notifications"
+    SCHEDULED_JOBS = "scheduled_jobs"
+    REFILL_SUPPLY = "refill_supply"
+    REFILL_ORDERS = "refill_orders"
 
 
 # ============================================================================
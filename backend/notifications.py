@@ -0,0 +1,487 @@
+"""
+Notification Pipeline
+Per-patient digesting and batched delivery of patient notifications
+
+Notifications submitted by the agents are buffered per patient for
+NOTIFICATION_DIGEST_WINDOW_SECONDS after the first one arrives; when the
+window closes, everything buffered for the patient is merged into one
+digest. A background flusher sends the digests that are ready in batches
+of NOTIFICATION_BATCH_SIZE through a transport that keeps its connection
+open between batches. Failed digests are retried up to
+NOTIFICATION_MAX_ATTEMPTS times; notifications arriving while more than
+NOTIFICATION_MAX_PENDING are buffered are dropped. stats() reports the send
+rate, batch sizes and drop counts.
+
+Buffered notifications are also written to a SQLite file
+(NOTIFICATION_BUFFER_PATH) until their digest is delivered or given up
+on, so a crash or restart inside the digest window does not lose them.
+Several processes may share the file: each one holds a lease on the rows
+it buffered and renews it on every flush, and a pipeline adopts the rows
+whose lease has run out (their process stopped or died), so every
+notification is sent by one process. The pipeline flushes what it still
+buffers when the interpreter exits and releases what it could not send.
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Dict, List, Optional
+from backend.config import config
+from backend.firebase_client import FirebaseClient, notification_service
+
+logger = logging.getLogger(__name__)
+
+# Send rate is averaged over this many seconds
+RATE_WINDOW_SECONDS = 60
+
+# Seconds a pipeline owns the buffered rows it does not renew
+BUFFER_LEASE_SECONDS = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buffered (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL,
+    notification TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS buffered_lease ON buffered (lease_until);
+CREATE INDEX IF NOT EXISTS buffered_owner ON buffered (owner);
+"""
+
+
+def merge_digest(notifications: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge a patient's buffered notifications into one
+
+    Args:
+        notifications: Notifications in arrival order
+
+    Returns:
+        The notification itself if there is only one, otherwise a digest
+        with the distinct messages and details and the originals as items
+    """
+    if len(notifications) == 1:
+        return notifications[0]
+
+    def distinct(values):
+        return list(dict.fromkeys(value for value in values if value))
+
+    titles = distinct(n.get("title") for n in notifications)
+    outcomes = distinct(n.get("expected_outcome") for n in notifications)
+    return {
+        "type": "digest",
+        "title": titles[0] if len(titles) == 1 else f"{len(notifications)} updates for you",
+        "message": " ".join(distinct(n.get("message") for n in notifications)),
+        "details": distinct(detail for n in notifications for detail in n.get("details") or []),
+        "expected_outcome": outcomes[-1] if outcomes else None,
+        "action_required": any(n.get("action_required") for n in notifications),
+        "items": [
+            {"title": n.get("title"), "message": n.get("message"), "type": n.get("type")}
+            for n in notifications
+        ]
+    }
+
+
+# ============================================================================
+# Transports
+# ============================================================================
+
+class Transport(ABC):
+    """
+    Delivers batches of {"patient_id", "notification"} messages
+
+    connect() is called before a batch and is expected to reuse an open
+    connection; close() is called after a failed batch and at shutdown.
+    """
+
+    def connect(self):
+        """Open the connection if it is not open"""
+
+    def close(self):
+        """Drop the connection"""
+
+    @abstractmethod
+    def send(self, messages: List[Dict[str, Any]]) -> List[bool]:
+        """Deliver messages, returning whether each one was accepted"""
+
+
+class LocalTransport(Transport):
+    """Logs messages and keeps the most recent ones in memory (stand-in for FCM)"""
+
+    def __init__(self, keep: int = 10000):
+        self.sent = deque(maxlen=keep)
+        self.connections = 0
+        self._connected = False
+
+    def connect(self):
+        if not self._connected:
+            self._connected = True
+            self.connections += 1
+
+    def close(self):
+        self._connected = False
+
+    def send(self, messages: List[Dict[str, Any]]) -> List[bool]:
+        if not self._connected:
+            raise RuntimeError("Transport is not connected")
+        self.sent.extend(messages)
+        logger.info(f"Delivered {len(messages)} notifications")
+        return [True] * len(messages)
+
+
+class FirestoreTransport(Transport):
+    """Stores messages as patient notifications, one write batch per send"""
+
+    def __init__(self):
+        self._db = None
+
+    def connect(self):
+        if self._db is None:
+            self._db = FirebaseClient().db
+
+    def close(self):
+        self._db = None
+
+    def send(self, messages: List[Dict[str, Any]]) -> List[bool]:
+        batch = self._db.batch()
+        for message in messages:
+            notification_service.add_to_batch(batch, message["patient_id"], message["notification"])
+        batch.commit()
+        return [True] * len(messages)
+
+
+TRANSPORTS = {
+    "local": LocalTransport,
+    "firestore": FirestoreTransport
+}
+
+
+def create_transport(name: Optional[str] = None) -> Transport:
+    """Create the transport configured by NOTIFICATION_TRANSPORT"""
+    name = name or config.NOTIFICATION_TRANSPORT
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown notification transport: {name}")
+    return TRANSPORTS[name]()
+
+
+# ============================================================================
+# Pipeline
+# ============================================================================
+
+class NotificationPipeline:
+    """
+    Buffers notifications per patient and sends digests in batches
+
+    Args:
+        transport: Delivery transport (default create_transport(), made on first send)
+        autostart: Start the flusher thread on the first submit
+        path: SQLite file keeping undelivered notifications (None: memory only)
+    """
+
+    def __init__(
+        self,
+        transport: Optional[Transport] = None,
+        autostart: bool = True,
+        path: Optional[str] = None
+    ):
+        self._transport = transport
+        self.autostart = autostart
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._owner = uuid.uuid4().hex
+        self._exit_registered = False
+
+        # {patient_id: {"first_at": epoch seconds, "notifications": [...], "ids": [row IDs]}}
+        self._buffers: Dict[str, Dict[str, Any]] = {}
+        self._retries: deque = deque()  # (message, attempts, row IDs)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._counters = {
+            "submitted": 0,
+            "merged": 0,
+            "digests_sent": 0,
+            "batches": 0,
+            "dropped_buffer_full": 0,
+            "dropped_send_failed": 0
+        }
+        self._sent_at: deque = deque()  # (time, digests) per batch, for the send rate
+        self._batched = 0
+        self._last_batch_size = 0
+
+    @property
+    def transport(self) -> Transport:
+        if self._transport is None:
+            self._transport = create_transport()
+        return self._transport
+
+    # ------------------------------------------------------------------
+    # Storage (called with self._lock held)
+    # ------------------------------------------------------------------
+
+    def _journal(self) -> Optional[sqlite3.Connection]:
+        """Open the buffer file (None without a path)"""
+        if self.path and self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _adopt(self):
+        """Renew the lease on this pipeline's rows and buffer the rows nobody holds"""
+        journal = self._journal()
+        if not journal:
+            return
+
+        now = time.time()
+        journal.execute("BEGIN IMMEDIATE")
+        try:
+            journal.execute(
+                "UPDATE buffered SET lease_until = ? WHERE owner = ?", (now + BUFFER_LEASE_SECONDS, self._owner)
+            )
+            rows = journal.execute(
+                "SELECT id, patient_id, notification, submitted_at FROM buffered "
+                "WHERE lease_until <= ? ORDER BY id",
+                (now,)
+            ).fetchall()
+            journal.executemany(
+                "UPDATE buffered SET owner = ?, lease_until = ? WHERE id = ?",
+                [(self._owner, now + BUFFER_LEASE_SECONDS, row[0]) for row in rows]
+            )
+            journal.execute("COMMIT")
+        except Exception:
+            journal.execute("ROLLBACK")
+            raise
+
+        for row_id, patient_id, notification, submitted_at in rows:
+            self._buffer(patient_id, json.loads(notification), submitted_at, row_id)
+        if rows:
+            logger.info(f"Adopted {len(rows)} undelivered notifications")
+
+    def _release(self):
+        """Hand the rows this pipeline could not send to the next pipeline"""
+        if self._journal():
+            self._conn.execute("UPDATE buffered SET owner = NULL, lease_until = 0 WHERE owner = ?", (self._owner,))
+            self._buffers.clear()
+            self._retries.clear()
+            self._pending = 0
+
+    def _buffer(self, patient_id: str, notification: Dict[str, Any], now: float, row_id: Optional[int]):
+        buffer = self._buffers.setdefault(patient_id, {"first_at": now, "notifications": [], "ids": []})
+        buffer["first_at"] = min(buffer["first_at"], now)
+        buffer["notifications"].append(notification)
+        if row_id is not None:
+            buffer["ids"].append(row_id)
+        self._pending += 1
+
+    def _forget(self, row_ids: List[int]):
+        """Delete notifications whose digest was delivered or given up on"""
+        if row_ids and self._journal():
+            self._conn.executemany("DELETE FROM buffered WHERE id = ?", [(row_id,) for row_id in row_ids])
+
+    def submit(self, patient_id: str, notification: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """
+        Buffer a notification for the patient's next digest
+
+        Returns:
+            False if it was dropped because the buffer is full
+        """
+        now = now or time.time()
+        with self._lock:
+            journal = self._journal()
+            if self._pending >= config.NOTIFICATION_MAX_PENDING:
+                self._counters["dropped_buffer_full"] += 1
+                logger.warning(f"Notification buffer full, dropped notification for patient {patient_id}")
+                return False
+
+            row_id = None
+            if journal:
+                row_id = journal.execute(
+                    "INSERT INTO buffered (patient_id, notification, submitted_at, owner, lease_until) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (patient_id, json.dumps(notification, default=str), now, self._owner,
+                     time.time() + BUFFER_LEASE_SECONDS)
+                ).lastrowid
+            self._buffer(patient_id, notification, now, row_id)
+            self._counters["submitted"] += 1
+
+        if self.autostart:
+            self.start()
+        return True
+
+    def _take_ready(self, now: float, force: bool) -> List[tuple]:
+        """Remove the buffers whose window has closed and merge them into (digest, row IDs)"""
+        window = config.NOTIFICATION_DIGEST_WINDOW_SECONDS
+        with self._lock:
+            self._adopt()
+            ready = [
+                patient_id for patient_id, buffer in self._buffers.items()
+                if force or now - buffer["first_at"] >= window
+            ]
+            messages = []
+            for patient_id in ready:
+                buffer = self._buffers.pop(patient_id)
+                notifications = buffer["notifications"]
+                self._pending -= len(notifications)
+                self._counters["merged"] += len(notifications) - 1
+                messages.append(
+                    ({"patient_id": patient_id, "notification": merge_digest(notifications)}, buffer["ids"])
+                )
+        return messages
+
+    def _send_batch(self, batch: List[tuple]) -> int:
+        """Send one batch of (message, attempts, row IDs); returns the number delivered"""
+        try:
+            self.transport.connect()
+            accepted = self.transport.send([message for message, _, _ in batch])
+        except Exception as e:
+            logger.warning(f"Notification batch of {len(batch)} failed: {str(e)}")
+            self.transport.close()
+            accepted = [False] * len(batch)
+
+        delivered = 0
+        finished = []
+        for (message, attempts, row_ids), ok in zip(batch, accepted):
+            if ok:
+                delivered += 1
+                finished += row_ids
+            elif attempts + 1 >= config.NOTIFICATION_MAX_ATTEMPTS:
+                self._counters["dropped_send_failed"] += 1
+                finished += row_ids
+                logger.error(f"Gave up on notification digest for patient {message['patient_id']}")
+            else:
+                self._retries.append((message, attempts + 1, row_ids))
+
+        with self._lock:
+            self._forget(finished)
+        return delivered
+
+    def flush_once(self, now: Optional[float] = None, force: bool = False) -> Dict[str, int]:
+        """
+        Send the digests whose window has closed, and retry failed ones
+
+        Args:
+            now: Current time (epoch seconds)
+            force: Send every buffered patient regardless of the window
+
+        Returns:
+            {"sent": digests delivered, "failed": digests not delivered, "batches": n}
+        """
+        now = now or time.time()
+        with self._send_lock:
+            queue = list(self._retries) + [(message, 0, row_ids) for message, row_ids in self._take_ready(now, force)]
+            self._retries.clear()
+
+            size = config.NOTIFICATION_BATCH_SIZE
+            sent = batches = 0
+            for i in range(0, len(queue), size):
+                batch = queue[i:i + size]
+                delivered = self._send_batch(batch)
+                sent += delivered
+                batches += 1
+                with self._lock:
+                    self._counters["digests_sent"] += delivered
+                    self._counters["batches"] += 1
+                    self._batched += len(batch)
+                    self._last_batch_size = len(batch)
+                    self._sent_at.append((time.time(), delivered))
+
+        if queue:
+            logger.info(f"Notification flush: {sent} of {len(queue)} digests sent in {batches} batches")
+        return {"sent": sent, "failed": len(queue) - sent, "batches": batches}
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.flush_once()
+            except Exception as e:
+                logger.error(f"Notification flusher error: {str(e)}")
+            self._stop.wait(config.NOTIFICATION_FLUSH_INTERVAL)
+
+    def start(self):
+        """Start the background flusher (no-op if running) and flush at interpreter exit"""
+        with self._lock:
+            self._journal()
+            if not self._exit_registered:
+                atexit.register(self._stop_at_exit)
+                self._exit_registered = True
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="notification-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0, flush: bool = True):
+        """
+        Stop the flusher, sending everything still buffered
+
+        What is not sent stays in the buffer file, released for the next
+        pipeline to adopt.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if flush:
+            self.flush_once(force=True)
+        if self._transport is not None:
+            self._transport.close()
+        with self._lock:
+            self._release()
+
+    def _stop_at_exit(self):
+        try:
+            self.stop()
+        except Exception as e:
+            logger.error(f"Notification flush at exit failed: {str(e)}")
+
+    def stats(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Pipeline counters
+
+        Returns:
+            Buffer depth (pending_patients, pending_notifications,
+            oldest_pending_seconds, retrying), totals (submitted, merged,
+            digests_sent, batches, dropped_buffer_full, dropped_send_failed),
+            avg_batch_size, last_batch_size and send_rate_per_second (digests
+            over the last RATE_WINDOW_SECONDS)
+        """
+        now = now or time.time()
+        with self._lock:
+            while self._sent_at and self._sent_at[0][0] < now - RATE_WINDOW_SECONDS:
+                self._sent_at.popleft()
+            recent = sum(count for _, count in self._sent_at)
+            oldest = min((buffer["first_at"] for buffer in self._buffers.values()), default=None)
+            counters = dict(self._counters)
+            batches = counters["batches"]
+
+            return {
+                "pending_patients": len(self._buffers),
+                "pending_notifications": self._pending,
+                "oldest_pending_seconds": round(now - oldest, 3) if oldest else 0.0,
+                "retrying": len(self._retries),
+                **counters,
+                "avg_batch_size": round(self._batched / batches, 1) if batches else 0.0,
+                "last_batch_size": self._last_batch_size,
+                "send_rate_per_second": round(recent / RATE_WINDOW_SECONDS, 3),
+                "flusher_running": bool(self._thread and self._thread.is_alive())
+            }
+
+
+# Global notification pipeline instance
+notification_pipeline = NotificationPipeline(path=config.NOTIFICATION_BUFFER_PATH or None)
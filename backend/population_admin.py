@@ -0,0 +1,59 @@
+"""
+Population Effectiveness Administration
+Rebuild and inspect the population-wide intervention effectiveness table
+
+Usage:
+    python -m backend.population_admin rebuild [--workers N]
+    python -m backend.population_admin show [root_cause]
+
+Run rebuild periodically (e.g. nightly from cron); agents pick up the new
+table within POPULATION_TABLE_TTL_SECONDS.
+"""
+import argparse
+import logging
+import sys
+from backend.analytics.population import ANY
+from backend.firebase_client import population_service
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild(workers):
+    """Rebuild the table from all sealed interventions"""
+    table = population_service.rebuild(workers)
+    print(f"Rebuilt population table: {len(table)} cells")
+    return 0
+
+
+def show(root_cause):
+    """Print effectiveness by root cause and intervention type"""
+    table = population_service.table()
+    if not len(table):
+        print("Population table is empty - run rebuild first")
+        return 1
+
+    print(f"Built at {table.built_at}")
+    for (cause, intervention_type, age_band, medication_band), stats in sorted(table.entries.items()):
+        if root_cause and cause != root_cause:
+            continue
+        if age_band == ANY and medication_band == ANY:
+            print(f"{cause:<24} {intervention_type:<24} n={stats['n']:<6} mean={stats['mean']:+.3f} std={stats['std']:.3f}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the population effectiveness table")
+    parser.add_argument("command", choices=["rebuild", "show"])
+    parser.add_argument("root_cause", nargs="?", help="Only show this root cause category")
+    parser.add_argument("--workers", type=int, default=None, help="Aggregation processes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == "rebuild":
+        return rebuild(args.workers)
+    return show(args.root_cause)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Refill Forecast Worker
+Advances every patient's medication supply and emits refill alerts and orders
+
+Usage:
+    python -m backend.refill_worker            # run nightly (REFILL_WORKER_INTERVAL)
+    python -m backend.refill_worker --once     # one pass (e.g. from cron)
+
+Each pass reads the adherence logs written since the previous pass (in
+created_at order), the projected medication lists and the supply ledgers,
+and hands them to analytics.refill_forecast, which projects run-out dates
+for the whole fleet with array operations. Medications at or under their
+trigger get a refill order (patients with auto_refill_enabled) or a refill
+alert notification, once per fill; all writes are batched.
+"""
+import argparse
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from backend.analytics.refill_forecast import SupplyForecast
+from backend.config import config
+from backend.effectiveness_worker import covers, next_cursor
+from backend.firebase_client import REFILL_FIELDS, adherence_service, patient_service, refill_service
+
+logger = logging.getLogger(__name__)
+
+
+def new_logs(cursor: Dict[str, Any], page_size: int) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Logs written since the cursor, read page by page
+
+    Returns:
+        (logs, cursor after them)
+    """
+    logs = []
+    while True:
+        page = adherence_service.logs_created_since(cursor.get("created_at"), limit=page_size)
+        seen = set(cursor.get("log_ids", []))
+        fresh = [log for log in page if log["log_id"] not in seen]
+        logs.extend(fresh)
+        if page:
+            cursor = next_cursor(cursor, page)
+
+        if len(page) < page_size:
+            return logs, cursor
+        if not fresh:
+            logger.warning(f"More than {page_size} logs share one created_at - increase the page size")
+            return logs, cursor
+
+
+def uncounted(
+    logs: List[Dict[str, Any]],
+    ledgers: Dict[str, Dict[str, Dict[str, Any]]]
+) -> List[Dict[str, Any]]:
+    """
+    Logs their ledger entry has not counted yet
+
+    A pass whose later batch failed did not store the worker cursor, so
+    its logs are read again; entries written by its committed batches
+    carry last_log_cursor and must not count them twice.
+    """
+    def entry(log):
+        return (ledgers.get(log.get("patient_id")) or {}).get(log.get("medication_id")) or {}
+
+    return [log for log in logs if not covers(entry(log).get("last_log_cursor"), log)]
+
+
+def run_once(now: Optional[datetime] = None, page_size: Optional[int] = None) -> Dict[str, int]:
+    """
+    Advance all supply ledgers and emit the refills that are due
+
+    Args:
+        now: Current UTC time (naive)
+        page_size: Logs per read (default LOG_PAGE_SIZE)
+
+    Returns:
+        {"medications", "logs", "due", "alerts", "batches"}
+    """
+    now = now or datetime.utcnow()
+    cursor = refill_service.get_worker_cursor()
+
+    if cursor:
+        logs, cursor = new_logs(cursor, page_size or config.LOG_PAGE_SIZE)
+    else:
+        # Ledgers start from the profiles on the first pass; older logs do not count
+        logs, cursor = [], {"created_at": now, "log_ids": [], "updated_at": now.isoformat()}
+
+    ledgers = refill_service.get_ledgers()
+    forecast = SupplyForecast(
+        patient_service.profiles(REFILL_FIELDS),
+        ledgers,
+        uncounted(logs, ledgers),
+        now,
+        config.REFILL_ALERT_DAYS
+    )
+    alerts = forecast.alerts()
+    batches = refill_service.apply(forecast.ledgers(), alerts, cursor, now)
+
+    result = {
+        "medications": len(forecast),
+        "logs": len(logs),
+        "due": int(forecast.due.sum()),
+        "alerts": len(alerts),
+        "batches": batches
+    }
+    logger.info(f"Refill pass: {result}")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Forecast medication supply and emit refill alerts")
+    parser.add_argument("--once", action="store_true", help="Run one pass and exit")
+    parser.add_argument("--interval", type=float, default=config.REFILL_WORKER_INTERVAL,
+                        help="Seconds between passes when running continuously")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    while True:
+        run_once()
+        if args.once:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Reminder Engine
+Sends medication reminders at each patient's scheduled_times
+
+Usage:
+    python -m backend.reminders                     # dispatch continuously
+    python -m backend.reminders --once              # dispatch the current minute and exit
+    python -m backend.reminders --notifier local    # log reminders instead of storing them
+
+The engine keeps a ReminderIndex (minute of the UTC day -> reminders) built
+from the patients' projected profiles once per day, and re-indexes only the
+patients updated since the last refresh. Every minute it reads that
+minute's bucket and hands the reminders to the notifier in chunks of
+REMINDER_DISPATCH_BATCH_SIZE, so the cost of a minute is proportional to the
+reminders due in it rather than to the number of patients. Follow-up
+reminders are dropped for doses the patient has already logged.
+"""
+import argparse
+import logging
+import sys
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+import numpy as np
+from backend.analytics.pattern_engine import parse_timestamps
+from backend.analytics.reminder_index import DOSE, FOLLOW_UP, Reminder, ReminderIndex
+from backend.config import config
+from backend.firebase_client import (
+    FIRESTORE_BATCH_LIMIT,
+    REMINDER_FIELDS,
+    adherence_service,
+    notification_service,
+    patient_service
+)
+
+logger = logging.getLogger(__name__)
+
+# Profiles updated this close to the previous refresh are fetched again, to
+# cover clock skew between this process and Firestore's server timestamps
+REFRESH_OVERLAP = timedelta(seconds=5)
+
+# Next day's index is built this long before UTC midnight
+PRELOAD_BEFORE_MIDNIGHT = timedelta(minutes=30)
+
+
+def reminder_notification(reminder: Reminder) -> Dict[str, Any]:
+    """Notification content for a reminder"""
+    name = reminder.medication_name or "your medication"
+    local_time = reminder.scheduled_local[11:16]
+    if reminder.kind == DOSE:
+        title = f"Time to take {name}"
+        message = f"Your {local_time} dose of {name} is due now."
+    else:
+        title = f"Did you take {name}?"
+        message = f"We haven't seen your {local_time} dose of {name} logged yet."
+
+    return {
+        "type": f"{reminder.kind}_reminder",
+        "title": title,
+        "message": message,
+        "medication_id": reminder.medication_id,
+        "scheduled_local": reminder.scheduled_local,
+        "due_at": reminder.due_at,
+        "action_required": True
+    }
+
+
+# ============================================================================
+# Notifiers
+# ============================================================================
+
+class Notifier(ABC):
+    """Delivers a batch of reminders"""
+
+    @abstractmethod
+    def send(self, reminders: List[Reminder]) -> int:
+        """Deliver reminders, returning how many were sent"""
+
+
+class LocalNotifier(Notifier):
+    """Logs reminders and keeps the most recent ones in memory (development stand-in)"""
+
+    def __init__(self, keep: int = 10000):
+        self.sent = deque(maxlen=keep)
+
+    def send(self, reminders: List[Reminder]) -> int:
+        self.sent.extend(reminders)
+        logger.info(f"Sent {len(reminders)} reminders")
+        return len(reminders)
+
+
+class FirestoreNotifier(Notifier):
+    """Stores reminders as patient notifications, FIRESTORE_BATCH_LIMIT per commit"""
+
+    def send(self, reminders: List[Reminder]) -> int:
+        for i in range(0, len(reminders), FIRESTORE_BATCH_LIMIT):
+            batch = notification_service.db.batch()
+            for reminder in reminders[i:i + FIRESTORE_BATCH_LIMIT]:
+                notification_service.add_to_batch(batch, reminder.patient_id, reminder_notification(reminder))
+            batch.commit()
+        return len(reminders)
+
+
+NOTIFIERS = {
+    "local": LocalNotifier,
+    "firestore": FirestoreNotifier
+}
+
+
+def create_notifier(name: Optional[str] = None) -> Notifier:
+    """Create the notifier configured by REMINDER_NOTIFIER"""
+    name = name or config.REMINDER_NOTIFIER
+    if name not in NOTIFIERS:
+        raise ValueError(f"Unknown reminder notifier: {name}")
+    return NOTIFIERS[name]()
+
+
+# ============================================================================
+# Engine
+# ============================================================================
+
+class ReminderEngine:
+    """
+    Dispatches each minute's reminders from a per-day index
+
+    Args:
+        notifier: Reminder delivery (default create_notifier())
+    """
+
+    def __init__(self, notifier: Optional[Notifier] = None):
+        self.notifier = notifier or create_notifier()
+        self.index: Optional[ReminderIndex] = None
+        self._next: Optional[ReminderIndex] = None
+        self._refreshed_at: Optional[datetime] = None
+        self._last_minute: Optional[datetime] = None
+        self._stop = threading.Event()
+
+    def build(self, day: date) -> ReminderIndex:
+        """Index every patient's reminders for a UTC day"""
+        index = ReminderIndex(day)
+        index.add(patient_service.profiles(REMINDER_FIELDS))
+        logger.info(f"Indexed {len(index)} reminders for {day}")
+        return index
+
+    def refresh(self, now: Optional[datetime] = None) -> int:
+        """
+        Re-index the patients updated since the last refresh
+
+        Returns:
+            Number of patients re-indexed
+        """
+        now = now or datetime.utcnow()
+        if self._refreshed_at is None:
+            self._refreshed_at = now
+            return 0
+
+        changed = patient_service.profiles(
+            REMINDER_FIELDS, updated_since=self._refreshed_at - REFRESH_OVERLAP
+        )
+        for index in (self.index, self._next):
+            if index is not None and changed:
+                index.replace(changed)
+        self._refreshed_at = now
+        return len(changed)
+
+    def preload(self, now: Optional[datetime] = None):
+        """Build the next day's index ahead of UTC midnight"""
+        now = now or datetime.utcnow()
+        tomorrow = now.date() + timedelta(days=1)
+        midnight = datetime.combine(tomorrow, datetime.min.time())
+        if midnight - now <= PRELOAD_BEFORE_MIDNIGHT and (self._next is None or self._next.day != tomorrow):
+            self._next = self.build(tomorrow)
+
+    def _index_for(self, day: date) -> ReminderIndex:
+        if self.index is None or self.index.day != day:
+            if self._next is not None and self._next.day == day:
+                self.index, self._next = self._next, None
+            else:
+                self.index = self.build(day)
+            if self._refreshed_at is None:
+                self._refreshed_at = datetime.utcnow()
+        return self.index
+
+    def dispatch(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """
+        Send the reminders of every minute since the last dispatch, up to now
+
+        Minutes missed while the engine was down are caught up, at most
+        REMINDER_CATCH_UP_MINUTES back.
+
+        Args:
+            now: Current time (naive UTC)
+
+        Returns:
+            {"minutes": n, "sent": n, "suppressed": n, "failed": n}
+        """
+        now = (now or datetime.utcnow()).replace(second=0, microsecond=0)
+        minute = now if self._last_minute is None else self._last_minute + timedelta(minutes=1)
+        minute = max(minute, now - timedelta(minutes=config.REMINDER_CATCH_UP_MINUTES))
+
+        counts = {"minutes": 0, "sent": 0, "suppressed": 0, "failed": 0}
+        while minute <= now:
+            index = self._index_for(minute.date())
+            self._send(index.due(index.minute_of(minute)), counts)
+            self._last_minute = minute
+            counts["minutes"] += 1
+            minute += timedelta(minutes=1)
+
+        if counts["sent"] or counts["failed"]:
+            logger.info(f"Dispatched reminders up to {now.isoformat()}: {counts}")
+        return counts
+
+    def _send(self, reminders: List[Reminder], counts: Dict[str, int]):
+        due = self._drop_answered(reminders)
+        counts["suppressed"] += len(reminders) - len(due)
+
+        size = config.REMINDER_DISPATCH_BATCH_SIZE
+        for i in range(0, len(due), size):
+            chunk = due[i:i + size]
+            try:
+                counts["sent"] += self.notifier.send(chunk)
+            except Exception as e:
+                counts["failed"] += len(chunk)
+                logger.error(f"Failed to send {len(chunk)} reminders: {str(e)}")
+
+    def _drop_answered(self, reminders: List[Reminder]) -> List[Reminder]:
+        """Remove follow-ups for doses the patient already logged"""
+        follow_ups = [reminder for reminder in reminders if reminder.kind == FOLLOW_UP]
+        if not follow_ups:
+            return reminders
+
+        try:
+            logs = adherence_service.logs_for_patients(
+                sorted({reminder.patient_id for reminder in follow_ups}), days=1
+            )
+        except Exception as e:
+            logger.warning(f"Could not check logged doses, sending all follow-ups: {str(e)}")
+            return reminders
+
+        window = np.timedelta64(config.REMINDER_ANSWERED_WINDOW_MINUTES, "m")
+        kept = []
+        for reminder in reminders:
+            if reminder.kind == FOLLOW_UP:
+                rows = [
+                    row for row in logs.get(reminder.patient_id, [])
+                    if row.medication_id == reminder.medication_id and row.action in ("took", "skipped")
+                ]
+                logged = parse_timestamps([row.timestamp for row in rows])
+                if (logged >= np.datetime64(reminder.dose_at, "ms") - window).any():
+                    continue
+            kept.append(reminder)
+        return kept
+
+    def serve(self):
+        """Dispatch every minute until stop() is called"""
+        next_refresh = datetime.min
+        while not self._stop.is_set():
+            now = datetime.utcnow()
+            try:
+                if now >= next_refresh:
+                    self.refresh(now)
+                    self.preload(now)
+                    next_refresh = now + timedelta(seconds=config.REMINDER_REFRESH_SECONDS)
+                self.dispatch(now)
+            except Exception as e:
+                logger.error(f"Reminder pass failed: {str(e)}")
+
+            next_minute = datetime.utcnow().replace(second=0, microsecond=0) + timedelta(minutes=1)
+            self._stop.wait(max((next_minute - datetime.utcnow()).total_seconds(), 0.05))
+
+    def stop(self):
+        self._stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send medication reminders")
+    parser.add_argument("--once", action="store_true", help="Dispatch the current minute and exit")
+    parser.add_argument("--notifier", choices=sorted(NOTIFIERS), help="Override REMINDER_NOTIFIER")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    engine = ReminderEngine(create_notifier(args.notifier))
+    if args.once:
+        counts = engine.dispatch()
+        return 1 if counts["failed"] else 0
+
+    engine.serve()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
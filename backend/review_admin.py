@@ -0,0 +1,91 @@
+"""
+Deferred Review Processing
+Batch-review actions the anomaly detector deferred instead of triggering a workflow
+
+Usage:
+    python -m backend.review_admin list
+    python -m backend.review_admin run [--limit N]
+
+Pending reviews are grouped by patient and each patient gets one agent
+workflow covering all of their deferred actions. Run it on a schedule
+(e.g. hourly from cron).
+"""
+import argparse
+import logging
+import sys
+from typing import Any, Dict, List
+from backend.firebase_client import triage_service
+
+logger = logging.getLogger(__name__)
+
+
+def group_by_patient(reviews: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Pending reviews per patient, oldest first"""
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for review in reviews:
+        grouped.setdefault(review["patient_id"], []).append(review)
+    return grouped
+
+
+def review_trigger(patient_id: str, reviews: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Workflow trigger for a patient's deferred actions (the latest one leads)"""
+    latest = reviews[-1]
+    return {
+        "patient_id": patient_id,
+        "medication_id": latest.get("medication_id"),
+        "action": latest.get("action"),
+        "reason": latest.get("reason"),
+        "timestamp": latest.get("timestamp"),
+        "deferred_review": {
+            "count": len(reviews),
+            "log_ids": [review.get("log_id") for review in reviews],
+            "triage_reasons": sorted({review.get("triage_reason") for review in reviews if review.get("triage_reason")})
+        }
+    }
+
+
+def list_reviews(limit):
+    """Print pending reviews per patient"""
+    grouped = group_by_patient(triage_service.pending_reviews(limit))
+    for patient_id, reviews in grouped.items():
+        print(f"{patient_id}: {len(reviews)} deferred actions")
+        for review in reviews:
+            print(f"  {review.get('timestamp')} {review.get('action')} - {review.get('triage_reason')}")
+    return 0
+
+
+def run(limit):
+    """Run one workflow per patient with pending reviews"""
+    from backend.agents.agent_init import orchestrator
+
+    grouped = group_by_patient(triage_service.pending_reviews(limit))
+    failed = 0
+    for patient_id, reviews in grouped.items():
+        try:
+            result = orchestrator.execute_workflow(review_trigger(patient_id, reviews))
+            triage_service.mark_reviewed([r["review_id"] for r in reviews], result.get("workflow_id"))
+            print(f"{patient_id}: reviewed {len(reviews)} actions ({result.get('state')})")
+        except Exception as e:
+            failed += 1
+            logger.error(f"Deferred review failed for patient {patient_id}: {str(e)}")
+            print(f"{patient_id}: failed - {str(e)}")
+
+    print(f"{len(grouped) - failed} of {len(grouped)} patients reviewed")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process deferred adherence reviews")
+    parser.add_argument("command", choices=["list", "run"])
+    parser.add_argument("--limit", type=int, default=None, help="Reviews to process (default: DEFERRED_REVIEW_BATCH_SIZE)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == "list":
+        return list_reviews(args.limit)
+    return run(args.limit)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
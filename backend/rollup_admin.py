@@ -0,0 +1,59 @@
+"""
+Adherence Rollup Administration
+Backfill, rebuild and consistency-check per-patient rollup documents
+
+Usage:
+    python -m backend.rollup_admin rebuild [patient_id ...]
+    python -m backend.rollup_admin check [patient_id ...]
+
+Without patient IDs the command runs for every patient.
+"""
+import argparse
+import logging
+import sys
+from backend.firebase_client import patient_service, rollup_service
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild(patient_ids):
+    """Rebuild the rollups of the given patients from their raw logs"""
+    for patient_id in patient_ids:
+        rollup = rollup_service.rebuild(patient_id)
+        print(f"{patient_id}: rebuilt from {rollup['total']} logs")
+    return 0
+
+
+def check(patient_ids):
+    """Report patients whose rollup disagrees with their raw logs"""
+    inconsistent = 0
+    for patient_id in patient_ids:
+        mismatches = rollup_service.check(patient_id)
+        if mismatches:
+            inconsistent += 1
+            print(f"{patient_id}: {len(mismatches)} mismatches")
+            for mismatch in mismatches:
+                print(f"  {mismatch}")
+        else:
+            print(f"{patient_id}: ok")
+
+    print(f"{inconsistent} of {len(patient_ids)} rollups inconsistent")
+    return 1 if inconsistent else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage per-patient adherence rollups")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("patient_ids", nargs="*", help="Patients to process (default: all)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    patient_ids = args.patient_ids or patient_service.list_patient_ids()
+
+    if args.command == "rebuild":
+        return rebuild(patient_ids)
+    return check(patient_ids)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Follow-Up Scheduler
+Runs follow-up check-ins, re-investigations and learning evaluations when they fall due
+
+Usage:
+    python -m backend.scheduler            # run continuously
+    python -m backend.scheduler --once     # run what is due now and exit (e.g. from cron)
+
+Jobs live in Firestore (SchedulerService), indexed by due time. Each
+worker pulls the jobs falling due within the next SCHEDULER_LOOKAHEAD_SECONDS
+into an in-memory min-heap and sleeps until the earliest one; when a job
+is due it is claimed with a lease (so several workers can run side by
+side) and handed to the handler for its kind. Failed jobs are retried with
+exponential backoff and given up on after SCHEDULER_MAX_ATTEMPTS.
+"""
+import argparse
+import heapq
+import logging
+import socket
+import sys
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from backend.analytics import effectiveness
+from backend.config import config
+from backend.firebase_client import learning_job_service, notification_service, scheduler_service
+
+logger = logging.getLogger(__name__)
+
+# Job kinds
+FOLLOW_UP = "follow_up"
+REINVESTIGATION = "reinvestigation"
+LEARNING_EVALUATION = "learning_evaluation"
+
+# Days after an intervention at which each job runs
+FOLLOW_UP_DAYS = 3
+LEARNING_EVALUATION_DAYS = effectiveness.COUNTER_WINDOW_DAYS  # after window closed
+REINVESTIGATION_DAYS = 14
+
+# Retry backoff bounds (seconds)
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 6 * 3600
+
+FOLLOW_UP_QUESTIONS = [
+    "Are the new reminders working better for you?",
+    "Have you noticed any improvement?",
+    "Any issues we should address?"
+]
+
+
+def intervention_jobs(
+    patient_id: str,
+    root_cause: Optional[str] = None,
+    now: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """
+    Jobs to schedule after an intervention was executed
+
+    Args:
+        patient_id: Patient identifier
+        root_cause: Root cause the intervention addressed
+        now: Intervention time (naive UTC)
+
+    Returns:
+        Follow-up, learning evaluation and re-investigation jobs (see
+        SchedulerService.new_job)
+    """
+    now = now or datetime.utcnow()
+    payload = {"root_cause": root_cause, "intervention_at": now.isoformat()}
+    return [
+        scheduler_service.new_job(
+            FOLLOW_UP, patient_id, now + timedelta(days=FOLLOW_UP_DAYS),
+            {**payload, "questions": FOLLOW_UP_QUESTIONS}
+        ),
+        scheduler_service.new_job(
+            LEARNING_EVALUATION, patient_id, now + timedelta(days=LEARNING_EVALUATION_DAYS), payload
+        ),
+        scheduler_service.new_job(
+            REINVESTIGATION, patient_id, now + timedelta(days=REINVESTIGATION_DAYS), payload
+        )
+    ]
+
+
+class DueHeap:
+    """
+    Min-heap of jobs by due time
+
+    push and pop are O(log n); a job already in the heap is not added twice.
+    """
+
+    def __init__(self):
+        self._heap: List[tuple] = []
+        self._ids = set()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, job: Dict[str, Any]) -> bool:
+        """Add a job (False if it is already queued)"""
+        if job["job_id"] in self._ids:
+            return False
+        self._ids.add(job["job_id"])
+        heapq.heappush(self._heap, (job["due_at"], job["job_id"], job))
+        return True
+
+    def next_due(self) -> Optional[str]:
+        """Due time of the earliest job (ISO string), or None if empty"""
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> Optional[Dict[str, Any]]:
+        """Remove and return the earliest job if it is due by `now`"""
+        if not self._heap or self._heap[0][0] > now.isoformat():
+            return None
+        _, job_id, job = heapq.heappop(self._heap)
+        self._ids.discard(job_id)
+        return job
+
+
+# ============================================================================
+# Handlers
+# ============================================================================
+
+def run_follow_up(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Send the patient a check-in notification"""
+    notification_id = notification_service.create(job["patient_id"], {
+        "type": "follow_up",
+        "title": "How is your new medication plan going?",
+        "message": "We'd like to hear how the recent changes are working for you.",
+        "details": job["payload"].get("questions", FOLLOW_UP_QUESTIONS),
+        "action_required": True
+    })
+    return {"notification_id": notification_id}
+
+
+def run_learning_evaluation(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Queue the patient for the batch learning worker once the after window closed"""
+    learning_job_service.enqueue({
+        "patient_id": job["patient_id"],
+        "action": LEARNING_EVALUATION,
+        "reason": job["payload"].get("root_cause")
+    })
+    return {"learning_job_queued": True}
+
+
+def run_reinvestigation(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Re-run Investigation and Learning to check whether the root cause is resolved"""
+    from backend.agents.agent_init import orchestrator
+    from backend.agents.base_agent import AgentType
+
+    result = orchestrator.execute_workflow(
+        {
+            "patient_id": job["patient_id"],
+            "action": REINVESTIGATION,
+            "reason": job["payload"].get("root_cause"),
+            "timestamp": datetime.utcnow().isoformat(),
+            "scheduled_job_id": job["job_id"]
+        },
+        agents_to_run=[AgentType.INVESTIGATION, AgentType.LEARNING]
+    )
+    return {"workflow_id": result.get("workflow_id"), "state": result.get("state")}
+
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    FOLLOW_UP: run_follow_up,
+    LEARNING_EVALUATION: run_learning_evaluation,
+    REINVESTIGATION: run_reinvestigation
+}
+
+
+# ============================================================================
+# Worker
+# ============================================================================
+
+class SchedulerWorker:
+    """
+    Pulls due jobs into a heap, claims them and runs their handlers
+
+    Args:
+        worker_id: Lease owner name (default: host and a random suffix)
+        handlers: {kind: handler} (default HANDLERS)
+    """
+
+    def __init__(
+        self,
+        worker_id: Optional[str] = None,
+        handlers: Optional[Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]]] = None
+    ):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.handlers = handlers or HANDLERS
+        self.heap = DueHeap()
+        self._stop = threading.Event()
+
+    def refill(self, now: datetime, lookahead_seconds: float = 0) -> int:
+        """
+        Add the jobs due within the lookahead to the heap
+
+        Returns:
+            Number of jobs added
+        """
+        jobs = scheduler_service.due_jobs(now + timedelta(seconds=lookahead_seconds))
+        return sum(self.heap.push(job) for job in jobs)
+
+    def run_due(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """
+        Claim and run every job in the heap that is due
+
+        Returns:
+            {"done": n, "failed": n, "skipped": n (claimed by another worker)}
+        """
+        now = now or datetime.utcnow()
+        counts = {"done": 0, "failed": 0, "skipped": 0}
+
+        job = self.heap.pop_due(now)
+        while job is not None:
+            if not scheduler_service.claim(job, self.worker_id, now):
+                counts["skipped"] += 1
+            elif self.run_job(job, now):
+                counts["done"] += 1
+            else:
+                counts["failed"] += 1
+            job = self.heap.pop_due(now)
+
+        return counts
+
+    def run_job(self, job: Dict[str, Any], now: datetime) -> bool:
+        """Run a claimed job and record the outcome"""
+        handler = self.handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for job kind {job['kind']}")
+            result = handler(job)
+            scheduler_service.complete(job["job_id"], result)
+            logger.info(f"Job {job['job_id']} done")
+            return True
+
+        except Exception as e:
+            attempts = job.get("attempts", 0) + 1
+            if attempts >= config.SCHEDULER_MAX_ATTEMPTS:
+                retry_at = None
+                logger.error(f"Job {job['job_id']} gave up after {attempts} attempts: {str(e)}")
+            else:
+                delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+                retry_at = now + timedelta(seconds=delay)
+                logger.warning(f"Job {job['job_id']} failed, retrying in {delay}s: {str(e)}")
+            scheduler_service.retry(job["job_id"], str(e), retry_at)
+            return False
+
+    def run_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Run every job that is due now (for cron)"""
+        now = now or datetime.utcnow()
+        self.refill(now)
+        return self.run_due(now)
+
+    def serve(self):
+        """Run jobs as they fall due until stop() is called"""
+        next_refill = datetime.min
+        while not self._stop.is_set():
+            now = datetime.utcnow()
+            try:
+                if now >= next_refill:
+                    self.refill(now, config.SCHEDULER_LOOKAHEAD_SECONDS)
+                    next_refill = now + timedelta(seconds=config.SCHEDULER_POLL_SECONDS)
+                self.run_due(now)
+            except Exception as e:
+                logger.error(f"Scheduler pass failed: {str(e)}")
+
+            # Sleep until the next job in the heap or the next refill
+            wake_at = next_refill
+            next_due = self.heap.next_due()
+            if next_due and datetime.fromisoformat(next_due) < wake_at:
+                wake_at = datetime.fromisoformat(next_due)
+            self._stop.wait(max((wake_at - datetime.utcnow()).total_seconds(), 0.05))
+
+    def stop(self):
+        self._stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run scheduled follow-up jobs")
+    parser.add_argument("--once", action="store_true", help="Run the jobs that are due now and exit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    worker = SchedulerWorker()
+    if args.once:
+        counts = worker.run_once()
+        while sum(counts.values()) >= config.SCHEDULER_BATCH_SIZE:
+            counts = worker.run_once()
+        return 0
+
+    worker.serve()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
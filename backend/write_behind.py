@@ -0,0 +1,382 @@
+"""
+Write-Behind Queue
+Durable local queue that moves Firestore writes off the workflow's critical path
+
+Execution results (intervention records, patient changes, notifications)
+are appended to a SQLite database in WAL mode, which survives process
+restarts, and the workflow continues immediately. A background flusher
+thread commits queued writes to Firestore in batches, retrying failed
+ones with exponential backoff. stats() reports the queue depth and the
+flush lag (age of the oldest unflushed write).
+
+Several processes may share the database file: flushers claim rows with a
+short lease, so a write is only committed by one of them at a time.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from backend.config import config
+from backend.firebase_client import (
+    FIRESTORE_BATCH_LIMIT,
+    FirebaseClient,
+    intervention_service,
+    notification_service,
+    patient_service,
+    scheduler_service
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds a flusher owns the rows it claimed
+CLAIM_LEASE_SECONDS = 60
+
+# Retry backoff bounds (seconds)
+RETRY_BASE_SECONDS = 2
+RETRY_MAX_SECONDS = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS writes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS writes_due ON writes (status, next_attempt_at, id);
+"""
+
+
+class WriteHandler:
+    """How one kind of queued write is committed"""
+
+    def __init__(
+        self,
+        add_to_batch: Callable[[Any, Dict[str, Any]], Any],
+        after_commit: Optional[Callable[[Dict[str, Any]], None]] = None,
+        writes: int = 1,
+        prepare: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+    ):
+        self.add_to_batch = add_to_batch
+        self.after_commit = after_commit
+        self.writes = writes  # Firestore writes per entry (batch sizing)
+        self.prepare = prepare  # Called once per batch with all its payloads of this kind
+
+
+class WriteBehindQueue:
+    """
+    SQLite-backed write-behind queue with a batching Firestore flusher
+
+    Args:
+        path: SQLite database file
+        batch_factory: Creates a write batch (default: Firestore WriteBatch)
+        autostart: Start the flusher thread on the first enqueue
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_factory: Optional[Callable[[], Any]] = None,
+        autostart: bool = True
+    ):
+        self.path = path
+        self.batch_factory = batch_factory or (lambda: FirebaseClient().db.batch())
+        self.autostart = autostart
+
+        self._handlers: Dict[str, WriteHandler] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._flushed = 0
+        self._last_flush_at: Optional[float] = None
+
+    def register(self, kind: str, handler: WriteHandler):
+        """Register how entries of a kind are written"""
+        self._handlers[kind] = handler
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]) -> int:
+        """
+        Durably queue a write
+
+        Args:
+            kind: Registered write kind
+            payload: JSON-serializable write data
+
+        Returns:
+            Queue entry ID
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown write kind: {kind}")
+
+        now = time.time()
+        with self._lock:
+            cursor = self._db().execute(
+                "INSERT INTO writes (kind, payload, enqueued_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload, default=str), now, now)
+            )
+            entry_id = cursor.lastrowid
+
+        if self.autostart:
+            self.start()
+        self._wake.set()
+        return entry_id
+
+    def _claim(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        """Lease the oldest due entries to this flusher"""
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    "SELECT id, kind, payload, attempts FROM writes "
+                    "WHERE status = 'pending' AND next_attempt_at <= ? AND lease_until <= ? "
+                    "ORDER BY id LIMIT ?",
+                    (now, now, limit)
+                ).fetchall()
+                db.executemany(
+                    "UPDATE writes SET lease_until = ? WHERE id = ?",
+                    [(now + CLAIM_LEASE_SECONDS, row[0]) for row in rows]
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+        return [
+            {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3]}
+            for row in rows
+        ]
+
+    def _done(self, entries: List[Dict[str, Any]]):
+        with self._lock:
+            self._db().executemany("DELETE FROM writes WHERE id = ?", [(entry["id"],) for entry in entries])
+
+    def _retry_later(self, entry: Dict[str, Any], error: Exception, now: float):
+        attempts = entry["attempts"] + 1
+        status = "dead" if attempts >= config.WRITE_BEHIND_MAX_ATTEMPTS else "pending"
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+        with self._lock:
+            self._db().execute(
+                "UPDATE writes SET attempts = ?, next_attempt_at = ?, lease_until = 0, status = ?, last_error = ? "
+                "WHERE id = ?",
+                (attempts, now + delay, status, str(error)[:500], entry["id"])
+            )
+
+        if status == "dead":
+            logger.error(f"Write-behind entry {entry['id']} ({entry['kind']}) gave up after {attempts} attempts: {error}")
+        else:
+            logger.warning(f"Write-behind entry {entry['id']} ({entry['kind']}) failed, retrying in {delay}s: {error}")
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    def _commit(self, entries: List[Dict[str, Any]]):
+        """Commit entries in one Firestore batch and run their after-commit hooks"""
+        by_kind: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in entries:
+            by_kind.setdefault(entry["kind"], []).append(entry["payload"])
+        for kind, payloads in by_kind.items():
+            if self._handlers[kind].prepare:
+                self._handlers[kind].prepare(payloads)
+
+        batch = self.batch_factory()
+        for entry in entries:
+            self._handlers[entry["kind"]].add_to_batch(batch, entry["payload"])
+        batch.commit()
+
+        for entry in entries:
+            after_commit = self._handlers[entry["kind"]].after_commit
+            if after_commit:
+                try:
+                    after_commit(entry["payload"])
+                except Exception as e:
+                    logger.warning(f"After-commit hook for write-behind entry {entry['id']} failed: {str(e)}")
+
+    def _batches(self, entries: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Split entries so no batch exceeds the Firestore write limit"""
+        batches, current, writes = [], [], 0
+        for entry in entries:
+            entry_writes = self._handlers[entry["kind"]].writes
+            if current and writes + entry_writes > FIRESTORE_BATCH_LIMIT:
+                batches.append(current)
+                current, writes = [], 0
+            current.append(entry)
+            writes += entry_writes
+        if current:
+            batches.append(current)
+        return batches
+
+    def flush_once(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Commit the due entries
+
+        A failed batch is retried entry by entry, so one bad write does not
+        hold back the others.
+
+        Args:
+            now: Current time (epoch seconds)
+
+        Returns:
+            {"committed": entries written, "failed": entries to retry}
+        """
+        now = now or time.time()
+        entries = self._claim(now, config.WRITE_BEHIND_BATCH_SIZE)
+
+        committed = failed = 0
+        for batch in self._batches(entries):
+            try:
+                self._commit(batch)
+                self._done(batch)
+                committed += len(batch)
+                continue
+            except Exception as e:
+                if len(batch) == 1:
+                    self._retry_later(batch[0], e, now)
+                    failed += 1
+                    continue
+                logger.warning(f"Write-behind batch of {len(batch)} failed, committing one by one: {str(e)}")
+
+            for entry in batch:
+                try:
+                    self._commit([entry])
+                    self._done([entry])
+                    committed += 1
+                except Exception as e:
+                    self._retry_later(entry, e, now)
+                    failed += 1
+
+        if entries:
+            self._flushed += committed
+            self._last_flush_at = time.time()
+            logger.info(f"Write-behind flush: {committed} committed, {failed} to retry")
+
+        return {"committed": committed, "failed": failed}
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                result = self.flush_once()
+                if result["committed"] == config.WRITE_BEHIND_BATCH_SIZE:
+                    continue  # more waiting - keep draining
+            except Exception as e:
+                logger.error(f"Write-behind flusher error: {str(e)}")
+
+            self._wake.wait(config.WRITE_BEHIND_FLUSH_INTERVAL)
+            self._wake.clear()
+
+    def start(self):
+        """Start the background flusher (no-op if running)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the flusher after its current pass"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    # ------------------------------------------------------------------
+    # Monitoring
+    # ------------------------------------------------------------------
+
+    def stats(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Queue depth and flush lag
+
+        Returns:
+            {"pending", "dead", "lag_seconds", "flushed", "last_flush_at",
+            "flusher_running"}; lag_seconds is the age of the oldest
+            pending write (0 when the queue is empty)
+        """
+        now = now or time.time()
+        with self._lock:
+            counts = dict(self._db().execute("SELECT status, COUNT(*) FROM writes GROUP BY status").fetchall())
+            oldest = self._db().execute(
+                "SELECT MIN(enqueued_at) FROM writes WHERE status = 'pending'"
+            ).fetchone()[0]
+
+        return {
+            "pending": counts.get("pending", 0),
+            "dead": counts.get("dead", 0),
+            "lag_seconds": round(now - oldest, 3) if oldest else 0.0,
+            "flushed": self._flushed,
+            "last_flush_at": self._last_flush_at,
+            "flusher_running": bool(self._thread and self._thread.is_alive())
+        }
+
+
+# ============================================================================
+# Write Kinds
+# ============================================================================
+
+def _add_intervention(batch, payload: Dict[str, Any]):
+    intervention_service.add_to_batch(
+        batch, payload["intervention"], payload.get("patient_updates"), payload.get("intervention_id")
+    )
+
+
+def _prepare_interventions(payloads: List[Dict[str, Any]]):
+    intervention_service.backfill_counters([payload["intervention"] for payload in payloads])
+
+
+def _after_intervention(payload: Dict[str, Any]):
+    if payload.get("patient_updates"):
+        patient_service.after_update(payload["intervention"].get("patient_id"), payload["patient_updates"])
+
+
+def _add_notification(batch, payload: Dict[str, Any]):
+    notification_service.add_to_batch(
+        batch, payload["patient_id"], payload["notification"], payload.get("notification_id")
+    )
+
+
+def _add_scheduled_job(batch, payload: Dict[str, Any]):
+    scheduler_service.add_to_batch(batch, payload["job"])
+
+
+def create_write_behind_queue() -> WriteBehindQueue:
+    """Create the queue configured by WRITE_BEHIND_PATH with the standard write kinds"""
+    queue = WriteBehindQueue(config.WRITE_BEHIND_PATH)
+    queue.register("intervention", WriteHandler(
+        _add_intervention, _after_intervention, writes=2, prepare=_prepare_interventions
+    ))
+    queue.register("notification", WriteHandler(_add_notification))
+    queue.register("scheduled_job", WriteHandler(_add_scheduled_job))
+    return queue
+
+
+# Global write-behind queue instance
+write_behind = create_write_behind_queue()
@@ -5,14 +5,16 @@ import json
 import logging
 from datetime import datetime
 from firebase_functions import https_fn, options
-from firebase_admin import initialize_app, firestore
+from firebase_admin import initialize_app
 import sys
 import os
 
 # Add backend to path to import existing modules
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from backend.firebase_client import adherence_service, patient_service
+from backend.analytics.anomaly import needs_workflow
+from backend.firebase_client import adherence_service
+from backend.image_store import image_store
 from backend.agents.agent_init import orchestrator
 
 # Initialize Firebase Admin
@@ -73,7 +75,15 @@ def api_patient_action(req: https_fn.Request) -> https_fn.Response:
         return https_fn.Response("", status=204)
     
     try:
-        data = req.get_json()
+        # Store photos once and pass image IDs from here on
+        try:
+            data = image_store.externalize_images(req.get_json())
+        except ValueError as e:
+            return https_fn.Response(
+                json.dumps({"status": "error", "message": str(e)}),
+                status=400,
+                mimetype="application/json"
+            )
         patient_id = data.get("patient_id")
         action = data.get("action")
         
@@ -83,8 +93,10 @@ def api_patient_action(req: https_fn.Request) -> https_fn.Response:
         log_id = adherence_service.log_action(data)
         logger.info(f"Action logged to Firebase: {log_id}")
         
+        triage = data.get("triage")
+        
         # Trigger agent workflow if appropriate
-        if orchestrator and action in ["skipped", "snoozed"]:
+        if orchestrator and needs_workflow(data, triage):
             logger.info(f"Triggering agent workflow for {action} action")
             
             workflow_id = f"wf_{patient_id}_{action}_{data.get('timestamp', '').replace(':', '').replace('-', '').replace('Z', '')[:14]}"
@@ -105,6 +117,7 @@ def api_patient_action(req: https_fn.Request) -> https_fn.Response:
                     "status": "success",
                     "message": "Action logged and workflow completed",
                     "workflow_id": workflow_id,
+                    "triage": triage,
                     "result": serialize_workflow_result(workflow_result)
                 }),
                 status=200,
@@ -115,7 +128,8 @@ def api_patient_action(req: https_fn.Request) -> https_fn.Response:
                 json.dumps({
                     "status": "success",
                     "message": "Action logged successfully",
-                    "agent_triggered": False
+                    "agent_triggered": False,
+                    "triage": triage
                 }),
                 status=200,
                 mimetype="application/json"
@@ -0,0 +1,107 @@
+"""
+Benchmark: adherence statistics by streaming logs vs server-side count() aggregations
+
+Runs against the configured Firestore project (or the emulator when
+FIRESTORE_EMULATOR_HOST is set). Each size gets a synthetic patient
+"bench_<size>" whose logs are written on the first run and reused after.
+
+Usage:
+    python tests/benchmark_adherence_stats.py [sizes...] [--days N] [--repeat N]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.analytics import rollups
+from backend.firebase_client import FIRESTORE_BATCH_LIMIT, VALID_ACTIONS, adherence_service
+
+# Firestore bills one read per this many index entries counted by an aggregation
+AGGREGATION_ENTRIES_PER_READ = 1000
+
+
+def seed_patient(patient_id: str, count: int, days: int):
+    """Write `count` synthetic logs spread over the last `days` days (once)"""
+    since = datetime.utcnow() - timedelta(days=days)
+    if adherence_service.count_actions(patient_id, since)["total_doses"] >= count:
+        return
+
+    random.seed(count)
+    db = adherence_service.db
+    collection = db.collection(adherence_service.collection)
+    for start in range(0, count, FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for i in range(start, min(start + FIRESTORE_BATCH_LIMIT, count)):
+            timestamp = since + timedelta(seconds=random.randint(60, days * 86400 - 60))
+            batch.set(collection.document(f"{patient_id}_{i}"), {
+                "patient_id": patient_id,
+                "medication_id": "med_bench",
+                "action": random.choices(VALID_ACTIONS, weights=(85, 10, 5))[0],
+                "reason": None,
+                "timestamp": timestamp.isoformat(),
+                "notes": "synthetic benchmark log"
+            })
+        batch.commit()
+
+
+def streaming_stats(patient_id: str, days: int):
+    """The previous fallback: stream every log row in the window and count client-side"""
+    rows = list(adherence_service.stream_patient_logs(patient_id, days=days))
+    transferred = sum(len(json.dumps(row._asdict(), default=str)) for row in rows)
+    return rollups.summarize_logs(row._asdict() for row in rows), len(rows), transferred
+
+
+def aggregation_stats(patient_id: str, days: int):
+    """count() per action plus the total; only the counts are transferred"""
+    counts = adherence_service.count_actions(patient_id, datetime.utcnow() - timedelta(days=days))
+    billed = sum(
+        max(1, math.ceil(counts[key] / AGGREGATION_ENTRIES_PER_READ))
+        for key in ("total_doses", "took_doses", "skipped_doses", "snoozed_doses")
+    )
+    return counts, billed, len(json.dumps(counts))
+
+
+def best_of(repeat: int, fn, *args):
+    """Fastest of `repeat` runs (network jitter only ever adds time)"""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=[1_000, 10_000, 50_000])
+    parser.add_argument("--days", type=int, default=365, help="History spread and statistics window")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'logs':>8} {'stream (s)':>11} {'reads':>7} {'bytes':>11} "
+          f"{'count (s)':>10} {'reads':>6} {'bytes':>6} {'speedup':>8}")
+    for size in args.sizes:
+        patient_id = f"bench_{size}"
+        seed_patient(patient_id, size, args.days)
+
+        stream_time, (stream_counts, stream_reads, stream_bytes) = best_of(
+            args.repeat, streaming_stats, patient_id, args.days
+        )
+        count_time, (counts, count_reads, count_bytes) = best_of(
+            args.repeat, aggregation_stats, patient_id, args.days
+        )
+        assert counts == stream_counts, (counts, stream_counts)
+
+        print(f"{size:>8} {stream_time:>11.3f} {stream_reads:>7} {stream_bytes:>11} "
+              f"{count_time:>10.3f} {count_reads:>6} {count_bytes:>6} {stream_time / count_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
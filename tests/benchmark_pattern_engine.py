@@ -0,0 +1,76 @@
+"""
+Microbenchmark: legacy per-log pattern analysis vs the vectorized pattern engine
+
+Usage:
+    python tests/benchmark_pattern_engine.py [sizes...]
+"""
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.analytics.pattern_engine import analyze_patterns
+
+REASONS = ["forgot", "ran_out", "side_effects", "timing_conflict", None]
+
+
+def generate_logs(count: int):
+    """Synthetic skipped-dose logs spread over several years"""
+    random.seed(42)
+    start = datetime(2022, 1, 1)
+    return [
+        {
+            "action": "skipped",
+            "timestamp": (start + timedelta(minutes=random.randint(0, 60 * 24 * 365 * 4))).isoformat(),
+            "reason": random.choice(REASONS)
+        }
+        for _ in range(count)
+    ]
+
+
+def legacy_patterns(logs):
+    """The original InvestigationAgent loops: parse every timestamp twice, then Counter"""
+    days = []
+    for log in logs:
+        dt = datetime.fromisoformat(log["timestamp"].replace('Z', '+00:00'))
+        days.append(dt.strftime("%A"))
+
+    times = []
+    for log in logs:
+        hour = datetime.fromisoformat(log["timestamp"].replace('Z', '+00:00')).hour
+        if 5 <= hour < 12:
+            times.append("morning")
+        elif 12 <= hour < 17:
+            times.append("afternoon")
+        elif 17 <= hour < 21:
+            times.append("evening")
+        else:
+            times.append("night")
+
+    reasons = Counter(log.get("reason", "unknown") for log in logs)
+    return Counter(days).most_common(1), Counter(times).most_common(1), reasons.most_common(1)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+
+    print(f"{'logs':>10} {'legacy (s)':>12} {'engine (s)':>12} {'speedup':>9}")
+    for size in sizes:
+        logs = generate_logs(size)
+        legacy = timed(legacy_patterns, logs)
+        engine = timed(analyze_patterns, logs, "America/New_York")
+        print(f"{size:>10} {legacy:>12.3f} {engine:>12.3f} {legacy / engine:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Tests for adherence statistics from rollups and count() aggregations
+"""
+from datetime import date, datetime, timedelta
+
+from backend import firebase_client
+from backend.analytics import rollups
+from backend.firebase_client import AdherenceService
+
+OPS = {
+    "==": lambda a, b: a == b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b
+}
+
+
+class FakeAggregation:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeQuery:
+    """Filters in-memory logs; count() is the only way to read them"""
+
+    def __init__(self, logs, counted, filters=()):
+        self.logs = logs
+        self.counted = counted
+        self.filters = list(filters)
+
+    def where(self, filter=None):
+        return FakeQuery(self.logs, self.counted, self.filters + [filter])
+
+    def stream(self):
+        raise AssertionError("statistics must not stream log documents")
+
+    def count(self, alias=None):
+        return self
+
+    def get(self):
+        self.counted.append([(f.field_path, f.op_string, f.value) for f in self.filters])
+        matching = [
+            log for log in self.logs
+            if all(OPS[f.op_string](log.get(f.field_path), f.value) for f in self.filters)
+        ]
+        return [[FakeAggregation(len(matching))]]
+
+
+class FakeDB:
+    def __init__(self, logs):
+        self.counted = []
+        self.logs = logs
+
+    def collection(self, name):
+        return FakeQuery(self.logs, self.counted)
+
+
+class FakeAdherenceService(AdherenceService):
+    def __init__(self, logs):
+        super().__init__()
+        self._db = FakeDB(logs)
+
+    @property
+    def db(self):
+        return self._db
+
+
+def _log(action, timestamp, patient_id="p001"):
+    return {"patient_id": patient_id, "action": action, "timestamp": timestamp}
+
+
+def test_counts_come_from_parallel_aggregations():
+    recent = (datetime.utcnow() - timedelta(days=1)).isoformat()
+    service = FakeAdherenceService([
+        _log("took", recent), _log("took", recent), _log("skipped", recent), _log("paused", recent),
+        _log("took", "2020-01-01T08:00:00"), _log("took", recent, patient_id="p002")
+    ])
+
+    counts = service.count_actions("p001", datetime.utcnow() - timedelta(days=7))
+
+    assert counts == {"total_doses": 4, "took_doses": 2, "skipped_doses": 1, "snoozed_doses": 0}
+    actions = sorted(f[2] for filters in service.db.counted for f in filters if f[0] == "action")
+    assert len(service.db.counted) == 4 and actions == ["skipped", "snoozed", "took"]
+
+
+def test_missing_rollup_uses_aggregations(monkeypatch):
+    monkeypatch.setattr(firebase_client.rollup_service, "get_rollup", lambda patient_id: None)
+    recent = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+    service = FakeAdherenceService([_log("took", recent)] * 3 + [_log("snoozed", recent)])
+
+    stats = service.calculate_adherence_rate("p001", days=7)
+
+    assert stats["source"] == "aggregation" and stats["adherence_rate"] == 75.0
+
+
+def test_ad_hoc_ranges_use_rollup_buckets_within_retention(monkeypatch):
+    today = date(2026, 10, 19)
+    monkeypatch.setattr(rollups, "local_today", lambda timezone: today)
+    rollup = {
+        "timezone": "America/New_York",
+        "daily": {
+            (today - timedelta(days=3)).isoformat(): {"actions": {"took": 2, "skipped": 2}},
+            (today - timedelta(days=1)).isoformat(): {"actions": {"took": 4}},
+            today.isoformat(): {"actions": {"took": 1}}
+        }
+    }
+    monkeypatch.setattr(firebase_client.config, "ROLLUP_RETENTION_DAYS", 120)
+    monkeypatch.setattr(firebase_client.rollup_service, "get_rollup", lambda patient_id: rollup)
+    service = FakeAdherenceService([
+        _log("took", "2026-03-08T04:30:00"), _log("skipped", "2026-03-08T05:30:00"),
+        _log("took", "2026-03-10T03:59:00"), _log("took", "2026-03-10T04:00:00")
+    ])
+
+    stats = service.calculate_adherence_rate("p001", start_date=today - timedelta(days=3),
+                                             end_date=today - timedelta(days=1))
+    assert stats["source"] == "rollup" and stats["period_days"] == 3
+    assert stats["took_doses"] == 6 and stats["total_doses"] == 8 and not service.db.counted
+
+    # Older than the daily buckets: count local days 2026-03-08..09 (DST starts on the 8th)
+    stats = service.calculate_adherence_rate("p001", start_date=date(2026, 3, 8), end_date=date(2026, 3, 9))
+    assert stats["source"] == "aggregation" and stats["end_date"] == "2026-03-09"
+    assert stats["took_doses"] == 1 and stats["skipped_doses"] == 1
+    assert ("timestamp", ">=", "2026-03-08T05:00:00") in service.db.counted[0]
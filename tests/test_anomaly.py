@@ -0,0 +1,76 @@
+"""
+Tests for the streaming anomaly detector that triages logged actions
+"""
+from backend.analytics import anomaly
+from backend.review_admin import group_by_patient, review_trigger
+
+
+def _run(actions, state=None, minute=8 * 60):
+    state = state or anomaly.new_state()
+    decisions = []
+    for action in actions:
+        minute_of_action = minute(len(decisions)) if callable(minute) else minute
+        state, signals = anomaly.update(state, action, minute_of_action)
+        decisions.append(anomaly.triage(action, None, signals)[0])
+    return state, decisions
+
+
+def test_isolated_miss_is_acknowledged_after_warmup():
+    state, decisions = _run(["took"] * 20 + ["skipped"] + ["took"] * 10 + ["snoozed"])
+
+    assert decisions[20] == anomaly.ACKNOWLEDGE
+    assert decisions[-1] == anomaly.ACKNOWLEDGE
+    assert state["observations"] == 32
+
+
+def test_new_patients_and_urgent_reasons_get_the_workflow():
+    _, decisions = _run(["skipped"])
+    assert decisions == [anomaly.WORKFLOW]
+
+    state, _ = _run(["took"] * 20)
+    _, signals = anomaly.update(state, "took", 8 * 60)
+    assert anomaly.triage("took", "side_effects", signals)[0] == anomaly.WORKFLOW
+
+
+def test_deterioration_escalates_to_the_workflow():
+    state, _ = _run(["took"] * 30)
+    _, decisions = _run(["skipped", "took", "skipped", "skipped"], state)
+
+    assert decisions[0] == anomaly.ACKNOWLEDGE
+    assert anomaly.WORKFLOW in decisions[1:]
+
+
+def test_timing_drift_is_deferred_for_review():
+    # Usually at 08:00, then drifting an hour later every day
+    state, decisions = _run(["took"] * 10 + ["took"] * 4, minute=lambda i: 8 * 60 + max(0, i - 9) * 60)
+
+    assert decisions[:10] == [anomaly.ACKNOWLEDGE] * 10
+    assert anomaly.DEFER in decisions[10:]
+
+
+def test_local_minute_uses_patient_timezone():
+    assert anomaly.local_minute("2026-03-10T12:05:00Z", "America/New_York") == 8 * 60 + 5
+    assert anomaly.local_minute("", "UTC") is None
+
+
+def test_deferred_reviews_become_one_trigger_per_patient():
+    reviews = [
+        {"review_id": "r1", "patient_id": "p001", "log_id": "l1", "action": "skipped", "triage_reason": "a"},
+        {"review_id": "r2", "patient_id": "p002", "log_id": "l2", "action": "took", "triage_reason": "b"},
+        {"review_id": "r3", "patient_id": "p001", "log_id": "l3", "action": "snoozed", "triage_reason": "a"},
+    ]
+
+    grouped = group_by_patient(reviews)
+    trigger = review_trigger("p001", grouped["p001"])
+
+    assert list(grouped) == ["p001", "p002"]
+    assert trigger["action"] == "snoozed"
+    assert trigger["deferred_review"] == {"count": 2, "log_ids": ["l1", "l3"], "triage_reasons": ["a"]}
+
+
+def test_triage_decision_gates_the_workflow():
+    skip = {"action": "skipped"}
+
+    assert anomaly.needs_workflow(skip) and not anomaly.needs_workflow({"action": "took"})
+    assert not anomaly.needs_workflow(skip, {"decision": anomaly.ACKNOWLEDGE})
+    assert anomaly.needs_workflow({"action": "took"}, {"decision": anomaly.WORKFLOW})
@@ -0,0 +1,198 @@
+"""
+Tests for bulk adherence log ingestion
+"""
+import itertools
+
+from backend import firebase_client
+from backend.firebase_client import AdherenceService, action_error
+
+
+class FakeRef:
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def create(self, ref, data):
+        self.writes.append(("create", ref.id, data))
+
+    def set(self, ref, data, merge=False):
+        self.writes.append(("set", ref.id, data))
+
+    def commit(self):
+        if self.db.fail_commits:
+            self.db.fail_commits -= 1
+            self.db.stored.update(self.db.stored_meanwhile)
+            raise RuntimeError("ALREADY_EXISTS")
+        created = [doc_id for kind, doc_id, _ in self.writes if kind == "create"]
+        assert not self.db.stored.intersection(created)
+        self.db.stored.update(created)
+        for _, doc_id, data in self.writes:
+            merge(self.db.data.setdefault(doc_id, {}), data)
+        self.db.commits.append(self.writes)
+
+
+def merge(target, data):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+
+
+class FakeDB:
+    """Documents are tracked by ID only; every collection shares them"""
+
+    def __init__(self, stored=()):
+        self.stored = set(stored)
+        self.data = {}
+        self.stored_meanwhile = set()
+        self.fail_commits = 0
+        self.commits = []
+        self._ids = itertools.count()
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id=None):
+        return FakeRef(doc_id or f"auto_{next(self._ids)}")
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, refs, transaction=None):
+        return [
+            FakeSnapshot(ref.id, self.data.get(ref.id, {}) if ref.id in self.stored else self.data.get(ref.id))
+            for ref in refs
+        ]
+
+
+class FakeAdherenceService(AdherenceService):
+    def __init__(self, db):
+        super().__init__()
+        self._db = db
+
+    @property
+    def db(self):
+        return self._db
+
+    def run_transaction(self, write):
+        transaction = self._db.batch()
+        write(transaction)
+        transaction.commit()
+
+
+def _service(monkeypatch, db):
+    monkeypatch.setattr(firebase_client.config, "TRIAGE_ENABLED", False)
+    monkeypatch.setattr(firebase_client.config, "ROLLUPS_ENABLED", True)
+    monkeypatch.setattr(firebase_client.config, "LEARNING_BATCH_ENABLED", True)
+    monkeypatch.setattr(
+        firebase_client.rollup_service, "get_stored_days",
+        lambda patient_ids, transaction: {patient_id: [] for patient_id in patient_ids}
+    )
+    monkeypatch.setattr(
+        firebase_client.rollup_service, "add_logs_to_batch",
+        lambda batch, patient_id, logs, days: batch.set(FakeRef(f"rollup_{patient_id}"), {"logs": len(logs)})
+    )
+    monkeypatch.setattr(firebase_client.learning_job_service, "get_pending", lambda patient_ids, transaction: set())
+    monkeypatch.setattr(
+        firebase_client.learning_job_service, "add_to_batch",
+        lambda batch, action, pending: batch.set(FakeRef(f"job_{action['patient_id']}"), action)
+    )
+    return FakeAdherenceService(db)
+
+
+def _action(patient_id="p001", hour=8, **fields):
+    return {
+        "patient_id": patient_id,
+        "medication_id": "m1",
+        "action": "took",
+        "timestamp": f"2026-03-10T{hour:02d}:00:00Z",
+        **fields
+    }
+
+
+def test_invalid_and_duplicate_actions_are_reported_per_item(monkeypatch):
+    db = FakeDB(stored={"k-stored"})
+    service = _service(monkeypatch, db)
+
+    results = service.log_actions([
+        _action(idempotency_key="k1"),
+        _action(action="ate"),
+        _action(idempotency_key="k1"),
+        _action(idempotency_key="k-stored"),
+        _action(timestamp="yesterday"),
+        _action(idempotency_key="a/b"),
+        "took",
+        _action(hour=7)
+    ])
+
+    assert [r["status"] for r in results] == [
+        "created", "invalid", "duplicate", "duplicate", "invalid", "invalid", "invalid", "created"
+    ]
+    assert results[0]["log_id"] == "k1" and results[3]["log_id"] == "k-stored"
+    assert action_error({"patient_id": "p001", "medication_id": "m1", "action": "ate"}).startswith("action")
+
+    # One batch: both logs, one rollup and one learning job for the later dose
+    writes = db.commits[0]
+    assert [w[1] for w in writes if w[0] == "create"] == [results[7]["log_id"], "k1"]
+    assert ("set", "rollup_p001", {"logs": 2}) in writes
+    assert [w[2]["timestamp"] for w in writes if w[1] == "job_p001"] == ["2026-03-10T08:00:00Z"]
+
+
+def test_batches_stay_within_the_write_limit(monkeypatch):
+    db = FakeDB()
+    service = _service(monkeypatch, db)
+    actions = [_action(f"p{i % 7}", hour=i % 24, idempotency_key=f"k{i}") for i in range(1200)]
+
+    results = service.log_actions(actions)
+
+    assert all(r["status"] == "created" for r in results) and len(db.stored) == 1200
+    assert len(db.commits) == 5  # ~240 actions per batch at two writes each
+    assert all(len(writes) <= firebase_client.FIRESTORE_BATCH_LIMIT for writes in db.commits)
+    for writes in db.commits:
+        rollups = [w[1] for w in writes if w[1].startswith("rollup_")]
+        assert len(rollups) == len(set(rollups))
+
+
+def test_failed_batch_skips_logs_stored_meanwhile_then_gives_up(monkeypatch):
+    db = FakeDB()
+    service = _service(monkeypatch, db)
+
+    db.fail_commits, db.stored_meanwhile = 1, {"k2"}
+    results = service.log_actions([_action(idempotency_key=f"k{i}", hour=8 + i) for i in range(3)])
+    assert [r["status"] for r in results] == ["created", "created", "duplicate"]
+    assert len(db.commits) == 1
+
+    db.fail_commits = 2
+    results = service.log_actions([_action(idempotency_key="k9"), _action("p002")])
+    assert [r["status"] for r in results] == ["failed", "failed"]
+    assert results[0]["error"] == "ALREADY_EXISTS" and "k9" not in db.stored
+
+
+def test_detector_state_is_read_from_the_store_by_every_process(monkeypatch):
+    db = FakeDB()
+    first, second = _service(monkeypatch, db), _service(monkeypatch, db)
+    monkeypatch.setattr(firebase_client.config, "TRIAGE_ENABLED", True)
+    monkeypatch.setattr(firebase_client.rollup_service, "timezone_for", lambda patient_id: "UTC")
+    monkeypatch.setattr(type(firebase_client.triage_service), "db", property(lambda self: db))
+
+    first.log_actions([_action(hour=h) for h in range(10)])
+    results = second.log_actions([_action(hour=h, action="skipped") for h in range(10, 12)])
+
+    assert db.data["p001"]["medications"]["m1"]["observations"] == 12
+    assert all(r["triage"]["decision"] for r in results)
@@ -0,0 +1,124 @@
+"""
+Tests for the workflow-scoped data context
+"""
+from datetime import datetime, timedelta
+
+from backend.agents import data_context
+from backend.agents.base_agent import AgentOrchestrator, AgentType
+from backend.agents.investigation_agent import InvestigationAgent
+from backend.agents.learning_agent import LearningAgent
+from backend.analytics import rollups
+from backend.models import LogRow
+
+
+def _logs():
+    now = datetime.utcnow()
+    return [
+        LogRow(
+            log_id=f"log_{day}",
+            action="skipped" if day % 3 == 0 else "took",
+            reason="forgot" if day % 3 == 0 else None,
+            timestamp=(now - timedelta(days=day, hours=1)).isoformat()
+        )
+        for day in range(30)
+    ]
+
+
+class CountingFirestore:
+    """Records each service call the context makes"""
+
+    def __init__(self):
+        self.calls = []
+
+    def stream_patient_logs(self, patient_id, days=None, action_type=None, page_size=None):
+        self.calls.append(("logs", days))
+        cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+        return iter([log for log in _logs() if log.timestamp >= cutoff])
+
+    def get_patient(self, patient_id):
+        self.calls.append(("patient",))
+        return {"patient_id": patient_id, "timezone": "UTC"}
+
+    def get_patient_interventions(self, patient_id, limit=10):
+        self.calls.append(("interventions", limit))
+        return []
+
+
+def _patch(monkeypatch):
+    firestore = CountingFirestore()
+    monkeypatch.setattr(data_context.config, "ROLLUPS_ENABLED", False)
+    monkeypatch.setattr(data_context.adherence_service, "stream_patient_logs", firestore.stream_patient_logs)
+    monkeypatch.setattr(data_context.patient_service, "get_patient", firestore.get_patient)
+    monkeypatch.setattr(
+        data_context.intervention_service, "get_patient_interventions", firestore.get_patient_interventions
+    )
+    return firestore
+
+
+def test_logs_are_loaded_once_and_sliced(monkeypatch):
+    firestore = _patch(monkeypatch)
+    context = data_context.WorkflowDataContext("p001", log_window_days=30)
+
+    assert len(context.logs()) == 30
+    assert len(context.logs(days=7)) == 7
+    assert context.adherence_stats(days=7)["total_doses"] == 7
+    assert firestore.calls == [("logs", 30)]
+    assert context.read_stats()["by_collection"]["adherence_logs"] == {"queries": 1, "documents": 30}
+
+
+def test_wider_window_reloads_once(monkeypatch):
+    firestore = _patch(monkeypatch)
+    context = data_context.WorkflowDataContext("p001", log_window_days=7)
+
+    context.logs(days=7)
+    context.logs(days=14)
+    context.logs(days=10)
+
+    assert firestore.calls == [("logs", 7), ("logs", 14)]
+
+
+def test_workflow_reads_each_source_once(monkeypatch):
+    firestore = _patch(monkeypatch)
+    orchestrator = AgentOrchestrator()
+    orchestrator.register_agent(InvestigationAgent())
+    orchestrator.register_agent(LearningAgent())
+
+    result = orchestrator.execute_workflow(
+        {"patient_id": "p001", "action": "snoozed"},
+        agents_to_run=[AgentType.INVESTIGATION, AgentType.LEARNING]
+    )
+
+    assert result["state"] == "completed"
+    assert "data_context" not in result["trigger"]
+    assert sorted(firestore.calls) == [("interventions", 10), ("logs", 90), ("patient",)]
+    assert result["data_reads"]["queries"] == 3
+
+
+def test_investigation_answered_by_the_rollup_reads_only_the_calendar_window(monkeypatch):
+    firestore = _patch(monkeypatch)
+    rollup = rollups.build_rollup(
+        "p001", [{**log._asdict(), "medication_id": "m1"} for log in _logs()], "UTC", 120
+    )
+    monkeypatch.setattr(data_context.config, "ROLLUPS_ENABLED", True)
+    monkeypatch.setattr(data_context.rollup_service, "get_rollup", lambda patient_id: rollup)
+    monkeypatch.setattr(
+        data_context.patient_service, "get_patient",
+        lambda patient_id: {"patient_id": patient_id, "timezone": "UTC",
+                            "medications": [{"medication_id": "m1", "frequency": "QD"}]}
+    )
+
+    def investigate():
+        context = data_context.WorkflowDataContext("p001", log_window_days=90)
+        result = InvestigationAgent().process({"patient_id": "p001", "action": "skipped", "data_context": context})
+        return result, [call for call in firestore.calls if call[0] == "logs"]
+
+    monkeypatch.setattr(data_context.config, "INVESTIGATION_DOSE_CALENDAR", True)
+    result, log_reads = investigate()
+    assert result["dose_calendar"]["expected_doses"] and log_reads == [("logs", 30)]
+
+    firestore.calls.clear()
+    monkeypatch.setattr(data_context.config, "INVESTIGATION_DOSE_CALENDAR", False)
+    result, log_reads = investigate()
+    assert result["dose_calendar"] is None and log_reads == []
+    assert result["medication_patterns"]["m1"]["skipped_count"] == rollup["actions"]["skipped"]
+    assert result["root_cause_medications"] == ["m1"]
@@ -0,0 +1,90 @@
+"""
+Tests for the expected-dose calendar
+"""
+from datetime import datetime, timedelta
+
+from backend.agents.investigation_agent import InvestigationAgent
+from backend.analytics.dose_calendar import DoseCalendar, daily_minutes
+from backend.models import LogRow
+from tests.test_multi_window import PresetContext
+
+MEDICATIONS = [
+    {"medication_id": "med_a", "frequency": "BID", "scheduled_times": ["08:00", "20:00"]},
+    {"medication_id": "med_b", "frequency": "QD", "scheduled_times": []},
+    {"medication_id": "med_c", "frequency": "PRN", "scheduled_times": ["09:00"]},
+]
+
+
+def test_schedule_defaults_and_as_needed():
+    assert daily_minutes(MEDICATIONS[0]) == [8 * 60, 20 * 60]
+    assert daily_minutes(MEDICATIONS[1]) == [8 * 60]
+    assert daily_minutes(MEDICATIONS[2]) == []
+
+
+def test_slots_are_classified_across_a_dst_change():
+    # New York switches to daylight time on 2026-03-08
+    logs = [
+        {"action": "took", "medication_id": "med_a", "timestamp": "2026-03-10T12:05:00Z"},
+        {"action": "took", "medication_id": "med_a", "timestamp": "2026-03-10T02:30:00Z"},
+        {"action": "skipped", "medication_id": "med_b", "timestamp": "2026-03-09T12:00:00Z"},
+        {"action": "took", "medication_id": "med_x", "timestamp": "2026-03-09T12:00:00Z"},
+    ]
+
+    calendar = DoseCalendar(MEDICATIONS, logs, "America/New_York", 3, now=datetime(2026, 3, 10, 18, 0))
+    slots = {(s["medication_id"], s["local"]): s for s in calendar.slots()}
+
+    assert slots[("med_a", "2026-03-07T20:00")]["scheduled"] == "2026-03-08T01:00:00"
+    assert slots[("med_a", "2026-03-08T20:00")]["scheduled"] == "2026-03-09T00:00:00"
+    assert slots[("med_a", "2026-03-10T08:00")]["status"] == "taken"
+    assert slots[("med_a", "2026-03-09T20:00")]["status"] == "late"
+    assert slots[("med_a", "2026-03-09T20:00")]["delay_minutes"] == 150
+    assert slots[("med_b", "2026-03-09T08:00")]["status"] == "skipped"
+    assert slots[("med_b", "2026-03-10T08:00")]["status"] == "pending"
+
+    summary = calendar.summary()
+    assert {k: summary[k] for k in ("expected_doses", "taken", "late", "skipped", "unlogged", "pending")} == {
+        "expected_doses": 9, "taken": 1, "late": 1, "skipped": 1, "unlogged": 5, "pending": 1
+    }
+    assert summary["unscheduled_logs"] == 1
+    assert summary["by_medication"]["med_a"]["dose_adherence_rate"] == round(2 / 6 * 100, 2)
+
+
+def test_a_year_of_doses_taken_on_time():
+    now = datetime(2026, 6, 1, 23, 0)
+    logs = [
+        {"action": "took", "medication_id": "med_a", "timestamp": (day + timedelta(hours=hour, minutes=10)).isoformat()}
+        for day in (datetime(2025, 5, 30) + timedelta(days=d) for d in range(368))
+        for hour in (8, 20)
+        if day + timedelta(hours=hour) <= now
+    ]
+
+    summary = DoseCalendar(MEDICATIONS[:1], logs, "UTC", 365, now=now).summary()
+
+    assert summary["expected_doses"] == 730
+    assert summary["taken"] == 730
+    assert summary["unscheduled_logs"] == 0
+
+
+class ScheduledContext(PresetContext):
+    """Preset logs plus a patient profile with a medication schedule"""
+
+    def patient(self):
+        return {"patient_id": "p002", "medications": MEDICATIONS[:2]}
+
+
+def test_silent_misses_become_a_memory_root_cause():
+    today = datetime.utcnow().date()
+    # med_b is taken every day, med_a is never logged at all
+    logs = [
+        LogRow(f"b_{d}", "took", None, f"{(today - timedelta(days=d)).isoformat()}T08:05:00", "med_b")
+        for d in range(1, 20)
+    ]
+
+    agent = InvestigationAgent()
+    result = agent.process({"patient_id": "p002", "action": "took", "data_context": ScheduledContext(logs)})
+
+    assert result["pattern_detected"] is True
+    assert result["dose_calendar"]["by_medication"]["med_b"]["unlogged"] <= 11
+    assert result["root_cause"].startswith("Memory/reminder")
+    assert result["root_cause_medications"][0] == "med_a"
+    assert "Increase reminder frequency" in result["recommendations"]
@@ -0,0 +1,164 @@
+"""
+Tests for searchsorted-based intervention effectiveness scoring
+"""
+from datetime import datetime, timedelta, timezone
+
+from backend.analytics.effectiveness import effectiveness_scores, intervention_times
+
+NOW = datetime(2026, 3, 20, 12, 0)
+
+
+def _logs():
+    # Hourly-ish logs over 20 days; adherence improves in the last week
+    return [
+        {
+            "action": "took" if (d < 7 and h % 5) or h % 2 else "skipped",
+            "timestamp": (NOW - timedelta(days=d, hours=h * 3)).isoformat()
+        }
+        for d in range(20)
+        for h in range(8)
+    ]
+
+
+def _per_intervention(logs, intervention_dt):
+    """The fixed-window formula, one intervention at a time"""
+    def window(start, end):
+        return [l for l in logs if start <= datetime.fromisoformat(l["timestamp"]) < end]
+
+    before = window(intervention_dt - timedelta(days=7), intervention_dt)
+    after = window(intervention_dt, intervention_dt + timedelta(days=7))
+    before_rate = len([l for l in before if l["action"] == "took"]) / len(before) * 100 if before else 0
+    after_rate = len([l for l in after if l["action"] == "took"]) / len(after) * 100 if after else 0
+    return (after_rate - before_rate) / 100
+
+
+def test_scores_match_the_per_intervention_formula():
+    logs = _logs()
+    interventions = [{"created_at": NOW - timedelta(days=d, hours=5)} for d in (3, 5, 9, 13, 30)]
+
+    scores = effectiveness_scores(logs, intervention_times(interventions))
+
+    for intervention, result in zip(interventions, scores):
+        assert result["score"] == _per_intervention(logs, intervention["created_at"])
+
+
+def test_aware_times_and_missing_dates():
+    logs = _logs()
+    aware = NOW.replace(tzinfo=timezone.utc) - timedelta(days=5)
+    interventions = [{"created_at": aware}, {"created_at": (NOW - timedelta(days=5)).isoformat() + "Z"}, {}]
+
+    scores = effectiveness_scores(logs, intervention_times(interventions))
+
+    assert scores[0] == scores[1]
+    assert scores[0]["score"] == _per_intervention(logs, NOW - timedelta(days=5))
+    assert scores[2] is None
+
+
+def test_worker_counts_only_logs_written_after_the_intervention():
+    from backend.analytics import effectiveness
+    from backend.effectiveness_worker import count_logs
+
+    anchor = NOW - timedelta(days=8)
+    counters = effectiveness.initial_counters(
+        [{"action": "took", "timestamp": (anchor - timedelta(days=1)).isoformat()}], anchor
+    )
+    intervention = {"intervention_id": "i1", "patient_id": "p001", "effectiveness": counters}
+
+    logs = [
+        # Written before the intervention - already backfilled
+        {"patient_id": "p001", "action": "took", "timestamp": (anchor - timedelta(days=2)).isoformat(),
+         "created_at": anchor - timedelta(days=2)},
+        {"patient_id": "p001", "action": "skipped", "timestamp": (anchor + timedelta(days=1)).isoformat(),
+         "created_at": anchor + timedelta(days=1)},
+        {"patient_id": "p001", "action": "took", "timestamp": (anchor + timedelta(days=2)).isoformat(),
+         "created_at": (anchor + timedelta(days=2)).replace(tzinfo=timezone.utc)},
+        # Outside the after window
+        {"patient_id": "p001", "action": "took", "timestamp": (anchor + timedelta(days=7, hours=1)).isoformat(),
+         "created_at": anchor + timedelta(days=7, hours=1)},
+        {"patient_id": "p002", "action": "took", "timestamp": anchor.isoformat(), "created_at": anchor},
+    ]
+
+    increments = count_logs(logs, [intervention])
+    assert increments == {"i1": {"before_took": 0, "before_total": 0, "after_took": 1, "after_total": 2}}
+
+    final = effectiveness.add_counts(counters, increments["i1"])
+    assert effectiveness.is_due(final, NOW)
+    assert effectiveness.seal(final, NOW)["score"] == (50.0 - 100.0) / 100
+
+
+def test_worker_skips_logs_an_earlier_partial_pass_counted():
+    from backend.analytics import effectiveness
+    from backend.effectiveness_worker import count_logs
+
+    anchor = NOW - timedelta(days=3)
+    counters = effectiveness.initial_counters([], anchor)
+    logs = [
+        {"log_id": f"l{i}", "patient_id": "p001", "action": "took",
+         "timestamp": (anchor + timedelta(hours=i)).isoformat(), "created_at": anchor + timedelta(hours=i // 2 + 1)}
+        for i in range(4)
+    ]
+    # The increments for l0..l2 were committed, but the worker cursor was not
+    counted = {**counters, "last_log_cursor": {"created_at": logs[2]["created_at"], "log_ids": ["l2"]}}
+
+    increments = count_logs(logs, [{"intervention_id": "i1", "patient_id": "p001", "effectiveness": counted}])
+    assert increments["i1"]["after_total"] == 1
+
+
+def test_scores_from_logs_match_the_counters():
+    from backend.analytics import effectiveness
+
+    logs = _logs()
+    anchor = NOW - timedelta(days=9, hours=5)
+    scores = effectiveness_scores(logs, intervention_times([{"created_at": anchor}]))
+
+    counters = effectiveness.initial_counters(logs, anchor)
+    assert effectiveness.counters_score(counters) == scores[0]
+
+
+def test_worker_skips_logs_written_before_the_backfill():
+    from backend.analytics import effectiveness
+    from backend.effectiveness_worker import count_logs
+
+    anchor = NOW - timedelta(days=3)
+    # Queued at `anchor`, flushed (and backfilled) an hour later
+    counters = effectiveness.initial_counters([], anchor, anchor + timedelta(hours=1))
+    logs = [
+        {"patient_id": "p001", "action": "took", "timestamp": (anchor + timedelta(minutes=m)).isoformat(),
+         "created_at": anchor + timedelta(minutes=m)}
+        for m in (30, 90)
+    ]
+
+    increments = count_logs(logs, [{"intervention_id": "i1", "patient_id": "p001", "effectiveness": counters}])
+    assert increments["i1"]["after_total"] == 1
+
+
+def test_backfill_streams_each_patient_once_and_anchors_at_creation(monkeypatch):
+    from backend import firebase_client
+    from backend.firebase_client import InterventionService
+
+    created = datetime.utcnow() - timedelta(days=2)
+    logs = [
+        {"action": "took", "timestamp": (created - timedelta(hours=1)).isoformat()},
+        {"action": "skipped", "timestamp": (created + timedelta(hours=1)).isoformat()},
+    ]
+    streamed = []
+
+    def stream_patient_logs(patient_id, days=None):
+        streamed.append((patient_id, days))
+        return iter(logs)
+
+    monkeypatch.setattr(firebase_client.config, "EFFECTIVENESS_STORE_ENABLED", True)
+    monkeypatch.setattr(firebase_client.adherence_service, "stream_patient_logs", stream_patient_logs)
+
+    records = [
+        {"patient_id": "p001", "timestamp": created.isoformat()},
+        {"patient_id": "p001", "timestamp": (created + timedelta(days=1)).isoformat()},
+        {"patient_id": "p002", "timestamp": created.isoformat(), "effectiveness": {"sealed": True}},
+    ]
+    InterventionService().backfill_counters(records)
+
+    assert streamed == [("p001", 7 + 2 + 1)]
+    assert records[0]["effectiveness"]["anchor"] == created.isoformat()
+    assert records[0]["effectiveness"]["before_took"] == 1 and records[0]["effectiveness"]["after_total"] == 1
+    assert records[1]["effectiveness"]["before_total"] == 2
+    assert records[2]["effectiveness"] == {"sealed": True}
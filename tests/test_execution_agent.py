@@ -0,0 +1,80 @@
+"""
+Tests for coalesced ExecutionAgent writes
+"""
+from backend.agents import execution_agent
+from backend.agents.execution_agent import ExecutionAgent, merge_updates
+
+PLAN = {
+    "patient_id": "p001",
+    "risk_assessment_output": {"approved": True, "overall_risk_level": "low"},
+    "remediation_output": {
+        "root_cause": "Timing issue",
+        "expected_outcome": "Better evening adherence",
+        "interventions": [
+            {"type": "schedule_adjustment", "details": {"target_day": "Monday", "adjustment": "+30m"}},
+            {"type": "schedule_adjustment", "details": {"target_day": "Friday", "adjustment": "-15m"}},
+            {"type": "time_shift", "details": {"proposed_time": "19:00", "context": "dinner"}},
+            {"type": "education"},
+        ],
+    },
+}
+
+
+def test_merge_updates_keeps_nested_keys():
+    patch = merge_updates({}, {"schedule_adjustments": {"Monday": {"adjustment": "+30m"}}, "a": 1})
+    merge_updates(patch, {"schedule_adjustments": {"Friday": {"adjustment": "-15m"}}, "a": 2})
+
+    assert set(patch["schedule_adjustments"]) == {"Monday", "Friday"}
+    assert patch["a"] == 2
+
+
+def test_plan_is_committed_with_one_write(monkeypatch):
+    monkeypatch.setattr(execution_agent.config, "WRITE_BEHIND_ENABLED", False)
+    monkeypatch.setattr(execution_agent.config, "SCHEDULER_ENABLED", False)
+    monkeypatch.setattr(execution_agent.config, "NOTIFICATION_DIGEST_ENABLED", False)
+    writes = []
+    monkeypatch.setattr(
+        execution_agent.intervention_service, "log_intervention",
+        lambda data, patient_updates=None: writes.append((data, patient_updates)) or "i1"
+    )
+
+    result = ExecutionAgent().process(PLAN)
+
+    assert len(writes) == 1
+    record, patient_updates = writes[0]
+    assert set(patient_updates["schedule_adjustments"]) == {"Monday", "Friday"}
+    assert patient_updates["preferred_time"] == "19:00"
+    assert record["patient_id"] == "p001"
+    assert [r["status"] for r in result["execution_results"]] == ["success", "success", "success", "logged"]
+
+
+def test_failed_commit_is_reported_for_every_intervention(monkeypatch):
+    def fail(data, patient_updates=None):
+        raise RuntimeError("patient not found")
+
+    monkeypatch.setattr(execution_agent.config, "WRITE_BEHIND_ENABLED", False)
+    monkeypatch.setattr(execution_agent.config, "SCHEDULER_ENABLED", False)
+    monkeypatch.setattr(execution_agent.config, "NOTIFICATION_DIGEST_ENABLED", False)
+    monkeypatch.setattr(execution_agent.intervention_service, "log_intervention", fail)
+
+    result = ExecutionAgent().process(PLAN)
+
+    results = result["execution_results"]
+    assert [r["status"] for r in results] == ["failed"] * 4
+    assert all(r["error"] == "Intervention was not committed: patient not found" for r in results)
+    assert result["patient_notification"]["details"] == []
+
+
+def test_notification_falls_back_to_write_behind(monkeypatch):
+    def broken(patient_id, notification):
+        raise OSError("disk full")
+
+    queued = []
+    monkeypatch.setattr(execution_agent.config, "NOTIFICATION_DIGEST_ENABLED", True)
+    monkeypatch.setattr(execution_agent.config, "WRITE_BEHIND_ENABLED", True)
+    monkeypatch.setattr(execution_agent.notification_pipeline, "submit", broken)
+    monkeypatch.setattr(execution_agent.write_behind, "enqueue", lambda kind, payload: queued.append(kind))
+
+    ExecutionAgent()._queue_notification("p001", {"message": "hi"})
+
+    assert queued == ["notification"]
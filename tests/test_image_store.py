@@ -0,0 +1,146 @@
+"""
+Tests for the content-addressed medical image store
+"""
+import base64
+import hashlib
+import io
+import tempfile
+
+from backend.image_store import ImageStore, LocalImageBackend, is_image_id
+
+JPEG_BYTES = b"\xff\xd8\xff\xe0" + b"synthetic-rash-photo" * 10
+JPEG_DATA_URI = "data:image/jpeg;base64," + base64.b64encode(JPEG_BYTES).decode("ascii")
+
+
+def _store():
+    return ImageStore(LocalImageBackend(tempfile.mkdtemp()))
+
+
+def test_image_id_is_sha256_of_bytes():
+    store = _store()
+    image_id = store.put_base64(JPEG_DATA_URI)
+
+    assert image_id == hashlib.sha256(JPEG_BYTES).hexdigest()
+    assert is_image_id(image_id)
+    assert store.get_bytes(image_id) == JPEG_BYTES
+    assert store.get_base64(image_id) == JPEG_DATA_URI
+
+
+def test_same_photo_is_stored_once():
+    store = _store()
+    first = store.put_bytes(JPEG_BYTES)
+    second = store.put_base64(base64.b64encode(JPEG_BYTES).decode("ascii"))
+
+    assert first == second
+    assert store.exists(first)
+
+
+def test_externalize_images_replaces_blobs_with_ids():
+    store = _store()
+    payload = {
+        "patient_id": "p004",
+        "reason": "side_effects",
+        "image": JPEG_DATA_URI,
+        "previous_images": [JPEG_DATA_URI],
+    }
+
+    result = store.externalize_images(payload)
+
+    assert "image" not in result and "previous_images" not in result
+    assert result["image_id"] == hashlib.sha256(JPEG_BYTES).hexdigest()
+    assert result["previous_image_ids"] == [result["image_id"]]
+    # Caller's payload is left untouched
+    assert payload["image"] == JPEG_DATA_URI
+
+
+def test_externalize_images_without_images_is_noop():
+    store = _store()
+    payload = {"patient_id": "p001", "action": "skipped"}
+
+    assert store.externalize_images(payload) is payload
+
+
+def test_invalid_base64_is_rejected():
+    store = _store()
+    try:
+        store.put_base64("data:image/jpeg;base64,not base64!!")
+    except ValueError:
+        return
+    raise AssertionError("Expected ValueError for invalid base64")
+
+
+def test_malformed_image_references_are_rejected():
+    store = _store()
+    image_id = store.put_bytes(JPEG_BYTES)
+
+    assert store.referenced_ids({"image_id": image_id, "previous_image_ids": [image_id]}) == [image_id] * 2
+    for payload in ({"previous_image_ids": image_id}, {"previous_image_ids": 7}, {"image_id": 7}):
+        try:
+            store.referenced_ids(payload)
+        except ValueError:
+            continue
+        raise AssertionError(f"Expected ValueError for {payload}")
+    try:
+        store.externalize_images({"previous_images": JPEG_DATA_URI})
+    except ValueError:
+        return
+    raise AssertionError("Expected ValueError for previous_images given as a string")
+
+
+def test_put_stream_hashes_while_spooling():
+    store = _store()
+    image_id = store.put_stream(io.BytesIO(JPEG_BYTES), chunk_size=7)
+
+    assert image_id == hashlib.sha256(JPEG_BYTES).hexdigest()
+    assert store.get_bytes(image_id) == JPEG_BYTES
+
+
+def test_put_stream_rejects_oversized_images():
+    store = _store()
+    try:
+        store.put_stream(io.BytesIO(JPEG_BYTES), max_bytes=10, chunk_size=4)
+    except ValueError:
+        assert not store.exists(hashlib.sha256(JPEG_BYTES).hexdigest())
+        return
+    raise AssertionError("Expected ValueError for oversized upload")
+
+
+def test_chunked_upload_session():
+    store = _store()
+    upload_id = store.begin_upload()
+    half = len(JPEG_BYTES) // 2
+
+    assert store.append_chunk(upload_id, io.BytesIO(JPEG_BYTES[:half]), offset=0) == half
+
+    # A retried chunk at the wrong offset is refused without corrupting the session
+    try:
+        store.append_chunk(upload_id, io.BytesIO(JPEG_BYTES[half:]), offset=0)
+        raise AssertionError("Expected ValueError for offset mismatch")
+    except ValueError:
+        pass
+    assert store.upload_status(upload_id)["received_bytes"] == half
+
+    store.append_chunk(upload_id, io.BytesIO(JPEG_BYTES[half:]), offset=half)
+    image_id = store.complete_upload(upload_id)
+
+    assert image_id == hashlib.sha256(JPEG_BYTES).hexdigest()
+    assert store.get_bytes(image_id) == JPEG_BYTES
+
+
+def test_upload_session_resumes_in_another_process():
+    root = tempfile.mkdtemp()
+    first, second = ImageStore(LocalImageBackend(root)), ImageStore(LocalImageBackend(root))
+    upload_id = first.begin_upload()
+    half = len(JPEG_BYTES) // 2
+    first.append_chunk(upload_id, io.BytesIO(JPEG_BYTES[:half]), offset=0)
+
+    # A restarted or different worker picks the session up from disk
+    assert second.upload_status(upload_id)["received_bytes"] == half
+    second.append_chunk(upload_id, io.BytesIO(JPEG_BYTES[half:]), offset=half)
+    assert first.complete_upload(upload_id) == hashlib.sha256(JPEG_BYTES).hexdigest()
+
+    try:
+        second.upload_status(upload_id)
+        raise AssertionError("Expected KeyError for a completed session")
+    except KeyError:
+        pass
@@ -0,0 +1,99 @@
+"""
+Tests for deferred batch learning of routine doses
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import learning_worker
+from backend.agents import base_agent, data_context, learning_agent
+from backend.agents.base_agent import AgentOrchestrator
+from backend.agents.data_context import WorkflowDataContext
+from backend.agents.learning_agent import LearningAgent
+from backend.analytics import population
+from tests.test_data_context import _logs, _patch
+
+
+def _interventions():
+    now = datetime.utcnow()
+    return [
+        {"intervention_id": "i1", "patient_id": "p001", "root_cause": "Timing issue",
+         "created_at": (now - timedelta(days=5)).isoformat()},
+        {"intervention_id": "i2", "patient_id": "p001", "root_cause": "Behavioral pattern",
+         "created_at": (now - timedelta(days=9)).isoformat()},
+    ]
+
+
+def test_batch_learning_matches_inline_learning_without_per_patient_reads(monkeypatch):
+    interventions = _interventions()
+    firestore = _patch(monkeypatch)
+    monkeypatch.setattr(learning_agent.population_service, "table", lambda: population.EffectivenessTable())
+    monkeypatch.setattr(
+        data_context.intervention_service, "get_patient_interventions", lambda patient_id, limit=10: interventions
+    )
+    cutoff = (datetime.utcnow() - timedelta(days=LearningAgent.data_window_days)).isoformat()
+    jobs = [
+        {"patient_id": "p001", "last_action": {"action": "took"}},
+        {"patient_id": "p002", "last_action": {"action": "took"}},
+    ]
+    sources = {
+        "p001": {"patient": {"patient_id": "p001"}, "logs": [log for log in _logs() if log.timestamp >= cutoff],
+                 "interventions": interventions, "rollup": None},
+        "p002": {"patient": None, "logs": _logs()[:5], "interventions": [], "rollup": None},
+    }
+
+    results = learning_worker.learn(jobs, sources)
+
+    # Everything came from the bulk-loaded sources
+    assert firestore.calls == []
+    assert results["p002"]["type"] == "baseline"
+
+    inline = LearningAgent().process({"patient_id": "p001", "current_action": {"action": "took"}})
+    assert results["p001"]["effectiveness_analysis"] == inline["effectiveness_analysis"]
+    assert results["p001"]["insights"] == inline["insights"]
+
+
+def test_preload_rejects_unknown_sources():
+    with pytest.raises(ValueError):
+        WorkflowDataContext("p001").preload(medications=[])
+
+
+def test_routine_took_is_queued_instead_of_learning_inline(monkeypatch):
+    queued = []
+    monkeypatch.setattr(base_agent.config, "LEARNING_BATCH_ENABLED", True)
+    monkeypatch.setattr(base_agent.learning_job_service, "enqueue", queued.append)
+
+    orchestrator = AgentOrchestrator()
+    monkeypatch.setattr(orchestrator, "execute_workflow", lambda *args, **kwargs: pytest.fail("ran inline"))
+
+    result = orchestrator.route_patient_action({"patient_id": "p001", "action": "took"})
+
+    assert result["status"] == "queued"
+    assert queued == [{"patient_id": "p001", "action": "took"}]
+
+
+def test_later_events_keep_the_job_place_in_the_queue(monkeypatch):
+    from backend.firebase_client import LearningJobService
+
+    class Batch:
+        def __init__(self):
+            self.jobs = []
+
+        def set(self, ref, data, merge=False):
+            self.jobs.append(data)
+
+    class DB:
+        def collection(self, name):
+            return self
+
+        def document(self, doc_id):
+            return doc_id
+
+    service = LearningJobService()
+    monkeypatch.setattr(LearningJobService, "db", property(lambda self: DB()))
+    batch = Batch()
+    service.add_to_batch(batch, {"patient_id": "p001", "action": "took"})
+    service.add_to_batch(batch, {"patient_id": "p001", "action": "took"}, pending=True)
+
+    assert "requested_at" in batch.jobs[0] and "requested_at" not in batch.jobs[1]
+    assert batch.jobs[1]["status"] == "pending" and batch.jobs[1]["last_action"]["action"] == "took"
@@ -0,0 +1,114 @@
+"""
+Tests for the streaming, projected adherence log reader
+"""
+from backend.firebase_client import AdherenceService
+from backend.models import LOG_ROW_FIELDS, LogRow
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeQuery:
+    """Minimal Firestore query: applies projection, limit and start_after cursors"""
+
+    def __init__(self, docs, pages, projection=None, limit=None, after=None):
+        self.docs = docs
+        self.pages = pages
+        self.projection = projection
+        self._limit = limit
+        self._after = after
+
+    def _copy(self, **changes):
+        state = dict(projection=self.projection, limit=self._limit, after=self._after)
+        state.update(changes)
+        return FakeQuery(self.docs, self.pages, **state)
+
+    def where(self, filter=None):
+        return self
+
+    def order_by(self, field, direction=None):
+        return self
+
+    def select(self, fields):
+        return self._copy(projection=list(fields))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot.id)
+
+    def stream(self):
+        self.pages.append(self._after)
+        start = 0
+        if self._after is not None:
+            start = [doc_id for doc_id, _ in self.docs].index(self._after) + 1
+        for doc_id, data in self.docs[start:start + self._limit]:
+            yield FakeSnapshot(doc_id, {k: v for k, v in data.items() if k in self.projection})
+
+
+class FakeDB:
+    def __init__(self, query):
+        self.query = query
+
+    def collection(self, name):
+        return self.query
+
+
+class FakeAdherenceService(AdherenceService):
+    def __init__(self, docs):
+        super().__init__()
+        self.pages = []
+        self._db = FakeDB(FakeQuery(docs, self.pages))
+
+    @property
+    def db(self):
+        return self._db
+
+
+DOCS = [
+    (f"log_{i}", {
+        "patient_id": "p001",
+        "action": "skipped" if i % 2 else "took",
+        "reason": "forgot" if i % 2 else None,
+        "timestamp": f"2026-03-{30 - i:02d}T08:00:00",
+        "medication_id": "med_a",
+        "notes": "long free text " * 50,
+        "image_id": "ab" * 32,
+    })
+    for i in range(7)
+]
+
+
+def test_stream_pages_through_all_logs_with_projection():
+    service = FakeAdherenceService(DOCS)
+
+    rows = list(service.stream_patient_logs("p001", page_size=3))
+
+    assert [row.log_id for row in rows] == [doc_id for doc_id, _ in DOCS]
+    assert service.pages == [None, "log_2", "log_5"]
+    assert rows[1] == LogRow("log_1", "skipped", "forgot", "2026-03-29T08:00:00", "med_a")
+    assert LogRow._fields[1:] == tuple(LOG_ROW_FIELDS)
+
+
+def test_stream_is_lazy():
+    service = FakeAdherenceService(DOCS)
+
+    stream = service.stream_patient_logs("p001", page_size=3)
+    next(stream)
+
+    assert service.pages == [None]
+
+
+def test_log_row_get_mirrors_dict_get():
+    row = LogRow("log_0", action="took")
+
+    assert row.get("action") == "took"
+    assert row.get("reason", "unknown") == "unknown"
+    assert row.get("notes") is None
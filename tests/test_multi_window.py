@@ -0,0 +1,124 @@
+"""
+Tests for 7/30/90-day multi-window adherence analysis
+"""
+from datetime import date, timedelta
+
+from backend.agents.data_context import WorkflowDataContext
+from backend.agents.investigation_agent import InvestigationAgent
+from backend.analytics.multi_window import daily_from_rows, scan_windows
+from backend.models import LogRow
+
+TODAY = date.today()
+
+
+def _day(days_ago, took=1, skipped=0, ran_out=0):
+    bucket = {"actions": {}, "reasons": {}}
+    if took:
+        bucket["actions"]["took"] = took
+    if skipped:
+        bucket["actions"]["skipped"] = skipped
+    if ran_out:
+        bucket["reasons"]["skipped"] = {"ran_out": ran_out}
+    return (TODAY - timedelta(days=days_ago)).isoformat(), bucket
+
+
+def test_windows_are_emitted_as_they_complete_and_cursor_stops():
+    consumed = []
+
+    def daily():
+        for days_ago in range(0, 200, 2):
+            consumed.append(days_ago)
+            yield _day(days_ago)
+
+    results = []
+    for window in scan_windows(daily(), (7, 30, 90), TODAY):
+        results.append((window["days"], window["total_actions"], max(consumed)))
+
+    # A window of N days holds days 0..N-1: the 7-day result is ready once
+    # the cursor reaches day 8, well before day 90
+    assert results == [(7, 4, 8), (30, 15, 30), (90, 45, 90)]
+
+
+def test_trend_and_change_point():
+    # Perfect adherence until 10 days ago, mostly missed since
+    days = [_day(d, took=0 if d < 10 else 1, skipped=1 if d < 10 else 0) for d in range(30)]
+
+    window = list(scan_windows(iter(days), (30,), TODAY))[0]
+
+    assert window["trend"]["direction"] == "declining"
+    assert window["change_point"]["detected"] is True
+    assert window["change_point"]["date"] == (TODAY - timedelta(days=9)).isoformat()
+    assert window["change_point"]["miss_rate_after"] == 1.0
+
+
+def test_daily_from_rows_groups_newest_first_cursor():
+    rows = [
+        LogRow("a", "skipped", "forgot", f"{TODAY.isoformat()}T20:00:00"),
+        LogRow("b", "took", None, f"{TODAY.isoformat()}T08:00:00"),
+        LogRow("c", "took", None, ""),
+        LogRow("d", "took", None, f"{(TODAY - timedelta(days=1)).isoformat()}T08:00:00"),
+    ]
+
+    days = list(daily_from_rows(iter(rows), "UTC", chunk_size=2))
+
+    assert [day for day, _ in days] == [TODAY.isoformat(), (TODAY - timedelta(days=1)).isoformat()]
+    assert days[0][1]["actions"] == {"skipped": 1, "took": 1}
+    assert days[0][1]["buckets"]["skipped"] == {"evening": 1}
+    assert days[0][1]["reasons"] == {"skipped": {"forgot": 1}}
+
+
+class PresetContext(WorkflowDataContext):
+    """Data context over in-memory logs"""
+
+    def __init__(self, logs):
+        super().__init__("p002", log_window_days=90)
+        self._logs = logs
+
+    def logs(self, days=None):
+        return self._logs
+
+    def rollup(self):
+        return None
+
+    def timezone(self):
+        return "UTC"
+
+
+def test_monthly_refill_gaps_are_found_in_the_90_day_window():
+    logs = []
+    for days_ago in range(89, -1, -1):
+        day = (TODAY - timedelta(days=days_ago)).isoformat()
+        # Runs out for two days every 30 days
+        if days_ago % 30 in (5, 6):
+            logs.append(LogRow(f"log_{days_ago}", "skipped", "ran_out", f"{day}T08:00:00", "med_a"))
+        else:
+            logs.append(LogRow(f"log_{days_ago}", "took", None, f"{day}T08:00:00", "med_a"))
+    logs.reverse()
+
+    agent = InvestigationAgent()
+    result = agent.process({"patient_id": "p002", "action": "took", "data_context": PresetContext(logs)})
+
+    assert set(result["windows"]) == {"7d", "30d", "90d"}
+    assert result["windows"]["7d"]["refill_gaps"]["detected"] is False
+    assert result["refill_gaps"] == {"detected": True, "episodes": 3, "interval_days": 30}
+    assert result["root_cause"].startswith("Supply chain")
+    assert "Set up auto-refill" in result["recommendations"]
+
+
+def test_root_cause_is_attributed_to_the_medication_behind_it():
+    logs = []
+    for days_ago in range(28):
+        day = (TODAY - timedelta(days=days_ago)).isoformat()
+        # med_a is taken every morning, med_b is forgotten every evening
+        logs.append(LogRow(f"a_{days_ago}", "took", None, f"{day}T08:00:00", "med_a"))
+        logs.append(LogRow(f"b_{days_ago}", "skipped", "forgot", f"{day}T19:00:00", "med_b"))
+
+    agent = InvestigationAgent()
+    result = agent.process({"patient_id": "p002", "action": "skipped", "data_context": PresetContext(logs)})
+
+    assert result["root_cause_medications"] == ["med_b"]
+    assert result["medication_patterns"]["med_a"]["skipped_count"] == 0
+    assert result["root_cause_medication_names"] == ["med_b"]
+    assert result["root_cause"] == InvestigationAgent()._determine_root_cause(
+        result["day_pattern"], result["time_pattern"], result["reason_pattern"]
+    )
@@ -0,0 +1,112 @@
+"""
+Tests for the notification digest pipeline
+"""
+from backend import notifications
+from backend.notifications import LocalTransport, NotificationPipeline, merge_digest
+
+
+def _note(message, details=()):
+    return {"title": "Your Medication Plan Updated", "message": message, "details": list(details)}
+
+
+class FlakyTransport(LocalTransport):
+    """Rejects the first patient's digest and fails whole batches on demand"""
+
+    def __init__(self):
+        super().__init__()
+        self.fail_batches = 0
+
+    def send(self, messages):
+        if self.fail_batches:
+            self.fail_batches -= 1
+            raise RuntimeError("connection reset")
+        accepted = [message["patient_id"] != "bad" for message in messages]
+        self.sent.extend(m for m, ok in zip(messages, accepted) if ok)
+        return accepted
+
+
+def test_notifications_within_window_merge_into_one_digest():
+    digest = merge_digest([_note("A", ["x"]), _note("B", ["x", "y"]), _note("A")])
+
+    assert digest["title"] == "Your Medication Plan Updated" and digest["message"] == "A B"
+    assert digest["details"] == ["x", "y"] and len(digest["items"]) == 3
+    assert merge_digest([_note("A")]) == _note("A")
+
+
+def test_digests_are_sent_in_batches_over_one_connection(monkeypatch):
+    monkeypatch.setattr(notifications.config, "NOTIFICATION_DIGEST_WINDOW_SECONDS", 60)
+    monkeypatch.setattr(notifications.config, "NOTIFICATION_BATCH_SIZE", 2)
+    transport = LocalTransport()
+    pipeline = NotificationPipeline(transport, autostart=False)
+
+    for i in range(5):
+        pipeline.submit(f"p{i}", _note("first"), now=1000)
+    pipeline.submit("p0", _note("second"), now=1030)
+
+    assert pipeline.flush_once(now=1059) == {"sent": 0, "failed": 0, "batches": 0}
+    assert pipeline.flush_once(now=1060) == {"sent": 5, "failed": 0, "batches": 3}
+
+    assert transport.connections == 1
+    assert transport.sent[0]["notification"]["message"] == "first second"
+    stats = pipeline.stats(now=1060)
+    assert stats["submitted"] == 6 and stats["merged"] == 1 and stats["pending_notifications"] == 0
+    assert stats["avg_batch_size"] == 1.7 and stats["last_batch_size"] == 1
+
+
+def test_failures_reconnect_retry_and_are_counted(monkeypatch):
+    monkeypatch.setattr(notifications.config, "NOTIFICATION_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(notifications.config, "NOTIFICATION_MAX_PENDING", 3)
+    transport = FlakyTransport()
+    pipeline = NotificationPipeline(transport, autostart=False)
+
+    assert all(pipeline.submit(pid, _note("hi")) for pid in ("bad", "p1", "p2"))
+    assert not pipeline.submit("p3", _note("hi"))
+
+    transport.fail_batches = 1
+    assert pipeline.flush_once(force=True)["failed"] == 3
+    assert pipeline.flush_once()["sent"] == 2
+
+    stats = pipeline.stats()
+    assert transport.connections == 2
+    assert stats["dropped_buffer_full"] == 1 and stats["dropped_send_failed"] == 1
+    assert stats["digests_sent"] == 2 and stats["retrying"] == 0
+
+
+def test_undelivered_notifications_survive_a_restart(monkeypatch, tmp_path):
+    monkeypatch.setattr(notifications.config, "NOTIFICATION_MAX_ATTEMPTS", 5)
+    path = str(tmp_path / "notifications.db")
+    transport = FlakyTransport()
+    pipeline = NotificationPipeline(transport, autostart=False, path=path)
+    pipeline.submit("p1", _note("A"), now=1000)
+    pipeline.submit("p1", _note("B"), now=1010)
+    pipeline.submit("p2", _note("C"), now=1020)
+
+    transport.fail_batches = 1
+    pipeline.stop(flush=True)  # the shutdown flush fails: nothing may be lost
+
+    restarted = NotificationPipeline(transport, autostart=False, path=path)
+    restarted.start()
+    restarted.stop(flush=True)
+
+    assert sorted(m["notification"]["message"] for m in transport.sent) == ["A B", "C"]
+    assert NotificationPipeline(transport, autostart=False, path=path).flush_once(force=True)["sent"] == 0
+
+
+def test_pipelines_sharing_a_file_send_each_notification_once(tmp_path):
+    path = str(tmp_path / "notifications.db")
+    first_transport, second_transport = LocalTransport(), LocalTransport()
+    first = NotificationPipeline(first_transport, autostart=False, path=path)
+    second = NotificationPipeline(second_transport, autostart=False, path=path)
+    first.submit("p1", _note("A"), now=1000)
+    second.submit("p2", _note("B"), now=1000)
+
+    first.flush_once(force=True)
+    second.flush_once(force=True)
+    assert [m["patient_id"] for m in first_transport.sent] == ["p1"]
+    assert [m["patient_id"] for m in second_transport.sent] == ["p2"]
+
+    # A process that exits without sending leaves its rows to the others
+    first.submit("p3", _note("C"), now=2000)
+    first.stop(flush=False)
+    second.flush_once(force=True)
+    assert [m["patient_id"] for m in second_transport.sent] == ["p2", "p3"]
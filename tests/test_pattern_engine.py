@@ -0,0 +1,105 @@
+"""
+Tests for the vectorized adherence pattern engine
+"""
+import warnings
+
+import numpy as np
+
+from backend.analytics.pattern_engine import analyze_by_medication, analyze_patterns, parse_timestamps
+
+
+def _log(timestamp, reason="forgot"):
+    return {"action": "skipped", "timestamp": timestamp, "reason": reason}
+
+
+def test_parse_timestamps_handles_offsets_and_bad_values():
+    parsed = parse_timestamps([
+        "2026-03-02T08:15:00",
+        "2026-03-02T08:15:00Z",
+        "2026-03-02T13:45:00.123+05:30",
+        "2026-03-02T03:15:00-05:00",
+        "",
+        "not a timestamp",
+    ])
+
+    expected = np.datetime64("2026-03-02T08:15:00", "ms")
+    assert parsed[0] == expected
+    assert parsed[1] == expected
+    assert parsed[2] == expected + np.timedelta64(123, "ms")
+    assert parsed[3] == expected
+    assert np.isnat(parsed[4]) and np.isnat(parsed[5])
+
+
+def test_parse_timestamps_without_seconds():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        parsed = parse_timestamps(["2026-10-19T04:45Z", "2026-10-19T06:45+02:00", "2026-10-19T03:15-01:30"])
+
+    assert (parsed == np.datetime64("2026-10-19T04:45", "ms")).all()
+
+
+def test_patterns_use_patient_local_time():
+    # Monday 00:30 UTC is Sunday evening in New York, on both sides of the DST change
+    logs = [_log("2026-03-02T00:30:00Z"), _log("2026-03-09T00:30:00Z"), _log("2026-03-16T00:30:00Z")]
+
+    utc = analyze_patterns(logs, "UTC")
+    local = analyze_patterns(logs, "America/New_York")
+
+    assert utc["day_pattern"]["problem_day"] == "Monday"
+    assert utc["time_pattern"]["problem_time"] == "night"
+    assert local["day_pattern"] == {"problem_day": "Sunday", "occurrences": 3, "pattern_strength": "strong"}
+    assert local["time_pattern"]["problem_time"] == "evening"
+
+
+def test_ties_and_reasons_match_counter_semantics():
+    logs = [
+        _log("2026-03-04T19:00:00", "ran_out"),   # Wednesday
+        _log("2026-03-02T08:00:00", "forgot"),    # Monday
+        _log("2026-03-09T08:00:00", "forgot"),    # Monday
+        _log("2026-03-11T19:00:00", None),        # Wednesday
+        _log("", "forgot"),
+    ]
+
+    patterns = analyze_patterns(logs, "UTC")
+
+    # Wednesday and Monday tie - the first seen wins, like Counter.most_common
+    assert patterns["day_pattern"] == {"problem_day": "Wednesday", "occurrences": 2, "pattern_strength": "weak"}
+    assert patterns["reason_pattern"] == {
+        "primary_reason": "forgot",
+        "occurrences": 3,
+        "all_reasons": {"ran_out": 1, "forgot": 3, "unknown": 1},
+    }
+
+
+def test_empty_logs():
+    patterns = analyze_patterns([], "America/New_York")
+
+    assert patterns["day_pattern"] == {"problem_day": None}
+    assert patterns["time_pattern"] == {"problem_time": None}
+    assert patterns["reason_pattern"] == {"primary_reason": "unknown"}
+
+
+def test_grouped_patterns_match_per_medication_analysis():
+    logs = [
+        {"action": "skipped", "timestamp": "2026-03-02T08:00:00", "reason": "forgot", "medication_id": "med_a"},
+        {"action": "skipped", "timestamp": "2026-03-09T08:30:00", "reason": "forgot", "medication_id": "med_a"},
+        {"action": "took", "timestamp": "2026-03-10T08:00:00", "reason": None, "medication_id": "med_a"},
+        {"action": "skipped", "timestamp": "2026-03-06T21:00:00", "reason": "ran_out", "medication_id": "med_b"},
+        {"action": "skipped", "timestamp": "2026-03-04T21:00:00", "reason": "side_effects", "medication_id": "med_b"},
+        {"action": "took", "timestamp": "2026-03-05T21:00:00", "reason": None, "medication_id": "med_c"},
+    ]
+
+    grouped = analyze_by_medication(logs, "UTC")
+
+    assert set(grouped) == {"med_a", "med_b", "med_c"}
+    for medication_id, patterns in grouped.items():
+        skipped = [
+            log for log in logs
+            if log["medication_id"] == medication_id and log["action"] == "skipped"
+        ]
+        expected = analyze_patterns(skipped, "UTC")
+        for key in ("day_pattern", "time_pattern", "reason_pattern"):
+            assert patterns[key] == expected[key], (medication_id, key)
+
+    assert grouped["med_a"]["miss_rate"] == round(2 / 3, 3)
+    assert grouped["med_c"]["skipped_count"] == 0
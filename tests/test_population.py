@@ -0,0 +1,88 @@
+"""
+Tests for the population effectiveness table
+"""
+import random
+
+from backend.agents import remediation_agent
+from backend.agents.remediation_agent import RemediationAgent
+from backend.analytics import population
+
+
+def _rows(count=600, seed=7):
+    rng = random.Random(seed)
+    causes = ["Timing issue", "Behavioral pattern", "Supply chain"]
+    types = ["time_shift", "meal_anchor", "auto_refill"]
+    return [
+        (
+            rng.choice(causes),
+            tuple(sorted(rng.sample(types, rng.randint(1, 2)))),
+            rng.choice(["<50", "65-74"]),
+            rng.choice(["1", "2-3"]),
+            round(rng.uniform(-0.2, 0.4), 3)
+        )
+        for _ in range(count)
+    ]
+
+
+def test_cohort_and_rows():
+    assert population.cohort({"age": 70, "medications": [{}, {}]}) == ("65-74", "2-3")
+    assert population.cohort(None) == (population.ANY, population.ANY)
+
+    intervention = {
+        "patient_id": "p001",
+        "root_cause": "Timing issue: Consistently forgets during evening (Metformin)",
+        "interventions": [{"type": "time_shift"}, {"type": "meal_anchor"}],
+        "effectiveness": {"sealed": True, "score": 0.25},
+    }
+    row = population.intervention_row(intervention, {"p001": ("65-74", "2-3")})
+
+    assert row == ("Timing issue", ("meal_anchor", "time_shift"), "65-74", "2-3", 0.25)
+    assert population.intervention_row({**intervention, "effectiveness": {"sealed": False}}, {}) is None
+
+
+def test_parallel_build_matches_single_process():
+    rows = _rows()
+
+    single = population.build_table(rows, workers=1, chunk_size=100)
+    parallel = population.build_table(rows, workers=2, chunk_size=100)
+
+    assert single.entries.keys() == parallel.entries.keys()
+    for key, stats in single.entries.items():
+        assert stats["n"] == parallel.entries[key]["n"]
+        assert abs(stats["mean"] - parallel.entries[key]["mean"]) < 1e-9
+
+    overall = single.entries[("Timing issue", population.ANY, population.ANY, population.ANY)]
+    timing = [row[4] for row in rows if row[0] == "Timing issue"]
+    assert overall["n"] == len(timing)
+    assert abs(overall["mean"] - sum(timing) / len(timing)) < 1e-4
+
+
+def test_lookup_backs_off_to_broader_cohorts():
+    rows = [("Timing issue", ("time_shift",), "65-74", "2-3", 0.3)] * 5
+    rows += [("Timing issue", ("time_shift",), "<50", "1", 0.1)] * 30
+    table = population.EffectivenessTable.from_records(population.build_table(rows).to_records())
+
+    sparse = table.lookup("Timing issue: evening", "time_shift", ("65-74", "2-3"))
+    dense = table.lookup("Timing issue", "time_shift", ("<50", "1"))
+
+    assert sparse["cohort"] == (population.ANY, population.ANY) and sparse["n"] == 35
+    assert dense["cohort"] == ("<50", "1") and dense["mean"] == 0.1
+    assert table.lookup("Supply chain", "auto_refill") is None
+
+
+def test_remediation_orders_interventions_by_population_evidence(monkeypatch):
+    rows = [("Timing issue", ("meal_anchor",), "*", "*", 0.3)] * 25
+    rows += [("Timing issue", ("time_shift",), "*", "*", 0.1)] * 25
+    monkeypatch.setattr(remediation_agent.population_service, "table", lambda: population.build_table(rows))
+
+    plan = RemediationAgent().process({
+        "patient_id": "p001",
+        "investigation_output": {
+            "pattern_detected": True,
+            "root_cause": "Timing issue: Consistently forgets during evening",
+            "time_pattern": {"problem_time": "evening"},
+        },
+    })
+
+    assert [i["type"] for i in plan["interventions"]] == ["meal_anchor", "time_shift"]
+    assert plan["interventions"][0]["population_effectiveness"] == {"mean": 0.3, "n": 25}
@@ -0,0 +1,94 @@
+"""
+Tests for the vectorized refill forecast
+"""
+from datetime import datetime
+
+from backend import refill_worker
+from backend.analytics.refill_forecast import SupplyForecast
+
+NOW = datetime(2026, 3, 10, 2, 0)
+
+
+def _patient(patient_id="p001", days=10, **fields):
+    return {
+        "patient_id": patient_id,
+        "medications": [
+            {"medication_id": "m1", "name": "Metformin", "frequency": "BID", "refill_days_remaining": days},
+            {"medication_id": "m2", "name": "Ibuprofen", "frequency": "PRN"}
+        ],
+        **fields
+    }
+
+
+def _took(patient_id, medication_id, n):
+    return [{"patient_id": patient_id, "medication_id": medication_id, "action": "took"}] * n
+
+
+def test_new_fill_then_logs_draw_down_supply():
+    first = SupplyForecast([_patient()], {}, _took("p001", "m1", 5), NOW)
+    ledgers = first.ledgers()
+    # Logs written before the fill was seen do not count
+    assert ledgers["p001"]["m1"]["doses_remaining"] == 20.0 and not first.alert.any()
+
+    logs = _took("p001", "m1", 7) + _took("p002", "m1", 3) + _took("p001", "m9", 1)
+    second = SupplyForecast([_patient()], ledgers, logs, NOW)
+    assert second.doses_remaining.tolist() == [13.0]
+    assert second.alerts()[0]["days_remaining"] == 6.5
+    assert second.alerts()[0]["run_out_date"] == "2026-03-16"
+
+    # Alerted once per fill; a new fill resets the ledger
+    third = SupplyForecast([_patient()], second.ledgers(), [], NOW)
+    assert third.due.all() and not third.alerts()
+    refilled = SupplyForecast([_patient(days=30)], second.ledgers(), [], NOW)
+    assert refilled.doses_remaining.tolist() == [60.0] and refilled.reset.all()
+
+
+def test_ran_out_and_patient_trigger():
+    ledgers = SupplyForecast([_patient(days=30)], {}, [], NOW).ledgers()
+    ran_out = [{"patient_id": "p001", "medication_id": "m1", "action": "skipped", "reason": "ran_out"}]
+    assert SupplyForecast([_patient(days=30)], ledgers, ran_out, NOW).alerts()[0]["doses_remaining"] == 0
+
+    eager = _patient(days=30, refill_trigger_days=31, auto_refill_enabled=True)
+    alert = SupplyForecast([eager], ledgers, [], NOW).alerts()[0]
+    assert alert["auto_refill"] and alert["days_remaining"] == 30
+
+
+def test_worker_reads_logs_after_cursor_and_batches_writes(monkeypatch):
+    ledgers = SupplyForecast([_patient(days=8)], {}, [], NOW).ledgers()
+    pages = [
+        [{"log_id": f"l{i}", "created_at": f"t{i}", "patient_id": "p001", "medication_id": "m1",
+          "action": "took"} for i in range(2)],
+        [{"log_id": "l2", "created_at": "t2", "patient_id": "p001", "medication_id": "m1", "action": "took"}]
+    ]
+    applied = []
+    monkeypatch.setattr(refill_worker.refill_service, "get_worker_cursor", lambda: {"created_at": "t0", "log_ids": []})
+    monkeypatch.setattr(refill_worker.refill_service, "get_ledgers", lambda: ledgers)
+    monkeypatch.setattr(refill_worker.refill_service, "apply", lambda *args: applied.append(args) or 1)
+    monkeypatch.setattr(refill_worker.patient_service, "profiles", lambda fields: [_patient(days=8)])
+    monkeypatch.setattr(refill_worker.adherence_service, "logs_created_since", lambda created_at, limit: pages.pop(0))
+
+    result = refill_worker.run_once(NOW, page_size=2)
+
+    assert result == {"medications": 1, "logs": 3, "due": 1, "alerts": 1, "batches": 1}
+    changed, alerts, cursor, _ = applied[0]
+    assert changed["p001"]["m1"]["doses_remaining"] == 13.0 and changed["p001"]["m1"]["alerted"]
+    assert cursor["created_at"] == "t2" and alerts[0]["medication_id"] == "m1"
+
+
+def test_retried_pass_does_not_count_logs_twice(monkeypatch):
+    ledgers = SupplyForecast([_patient(days=8)], {}, [], NOW).ledgers()
+    # A previous pass committed this ledger with l0..l1 counted, then failed before storing its cursor
+    ledgers["p001"]["m1"]["last_log_cursor"] = {"created_at": "t1", "log_ids": ["l1"]}
+    page = [{"log_id": f"l{i}", "created_at": f"t{i}", "patient_id": "p001", "medication_id": "m1",
+             "action": "took"} for i in range(3)]
+    applied = []
+    monkeypatch.setattr(refill_worker.refill_service, "get_worker_cursor", lambda: {"created_at": "t0", "log_ids": []})
+    monkeypatch.setattr(refill_worker.refill_service, "get_ledgers", lambda: ledgers)
+    monkeypatch.setattr(refill_worker.refill_service, "apply", lambda *args: applied.append(args) or 1)
+    monkeypatch.setattr(refill_worker.patient_service, "profiles", lambda fields: [_patient(days=8)])
+    monkeypatch.setattr(refill_worker.adherence_service, "logs_created_since", lambda created_at, limit: page)
+
+    refill_worker.run_once(NOW, page_size=10)
+
+    changed = applied[0][0]
+    assert changed["p001"]["m1"]["doses_remaining"] == 15.0
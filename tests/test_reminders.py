@@ -0,0 +1,70 @@
+"""
+Tests for the reminder index and dispatch engine
+"""
+from datetime import date, datetime
+
+from backend import reminders
+from backend.analytics.reminder_index import ReminderIndex, adjustment_minutes, expand_reminders
+from backend.models import LogRow
+from backend.reminders import LocalNotifier, ReminderEngine
+
+MONDAY = date(2026, 3, 9)  # EDT (UTC-4) since March 8
+
+
+def _patient(patient_id="p001", **fields):
+    return {
+        "patient_id": patient_id,
+        "timezone": "America/New_York",
+        "medications": [{"medication_id": "m1", "name": "Metformin", "scheduled_times": ["08:00", "21:50"]}],
+        "preferences": {"quiet_hours": {"start": "22:00", "end": "07:00"}},
+        "reminder_settings": {"follow_ups": ["5 minutes after", "15 minutes after"]},
+        **fields
+    }
+
+
+def test_adjustments_quiet_hours_and_timezone():
+    assert adjustment_minutes("30 minutes earlier") == -30 and adjustment_minutes("+1 hour") == 60
+
+    patient = _patient(schedule_adjustments={"Monday": {"adjustment": "90 minutes earlier"}})
+    rows = [(r.kind, r.scheduled_local, r.due_at) for r in expand_reminders([patient], MONDAY)["reminders"]]
+
+    # Monday 08:00 -> 06:30 falls in quiet hours and is held until 07:00 EDT
+    assert ("dose", "2026-03-09T07:00", "2026-03-09T11:00") in rows
+    assert ("follow_up", "2026-03-09T07:00", "2026-03-09T11:05") in rows
+    # Monday 21:50 -> 20:20; Sunday's 21:50 dose keeps only the follow-up before 22:00
+    assert ("dose", "2026-03-09T20:20", "2026-03-10T00:20") not in rows
+    assert ("follow_up", "2026-03-08T21:50", "2026-03-09T01:55") in rows
+    assert ("follow_up", "2026-03-08T21:50", "2026-03-09T02:05") not in rows
+    assert all("2026-03-09" == due_at[:10] for _, _, due_at in rows)
+
+
+def test_index_replaces_one_patient():
+    index = ReminderIndex(MONDAY)
+    index.add([_patient("p001"), _patient("p002", timezone="Europe/London")])
+    eight_am_new_york = index.minute_of(datetime(2026, 3, 9, 12, 0))
+
+    assert {r.patient_id for r in index.due(eight_am_new_york)} == {"p001"}
+    assert {r.patient_id for r in index.due(8 * 60)} == {"p002"}
+
+    total = len(index)
+    index.replace([_patient("p001", medications=[])])
+    assert index.due(eight_am_new_york) == [] and len(index) == total // 2
+
+
+def test_engine_dispatches_in_chunks_and_skips_answered_follow_ups(monkeypatch):
+    patients = [_patient(f"p{i:03d}") for i in range(5)]
+    monkeypatch.setattr(reminders.config, "REMINDER_DISPATCH_BATCH_SIZE", 2)
+    monkeypatch.setattr(reminders.patient_service, "profiles", lambda fields, updated_since=None: patients)
+    monkeypatch.setattr(
+        reminders.adherence_service, "logs_for_patients",
+        lambda ids, days: {"p000": [LogRow("l1", "took", None, "2026-03-09T12:02:00Z", "m1")]}
+    )
+    notifier = LocalNotifier()
+    engine = ReminderEngine(notifier)
+
+    assert engine.dispatch(datetime(2026, 3, 9, 12, 0, 30))["sent"] == 5
+    counts = engine.dispatch(datetime(2026, 3, 9, 12, 5))
+
+    assert counts == {"minutes": 5, "sent": 4, "suppressed": 1, "failed": 0}
+    assert [r.kind for r in notifier.sent] == ["dose"] * 5 + ["follow_up"] * 4
+    assert "p000" not in {r.patient_id for r in list(notifier.sent)[5:]}
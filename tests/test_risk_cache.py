@@ -0,0 +1,50 @@
+"""
+Tests for risk assessment cache fingerprints
+"""
+from backend.agents import risk_agent
+from backend.agents.risk_agent import RiskAssessmentAgent, assessment_fingerprint, regimen_fingerprint
+from backend.models import get_sample_patient
+
+PLAN = [{"type": "timing_optimization", "details": {"suggestion": "Take with food"}}]
+TRIGGER = {"action": "took", "reason": "side_effects", "medication_id": "med_001", "notes": "Nausea"}
+
+
+def test_regimen_fingerprint_ignores_medication_order():
+    medications = get_sample_patient()["medications"]
+    assert regimen_fingerprint(medications) == regimen_fingerprint(list(reversed(medications)))
+
+
+def test_regimen_change_changes_fingerprint():
+    medications = get_sample_patient()["medications"]
+    changed = [dict(medications[0], dosage="1000 mg"), medications[1]]
+    assert regimen_fingerprint(medications) != regimen_fingerprint(changed)
+
+
+def test_assessment_fingerprint_tracks_plan_and_trigger_only():
+    regimen = regimen_fingerprint(get_sample_patient()["medications"])
+    base = assessment_fingerprint(regimen, PLAN, TRIGGER)
+
+    # Timestamps differ every day - they must not defeat the cache
+    assert assessment_fingerprint(regimen, PLAN, dict(TRIGGER, timestamp="2026-03-02T08:00:00Z")) == base
+    assert assessment_fingerprint(regimen, PLAN, dict(TRIGGER, notes="Dizziness")) != base
+    assert assessment_fingerprint(regimen, PLAN[:0], TRIGGER) != base
+
+
+def test_rule_tier_plans_skip_the_cache_lookup(monkeypatch):
+    lookups = []
+    monkeypatch.setattr(risk_agent.risk_cache_service, "get_assessment", lambda *args: lookups.append(args))
+    agent = RiskAssessmentAgent()
+    agent.llm = object()
+    agent.cache_enabled = True
+    monkeypatch.setattr(agent, "_cache_key", lambda context, interventions, current_action: ("plan", "regimen"))
+    shift = {"type": "time_shift", "details": {"current_time": "morning", "proposed_time": "evening"}}
+
+    result = agent.process({
+        "patient_id": "p001",
+        "action": "skipped",
+        "medication_id": "med_atorvastatin_20mg",
+        "remediation_output": {"interventions": [shift]}
+    })
+
+    # Only MedGemma assessments are cached, so there is nothing to look up
+    assert result["approved"] and not result["medgemma_consulted"] and lookups == []
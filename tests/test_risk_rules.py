@@ -0,0 +1,55 @@
+"""
+Tests for the deterministic risk rule tier
+"""
+from backend.agents.risk_rules import RiskRuleEngine, summarize_tiers
+
+engine = RiskRuleEngine()
+
+
+def test_once_daily_statin_shift_is_confident():
+    verdict = engine.evaluate(
+        {"type": "time_shift", "details": {"current_time": "morning", "proposed_time": "evening"}},
+        {"medication_id": "med_atorvastatin_20mg"}
+    )
+    assert verdict["rule"] == "once_daily_flexible"
+    assert verdict["approved"] and verdict["risk_level"] == "low"
+    assert verdict["confidence"] >= 0.85
+
+
+def test_short_half_life_statin_moved_away_from_evening_escalates():
+    verdict = engine.evaluate(
+        {"type": "time_shift", "details": {"current_time": "evening", "proposed_time": "morning"}},
+        {"medication_id": "med_simvastatin_40mg"}
+    )
+    assert verdict["confidence"] < 0.85
+
+
+def test_small_reminder_shift_is_confident():
+    verdict = engine.evaluate(
+        {"type": "schedule_adjustment", "details": {"target_day": "Monday", "adjustment": "30 minutes earlier"}},
+        {"medication_id": "med_001"}
+    )
+    assert verdict["rule"] == "small_reminder_shift"
+    assert verdict["confidence"] >= 0.85
+
+
+def test_levothyroxine_with_food_is_not_approved():
+    verdict = engine.evaluate(
+        {"type": "timing_optimization", "details": {"suggestion": "Take with food"}},
+        {"medication_id": "med_levothyroxine_50mcg"}
+    )
+    assert verdict["approved"] is False
+    assert verdict["risk_level"] == "medium"
+
+
+def test_timing_sensitive_and_unknown_drugs_escalate():
+    shift = {"type": "time_shift", "details": {"current_time": "morning", "proposed_time": "evening"}}
+    assert engine.evaluate(shift, {"medication_id": "med_warfarin_5mg"})["confidence"] < 0.85
+    assert engine.evaluate(shift, {"medication_id": "med_001"})["confidence"] < 0.85
+
+
+def test_summarize_tiers():
+    assert summarize_tiers([{"tier": "rules"}, {"tier": "rules"}, {"tier": "medgemma"}, {}]) == {
+        "rules": 2,
+        "medgemma": 1
+    }
@@ -0,0 +1,165 @@
+"""
+Tests for per-patient adherence rollups
+"""
+from datetime import date, timedelta
+
+from backend.analytics import rollups
+from backend.analytics.pattern_engine import analyze_by_medication, analyze_patterns
+
+TODAY = date(2026, 3, 20)
+
+LOGS = [
+    {"action": "took", "medication_id": "med_a", "timestamp": "2026-03-19T12:00:00Z"},
+    {"action": "took", "medication_id": "med_a", "timestamp": "2026-03-18T12:00:00Z"},
+    {"action": "skipped", "reason": "forgot", "medication_id": "med_a", "timestamp": "2026-03-16T12:30:00Z"},
+    {"action": "skipped", "reason": "forgot", "medication_id": "med_b", "timestamp": "2026-03-09T13:00:00Z"},
+    {"action": "skipped", "medication_id": "med_a", "timestamp": "2026-03-02T14:00:00Z"},
+    {"action": "skipped", "reason": "ran_out", "medication_id": "med_a", "timestamp": "2025-12-01T14:00:00Z"},
+]
+
+
+def _rollup(logs=LOGS):
+    return rollups.build_rollup("p001", logs, "America/New_York", retention_days=90, today=TODAY)
+
+
+def test_build_rollup_counts_and_local_buckets():
+    rollup = _rollup()
+
+    assert rollup["total"] == 6
+    assert rollup["actions"] == {"took": 2, "skipped": 4}
+    assert rollup["reasons"]["skipped"] == {"forgot": 2, "ran_out": 1}
+    assert rollup["medications"]["med_a"] == {"took": 2, "skipped": 3}
+    # All skips were Monday mornings in New York (12:30 UTC is 08:30 after the DST change)
+    assert rollup["slots"]["skipped"] == {"Monday_morning": 4}
+    # The December log is kept in the lifetime counters but not the daily buckets
+    assert "2025-12-01" not in rollup["daily"]
+    assert rollup["daily"]["2026-03-16"]["reasons"] == {"skipped": {"forgot": 1}}
+
+
+def test_incremental_counts_match_rebuild():
+    incremental = {}
+    for log in LOGS:
+        rollups.merge_counts(incremental, rollups.log_counts(log, "America/New_York"))
+
+    assert rollups.diff_rollups(incremental, _rollup(), retention_days=90, today=TODAY) == []
+
+
+def test_diff_reports_drift():
+    stored = _rollup(LOGS[:-2])
+
+    mismatches = rollups.diff_rollups(stored, _rollup(), retention_days=90, today=TODAY)
+
+    assert "total: stored 4, expected 6" in mismatches
+    assert "actions.skipped: stored 2, expected 4" in mismatches
+    assert "daily.2026-03-02.actions.skipped: stored 0, expected 1" in mismatches
+
+
+def test_window_summary_and_streak():
+    rollup = _rollup()
+
+    assert rollups.window_summary(rollup, days=7, today=TODAY) == {
+        "total_doses": 3, "took_doses": 2, "skipped_doses": 1, "snoozed_doses": 0
+    }
+    assert rollups.window_summary(rollup, days=30, today=TODAY)["skipped_doses"] == 3
+    # Nothing logged today, so the streak counts back from yesterday
+    assert rollups.streak_days(rollup, today=TODAY) == 2
+
+
+def test_window_patterns_match_log_analysis():
+    skipped = [log for log in LOGS[:-1] if log["action"] == "skipped"]
+
+    from_rollup = rollups.window_patterns(_rollup(), days=30, today=TODAY)
+    from_logs = analyze_patterns(skipped, "America/New_York")
+
+    assert from_rollup["day_pattern"] == from_logs["day_pattern"]
+    assert from_rollup["time_pattern"] == from_logs["time_pattern"]
+    assert from_rollup["reason_pattern"] == from_logs["reason_pattern"]
+
+
+def test_medication_summary_matches_grouped_log_analysis():
+    in_window = [log for log in LOGS if log["timestamp"] >= "2026-02-19"]
+
+    from_rollup = rollups.medication_summary(_rollup(), days=30, today=TODAY)
+    from_logs = analyze_by_medication(in_window, "America/New_York")
+
+    assert from_rollup == from_logs
+    assert from_rollup["med_a"]["day_pattern"]["problem_day"] == "Monday"
+    assert from_rollup["med_a"]["reason_pattern"]["all_reasons"] == {"forgot": 1, "unknown": 1}
+
+
+def test_window_of_n_days_holds_n_dates():
+    rollup = {"daily": {(TODAY - timedelta(days=age)).isoformat(): {"actions": {"took": 1}} for age in range(10)}}
+
+    assert [day for day, _ in rollups.window_days(rollup, 7, TODAY)][-1] == (TODAY - timedelta(days=6)).isoformat()
+    assert rollups.window_summary(rollup, days=7, today=TODAY)["total_doses"] == 7
+
+
+def test_log_write_prunes_every_expired_daily_bucket(monkeypatch):
+    from backend import firebase_client
+
+    class Batch:
+        def set(self, ref, data, merge=False):
+            self.data = data
+
+    class DB:
+        def collection(self, name):
+            return self
+
+        def document(self, doc_id):
+            return doc_id
+
+    service = firebase_client.AdherenceRollupService()
+    monkeypatch.setattr(type(service), "db", property(lambda self: DB()))
+    monkeypatch.setattr(service, "timezone_for", lambda patient_id: "UTC")
+    monkeypatch.setattr(rollups, "local_today", lambda timezone: TODAY)
+    monkeypatch.setattr(firebase_client.config, "ROLLUP_RETENTION_DAYS", 30)
+    stored = [(TODAY - timedelta(days=age)).isoformat() for age in (0, 30, 31, 45, 200)]
+
+    batch = Batch()
+    late = {"action": "took", "timestamp": "2025-01-01T12:00:00Z"}
+    service.add_logs_to_batch(batch, "p001", [LOGS[0], late], stored)
+
+    daily = batch.data["daily"]
+    deleted = sorted(day for day, value in daily.items() if value is firebase_client.firestore.DELETE_FIELD)
+    assert deleted == sorted(["2025-01-01"] + stored[2:])
+    assert "2026-03-19" in daily and stored[1] not in daily
+
+
+def test_only_complete_rollups_are_read(monkeypatch):
+    from backend import firebase_client
+
+    class Doc:
+        def __init__(self, data):
+            self.id, self.exists, self.data = "p001", data is not None, data
+
+        def get(self, transaction=None):
+            return self
+
+        def to_dict(self):
+            return self.data
+
+    class DB:
+        def __init__(self):
+            self.docs = {}
+
+        def collection(self, name):
+            return self
+
+        def document(self, doc_id):
+            return self.docs.setdefault(doc_id, Doc(None))
+
+    class Batch:
+        def set(self, ref, data, merge=False):
+            ref.exists, ref.data = True, data
+
+    db = DB()
+    service = firebase_client.AdherenceRollupService()
+    monkeypatch.setattr(type(service), "db", property(lambda self: db))
+
+    # Increments for a patient who was never backfilled
+    db.document("p001").exists, db.document("p001").data = True, {"total": 1, "actions": {"took": 1}}
+    assert service.get_rollup("p001") is None
+
+    service.add_empty_to_batch(Batch(), "p002", "UTC")
+    assert service.get_rollup("p002")["complete"] and service.get_rollup("p002")["total"] == 0
+    assert _rollup()["complete"]
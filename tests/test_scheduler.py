@@ -0,0 +1,106 @@
+"""
+Tests for the follow-up scheduler
+"""
+import random
+from datetime import datetime, timedelta
+
+from backend import scheduler
+from backend.scheduler import DueHeap, SchedulerWorker
+
+NOW = datetime(2026, 3, 10, 12, 0)
+
+
+class FakeJobStore:
+    """In-memory stand-in for SchedulerService with update-time claims"""
+
+    def __init__(self, jobs):
+        self.jobs = {job["job_id"]: {**job, "update_time": 0} for job in jobs}
+        self.done = []
+        self.retries = []
+
+    def due_jobs(self, until, limit=None):
+        due = [dict(j) for j in self.jobs.values() if j["status"] == "pending" and j["due_at"] <= until.isoformat()]
+        return sorted(due, key=lambda j: j["due_at"])[:limit]
+
+    def claim(self, job, worker_id, now=None):
+        stored = self.jobs[job["job_id"]]
+        if stored["update_time"] != job["update_time"]:
+            return False
+        stored.update(due_at=(now + timedelta(minutes=5)).isoformat(), attempts=job.get("attempts", 0) + 1,
+                      update_time=stored["update_time"] + 1)
+        return True
+
+    def complete(self, job_id, result=None):
+        self.jobs[job_id]["status"] = "done"
+        self.done.append(job_id)
+
+    def retry(self, job_id, error, retry_at):
+        self.retries.append((job_id, retry_at))
+        if retry_at is None:
+            self.jobs[job_id]["status"] = "dead"
+        else:
+            self.jobs[job_id]["due_at"] = retry_at.isoformat()
+        self.jobs[job_id]["update_time"] += 1
+
+
+def _job(job_id, minutes, kind="follow_up"):
+    return {"job_id": job_id, "kind": kind, "patient_id": "p001", "payload": {},
+            "status": "pending", "attempts": 0, "due_at": (NOW + timedelta(minutes=minutes)).isoformat()}
+
+
+def test_heap_pops_due_jobs_in_order():
+    heap = DueHeap()
+    minutes = list(range(-500, 500))
+    random.Random(3).shuffle(minutes)
+    for m in minutes:
+        heap.push(_job(f"j{m}", m))
+    assert not heap.push(_job("j0", 0))
+
+    popped = []
+    job = heap.pop_due(NOW)
+    while job:
+        popped.append(job["due_at"])
+        job = heap.pop_due(NOW)
+
+    assert len(popped) == 501 and popped == sorted(popped)
+    assert len(heap) == 499 and heap.next_due() == (NOW + timedelta(minutes=1)).isoformat()
+
+
+def test_intervention_jobs_are_idempotent_per_day():
+    jobs = scheduler.intervention_jobs("p001", "Timing issue", NOW)
+    again = scheduler.intervention_jobs("p001", "Timing issue", NOW + timedelta(hours=1))
+
+    assert [j["kind"] for j in jobs] == [scheduler.FOLLOW_UP, scheduler.LEARNING_EVALUATION, scheduler.REINVESTIGATION]
+    assert jobs[0]["due_at"] == (NOW + timedelta(days=3)).isoformat()
+    assert [j["job_id"] for j in jobs] == [j["job_id"] for j in again]
+
+
+def test_only_one_worker_runs_a_job(monkeypatch):
+    store = FakeJobStore([_job("a", -2), _job("b", -1), _job("later", 30)])
+    monkeypatch.setattr(scheduler, "scheduler_service", store)
+    ran = []
+    handlers = {"follow_up": lambda job: ran.append(job["job_id"]) or {}}
+
+    first, second = SchedulerWorker("w1", handlers), SchedulerWorker("w2", handlers)
+    first.refill(NOW)
+    second.refill(NOW)
+
+    assert first.run_due(NOW) == {"done": 2, "failed": 0, "skipped": 0}
+    assert second.run_due(NOW) == {"done": 0, "failed": 0, "skipped": 2}
+    assert ran == ["a", "b"] and store.jobs["later"]["status"] == "pending"
+
+
+def test_failed_jobs_back_off_then_die(monkeypatch):
+    monkeypatch.setattr(scheduler.config, "SCHEDULER_MAX_ATTEMPTS", 2)
+    store = FakeJobStore([_job("a", 0)])
+    monkeypatch.setattr(scheduler, "scheduler_service", store)
+
+    def fail(job):
+        raise RuntimeError("down")
+
+    worker = SchedulerWorker("w1", {"follow_up": fail})
+    assert worker.run_once(NOW) == {"done": 0, "failed": 1, "skipped": 0}
+    assert store.retries[0][1] == NOW + timedelta(seconds=scheduler.RETRY_BASE_SECONDS)
+
+    assert worker.run_once(NOW + timedelta(minutes=2))["failed"] == 1
+    assert store.jobs["a"]["status"] == "dead"
@@ -0,0 +1,141 @@
+"""
+Tests for speculative risk assessment in the orchestrator
+"""
+import threading
+from typing import Any, Dict
+
+from backend.agents.base_agent import AgentOrchestrator, AgentType, BaseAgent
+from backend.agents.remediation_agent import RemediationAgent
+from backend.agents.risk_agent import RiskAssessmentAgent
+
+
+class StubInvestigationAgent(BaseAgent):
+    """Investigation stand-in that reports a tolerability root cause without Firestore"""
+
+    def __init__(self):
+        super().__init__(AgentType.INVESTIGATION)
+
+    def validate_input(self, input_data: Dict[str, Any]) -> bool:
+        return True
+
+    def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "pattern_detected": True,
+            "root_cause": "Tolerability issue: Side effects affecting adherence",
+            "adherence_rate": 80.0,
+            "reasoning": []
+        }
+
+
+class CountingLLM:
+    """MedGemma stand-in that records every prompt"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, prompt, **kwargs):
+        self.calls += 1
+        return "Severity: Mild. Urgent Care Needed: No. Take with food."
+
+
+class DriftingRemediationAgent(RemediationAgent):
+    """Remediation whose real plan differs from the predicted one"""
+
+    def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        plan = super().process(input_data)
+        plan["interventions"] = plan["interventions"][:1]
+        return plan
+
+
+class CountingRemediationAgent(RemediationAgent):
+    """Remediation that counts full planning runs"""
+
+    def __init__(self):
+        super().__init__()
+        self.runs = 0
+
+    def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        self.runs += 1
+        return super().process(input_data)
+
+
+def _orchestrator(remediation_agent):
+    orchestrator = AgentOrchestrator()
+    risk_agent = RiskAssessmentAgent()
+    risk_agent.llm = CountingLLM()
+    risk_agent.cache_enabled = False
+
+    orchestrator.register_agent(StubInvestigationAgent())
+    orchestrator.register_agent(remediation_agent)
+    orchestrator.register_agent(risk_agent)
+    return orchestrator, risk_agent
+
+
+TRIGGER = {
+    "patient_id": "p003",
+    "action": "took",
+    "reason": "side_effects",
+    "medication_id": "med_metformin_500mg",
+    "notes": "Upset stomach after morning dose"
+}
+
+AGENTS = [AgentType.INVESTIGATION, AgentType.REMEDIATION, AgentType.RISK_ASSESSMENT]
+
+
+def test_speculative_result_is_committed_when_plan_matches():
+    remediation_agent = CountingRemediationAgent()
+    orchestrator, risk_agent = _orchestrator(remediation_agent)
+
+    result = orchestrator.execute_workflow(TRIGGER, agents_to_run=AGENTS)
+
+    speculation = result["speculation"]
+    assert speculation["started"] and speculation["committed"]
+    assert speculation["saved_seconds"] >= 0 and speculation["waited_seconds"] >= 0
+    # The prediction is the pre-plan; remediation itself ran once
+    assert remediation_agent.runs == 1
+    assert result["state"] == "completed"
+    # The side-effect prompt ran once, in the speculative thread only
+    assert risk_agent.llm.calls == 1
+    risk_result = result["agents_executed"][-1]["result"]
+    assert risk_result["medgemma_consulted"] is True
+    assert risk_agent.execution_history[-1] is result["agents_executed"][-1]
+
+
+def test_speculative_result_is_discarded_when_plan_differs():
+    orchestrator, risk_agent = _orchestrator(DriftingRemediationAgent())
+
+    result = orchestrator.execute_workflow(TRIGGER, agents_to_run=AGENTS)
+
+    assert result["speculation"]["committed"] is False
+    assert result["speculation"]["discarded"] == "plan_mismatch"
+    # The real plan dropped the medgemma_consult step, so the assessment has one entry
+    risk_result = result["agents_executed"][-1]["result"]
+    assert [a["intervention_type"] for a in risk_result["intervention_assessments"]] == ["timing_optimization"]
+
+
+def test_mismatched_speculation_in_flight_is_not_orphaned():
+    started, release, accounted = threading.Event(), threading.Event(), threading.Event()
+
+    class SlowLLM(CountingLLM):
+        def invoke(self, prompt, **kwargs):
+            if threading.current_thread().name.startswith("speculative-risk"):
+                started.set()
+                release.wait(5)
+            return super().invoke(prompt, **kwargs)
+
+    class LateDriftingRemediationAgent(DriftingRemediationAgent):
+        def process(self, input_data):
+            started.wait(5)  # the speculative MedGemma call is in flight
+            return super().process(input_data)
+
+    orchestrator, risk_agent = _orchestrator(LateDriftingRemediationAgent())
+    risk_agent.llm = SlowLLM()
+    log_wasted = orchestrator._log_wasted_speculation
+    orchestrator._log_wasted_speculation = lambda *args: (log_wasted(*args), accounted.set())
+
+    result = orchestrator.execute_workflow(TRIGGER, agents_to_run=AGENTS)
+
+    assert result["speculation"]["discarded"] == "plan_mismatch" and result["speculation"]["wasted_call"]
+    assert not accounted.is_set()
+    release.set()
+    assert accounted.wait(5)
@@ -0,0 +1,130 @@
+"""
+Tests for the SQLite write-behind queue
+"""
+import time
+
+from backend import write_behind
+from backend.agents import execution_agent
+from backend.agents.execution_agent import ExecutionAgent
+from backend.write_behind import WriteBehindQueue, WriteHandler
+from tests.test_execution_agent import PLAN
+
+
+class FakeBatch:
+    """Write batch that records documents, or fails on commit"""
+
+    commits = []
+
+    def __init__(self):
+        self.docs = []
+
+    def set(self, doc):
+        if doc.get("fail"):
+            self.failing = True
+        self.docs.append(doc)
+
+    def commit(self):
+        if getattr(self, "failing", False):
+            raise RuntimeError("rejected")
+        FakeBatch.commits.append(self.docs)
+
+
+def _queue(tmp_path, name="queue.db"):
+    FakeBatch.commits = []
+    queue = WriteBehindQueue(str(tmp_path / name), batch_factory=FakeBatch, autostart=False)
+    queue.register("doc", WriteHandler(lambda batch, payload: batch.set(payload)))
+    return queue
+
+
+def test_entries_survive_restart_and_flush_in_one_batch(tmp_path):
+    queue = _queue(tmp_path)
+    for i in range(3):
+        queue.enqueue("doc", {"n": i})
+
+    stats = queue.stats(now=time.time() + 5)
+    assert stats["pending"] == 3 and stats["lag_seconds"] >= 5
+
+    reopened = _queue(tmp_path)
+    assert reopened.flush_once() == {"committed": 3, "failed": 0}
+    assert FakeBatch.commits == [[{"n": 0}, {"n": 1}, {"n": 2}]]
+    assert reopened.stats()["pending"] == 0 and reopened.stats()["lag_seconds"] == 0.0
+
+
+def test_failed_write_is_isolated_and_retried_with_backoff(tmp_path, monkeypatch):
+    monkeypatch.setattr("backend.write_behind.config.WRITE_BEHIND_MAX_ATTEMPTS", 2)
+    queue = _queue(tmp_path)
+    queue.enqueue("doc", {"n": 0})
+    queue.enqueue("doc", {"n": 1, "fail": True})
+    queue.enqueue("doc", {"n": 2})
+
+    assert queue.flush_once(now=1e10) == {"committed": 2, "failed": 1}
+    assert FakeBatch.commits == [[{"n": 0}], [{"n": 2}]]
+
+    # Not due again until the backoff has passed, then given up on
+    assert queue.flush_once(now=1e10 + 1) == {"committed": 0, "failed": 0}
+    assert queue.flush_once(now=1e10 + 10) == {"committed": 0, "failed": 1}
+    assert queue.stats()["dead"] == 1 and queue.stats()["pending"] == 0
+
+
+def test_prepare_runs_once_per_batch(tmp_path):
+    prepared = []
+    queue = _queue(tmp_path)
+    queue.register("prepared", WriteHandler(
+        lambda batch, payload: batch.set(payload), prepare=lambda payloads: prepared.append(len(payloads))
+    ))
+    for i in range(3):
+        queue.enqueue("prepared", {"n": i})
+    queue.enqueue("doc", {"n": 3})
+
+    assert queue.flush_once() == {"committed": 4, "failed": 0}
+    assert prepared == [3]
+
+
+def test_execution_enqueues_instead_of_writing(monkeypatch):
+    def write_inline(*args, **kwargs):
+        raise AssertionError("wrote inline")
+
+    queued = []
+    monkeypatch.setattr(execution_agent.config, "WRITE_BEHIND_ENABLED", True)
+    monkeypatch.setattr(execution_agent.config, "NOTIFICATION_DIGEST_ENABLED", False)
+    monkeypatch.setattr(execution_agent.write_behind, "enqueue", lambda kind, payload: queued.append((kind, payload)))
+    monkeypatch.setattr(execution_agent.intervention_service, "log_intervention", write_inline)
+
+    result = ExecutionAgent().process(PLAN)
+
+    assert [kind for kind, _ in queued] == ["intervention", "notification"] + ["scheduled_job"] * 3
+    assert queued[0][1]["patient_updates"]["preferred_time"] == "19:00"
+    assert queued[1][1]["patient_id"] == "p001"
+    assert queued[0][1]["intervention_id"] != queued[1][1]["notification_id"]
+    assert result["execution_results"][0]["status"] == "success"
+
+
+def test_retried_intervention_flush_rewrites_the_same_document(tmp_path, monkeypatch):
+    class Ref:
+        def __init__(self, doc_id):
+            self.id = doc_id
+
+    class DB:
+        def collection(self, name):
+            return self
+
+        def document(self, doc_id=None):
+            return Ref(doc_id)
+
+    class Batch:
+        def set(self, ref, data, merge=False):
+            written.append(ref.id)
+
+        def commit(self):
+            pass
+
+    written = []
+    monkeypatch.setattr(write_behind.config, "EFFECTIVENESS_STORE_ENABLED", False)
+    monkeypatch.setattr(type(write_behind.intervention_service), "db", property(lambda self: DB()))
+    payload = {"intervention_id": "int_1", "intervention": {"patient_id": "p001"}}
+
+    # A commit whose outcome was unknown is flushed again
+    for _ in range(2):
+        write_behind._add_intervention(Batch(), dict(payload, intervention=dict(payload["intervention"])))
+
+    assert written == ["int_1", "int_1"]